@@ -5,8 +5,9 @@
 
 import asyncio
 import time
-from typing import Dict, List, Any
-from task_manager import task_manager, TaskStatus
+from typing import Dict, List, Any, Optional
+from task_manager import task_manager
+from cancellation import CancellationToken
 from music_downloader import MusicDownloader
 from playlist_downloader import PlaylistDownloader
 from artist_downloader import ArtistDownloader
@@ -17,6 +18,32 @@ import logging
 logger = logging.getLogger('async_downloader')
 
 
+# 异步下载任务共用的下载器，其长连接会话在任务管理器停止时关闭
+_async_downloader: Optional[MusicDownloader] = None
+
+
+def _get_async_downloader() -> MusicDownloader:
+    """获取异步下载任务共用的下载器"""
+    global _async_downloader
+    if _async_downloader is None:
+        _async_downloader = MusicDownloader()
+        task_manager.register_shutdown_callback(_close_async_downloader)
+    return _async_downloader
+
+
+async def _close_async_downloader() -> None:
+    """关闭共用下载器的长连接会话"""
+    global _async_downloader
+    downloader, _async_downloader = _async_downloader, None
+    if downloader is not None:
+        await downloader.close()
+
+
+def _get_cancel_token(task_id: str, kwargs: Dict[str, Any]) -> CancellationToken:
+    """获取任务取消令牌（由任务管理器通过kwargs传入）"""
+    return kwargs.get('cancel_token') or task_manager.get_cancel_token(task_id)
+
+
 async def async_download_music(music_id: str, quality: str = "lossless", **kwargs) -> Dict[str, Any]:
     """异步下载单首音乐
     
@@ -29,15 +56,16 @@ async def async_download_music(music_id: str, quality: str = "lossless", **kwarg
         下载结果
     """
     task_id = kwargs.get('task_id', 'unknown')
+    cancel_token = _get_cancel_token(task_id, kwargs)
     
     try:
         logger.info(f"开始异步下载音乐: {music_id}, 音质: {quality}")
         
-        # 创建下载器
-        downloader = MusicDownloader()
+        # 复用共享下载器，避免每首歌新建连接
+        downloader = _get_async_downloader()
         
         # 使用异步下载方法
-        download_result = await downloader.download_music_file_async(music_id, quality)
+        download_result = await downloader.download_music_file_async(music_id, quality, cancel_token=cancel_token)
         
         # 更新任务进度
         task_manager.update_task_progress(task_id, 100.0, 1, 1)
@@ -65,7 +93,8 @@ async def async_download_music(music_id: str, quality: str = "lossless", **kwarg
 
 def sync_download_playlist(playlist_id: str, quality: str = "lossless", 
                           include_lyric: bool = True, max_concurrent: int = 3,
-                          selected_songs: List[str] = None, **kwargs) -> Dict[str, Any]:
+                          selected_songs: List[str] = None, schedule_policy: str = None,
+                          **kwargs) -> Dict[str, Any]:
     """同步下载歌单（在后台线程中执行）
     
     Args:
@@ -74,12 +103,14 @@ def sync_download_playlist(playlist_id: str, quality: str = "lossless",
         include_lyric: 是否包含歌词
         max_concurrent: 最大并发数
         selected_songs: 选中的歌曲ID列表
+        schedule_policy: 下载顺序策略，为None时使用配置文件中的值
         **kwargs: 其他参数
         
     Returns:
         下载结果
     """
     task_id = kwargs.get('task_id', 'unknown')
+    cancel_token = _get_cancel_token(task_id, kwargs)
     
     try:
         logger.info(f"开始下载歌单: {playlist_id}, 音质: {quality}")
@@ -87,8 +118,8 @@ def sync_download_playlist(playlist_id: str, quality: str = "lossless",
         logger.info(f"选中的歌曲: {selected_songs}")
         
         # 检查任务是否已被取消
-        task_info = task_manager.get_task(task_id)
-        if task_info and task_info.status == TaskStatus.CANCELLED:
+        if cancel_token.is_cancelled():
+            cancel_token.mark_observed()
             logger.info(f"任务 {task_id} 已被取消，停止下载歌单")
             return {
                 'success': False,
@@ -117,7 +148,8 @@ def sync_download_playlist(playlist_id: str, quality: str = "lossless",
             download_dir=playlist_download_dir,
             include_lyric=include_lyric,
             max_concurrent=max_concurrent,
-            selected_songs=selected_songs
+            selected_songs=selected_songs,
+            schedule_policy=schedule_policy
         )
         
         # 创建下载器
@@ -126,15 +158,15 @@ def sync_download_playlist(playlist_id: str, quality: str = "lossless",
         # 如果有选中的歌曲，使用download_selected_songs方法
         if selected_songs and isinstance(selected_songs, list) and len(selected_songs) > 0:
             logger.info(f"下载选中的 {len(selected_songs)} 首歌曲")
-            result = downloader.download_selected_songs(selected_songs, task_id)
+            result = downloader.download_selected_songs(selected_songs, task_id, cancel_token=cancel_token)
         else:
             # 下载整个歌单
             logger.info(f"下载整个歌单")
-            result = downloader.download_playlist_songs(task_id)
+            result = downloader.download_playlist_songs(task_id, cancel_token=cancel_token)
         
         # 检查任务是否已被取消
-        task_info = task_manager.get_task(task_id)
-        if task_info and task_info.status == TaskStatus.CANCELLED:
+        if cancel_token.is_cancelled():
+            cancel_token.mark_observed()
             logger.info(f"任务 {task_id} 已被取消，停止下载歌单")
             return {
                 'success': False,
@@ -144,8 +176,7 @@ def sync_download_playlist(playlist_id: str, quality: str = "lossless",
             }
         
         # 只有在任务没有被取消的情况下才设置完成进度
-        task_info = task_manager.get_task(task_id)
-        if not task_info or task_info.status != TaskStatus.CANCELLED:
+        if not cancel_token.is_cancelled():
             task_manager.update_task_progress(task_id, 100.0, 
                                              result.get('success_count', 0) + result.get('skipped_count', 0),
                                              result.get('total_songs', 0))
@@ -158,8 +189,7 @@ def sync_download_playlist(playlist_id: str, quality: str = "lossless",
         logger.error(f"歌单下载异常: {playlist_id}, 错误: {e}")
         logger.error(f"详细错误信息: {traceback.format_exc()}")
         # 只有在任务没有被取消的情况下才设置完成进度
-        task_info = task_manager.get_task(task_id)
-        if not task_info or task_info.status != TaskStatus.CANCELLED:
+        if not cancel_token.is_cancelled():
             task_manager.update_task_progress(task_id, 100.0, 0, 0)
         return {
             'success': False,
@@ -170,7 +200,8 @@ def sync_download_playlist(playlist_id: str, quality: str = "lossless",
 
 def sync_download_artist(artist_name: str, quality: str = "lossless", 
                         limit: int = None, match_mode: str = "exact_single",
-                        include_lyric: bool = True, max_concurrent: int = 3, **kwargs) -> Dict[str, Any]:
+                        include_lyric: bool = True, max_concurrent: int = 3,
+                        schedule_policy: str = None, **kwargs) -> Dict[str, Any]:
     """同步下载艺术家歌曲（在后台线程中执行）
     
     Args:
@@ -180,19 +211,21 @@ def sync_download_artist(artist_name: str, quality: str = "lossless",
         match_mode: 匹配模式
         include_lyric: 是否包含歌词
         max_concurrent: 最大并发数
+        schedule_policy: 下载顺序策略，为None时使用配置文件中的值
         **kwargs: 其他参数
         
     Returns:
         下载结果
     """
     task_id = kwargs.get('task_id', 'unknown')
+    cancel_token = _get_cancel_token(task_id, kwargs)
     
     try:
         logger.info(f"开始下载艺术家歌曲: {artist_name}, 音质: {quality}")
         
         # 检查任务是否已被取消
-        task_info = task_manager.get_task(task_id)
-        if task_info and task_info.status == TaskStatus.CANCELLED:
+        if cancel_token.is_cancelled():
+            cancel_token.mark_observed()
             logger.info(f"任务 {task_id} 已被取消，停止下载艺术家歌曲")
             return {
                 'success': False,
@@ -222,7 +255,8 @@ def sync_download_artist(artist_name: str, quality: str = "lossless",
             match_mode=match_mode,
             download_dir=artist_download_dir,
             include_lyric=include_lyric,
-            max_concurrent=max_concurrent
+            max_concurrent=max_concurrent,
+            schedule_policy=schedule_policy
         )
         
         # 创建下载器
@@ -245,6 +279,10 @@ def sync_download_artist(artist_name: str, quality: str = "lossless",
             songs = songs[:limit]
             total_songs = limit
         
+        # 一次查询规划已下载的歌曲，并按调度策略决定下载顺序（例如小文件优先）
+        plan = downloader._plan_songs(songs)
+        songs = downloader._schedule_songs(songs, plan)
+
         logger.info(f"艺术家 {artist_name} 共有 {total_songs} 首歌曲需要下载")
         
         # 批量下载
@@ -255,8 +293,8 @@ def sync_download_artist(artist_name: str, quality: str = "lossless",
         
         for i, song in enumerate(songs):
             # 检查任务是否已被取消
-            task_info = task_manager.get_task(task_id)
-            if task_info and task_info.status == TaskStatus.CANCELLED:
+            if cancel_token.is_cancelled():
+                cancel_token.mark_observed()
                 logger.info(f"任务 {task_id} 已被取消，停止下载艺术家歌曲")
                 return {
                     'success': False,
@@ -270,7 +308,7 @@ def sync_download_artist(artist_name: str, quality: str = "lossless",
             task_manager.update_task_progress(task_id, progress, i + 1, total_songs)
             
             # 下载单首歌曲
-            song_result = downloader.download_song(song, task_id=task_id)
+            song_result = downloader.download_song(song, cancel_token=cancel_token, plan=plan)
             
             if song_result.status == 'success':
                 success_count += 1
@@ -291,8 +329,7 @@ def sync_download_artist(artist_name: str, quality: str = "lossless",
             logger.info(f"艺术家下载进度: {i+1}/{total_songs}, 成功: {success_count}, 失败: {failed_count}, 跳过: {skipped_count}")
         
         # 只有在任务没有被取消的情况下才设置完成进度
-        task_info = task_manager.get_task(task_id)
-        if not task_info or task_info.status != TaskStatus.CANCELLED:
+        if not cancel_token.is_cancelled():
             task_manager.update_task_progress(task_id, 100.0, total_songs, total_songs)
         
         result = {
@@ -311,8 +348,7 @@ def sync_download_artist(artist_name: str, quality: str = "lossless",
     except Exception as e:
         logger.error(f"艺术家下载异常: {artist_name}, 错误: {e}")
         # 只有在任务没有被取消的情况下才设置完成进度
-        task_info = task_manager.get_task(task_id)
-        if not task_info or task_info.status != TaskStatus.CANCELLED:
+        if not cancel_token.is_cancelled():
             task_manager.update_task_progress(task_id, 100.0, 0, 0)
         return {
             'success': False,
@@ -333,13 +369,14 @@ def sync_download_music(music_id: str, quality: str = "lossless", **kwargs) -> D
         下载结果
     """
     task_id = kwargs.get('task_id', 'unknown')
+    cancel_token = _get_cancel_token(task_id, kwargs)
     
     try:
         logger.info(f"开始同步下载音乐: {music_id}, 音质: {quality}")
         
         # 检查任务是否已被取消
-        task_info = task_manager.get_task(task_id)
-        if task_info and task_info.status == TaskStatus.CANCELLED:
+        if cancel_token.is_cancelled():
+            cancel_token.mark_observed()
             logger.info(f"任务 {task_id} 已被取消，停止下载音乐")
             return {
                 'success': False,
@@ -351,11 +388,11 @@ def sync_download_music(music_id: str, quality: str = "lossless", **kwargs) -> D
         downloader = MusicDownloader()
         
         # 使用同步下载方法
-        download_result = downloader.download_music_file(music_id, quality, task_id=task_id)
+        download_result = downloader.download_music_file(music_id, quality, cancel_token=cancel_token)
         
         # 检查任务是否已被取消
-        task_info = task_manager.get_task(task_id)
-        if task_info and task_info.status == TaskStatus.CANCELLED:
+        if cancel_token.is_cancelled():
+            cancel_token.mark_observed()
             logger.info(f"任务 {task_id} 已被取消，停止下载音乐")
             return {
                 'success': False,
@@ -364,8 +401,7 @@ def sync_download_music(music_id: str, quality: str = "lossless", **kwargs) -> D
             }
         
         # 只有在任务没有被取消的情况下才设置完成进度
-        task_info = task_manager.get_task(task_id)
-        if not task_info or task_info.status != TaskStatus.CANCELLED:
+        if not cancel_token.is_cancelled():
             task_manager.update_task_progress(task_id, 100.0, 1, 1)
         
         result = {
@@ -382,8 +418,7 @@ def sync_download_music(music_id: str, quality: str = "lossless", **kwargs) -> D
     except Exception as e:
         logger.error(f"同步下载音乐异常: {music_id}, 错误: {e}")
         # 只有在任务没有被取消的情况下才设置完成进度
-        task_info = task_manager.get_task(task_id)
-        if not task_info or task_info.status != TaskStatus.CANCELLED:
+        if not cancel_token.is_cancelled():
             task_manager.update_task_progress(task_id, 100.0, 1, 1)
         return {
             'success': False,
@@ -427,7 +462,7 @@ def submit_music_download_task(music_id: str, quality: str = "lossless") -> str:
 
 def submit_playlist_download_task(playlist_id: str, quality: str = "lossless", 
                                  include_lyric: bool = True, max_concurrent: int = 3,
-                                 selected_songs: List[str] = None) -> str:
+                                 selected_songs: List[str] = None, schedule_policy: str = None) -> str:
     """提交歌单下载任务
     
     Args:
@@ -436,6 +471,7 @@ def submit_playlist_download_task(playlist_id: str, quality: str = "lossless",
         include_lyric: 是否包含歌词
         max_concurrent: 最大并发数
         selected_songs: 选中的歌曲ID列表
+        schedule_policy: 下载顺序策略
         
     Returns:
         任务ID
@@ -461,13 +497,15 @@ def submit_playlist_download_task(playlist_id: str, quality: str = "lossless",
         include_lyric=include_lyric,
         max_concurrent=max_concurrent,
         selected_songs=selected_songs,
+        schedule_policy=schedule_policy,
         content_name=content_name
     )
 
 
 def submit_artist_download_task(artist_name: str, quality: str = "lossless", 
                                limit: int = None, match_mode: str = "exact_single",
-                               include_lyric: bool = True, max_concurrent: int = 3) -> str:
+                               include_lyric: bool = True, max_concurrent: int = 3,
+                               schedule_policy: str = None) -> str:
     """提交艺术家下载任务
     
     Args:
@@ -477,6 +515,7 @@ def submit_artist_download_task(artist_name: str, quality: str = "lossless",
         match_mode: 匹配模式
         include_lyric: 是否包含歌词
         max_concurrent: 最大并发数
+        schedule_policy: 下载顺序策略
         
     Returns:
         任务ID
@@ -493,5 +532,6 @@ def submit_artist_download_task(artist_name: str, quality: str = "lossless",
         match_mode=match_mode,
         include_lyric=include_lyric,
         max_concurrent=max_concurrent,
+        schedule_policy=schedule_policy,
         content_name=content_name
     )
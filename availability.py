@@ -0,0 +1,183 @@
+"""歌曲可用性预检模块
+
+批量下载开始前一次性检查整个任务中歌曲的可用性：
+- 按音质降级顺序（如 hires → lossless → exhigh）批量请求下载链接，为每首歌选出可用的最高音质
+- 没有下载链接、只能试听或缺少该音质的 (歌曲, 音质) 写入数据库负缓存，有效期内不再请求接口
+- 预检得到的链接信息（URL、大小、MD5）可供随后的下载直接复用
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from music_api import NeteaseAPI, APIException
+from download_db import DownloadDatabase
+
+
+# 默认的音质降级顺序（从高到低）
+DEFAULT_QUALITY_LADDER = ['jymaster', 'hires', 'lossless', 'exhigh', 'standard']
+
+# 每次批量请求下载链接的歌曲数
+PROBE_BATCH_SIZE = 100
+
+
+@dataclass
+class ProbeResult:
+    """单首歌曲的预检结果"""
+    song_id: int
+    quality: Optional[str]  # 可用的最高音质，全部不可用时为None
+    song_data: Optional[Dict[str, Any]] = None  # 接口返回的链接信息
+    reason: str = ""  # 不可用原因
+    probed_time: float = 0.0
+
+    @property
+    def available(self) -> bool:
+        return self.quality is not None
+
+
+def quality_ladder_from(quality: str, ladder: List[str]) -> List[str]:
+    """获取从指定音质开始的降级顺序
+
+    Args:
+        quality: 请求的音质
+        ladder: 完整的降级顺序
+
+    Returns:
+        需要依次尝试的音质列表，音质不在降级顺序中时只尝试该音质本身
+    """
+    if quality in ladder:
+        return ladder[ladder.index(quality):]
+    return [quality]
+
+
+def unusable_reason(song_data: Optional[Dict[str, Any]]) -> Optional[str]:
+    """判断接口返回的链接信息是否可用于下载
+
+    Args:
+        song_data: 接口返回的单首歌曲链接信息
+
+    Returns:
+        不可用原因，可用时返回None
+    """
+    if not song_data:
+        return "接口未返回该歌曲"
+    if not song_data.get('url'):
+        return "无可用的下载链接"
+    if song_data.get('freeTrialInfo'):
+        return "仅可试听片段"
+    return None
+
+
+class AvailabilityProbe:
+    """歌曲可用性预检类"""
+
+    def __init__(self, api: NeteaseAPI, db: DownloadDatabase, ladder: Optional[List[str]] = None,
+                 negative_ttl: float = 86400, batch_size: int = PROBE_BATCH_SIZE):
+        """
+        初始化可用性预检
+
+        Args:
+            api: 网易云API实例
+            db: 下载数据库实例（保存负缓存）
+            ladder: 音质降级顺序，为None时使用默认顺序
+            negative_ttl: 不可用记录的有效期（秒）
+            batch_size: 每次请求的歌曲数
+        """
+        self.api = api
+        self.db = db
+        self.ladder = list(ladder) if ladder is not None else list(DEFAULT_QUALITY_LADDER)
+        self.negative_ttl = negative_ttl
+        self.batch_size = batch_size
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.negative_hits = 0
+        self.unavailable = 0
+        self.downgraded = 0
+
+    def probe(self, song_ids: List[int], quality: str, cookies: Dict[str, str]) -> Dict[int, ProbeResult]:
+        """预检一批歌曲的可用性
+
+        Args:
+            song_ids: 歌曲ID列表
+            quality: 请求的音质
+            cookies: 用户cookies
+
+        Returns:
+            歌曲ID到预检结果的映射；接口请求失败的歌曲不在其中，由调用方按原流程处理
+        """
+        ladder = quality_ladder_from(quality, self.ladder)
+        results: Dict[int, ProbeResult] = {}
+        reasons: Dict[int, str] = {}
+        pending = list(dict.fromkeys(song_ids))
+
+        for index, level in enumerate(ladder):
+            if not pending:
+                break
+            lower_levels = ladder[index + 1:]
+
+            # 负缓存中的歌曲直接进入下一档音质
+            cached = self.db.get_unavailable(pending, level)
+            reasons.update(cached)
+            still_pending = [song_id for song_id in pending if song_id in cached]
+            to_query = [song_id for song_id in pending if song_id not in cached]
+
+            with self._lock:
+                self.negative_hits += len(cached)
+
+            for start in range(0, len(to_query), self.batch_size):
+                batch = to_query[start:start + self.batch_size]
+                try:
+                    with self._lock:
+                        self.requests += 1
+                    response = self.api.get_song_urls(batch, level, cookies)
+                except APIException as e:
+                    # 请求失败不代表歌曲不可用，不写负缓存，也不给出结论
+                    print(f"可用性预检请求失败: {e}")
+                    continue
+
+                items = {item.get('id'): item for item in response.get('data') or []}
+                now = time.time()
+                for song_id in batch:
+                    item = items.get(song_id)
+                    reason = unusable_reason(item)
+                    actual_level = item.get('level') if item else None
+
+                    if reason is None:
+                        if not actual_level or actual_level == level or level not in self.ladder:
+                            results[song_id] = ProbeResult(song_id, level, item, probed_time=now)
+                            continue
+                        # 接口自动降级返回了较低音质：该音质不可用，较低音质在允许范围内时直接采用
+                        reason = f"无{level}音质"
+                        if actual_level in lower_levels:
+                            self.db.mark_unavailable(song_id, level, reason, self.negative_ttl)
+                            results[song_id] = ProbeResult(song_id, actual_level, item, probed_time=now)
+                            continue
+
+                    self.db.mark_unavailable(song_id, level, reason, self.negative_ttl)
+                    reasons[song_id] = reason
+                    still_pending.append(song_id)
+
+            pending = still_pending
+
+        for song_id in pending:
+            results[song_id] = ProbeResult(song_id, None, reason=reasons.get(song_id, ""))
+
+        with self._lock:
+            self.unavailable += len(pending)
+            self.downgraded += sum(
+                1 for result in results.values() if result.available and result.quality != quality
+            )
+        return results
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取预检统计信息"""
+        with self._lock:
+            return {
+                'ladder': self.ladder,
+                'requests': self.requests,
+                'negative_hits': self.negative_hits,
+                'unavailable': self.unavailable,
+                'downgraded': self.downgraded
+            }
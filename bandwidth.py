@@ -0,0 +1,299 @@
+"""下载带宽调度模块
+
+为所有下载写入循环（同步和异步）提供共享的令牌桶限速：
+- 全局速率上限：所有活跃任务按权重分享全局带宽，受自身上限限制的任务用不完的份额分给其他任务
+- 单任务速率上限：每个任务的速率不超过其自身上限
+- 上限和权重可在运行时调整，正在进行的下载在下一个分块起生效
+速率为0表示不限速。
+"""
+
+import asyncio
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional
+
+
+# 任务在最近一段时间内有数据读取时视为活跃，参与全局带宽分配
+ACTIVE_WINDOW = 2.0
+
+# 非活跃且未单独配置的任务状态保留时间（秒）
+IDLE_EXPIRE = 60.0
+
+# 单次等待的最长时间，超出时分多次等待以便及时响应取消
+MAX_SLEEP_SLICE = 0.1
+
+# 未指定任务ID的下载共用的键
+DEFAULT_TASK = '__default__'
+
+
+class _TaskBucket:
+    """单个任务的令牌桶状态"""
+
+    def __init__(self, now: float):
+        self.rate = 0.0
+        self.tokens = 0.0
+        self.updated = now
+        self.last_active = now
+        self.limit: Optional[float] = None
+        self.weight = 1.0
+        self.bytes = 0
+        self.throttled_seconds = 0.0
+
+    def refill(self, now: float, burst_seconds: float) -> None:
+        """按当前速率补充令牌，不超过突发容量"""
+        if self.rate > 0:
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.rate * burst_seconds)
+        self.updated = now
+
+
+class BandwidthScheduler:
+    """带宽调度器类
+
+    读取循环每读到一个分块就调用reserve()登记字节数，令牌不足时返回需要等待的秒数。
+    令牌允许透支，单个分块大于突发容量时也能按平均速率限速。
+    """
+
+    def __init__(self, global_limit: float = 0, task_limit: float = 0, burst_seconds: float = 0.5):
+        """
+        初始化带宽调度器
+
+        Args:
+            global_limit: 全局速率上限（字节/秒），为0时不限速
+            task_limit: 单任务默认速率上限（字节/秒），为0时不限速
+            burst_seconds: 突发容量，以当前速率下可读取的秒数表示
+        """
+        self.global_limit = max(0.0, float(global_limit))
+        self.task_limit = max(0.0, float(task_limit))
+        self.burst_seconds = max(0.01, float(burst_seconds))
+
+        self._lock = threading.Lock()
+        self._tasks: Dict[Hashable, _TaskBucket] = {}
+
+        # 统计信息
+        self.total_bytes = 0
+        self.throttled_seconds = 0.0
+
+    def _task_cap(self, bucket: _TaskBucket) -> float:
+        """任务自身的速率上限，为0时不限速"""
+        return self.task_limit if bucket.limit is None else bucket.limit
+
+    def _effective_rate(self, task_id: Hashable, bucket: _TaskBucket, now: float) -> float:
+        """计算任务当前可用速率（需持有锁）
+
+        全局带宽按注水法分配：活跃任务按权重分享剩余带宽，按权重分得的份额超过自身上限的任务
+        只分配其上限，剩余带宽在其余任务之间重新按权重分配，直到没有任务超过上限。
+        """
+        cap = self._task_cap(bucket)
+        if self.global_limit <= 0:
+            return cap
+
+        active = {
+            key: other for key, other in self._tasks.items()
+            if key == task_id or now - other.last_active <= ACTIVE_WINDOW
+        }
+        remaining = self.global_limit
+        while True:
+            total_weight = sum(other.weight for other in active.values())
+            capped = {
+                key: other for key, other in active.items()
+                if 0 < self._task_cap(other) < remaining * other.weight / total_weight
+            }
+            if not capped:
+                break
+            if task_id in capped:
+                return cap
+            for key, other in capped.items():
+                remaining -= self._task_cap(other)
+                del active[key]
+        return remaining * bucket.weight / total_weight
+
+    def _expire_idle(self, now: float) -> None:
+        """清理长时间不活跃且未单独配置的任务（需持有锁）"""
+        expired = [
+            key for key, bucket in self._tasks.items()
+            if bucket.limit is None and bucket.weight == 1.0 and now - bucket.last_active > IDLE_EXPIRE
+        ]
+        for key in expired:
+            del self._tasks[key]
+
+    def _get_bucket(self, task_id: Hashable, now: float) -> _TaskBucket:
+        """获取任务的令牌桶，不存在时创建（需持有锁）"""
+        bucket = self._tasks.get(task_id)
+        if bucket is None:
+            self._expire_idle(now)
+            bucket = _TaskBucket(now)
+            self._tasks[task_id] = bucket
+        return bucket
+
+    def reserve(self, nbytes: int, task_id: Optional[Hashable] = None) -> float:
+        """登记已读取的字节数
+
+        Args:
+            nbytes: 本次读取的字节数
+            task_id: 任务ID，为None时归入默认任务
+
+        Returns:
+            调用方需要等待的秒数，不需要限速时返回0
+        """
+        task_id = DEFAULT_TASK if task_id is None else task_id
+        now = time.monotonic()
+
+        with self._lock:
+            bucket = self._get_bucket(task_id, now)
+            bucket.refill(now, self.burst_seconds)
+            bucket.last_active = now
+            bucket.rate = self._effective_rate(task_id, bucket, now)
+            bucket.bytes += nbytes
+            self.total_bytes += nbytes
+
+            if bucket.rate <= 0:
+                bucket.tokens = 0.0
+                return 0.0
+
+            bucket.tokens -= nbytes
+            if bucket.tokens >= 0:
+                return 0.0
+
+            delay = -bucket.tokens / bucket.rate
+            bucket.throttled_seconds += delay
+            self.throttled_seconds += delay
+            return delay
+
+    def burst_bytes(self, task_id: Optional[Hashable] = None) -> int:
+        """任务当前速率下突发容量对应的字节数，作为限速时单次读取的上限
+
+        分块远大于突发容量时，每读一块就要等待很久，速率呈锯齿状且取消响应变慢。
+
+        Returns:
+            字节数，不限速时返回0
+        """
+        task_id = DEFAULT_TASK if task_id is None else task_id
+        with self._lock:
+            bucket = self._tasks.get(task_id)
+            return int(bucket.rate * self.burst_seconds) if bucket is not None else 0
+
+    def throttle(self, nbytes: int, task_id: Optional[Hashable] = None,
+                 should_cancel=None) -> int:
+        """登记字节数并在需要时阻塞等待（同步读取循环使用）
+
+        Args:
+            nbytes: 本次读取的字节数
+            task_id: 任务ID
+            should_cancel: 取消检查函数，等待期间定期调用，返回True时提前结束等待
+
+        Returns:
+            下一次读取的建议上限（见burst_bytes），不限速时返回0
+        """
+        delay = self.reserve(nbytes, task_id)
+        deadline = time.monotonic() + delay
+        while delay > 0:
+            if should_cancel is not None and should_cancel():
+                break
+            time.sleep(min(delay, MAX_SLEEP_SLICE))
+            delay = deadline - time.monotonic()
+        return self.burst_bytes(task_id)
+
+    async def throttle_async(self, nbytes: int, task_id: Optional[Hashable] = None,
+                             should_cancel=None) -> int:
+        """登记字节数并在需要时异步等待（异步读取循环使用）
+
+        Args:
+            nbytes: 本次读取的字节数
+            task_id: 任务ID
+            should_cancel: 取消检查函数，等待期间定期调用，返回True时提前结束等待
+
+        Returns:
+            下一次读取的建议上限（见burst_bytes），不限速时返回0
+        """
+        delay = self.reserve(nbytes, task_id)
+        deadline = time.monotonic() + delay
+        while delay > 0:
+            if should_cancel is not None and should_cancel():
+                break
+            await asyncio.sleep(min(delay, MAX_SLEEP_SLICE))
+            delay = deadline - time.monotonic()
+        return self.burst_bytes(task_id)
+
+    def set_limits(self, global_limit: Optional[float] = None, task_limit: Optional[float] = None,
+                   burst_seconds: Optional[float] = None) -> None:
+        """运行时调整全局速率参数
+
+        Args:
+            global_limit: 全局速率上限（字节/秒），为None时不修改
+            task_limit: 单任务默认速率上限（字节/秒），为None时不修改
+            burst_seconds: 突发容量（秒），为None时不修改
+        """
+        with self._lock:
+            if global_limit is not None:
+                self.global_limit = max(0.0, float(global_limit))
+            if task_limit is not None:
+                self.task_limit = max(0.0, float(task_limit))
+            if burst_seconds is not None:
+                self.burst_seconds = max(0.01, float(burst_seconds))
+
+    def set_task_limit(self, task_id: Hashable, limit: Optional[float] = None,
+                       weight: Optional[float] = None) -> None:
+        """运行时调整单个任务的速率上限和权重
+
+        Args:
+            task_id: 任务ID
+            limit: 速率上限（字节/秒），0表示不限速，负数表示恢复使用默认上限，为None时不修改
+            weight: 分享全局带宽时的权重，为None时不修改
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._get_bucket(task_id, now)
+            if limit is not None:
+                bucket.limit = None if limit < 0 else float(limit)
+            if weight is not None:
+                bucket.weight = max(0.01, float(weight))
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取带宽统计信息，速率单位为字节/秒"""
+        now = time.monotonic()
+        with self._lock:
+            tasks = {}
+            for key, bucket in self._tasks.items():
+                tasks[str(key)] = {
+                    'active': now - bucket.last_active <= ACTIVE_WINDOW,
+                    'limit': bucket.limit,
+                    'weight': bucket.weight,
+                    'rate': round(bucket.rate, 1),
+                    'bytes': bucket.bytes,
+                    'throttled_seconds': round(bucket.throttled_seconds, 3)
+                }
+            return {
+                'global_limit': self.global_limit,
+                'task_limit': self.task_limit,
+                'burst_seconds': self.burst_seconds,
+                'total_bytes': self.total_bytes,
+                'throttled_seconds': round(self.throttled_seconds, 3),
+                'tasks': tasks
+            }
+
+
+_bandwidth_scheduler: Optional[BandwidthScheduler] = None
+_bandwidth_scheduler_lock = threading.Lock()
+
+
+def get_bandwidth_scheduler() -> BandwidthScheduler:
+    """获取全局带宽调度器实例（首次调用时根据配置文件创建）"""
+    global _bandwidth_scheduler
+    if _bandwidth_scheduler is not None:
+        return _bandwidth_scheduler
+
+    # 在加锁前读取配置，避免导入main时重入
+    try:
+        from main import config
+        bandwidth_config = config.bandwidth_config
+    except ImportError:
+        bandwidth_config = {}
+
+    with _bandwidth_scheduler_lock:
+        if _bandwidth_scheduler is None:
+            _bandwidth_scheduler = BandwidthScheduler(
+                global_limit=float(bandwidth_config.get('global_limit_kb', 0)) * 1024,
+                task_limit=float(bandwidth_config.get('task_limit_kb', 0)) * 1024,
+                burst_seconds=float(bandwidth_config.get('burst_seconds', 0.5))
+            )
+        return _bandwidth_scheduler
@@ -0,0 +1,115 @@
+"""下载数据库并发读写基准测试
+
+多个线程同时写入下载记录并查询已有记录，对比几种写入方式的吞吐量：
+- per-call：每次调用重新打开连接，使用默认的回滚日志（旧实现）
+- pooled：线程本地长连接，WAL日志，synchronous=NORMAL，每条记录提交一次
+- write-behind：在pooled基础上延迟批量写入下载记录
+每个线程循环执行：写入一条记录，随后查询若干条已有记录。不依赖网络。
+
+用法: python benchmarks/bench_db_concurrency.py [线程数] [每线程写入数] [每次写入后的查询数]
+"""
+
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from download_db import DownloadDatabase
+
+
+class PerCallDatabase(DownloadDatabase):
+    """每次调用重新连接、使用回滚日志的数据库（模拟旧实现）"""
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path, write_behind=False)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('PRAGMA journal_mode=DELETE')
+        return conn
+
+
+def run(db: DownloadDatabase, threads: int, writes: int, lookups: int) -> dict:
+    """运行一轮并发读写，返回吞吐量"""
+    counters = {'inserts': 0, 'lookups': 0, 'errors': 0}
+    counters_lock = threading.Lock()
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(index: int):
+        rng = random.Random(index)
+        inserts = found = errors = 0
+        barrier.wait()
+        for n in range(writes):
+            song_id = index * writes + n + 1
+            ok = db.add_song({
+                'song_id': song_id,
+                'song_name': f'歌曲{song_id}',
+                'artists': f'歌手{song_id % 100}',
+                'album': '专辑',
+                'file_path': f'/music/{song_id}.flac',
+                'file_size': 30 * 1024 * 1024,
+                'quality': 'lossless',
+                'status': 'success'
+            })
+            if ok:
+                inserts += 1
+            else:
+                errors += 1
+            for _ in range(lookups):
+                try:
+                    db.get_song_info(rng.randint(1, song_id))
+                    found += 1
+                except sqlite3.Error:
+                    errors += 1
+        with counters_lock:
+            counters['inserts'] += inserts
+            counters['lookups'] += found
+            counters['errors'] += errors
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    db.flush()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'elapsed': elapsed,
+        'inserts_per_sec': counters['inserts'] / elapsed,
+        'lookups_per_sec': counters['lookups'] / elapsed,
+        'errors': counters['errors']
+    }
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    writes = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    lookups = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    print(f"线程数: {threads}，每线程写入: {writes}，每次写入后查询: {lookups}")
+    print(f"{'写入方式':<14}{'耗时(s)':>10}{'写入/s':>12}{'查询/s':>12}{'错误数':>8}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        modes = (
+            ('per-call', lambda path: PerCallDatabase(path)),
+            ('pooled', lambda path: DownloadDatabase(path, write_behind=False)),
+            ('write-behind', lambda path: DownloadDatabase(path))
+        )
+        for name, create in modes:
+            db = create(str(Path(tmp) / f'{name}.db'))
+            result = run(db, threads, writes, lookups)
+            print(f"{name:<14}{result['elapsed']:>10.2f}{result['inserts_per_sec']:>12.0f}"
+                  f"{result['lookups_per_sec']:>12.0f}{result['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""下载写入循环CPU开销基准测试
+
+对比旧的 iter_content(8192) 写入循环与 stream_fetcher 的缓冲区复用写入循环，
+输出每下载1GB数据消耗的CPU时间。数据源为内存中的模拟响应流，不依赖网络。
+
+用法: python benchmarks/bench_fetch_loop.py [数据量MB] [重复次数]
+"""
+
+import os
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stream_fetcher import stream_to_file
+
+
+GB = 1024 * 1024 * 1024
+
+
+class FakeRawResponse:
+    """模拟urllib3的原始响应流
+
+    read(n)每次返回新的bytes对象，readinto按urllib3的实现先read再复制，
+    以保证两种循环承担相同的数据源开销。
+    """
+
+    def __init__(self, total_size: int, block: bytes):
+        self.remaining = total_size
+        self.block = memoryview(block)
+
+    def read(self, amt: int) -> bytes:
+        amt = min(amt, self.remaining, len(self.block))
+        self.remaining -= amt
+        return self.block[:amt].tobytes()
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+def legacy_loop(raw, file_path: Path, should_cancel) -> int:
+    """旧实现: 每8KB一个bytes对象、一次取消检查和一次write调用"""
+    written = 0
+    with open(file_path, 'wb') as f:
+        for chunk in iter(lambda: raw.read(8192), b''):
+            if should_cancel():
+                break
+            if chunk:
+                f.write(chunk)
+                written += len(chunk)
+    return written
+
+
+def measure(label: str, func, total_size: int, block: bytes, repeat: int, tmp_dir: Path):
+    """多次运行取最小值，返回(每GB CPU秒, 每GB墙钟秒)"""
+    best_cpu = best_wall = float('inf')
+    file_path = tmp_dir / f"{label}.bin"
+
+    for _ in range(repeat):
+        raw = FakeRawResponse(total_size, block)
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        written = func(raw, file_path)
+        cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+        assert written == total_size, f"{label}: 写入 {written} != {total_size}"
+        best_cpu, best_wall = min(best_cpu, cpu), min(best_wall, wall)
+        file_path.unlink()
+
+    scale = GB / total_size
+    return best_cpu * scale, best_wall * scale
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    total_size = size_mb * 1024 * 1024
+    block = os.urandom(8 * 1024 * 1024)
+
+    # 模拟旧实现中每个分块一次的任务表查询
+    tasks = {'task': 'running'}
+
+    def should_cancel() -> bool:
+        return tasks.get('task') == 'cancelled'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        results = [
+            ('iter_content(8192)', measure(
+                'legacy', lambda raw, path: legacy_loop(raw, path, should_cancel),
+                total_size, block, repeat, tmp_dir)),
+            ('stream_to_file', measure(
+                'stream', lambda raw, path: stream_to_file(raw, path, total_size, should_cancel),
+                total_size, block, repeat, tmp_dir)),
+        ]
+
+    print(f"数据量: {size_mb} MB, 重复: {repeat} 次（取最小值）")
+    print(f"{'写入循环':<22}{'CPU秒/GB':>12}{'墙钟秒/GB':>12}")
+    for label, (cpu, wall) in results:
+        print(f"{label:<22}{cpu:>12.3f}{wall:>12.3f}")
+
+    legacy_cpu, stream_cpu = results[0][1][0], results[1][1][0]
+    if stream_cpu > 0:
+        print(f"CPU开销降低: {legacy_cpu / stream_cpu:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
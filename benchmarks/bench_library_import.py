@@ -0,0 +1,71 @@
+"""曲库导入基准测试
+
+生成带有歌曲ID标签的模拟曲库（MP3和FLAC各半，标签由stream_tagger生成，音频数据为填充字节），
+分别用单进程和多进程从标签导入到空数据库，统计耗时和每秒处理的文件数。不依赖网络。
+
+用法: python benchmarks/bench_library_import.py [文件数] [进程数]
+"""
+
+import os
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from download_db import DownloadDatabase
+from library_import import LibraryImporter
+from stream_tagger import create_tag_rewriter
+
+# 最小的FLAC头部：fLaC标记 + 最后一个元数据块STREAMINFO（34字节，44.1kHz/双声道/16位）
+FLAC_HEADER = (b'fLaC' + bytes([0x80, 0, 0, 34]) + struct.pack('>HH', 4096, 4096) + bytes(6)
+               + struct.pack('>Q', (44100 << 44) | (1 << 41) | (15 << 36)) + bytes(16))
+AUDIO_PADDING = bytes(64 * 1024)
+
+
+def build_library(root: Path, count: int) -> None:
+    """生成模拟曲库文件（每100首一个歌手目录）"""
+    for song_id in range(1, count + 1):
+        file_ext = '.flac' if song_id % 2 else '.mp3'
+        info = SimpleNamespace(id=song_id, name=f'歌曲{song_id}', artists=f'歌手{song_id // 100}',
+                               album=f'专辑{song_id // 10}', track_number=song_id % 10,
+                               quality='lossless' if file_ext == '.flac' else 'exhigh')
+        rewriter = create_tag_rewriter(file_ext, info)
+        source = FLAC_HEADER if file_ext == '.flac' else b''
+        chunks = rewriter.feed(source + AUDIO_PADDING) + rewriter.finish()
+
+        directory = root / f'歌手{song_id // 100}'
+        directory.mkdir(exist_ok=True)
+        with open(directory / f'{song_id}{file_ext}', 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / 'library'
+        root.mkdir()
+        start = time.perf_counter()
+        build_library(root, count)
+        print(f"文件数: {count}，生成耗时: {time.perf_counter() - start:.1f}s")
+
+        for process_count in sorted({1, workers}):
+            label = '单进程' if process_count == 1 else f'{process_count}进程'
+            db = DownloadDatabase(str(Path(tmp) / f'import_{process_count}.db'))
+            start = time.perf_counter()
+            result = LibraryImporter(db, workers=process_count).run(str(root))
+            elapsed = time.perf_counter() - start
+            print(f"{label}: 耗时 {elapsed:.1f}s，{count / elapsed:.0f} 文件/秒，"
+                  f"导入 {result['imported']}，未标记 {result['untagged']}，失败 {result['errors']}")
+            db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""曲库搜索基准测试
+
+生成一个模拟曲库（歌名由常用词随机组合，歌手按长尾分布），用从曲库中抽取的歌名片段、
+歌手名、歌手+歌名组合以及1到2个字符的短词作为搜索词，统计第一页和第二页的查询耗时。不依赖网络。
+
+用法: python benchmarks/bench_library_search.py [歌曲数] [每类搜索次数]
+"""
+
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from download_db import DownloadDatabase, _song_statements
+
+
+SYLLABLES = ['晴', '天', '夜', '曲', '稻', '香', '星', '海', '风', '雨', '心', '光', '梦', '爱', '城', '花',
+             '月', '歌', '路', '远', '时', '间', '你', '我', '他', '的', '在', '不', '说', '走']
+LATIN = ['love', 'night', 'story', 'light', 'dream', 'heart', 'summer', 'river', 'fire', 'rain',
+         'blue', 'home', 'star', 'road', 'time', 'ghost', 'gold', 'wild', 'youth', 'echo']
+
+
+def random_word(rng: random.Random) -> str:
+    """生成一个中文或英文词"""
+    if rng.random() < 0.6:
+        return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+    return rng.choice(LATIN) + rng.choice(['', 's', 'er', 'ing', 'ly']) + str(rng.randint(0, 99))
+
+
+def build_library(db: DownloadDatabase, count: int, rng: random.Random) -> list:
+    """写入模拟曲库，返回所有 (歌名, 歌手) 供抽取搜索词"""
+    vocabulary = [random_word(rng) for _ in range(20000)]
+    artists = [random_word(rng) + random_word(rng) for _ in range(5000)]
+    conn = db._connect()
+    songs = []
+    batch = []
+    now = time.time()
+    for song_id in range(1, count + 1):
+        name = ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(1, 3)))
+        # 长尾分布：少数歌手有大量歌曲
+        artist = artists[min(int(rng.paretovariate(1.2)) - 1, len(artists) - 1) if rng.random() < 0.3
+                         else rng.randrange(len(artists))]
+        songs.append((name, artist))
+        batch.append((song_id, name, artist, rng.choice(vocabulary), f'/music/{song_id}.flac', 0,
+                      now + song_id, 'lossless', 'success', '', now, ''))
+        if len(batch) >= 10000:
+            write_batch(conn, batch)
+            batch = []
+    if batch:
+        write_batch(conn, batch)
+    return songs
+
+
+def write_batch(conn, batch: list) -> None:
+    """与写入下载记录相同，同时写入短词索引和歌手索引"""
+    for row in batch:
+        for sql, params in _song_statements(row):
+            conn.execute(sql, params)
+    conn.commit()
+
+
+def measure(db: DownloadDatabase, queries: list) -> tuple:
+    """执行搜索，返回第一页和第二页耗时（毫秒）"""
+    first, second = [], []
+    for query in queries:
+        start = time.perf_counter()
+        result = db.search_library(query, limit=20)
+        first.append((time.perf_counter() - start) * 1000)
+        if result['next_cursor']:
+            start = time.perf_counter()
+            db.search_library(query, limit=20, cursor=result['next_cursor'])
+            second.append((time.perf_counter() - start) * 1000)
+    return first, second
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DownloadDatabase(str(Path(tmp) / 'library.db'))
+        start = time.perf_counter()
+        songs = build_library(db, count, rng)
+        print(f"曲库歌曲数: {count}，建库耗时: {time.perf_counter() - start:.1f}s，每类搜索次数: {samples}")
+
+        picks = [rng.choice(songs) for _ in range(samples)]
+        kinds = {
+            '歌名': [name.split()[0] for name, _ in picks],
+            '歌手': [artist for _, artist in picks],
+            '歌手+歌名': [f'{artist} {name.split()[-1]}' for name, artist in picks],
+            '短词': [name.split()[0][:2] for name, _ in picks],
+            '单字': [name.split()[0][:1] for name, _ in picks],
+            '长词+短词': [f'{artist} {name.split()[-1][:2]}' for name, artist in picks],
+            '空（最近下载）': [''] * samples
+        }
+
+        print(f"{'搜索类型':<12}{'第一页p50(ms)':>16}{'第一页p95(ms)':>16}{'第二页p50(ms)':>16}")
+        for kind, queries in kinds.items():
+            first, second = measure(db, queries)
+            print(f"{kind:<12}{statistics.median(first):>16.2f}{percentile(first, 0.95):>16.2f}"
+                  f"{(statistics.median(second) if second else 0):>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
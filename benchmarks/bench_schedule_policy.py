@@ -0,0 +1,100 @@
+"""批量下载调度策略基准测试
+
+模拟一个歌单的下载过程，对比 list / smallest_first / largest_first 三种调度策略下
+每首歌曲的平均完成时间、中位完成时间和总耗时。文件大小按普通音质与少量超大
+（如jymaster）文件混合生成，同时下载的歌曲平分带宽，单个连接的速率受CDN限制，
+因此任务末尾只剩一个大文件时无法用满带宽。不依赖网络。
+
+用法: python benchmarks/bench_schedule_policy.py [歌曲数] [带宽MB/s] [单连接MB/s] [并发数] [重复次数]
+"""
+
+import random
+import statistics
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from scheduling import SCHEDULE_POLICIES, order_songs
+
+
+MB = 1024 * 1024
+
+
+def generate_playlist(count: int, rng: random.Random) -> List[Dict[str, int]]:
+    """生成模拟歌单：多数为30~60MB的无损文件，约5%为150~250MB的超大文件"""
+    songs = []
+    for song_id in range(1, count + 1):
+        if rng.random() < 0.05:
+            size = rng.randint(150 * MB, 250 * MB)
+        else:
+            size = rng.randint(30 * MB, 60 * MB)
+        songs.append({'id': song_id, 'size': size})
+    return songs
+
+
+def simulate(sizes: List[int], bandwidth: float, connection_rate: float, concurrency: int) -> List[float]:
+    """按给定顺序模拟下载，返回每首歌曲的完成时间（秒）
+
+    最多同时下载concurrency首，正在下载的歌曲平分带宽，且每首不超过单连接速率；
+    一首完成后立即从队列中取下一首。
+    """
+    queue = list(sizes)
+    active: List[float] = []  # 各下载剩余字节数
+    now = 0.0
+    finished = []
+
+    while queue or active:
+        while queue and len(active) < concurrency:
+            active.append(float(queue.pop(0)))
+
+        # 推进到下一首歌曲完成的时刻
+        rate = min(bandwidth / len(active), connection_rate)
+        step = min(active) / rate
+        now += step
+        remaining = []
+        for left in active:
+            left -= step * rate
+            if left <= 1e-6:
+                finished.append(now)
+            else:
+                remaining.append(left)
+        active = remaining
+
+    return finished
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    bandwidth = float(sys.argv[2]) * MB if len(sys.argv) > 2 else 20 * MB
+    connection_rate = float(sys.argv[3]) * MB if len(sys.argv) > 3 else 8 * MB
+    concurrency = int(sys.argv[4]) if len(sys.argv) > 4 else 3
+    repeat = int(sys.argv[5]) if len(sys.argv) > 5 else 20
+
+    print(f"歌曲数: {count}，带宽: {bandwidth / MB:.0f} MB/s，单连接: {connection_rate / MB:.0f} MB/s，"
+          f"并发数: {concurrency}，重复次数: {repeat}")
+
+    results = {policy: {'mean': [], 'median': [], 'makespan': []} for policy in SCHEDULE_POLICIES}
+    for seed in range(repeat):
+        songs = generate_playlist(count, random.Random(seed))
+        sizes = {song['id']: song['size'] for song in songs}
+        for policy in SCHEDULE_POLICIES:
+            ordered = order_songs(songs, policy, sizes)
+            finished = simulate([song['size'] for song in ordered], bandwidth, connection_rate, concurrency)
+            results[policy]['mean'].append(statistics.mean(finished))
+            results[policy]['median'].append(statistics.median(finished))
+            results[policy]['makespan'].append(max(finished))
+
+    baseline = statistics.mean(results['list']['mean'])
+    print(f"{'策略':<16}{'平均完成(s)':>12}{'中位完成(s)':>12}{'总耗时(s)':>12}{'平均完成对比list':>18}")
+    for policy in SCHEDULE_POLICIES:
+        mean = statistics.mean(results[policy]['mean'])
+        median = statistics.mean(results[policy]['median'])
+        makespan = statistics.mean(results[policy]['makespan'])
+        print(f"{policy:<16}{mean:>12.1f}{median:>12.1f}{makespan:>12.1f}{(mean / baseline - 1) * 100:>+17.1f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""任务取消令牌模块
+
+为后台下载任务提供协作式取消机制：
+- 每个任务一个取消令牌（threading.Event + 各事件循环的asyncio.Event）
+- 下载循环以极低开销检查令牌状态
+- 支持注册回调，在取消时立即中断阻塞中的网络读取
+- 统计从发出取消到下载代码响应之间的延迟
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class TaskCancelledException(Exception):
+    """任务已取消异常类"""
+    pass
+
+
+class CancellationStats:
+    """取消延迟统计"""
+
+    def __init__(self, window: int = 200):
+        """
+        初始化统计
+
+        Args:
+            window: 计算分位数时保留的最近样本数
+        """
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)
+        self.count = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency: float) -> None:
+        """记录一次取消延迟（秒）"""
+        with self._lock:
+            self.count += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self._recent.append(latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取统计快照，延迟单位为毫秒"""
+        with self._lock:
+            recent = sorted(self._recent)
+            p95 = recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0
+            return {
+                'count': self.count,
+                'avg_ms': round(self.total_latency / self.count * 1000, 2) if self.count else 0.0,
+                'p95_ms': round(p95 * 1000, 2),
+                'max_ms': round(self.max_latency * 1000, 2)
+            }
+
+
+# 全局取消延迟统计
+cancellation_stats = CancellationStats()
+
+
+class CancellationToken:
+    """任务取消令牌
+
+    由TaskManager为每个任务创建并沿调用栈向下传递。
+    线程中的同步代码调用is_cancelled()或wait()，协程调用wait_async()，
+    需要被立即唤醒的阻塞操作通过register()注册中断回调。
+    """
+
+    def __init__(self, task_id: Optional[str] = None):
+        """
+        初始化取消令牌
+
+        Args:
+            task_id: 所属任务ID
+        """
+        self.task_id = task_id
+        self.cancelled_at: Optional[float] = None
+        self.observed_at: Optional[float] = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self._loop_events: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    def is_cancelled(self) -> bool:
+        """检查是否已取消（无锁，可在下载热路径中频繁调用）"""
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """发出取消信号，唤醒所有等待者并执行已注册的中断回调"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.cancelled_at = time.monotonic()
+            self._event.set()
+            callbacks = list(self._callbacks)
+            loop_events = list(self._loop_events)
+            self._callbacks.clear()
+
+        for loop, event in loop_events:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(event.set)
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                # 中断回调失败不影响取消流程，下载循环仍会在下一分块检查到取消
+                pass
+
+    def register(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """注册取消时执行的中断回调
+
+        Args:
+            callback: 回调函数（在调用cancel的线程中执行）
+
+        Returns:
+            用于注销回调的函数
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+
+                def unregister() -> None:
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+
+                return unregister
+
+        # 已取消时立即执行
+        callback()
+        return lambda: None
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """阻塞等待取消信号
+
+        Args:
+            timeout: 超时时间（秒）
+
+        Returns:
+            是否已取消
+        """
+        return self._event.wait(timeout)
+
+    async def wait_async(self) -> None:
+        """在当前事件循环中等待取消信号"""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        entry = (loop, event)
+
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._loop_events.append(entry)
+
+        try:
+            await event.wait()
+        finally:
+            with self._lock:
+                if entry in self._loop_events:
+                    self._loop_events.remove(entry)
+
+    def mark_observed(self) -> Optional[float]:
+        """记录下载代码响应取消的时间点，首次调用时计入延迟统计
+
+        Returns:
+            取消延迟（秒），未取消时返回None
+        """
+        if self.cancelled_at is None:
+            return None
+
+        with self._lock:
+            if self.observed_at is not None:
+                return self.observed_at - self.cancelled_at
+            self.observed_at = time.monotonic()
+            latency = self.observed_at - self.cancelled_at
+
+        cancellation_stats.record(latency)
+        return latency
+
+    def raise_if_cancelled(self) -> None:
+        """已取消时抛出TaskCancelledException"""
+        if self._event.is_set():
+            self.mark_observed()
+            raise TaskCancelledException('任务已被用户取消')
@@ -0,0 +1,276 @@
+"""专辑封面缓存模块
+
+为写入音乐标签提供共享的封面图片缓存，包括：
+- 内存LRU缓存（按字节数限制）
+- 磁盘缓存（按总大小限制，按最近访问时间淘汰）
+- 单飞请求：同一封面的并发请求只发起一次下载，其余请求等待结果
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from http_pool import get_http_pool
+
+
+class CoverArtCache:
+    """封面图片缓存类"""
+
+    def __init__(self, cache_dir: str = "downloads/.cache/covers", max_memory_bytes: int = 32 * 1024 * 1024,
+                 max_disk_bytes: int = 512 * 1024 * 1024, timeout: int = 10):
+        """
+        初始化封面缓存
+
+        Args:
+            cache_dir: 磁盘缓存目录
+            max_memory_bytes: 内存缓存上限（字节）
+            max_disk_bytes: 磁盘缓存上限（字节），为0时禁用磁盘缓存
+            timeout: 封面下载超时时间（秒）
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._inflight: Dict[str, Future] = {}
+        self._disk_bytes: Optional[int] = None
+
+        # 统计信息
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.fetches = 0
+        self.coalesced = 0
+        self.failures = 0
+
+        if self.max_disk_bytes > 0:
+            self.cache_dir.mkdir(exist_ok=True, parents=True)
+
+    def _cache_key(self, pic_url: str) -> str:
+        """生成缓存键
+
+        封面URL形如 http://p1.music.126.net/<token>==/<pic_id>.jpg，
+        不同CDN节点（p1/p2/p3）、协议和查询参数指向同一张图片，只按路径区分。
+        """
+        path = urlparse(pic_url).path or pic_url
+        return hashlib.sha1(path.encode('utf-8')).hexdigest()
+
+    def _disk_path(self, key: str) -> Path:
+        """获取缓存键对应的磁盘文件路径"""
+        return self.cache_dir / key[:2] / key
+
+    def get(self, pic_url: str) -> Optional[bytes]:
+        """获取封面图片数据
+
+        Args:
+            pic_url: 封面URL
+
+        Returns:
+            图片数据，下载失败时返回None
+        """
+        if not pic_url:
+            return None
+
+        key = self._cache_key(pic_url)
+
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return data
+
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            # 同一封面正在被其他下载获取，等待其结果
+            try:
+                return future.result(timeout=self.timeout * 2)
+            except Exception:
+                return None
+
+        data = None
+        try:
+            data = self._load_from_disk(key)
+            if data is not None:
+                with self._lock:
+                    self.disk_hits += 1
+            else:
+                data = self._fetch(pic_url)
+                if data is not None:
+                    self._save_to_disk(key, data)
+            if data is not None:
+                self._remember(key, data)
+        finally:
+            future.set_result(data)
+            with self._lock:
+                self._inflight.pop(key, None)
+
+        return data
+
+    def _fetch(self, pic_url: str) -> Optional[bytes]:
+        """从网络下载封面"""
+        with self._lock:
+            self.fetches += 1
+        try:
+            response = get_http_pool('cdn').get(pic_url, timeout=self.timeout)
+            response.raise_for_status()
+            return response.content
+        except requests.RequestException as e:
+            with self._lock:
+                self.failures += 1
+            print(f"下载封面失败: {pic_url} - {e}")
+            return None
+
+    def _remember(self, key: str, data: bytes) -> None:
+        """写入内存缓存并按LRU淘汰"""
+        if len(data) > self.max_memory_bytes:
+            return
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.max_memory_bytes and self._memory:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _load_from_disk(self, key: str) -> Optional[bytes]:
+        """从磁盘缓存读取，命中时刷新访问时间"""
+        if self.max_disk_bytes <= 0:
+            return None
+
+        path = self._disk_path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def _save_to_disk(self, key: str, data: bytes) -> None:
+        """写入磁盘缓存，超出上限时淘汰最久未访问的文件"""
+        if self.max_disk_bytes <= 0 or len(data) > self.max_disk_bytes:
+            return
+
+        path = self._disk_path(key)
+        try:
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_suffix('.tmp')
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"写入封面缓存失败: {e}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_usage()
+            else:
+                self._disk_bytes += len(data)
+            need_evict = self._disk_bytes > self.max_disk_bytes
+
+        if need_evict:
+            self._evict_disk()
+
+    def _scan_disk_usage(self) -> int:
+        """统计磁盘缓存总大小"""
+        total = 0
+        for path in self.cache_dir.glob('*/*'):
+            try:
+                total += path.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def _evict_disk(self) -> None:
+        """按访问时间从旧到新淘汰，直到低于上限的80%"""
+        entries = []
+        for path in self.cache_dir.glob('*/*'):
+            try:
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                pass
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_disk_bytes * 0.8)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
+
+        with self._lock:
+            self._disk_bytes = total
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_bytes': self._disk_bytes,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'fetches': self.fetches,
+                'coalesced': self.coalesced,
+                'failures': self.failures
+            }
+
+
+def guess_image_mime(data: bytes) -> str:
+    """根据文件头判断图片MIME类型"""
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    return 'image/jpeg'
+
+
+_cover_cache: Optional[CoverArtCache] = None
+_cover_cache_lock = threading.Lock()
+
+
+def get_cover_cache() -> CoverArtCache:
+    """获取全局封面缓存实例（首次调用时根据配置文件创建）"""
+    global _cover_cache
+    if _cover_cache is not None:
+        return _cover_cache
+
+    # 在加锁前读取配置，避免导入main时重入
+    try:
+        from main import config
+        base_dir = config.download_config.get('base_dir', 'downloads')
+        cache_config = config.cover_cache_config
+    except ImportError:
+        base_dir = 'downloads'
+        cache_config = {}
+
+    with _cover_cache_lock:
+        if _cover_cache is None:
+            _cover_cache = CoverArtCache(
+                cache_dir=cache_config.get('cache_dir') or str(Path(base_dir) / '.cache' / 'covers'),
+                max_memory_bytes=int(cache_config.get('max_memory_mb', 32)) * 1024 * 1024,
+                max_disk_bytes=int(cache_config.get('max_disk_mb', 512)) * 1024 * 1024
+            )
+        return _cover_cache
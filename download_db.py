@@ -3,11 +3,308 @@
 使用SQLite数据库记录已下载的歌曲信息，用于验证是否已下载过歌曲。
 """
 
+import atexit
+import base64
+import bisect
+import json
+import logging
+import mmap
+import os
 import sqlite3
+import struct
+import threading
 import time
+import unicodedata
+from array import array
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass
+from typing import List, Dict, Any, Iterable, Optional, Sequence, Tuple
+from dataclasses import asdict, dataclass, field
+
+
+logger = logging.getLogger('download_db')
+
+# 等待其他连接释放写锁的最长时间（秒）
+BUSY_TIMEOUT = 30.0
+
+# 每个连接的页缓存大小（KB）
+CACHE_SIZE_KB = 8192
+
+# 每个连接缓存的预编译语句数
+STATEMENT_CACHE_SIZE = 256
+
+
+# 写入下载记录的SQL（延迟写入和立即写入共用）
+# 已有记录时原地更新而不是REPLACE：REPLACE删除旧行时不会触发DELETE触发器，统计表会重复计数
+# 同一文件（路径和大小不变）再次写入记录但没有带MD5时（如批量下载结束后补写记录），保留下载时记录的MD5；
+# 成功记录不会被失败等其他状态的记录覆盖（如升级失败时原有的低音质文件仍然可用）
+INSERT_SONG_SQL = '''
+    INSERT INTO downloaded_songs
+    (song_id, song_name, artists, album, file_path, file_size,
+     download_time, quality, status, file_md5, updated_time, content_md5)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(song_id) DO UPDATE SET
+        song_name = excluded.song_name, artists = excluded.artists, album = excluded.album,
+        file_path = excluded.file_path, file_size = excluded.file_size,
+        download_time = excluded.download_time, quality = excluded.quality,
+        status = excluded.status, updated_time = excluded.updated_time,
+        file_md5 = CASE WHEN excluded.file_md5 = '' AND excluded.file_path = file_path
+                        AND excluded.file_size = file_size
+                   THEN file_md5 ELSE excluded.file_md5 END,
+        content_md5 = CASE WHEN excluded.content_md5 = '' AND excluded.file_path = file_path
+                           AND excluded.file_size = file_size
+                      THEN content_md5 ELSE excluded.content_md5 END
+    WHERE excluded.status = 'success' OR downloaded_songs.status != 'success'
+'''
+INSERT_LOCATION_SQL = '''
+    INSERT OR IGNORE INTO song_locations (file_path, song_id, quality, link_type, created_time)
+    VALUES (?, ?, ?, ?, ?)
+'''
+REPLACE_LOCATION_SQL = '''
+    INSERT OR REPLACE INTO song_locations (file_path, song_id, quality, link_type, created_time)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+# 统计表触发器：把一行下载记录计入（NEW）或移出（OLD）按状态和按歌手的计数，
+# meta表中的artist_count在某歌手的歌曲数由0变1或由1变0时增减。
+# 触发器中的INSERT OR IGNORE会被外层语句的冲突处理方式覆盖，因此用NOT EXISTS判断
+STATS_ADD_SQL = '''
+    INSERT INTO song_stats (status)
+    SELECT NEW.status WHERE NOT EXISTS (SELECT 1 FROM song_stats WHERE status = NEW.status);
+    UPDATE song_stats SET song_count = song_count + 1, total_size = total_size + COALESCE(NEW.file_size, 0)
+    WHERE status = NEW.status;
+    INSERT INTO artist_stats (artists)
+    SELECT NEW.artists WHERE NOT EXISTS (SELECT 1 FROM artist_stats WHERE artists = NEW.artists);
+    UPDATE artist_stats SET song_count = song_count + 1 WHERE artists = NEW.artists;
+    UPDATE meta SET value = value + 1
+    WHERE key = 'artist_count' AND (SELECT song_count FROM artist_stats WHERE artists = NEW.artists) = 1;
+'''
+STATS_REMOVE_SQL = '''
+    UPDATE song_stats SET song_count = song_count - 1, total_size = total_size - COALESCE(OLD.file_size, 0)
+    WHERE status = OLD.status;
+    UPDATE meta SET value = value - 1
+    WHERE key = 'artist_count' AND (SELECT song_count FROM artist_stats WHERE artists = OLD.artists) = 1;
+    UPDATE artist_stats SET song_count = song_count - 1 WHERE artists = OLD.artists;
+    DELETE FROM artist_stats WHERE artists = OLD.artists AND song_count <= 0;
+'''
+# 歌手索引：每首歌的每位歌手一行，name_key为规范化后的歌手名
+DELETE_SONG_ARTISTS_SQL = 'DELETE FROM song_artists WHERE song_id = ?'
+INSERT_SONG_ARTIST_SQL = '''
+    INSERT OR IGNORE INTO song_artists (song_id, name_key, artist, position)
+    VALUES (?, ?, ?, ?)
+'''
+
+# 短词索引：每首歌一行，内容为歌名、歌手、专辑中所有1到2个字符的片段（见search_grams）
+UPSERT_SONG_GRAMS_SQL = '''
+    INSERT INTO song_grams (song_id, grams) VALUES (?, ?)
+    ON CONFLICT(song_id) DO UPDATE SET grams = excluded.grams WHERE grams != excluded.grams
+'''
+
+# 多位歌手在artists字段中的分隔符
+ARTIST_SEPARATOR = '/'
+
+# 全文搜索：三元组分词支持中文等不以空格分词的文本，但少于3个字符的词无法用三元组匹配，
+# 改用短词索引（song_gram_fts，以1到2个字符的片段为词）匹配
+FTS_MIN_TERM_LENGTH = 3
+
+# 相关度排序中歌名、歌手、专辑包含搜索词的得分
+SEARCH_FIELD_WEIGHTS = (3, 2, 1)
+
+# 匹配的歌曲不超过该数量时在SQLite中对全部匹配按相关度排序；更宽泛的搜索按歌曲ID从新到旧排列，
+# 取满一页后即可停止。相关度不用bm25：bm25要为每个词统计全库匹配数，包含常见词时
+# 会再遍历一遍该词的全部匹配（实测比匹配本身慢数倍）
+FTS_RANK_LIMIT = 1000
+
+# 曲库搜索每页最多返回的歌曲数
+SEARCH_MAX_LIMIT = 100
+
+# 延迟写入：队列中的记录数达到该值时立即写入
+WRITE_BATCH_SIZE = 200
+
+# 延迟写入：记录在队列中停留的最长时间（秒）
+WRITE_FLUSH_INTERVAL = 1.0
+
+
+# 已下载歌曲ID索引快照：文件头为 标识, downloaded_songs修改代数, ID数量，之后是有序的int64 ID
+INDEX_MAGIC = b'SONGIDX1'
+INDEX_HEADER = struct.Struct('<8sqq')
+
+# 索引增量达到该数量时从数据库重建并写入快照
+INDEX_COMPACT_THRESHOLD = 65536
+
+
+# 可按文件路径分批扫描的表（文件路径列均有索引）
+PATH_TABLES = ('downloaded_songs', 'song_locations')
+
+
+# 下载记录查询字段（顺序与DownloadedSong字段一致，表别名为d）
+SONG_COLUMNS = (
+    'd.song_id, d.song_name, d.artists, d.album, d.file_path, d.file_size, '
+    'd.download_time, d.quality, d.status, d.file_md5'
+)
+
+
+# 音质等级（从低到高），用于判断已有文件是否满足请求的音质
+QUALITY_RANK = {
+    'standard': 0,
+    'higher': 1,
+    'exhigh': 2,
+    'lossless': 3,
+    'hires': 4,
+    'jyeffect': 5,
+    'sky': 6,
+    'dolby': 7,
+    'jymaster': 8
+}
+
+
+def quality_rank(quality: str) -> int:
+    """获取音质等级，未知音质返回-1"""
+    return QUALITY_RANK.get(quality, -1)
+
+
+def normalize_artist(name: str) -> str:
+    """规范化歌手名（全半角统一、忽略大小写、合并空白），用于精确和前缀匹配"""
+    return ' '.join(unicodedata.normalize('NFKC', name).casefold().split())
+
+
+def split_artists(artists: str) -> List[Tuple[str, str]]:
+    """拆分以"/"连接的歌手字符串
+
+    Args:
+        artists: 下载记录中的歌手字段
+
+    Returns:
+        (歌手名, 规范化歌手名) 列表，按原顺序去重，忽略空名
+    """
+    result = []
+    seen = set()
+    for name in (artists or '').split(ARTIST_SEPARATOR):
+        name = name.strip()
+        key = normalize_artist(name)
+        if key and key not in seen:
+            seen.add(key)
+            result.append((name, key))
+    return result
+
+
+def search_grams(*fields: str) -> str:
+    """拆出文本中所有1到2个字符的片段，以空格连接，作为短词索引的内容
+
+    只取由字母和数字组成的片段（与unicode61分词器的词字符一致），片段不跨越空白和标点。
+
+    Args:
+        fields: 歌名、歌手、专辑等文本
+
+    Returns:
+        去重排序后以空格连接的片段
+    """
+    grams = set()
+    for text in fields:
+        text = text or ''
+        for i, char in enumerate(text):
+            if not char.isalnum():
+                continue
+            grams.add(char)
+            if i + 1 < len(text) and text[i + 1].isalnum():
+                grams.add(text[i:i + 2])
+    return ' '.join(sorted(grams))
+
+
+def _quote_phrase(term: str) -> str:
+    """把搜索词作为FTS5短语加引号，避免用户输入被解析为FTS5查询语法"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _fts_phrases(text: str, fts_enabled: bool = True) -> Tuple[List[str], List[str], List[str]]:
+    """把用户输入的搜索词转换为FTS5短语
+
+    不少于3个字符的词用三元组索引匹配，更短的词用短词索引匹配；短词中含有标点等
+    非字母数字字符时，先用其中的片段在短词索引中筛选，再用LIKE精确匹配。
+
+    Args:
+        text: 以空白分隔的搜索词，所有词都需匹配
+        fts_enabled: 全文索引是否可用，不可用时所有词都用LIKE匹配
+
+    Returns:
+        (三元组索引的FTS5短语列表, 短词索引的FTS5短语列表, 需要用LIKE匹配的词列表)
+    """
+    terms = text.split()
+    if not fts_enabled:
+        return [], [], terms
+    phrases, gram_phrases, like_terms = [], [], []
+    for term in terms:
+        if len(term) >= FTS_MIN_TERM_LENGTH:
+            phrases.append(_quote_phrase(term))
+        elif term.isalnum():
+            gram_phrases.append(_quote_phrase(term))
+        else:
+            gram_phrases.extend(_quote_phrase(gram) for gram in search_grams(term).split())
+            like_terms.append(term)
+    return phrases, list(dict.fromkeys(gram_phrases)), like_terms
+
+
+def _relevance_sql(terms: List[str]) -> Tuple[str, List[str]]:
+    """生成计算下载记录与搜索词相关度（越小越相关）的SQL表达式
+
+    歌名、歌手、专辑包含搜索词分别按SEARCH_FIELD_WEIGHTS计分，得分相同时歌名越短越靠前。
+
+    Returns:
+        (SQL表达式, 参数列表)
+    """
+    hits, params = [], []
+    for term in terms:
+        for column, weight in zip(('d.song_name', 'd.artists', 'd.album'), SEARCH_FIELD_WEIGHTS):
+            hits.append(f'(instr(lower({column}), ?) > 0) * {weight}')
+            params.append(term.lower())
+    return f"length(d.song_name) - 1000.0 * ({' + '.join(hits) or '0'})", params
+
+
+# 曲库搜索的排序方式：按相关度、按歌曲ID倒序、按下载时间倒序
+SEARCH_ORDERS = ('rank', 'id', 'time')
+
+
+def _encode_cursor(order: str, score: float, song_id: int) -> str:
+    """把排序方式和上一页最后一条的位置编码为不透明的游标字符串"""
+    return base64.urlsafe_b64encode(json.dumps([order, score, song_id]).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, float, int]:
+    """解析分页游标，格式不正确时抛出ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except ValueError:
+        raise ValueError("无效的分页游标")
+    if not (isinstance(values, list) and len(values) == 3 and values[0] in SEARCH_ORDERS
+            and all(isinstance(value, (int, float)) for value in values[1:])):
+        raise ValueError("无效的分页游标")
+    return values[0], values[1], values[2]
+
+
+def _merge_song_row(previous: tuple, row: tuple) -> tuple:
+    """合并队列中同一歌曲的两条记录（同INSERT_SONG_SQL）：成功记录不被其他状态的记录覆盖，
+    同一文件的新记录没有带MD5时沿用旧记录的MD5"""
+    if previous[8] == 'success' and row[8] != 'success':
+        return previous
+    if previous[4] != row[4] or previous[5] != row[5]:
+        return row
+    row = list(row)
+    for column in (9, 11):
+        row[column] = row[column] or previous[column]
+    return tuple(row)
+
+
+def _song_statements(row: tuple) -> List[Tuple[str, tuple]]:
+    """写入一条下载记录需要执行的语句：记录本身及其短词索引和歌手索引"""
+    statements = [
+        (INSERT_SONG_SQL, row),
+        (UPSERT_SONG_GRAMS_SQL, (row[0], search_grams(row[1], row[2], row[3]))),
+        (DELETE_SONG_ARTISTS_SQL, (row[0],))
+    ]
+    statements.extend(
+        (INSERT_SONG_ARTIST_SQL, (row[0], key, name, position))
+        for position, (name, key) in enumerate(split_artists(row[2]))
+    )
+    return statements
 
 
 @dataclass
@@ -21,26 +318,482 @@ class DownloadedSong:
     file_size: int
     download_time: float
     quality: str
-    status: str  # 'success', 'failed', 'skipped'
+    status: str  # 'success', 'failed', 'skipped', 'missing'（文件已被删除或移走）, 'corrupt'（校验失败）
+    file_md5: str = ""  # 下载时校验通过的上游音频MD5
+
+
+@dataclass
+class DownloadPlan:
+    """批量下载规划结果"""
+    skip: Dict[int, DownloadedSong] = field(default_factory=dict)  # 已有同等或更高音质的文件
+    upgrade: Dict[int, DownloadedSong] = field(default_factory=dict)  # 已有较低音质的文件，需要重新下载替换
+    download: List[int] = field(default_factory=list)  # 尚未下载（或记录失败、文件丢失）
+    locations: Dict[int, List[Dict[str, Any]]] = field(default_factory=dict)  # 跳过的歌曲的所有存放位置
+
+
+class _WriteBehindRecorder:
+    """下载记录的延迟批量写入队列
+
+    add_song/add_song_location先把记录放入内存队列，队列满WRITE_BATCH_SIZE条或最早的记录
+    停留超过WRITE_FLUSH_INTERVAL秒时，在一个事务中批量写入，避免每首歌提交一次。
+    同一首歌的多条记录只保留最后一条；同一路径的位置记录与立即写入时的覆盖规则一致。
+    查询队列中（或正在写入）的歌曲前先写入，保证读到自己的写入。
+    """
+
+    def __init__(self, pool: '_ConnectionPool', batch_size: int = WRITE_BATCH_SIZE,
+                 flush_interval: float = WRITE_FLUSH_INTERVAL):
+        self._pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._songs: Dict[int, tuple] = {}
+        # 文件路径 -> (位置参数, 是否覆盖已有记录)
+        self._locations: Dict[str, tuple] = {}
+        self._flushing_ids: set = set()
+        self._oldest: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+        # 统计信息
+        self.records = 0
+        self.collapsed = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.errors = 0
+
+    def _ensure_thread(self) -> None:
+        """启动定时写入线程（需持有锁）"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='download-db-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        """定时检查队列，最早的记录超过时限时写入"""
+        while True:
+            time.sleep(self.flush_interval / 4)
+            with self._lock:
+                due = self._oldest is not None and time.time() - self._oldest >= self.flush_interval
+            if due:
+                self.flush()
+
+    def add_song(self, row: tuple, location: Optional[tuple]) -> None:
+        """加入一条下载记录及其存放位置（不覆盖已有位置）"""
+        with self._lock:
+            self.records += 1
+            previous = self._songs.get(row[0])
+            if previous is not None:
+                self.collapsed += 1
+                row = _merge_song_row(previous, row)
+            self._songs[row[0]] = row
+            if location is not None and location[0] not in self._locations:
+                self._locations[location[0]] = (location, False)
+            full = self._mark_pending()
+        if full:
+            self.flush()
+
+    def add_location(self, location: tuple) -> None:
+        """加入一条存放位置记录（覆盖已有位置）"""
+        with self._lock:
+            self.records += 1
+            self._locations[location[0]] = (location, True)
+            full = self._mark_pending()
+        if full:
+            self.flush()
+
+    def _mark_pending(self) -> bool:
+        """记录队列时间并返回是否需要立即写入（需持有锁）"""
+        if self._oldest is None:
+            self._oldest = time.time()
+            self._ensure_thread()
+        return len(self._songs) + len(self._locations) >= self.batch_size
+
+    def is_pending(self, song_ids: List[int]) -> bool:
+        """判断这些歌曲是否有尚未写入数据库的记录"""
+        with self._lock:
+            if not (self._songs or self._locations or self._flushing_ids):
+                return False
+            pending = set(self._songs) | self._flushing_ids
+            pending.update(location[1] for location, _ in self._locations.values())
+        return any(song_id in pending for song_id in song_ids)
+
+    def flush(self) -> int:
+        """把队列中的记录在一个事务中写入数据库
+
+        Returns:
+            写入的记录数，写入失败时记录放回队列并返回0
+        """
+        with self._flush_lock:
+            with self._lock:
+                songs, self._songs = self._songs, {}
+                locations, self._locations = self._locations, {}
+                self._oldest = None
+                self._flushing_ids = set(songs) | {location[1] for location, _ in locations.values()}
+            if not songs and not locations:
+                return 0
+
+            # 每条记录的语句为一组，逐条写入时整组写入或整组丢弃
+            groups = [_song_statements(row) for row in songs.values()] + [
+                [(REPLACE_LOCATION_SQL if replace else INSERT_LOCATION_SQL, location)]
+                for location, replace in locations.values()
+            ]
+            conn = self._pool.connection()
+            dropped_ids = set()
+            dropped = 0
+            try:
+                try:
+                    for group in groups:
+                        for sql, params in group:
+                            conn.execute(sql, params)
+                except sqlite3.IntegrityError:
+                    # 个别记录不符合约束时逐组写入，只丢弃出错的记录，避免整批反复失败；
+                    # 每组在保存点中执行，出错时回滚到保存点，已执行的同组语句不会残留
+                    self._pool.rollback()
+                    conn.execute('BEGIN')
+                    for group in groups:
+                        conn.execute('SAVEPOINT g')
+                        try:
+                            for sql, params in group:
+                                conn.execute(sql, params)
+                        except sqlite3.IntegrityError as e:
+                            conn.execute('ROLLBACK TO g')
+                            dropped += 1
+                            if group[0][0] == INSERT_SONG_SQL:
+                                dropped_ids.add(group[0][1][0])
+                            logger.warning("丢弃无效的下载记录 %s: %s", group[0][1][0], e)
+                        conn.execute('RELEASE g')
+                conn.commit()
+            except sqlite3.Error as e:
+                self._pool.rollback()
+                print(f"批量写入下载记录失败: {e}")
+                # 放回队列等待下次写入，期间加入的较新记录优先
+                with self._lock:
+                    for song_id, row in songs.items():
+                        self._songs.setdefault(song_id, row)
+                    for file_path, location in locations.items():
+                        self._locations.setdefault(file_path, location)
+                    self._oldest = self._oldest or time.time()
+                    self._flushing_ids = set()
+                    self.errors += 1
+                return 0
+
+            # 其他状态的记录不会覆盖成功记录，只有成功记录会改变索引
+            self._pool.index.apply(
+                (row[0], row[8]) for row in songs.values() if row[8] == 'success' and row[0] not in dropped_ids
+            )
+            written = len(songs) + len(locations) - dropped
+            with self._lock:
+                self._flushing_ids = set()
+                self.flushes += 1
+                self.rows_written += written
+            return written
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取延迟写入统计信息"""
+        with self._lock:
+            return {
+                'pending': len(self._songs) + len(self._locations),
+                'records': self.records,
+                'collapsed': self.collapsed,
+                'flushes': self.flushes,
+                'rows_written': self.rows_written,
+                'errors': self.errors
+            }
+
+
+class _SongIndex:
+    """已成功下载的歌曲ID内存索引
+
+    基础部分是有序的int64数组（从快照文件内存映射或从数据库读取），写入时的变化记录在
+    增量集合中；增量较多时重新从数据库读取并写入快照。快照头部记录downloaded_songs的
+    修改代数（由触发器维护），与数据库不一致时不使用快照。
+    只反映本进程的写入，其他进程写入同一数据库后需重启才能看到。
+    """
+
+    def __init__(self, pool: '_ConnectionPool'):
+        self._pool = pool
+        self.snapshot_path = pool.db_path.with_name(pool.db_path.name + '.ids')
+
+        self._lock = threading.Lock()
+        self._base: Sequence[int] = array('q')
+        self._mmap: Optional[mmap.mmap] = None
+        self._added: set = set()
+        self._removed: set = set()
+        self._loaded = False
+
+        # 统计信息
+        self.source = ''
+        self.generation = 0
+        self.load_seconds = 0.0
+        self.lookups = 0
+        self.rebuilds = 0
+
+    def _read_generation(self, conn: sqlite3.Connection) -> int:
+        """读取downloaded_songs的修改代数"""
+        row = conn.execute("SELECT value FROM meta WHERE key = 'songs_generation'").fetchone()
+        return row[0] if row else 0
+
+    def _ensure_loaded(self) -> None:
+        """首次使用时加载索引：快照有效时直接映射，否则从数据库重建"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            start = time.perf_counter()
+            generation = self._read_generation(self._pool.connection())
+            if not self._load_snapshot(generation):
+                self._rebuild()
+            self.load_seconds = time.perf_counter() - start
+            self._loaded = True
+
+    def _load_snapshot(self, generation: int) -> bool:
+        """从快照文件内存映射索引（需持有锁）
+
+        Returns:
+            快照存在且与数据库代数一致时返回True
+        """
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+
+        if len(mapped) >= INDEX_HEADER.size:
+            magic, snapshot_generation, count = INDEX_HEADER.unpack_from(mapped)
+            if (magic == INDEX_MAGIC and snapshot_generation == generation
+                    and len(mapped) == INDEX_HEADER.size + count * 8):
+                self._set_base(memoryview(mapped)[INDEX_HEADER.size:].cast('q'), mapped)
+                self.source = 'snapshot'
+                self.generation = generation
+                return True
+        mapped.close()
+        return False
+
+    def _set_base(self, base: Sequence[int], mapped: Optional[mmap.mmap] = None) -> None:
+        """替换基础数组（需持有锁），旧的内存映射由垃圾回收释放"""
+        self._base = base
+        self._mmap = mapped
+        self._added = set()
+        self._removed = set()
+
+    def _rebuild(self) -> None:
+        """在一个读事务中读取代数和全部ID，重建索引并写入快照（需持有锁）"""
+        conn = self._pool.connection()
+        conn.execute('BEGIN')
+        try:
+            generation = self._read_generation(conn)
+            ids = array('q', (row[0] for row in conn.execute(
+                "SELECT song_id FROM downloaded_songs WHERE status = 'success' ORDER BY song_id"
+            )))
+        finally:
+            conn.commit()
+
+        self._set_base(ids)
+        self.source = 'table'
+        self.generation = generation
+        self.rebuilds += 1
+
+        tmp_path = self.snapshot_path.with_name(self.snapshot_path.name + '.tmp')
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, generation, len(ids)))
+                f.write(ids.tobytes())
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"写入歌曲ID索引快照失败: {e}")
+
+    def contains(self, song_id: int) -> bool:
+        """判断歌曲是否已成功下载（只查内存）"""
+        self._ensure_loaded()
+        self.lookups += 1
+        if song_id in self._added:
+            return True
+        if song_id in self._removed:
+            return False
+        base = self._base
+        position = bisect.bisect_left(base, song_id)
+        return position < len(base) and base[position] == song_id
+
+    def apply(self, statuses: Iterable[Tuple[int, str]]) -> None:
+        """登记已提交的状态变化
+
+        Args:
+            statuses: (歌曲ID, 新状态) 序列，状态为None表示记录已删除
+        """
+        with self._lock:
+            if not self._loaded:
+                # 尚未加载时无需登记，加载时会从数据库读到这些变化
+                return
+            for song_id, status in statuses:
+                if status == 'success':
+                    self._added.add(song_id)
+                    self._removed.discard(song_id)
+                else:
+                    self._removed.add(song_id)
+                    self._added.discard(song_id)
+            if len(self._added) + len(self._removed) >= INDEX_COMPACT_THRESHOLD:
+                self._rebuild()
+
+    def save(self) -> None:
+        """有未写入快照的变化时重建索引并写入快照（进程退出时调用）"""
+        with self._lock:
+            if self._loaded and (self._added or self._removed):
+                self._rebuild()
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取索引统计信息"""
+        with self._lock:
+            return {
+                'loaded': self._loaded,
+                'source': self.source,
+                'generation': self.generation,
+                'base_size': len(self._base),
+                'pending_changes': len(self._added) + len(self._removed),
+                'load_seconds': round(self.load_seconds, 4),
+                'lookups': self.lookups,
+                'rebuilds': self.rebuilds
+            }
+
+
+class _ConnectionPool:
+    """同一数据库文件的线程本地连接池
+
+    每个线程首次访问时创建一个长连接并一直复用，避免每次查询重新打开数据库；
+    连接使用WAL日志，读操作不会被写操作阻塞，多个下载线程可以同时查询。
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+        self.recorder = _WriteBehindRecorder(self)
+        self.index = _SongIndex(self)
+
+    def connection(self) -> sqlite3.Connection:
+        """获取当前线程的连接，不存在或进程已fork时重新创建"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # WAL模式下NORMAL只在检查点时同步磁盘，断电最多丢失最近的提交，不会损坏数据库
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{CACHE_SIZE_KB}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        with self._lock:
+            self.connections_opened += 1
+        return conn
+
+    def rollback(self) -> None:
+        """回滚当前线程连接中未提交的事务"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+
+    def close(self) -> None:
+        """关闭当前线程的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            if self._local.pid == os.getpid():
+                conn.close()
+
+
+_pools: Dict[str, _ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def flush_all() -> int:
+    """写入所有数据库文件延迟写入队列中的记录（任务结束和进程退出时调用）
+
+    Returns:
+        写入的记录数
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+    return sum(pool.recorder.flush() for pool in pools)
+
+
+def _shutdown() -> None:
+    """进程退出时写入队列中的记录，并保存歌曲ID索引快照"""
+    flush_all()
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        try:
+            pool.index.save()
+        except sqlite3.Error as e:
+            print(f"保存歌曲ID索引快照失败: {e}")
+
+
+atexit.register(_shutdown)
+
+
+def _get_pool(db_path: Path) -> _ConnectionPool:
+    """获取数据库文件对应的连接池，同一文件的所有DownloadDatabase实例共用"""
+    key = str(db_path.resolve())
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _ConnectionPool(db_path)
+            _pools[key] = pool
+        return pool
 
 
 class DownloadDatabase:
     """下载数据库管理类"""
     
-    def __init__(self, db_path: str = "downloads.db"):
+    def __init__(self, db_path: str = "downloads.db", write_behind: bool = True):
         """
         初始化数据库
         
         Args:
             db_path: 数据库文件路径
+            write_behind: 是否延迟批量写入下载记录（同一数据库文件的实例共用一个写入队列）
         """
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(exist_ok=True)
+        self._pool = _get_pool(self.db_path)
+        self._recorder = self._pool.recorder if write_behind else None
         self._init_database()
     
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前线程复用的数据库连接"""
+        return self._pool.connection()
+
+    def _rollback(self) -> None:
+        """写入失败时回滚当前线程未提交的事务，避免长连接一直持有写锁"""
+        self._pool.rollback()
+
+    def close(self) -> None:
+        """关闭当前线程的数据库连接（线程结束前可调用，下次访问时自动重新连接）"""
+        self._pool.close()
+
+    def flush(self) -> int:
+        """
+        立即写入延迟写入队列中的下载记录
+
+        Returns:
+            int: 写入的记录数
+        """
+        return self._pool.recorder.flush()
+
+    def _sync(self, song_ids: List[int]) -> None:
+        """查询前写入这些歌曲尚在队列中的记录"""
+        if self._pool.recorder.is_pending(song_ids):
+            self._pool.recorder.flush()
+
     def _init_database(self):
         """初始化数据库表结构"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         # 创建下载记录表
@@ -55,19 +808,248 @@ class DownloadDatabase:
                 download_time REAL NOT NULL,
                 quality TEXT NOT NULL,
                 status TEXT NOT NULL,
+                file_md5 TEXT DEFAULT '',
                 created_time REAL DEFAULT (strftime('%s', 'now')),
                 updated_time REAL DEFAULT (strftime('%s', 'now'))
             )
         ''')
         
+        # 迁移：旧数据库补充file_md5列和content_md5列（写入文件的数据的MD5，定期校验的基准）
+        cursor.execute('PRAGMA table_info(downloaded_songs)')
+        columns = {row[1] for row in cursor.fetchall()}
+        if 'file_md5' not in columns:
+            cursor.execute("ALTER TABLE downloaded_songs ADD COLUMN file_md5 TEXT DEFAULT ''")
+        if 'content_md5' not in columns:
+            cursor.execute("ALTER TABLE downloaded_songs ADD COLUMN content_md5 TEXT DEFAULT ''")
+
         # 创建索引以提高查询性能
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_song_id ON downloaded_songs(song_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_artists ON downloaded_songs(artists)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_path ON downloaded_songs(file_path)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_download_time ON downloaded_songs(download_time)')
         
+        # 创建歌曲存放位置表（同一首歌可链接到多个歌单/歌手目录）
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'song_locations'")
+        locations_exist = cursor.fetchone() is not None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS song_locations (
+                file_path TEXT PRIMARY KEY,
+                song_id INTEGER NOT NULL,
+                quality TEXT NOT NULL,
+                link_type TEXT NOT NULL,
+                created_time REAL DEFAULT (strftime('%s', 'now'))
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_locations_song ON song_locations(song_id, quality)')
+
+        if not locations_exist:
+            # 首次创建时从已有下载记录迁移存放位置
+            cursor.execute('''
+                INSERT OR IGNORE INTO song_locations (file_path, song_id, quality, link_type)
+                SELECT file_path, song_id, quality, 'download' FROM downloaded_songs
+                WHERE status = 'success' AND file_path != ''
+            ''')
+
+        # 创建歌手索引表（按规范化歌手名精确或前缀查找歌曲）
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'song_artists'")
+        artists_exist = cursor.fetchone() is not None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS song_artists (
+                song_id INTEGER NOT NULL,
+                name_key TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                position INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (song_id, name_key)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_song_artists_name ON song_artists(name_key, song_id)')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS song_artists_delete AFTER DELETE ON downloaded_songs
+            BEGIN
+                DELETE FROM song_artists WHERE song_id = OLD.song_id;
+            END
+        ''')
+
+        if not artists_exist:
+            # 首次创建时从已有下载记录拆分歌手
+            cursor.execute('SELECT song_id, artists FROM downloaded_songs')
+            cursor.executemany(INSERT_SONG_ARTIST_SQL, [
+                (song_id, key, name, position)
+                for song_id, artists in cursor.fetchall()
+                for position, (name, key) in enumerate(split_artists(artists))
+            ])
+
+        # 创建短词索引的内容表（与下载记录一起写入，记录删除时由触发器删除）
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'song_grams'")
+        grams_exist = cursor.fetchone() is not None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS song_grams (
+                song_id INTEGER PRIMARY KEY,
+                grams TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS song_grams_delete AFTER DELETE ON downloaded_songs
+            BEGIN
+                DELETE FROM song_grams WHERE song_id = OLD.song_id;
+            END
+        ''')
+
+        if not grams_exist:
+            # 首次创建时从已有下载记录拆分片段
+            cursor.execute('SELECT song_id, song_name, artists, album FROM downloaded_songs')
+            cursor.executemany(UPSERT_SONG_GRAMS_SQL, [
+                (song_id, search_grams(song_name, artists, album))
+                for song_id, song_name, artists, album in cursor.fetchall()
+            ])
+
+        # 创建全文索引（外部内容表，由触发器与内容表同步；SQLite未编译FTS5时搜索退化为LIKE）：
+        # song_fts是歌名、歌手、专辑的三元组索引，song_gram_fts以song_grams中的片段为词，匹配少于3个字符的词
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('song_fts', 'song_gram_fts')"
+        )
+        fts_tables = {row[0] for row in cursor.fetchall()}
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS song_fts USING fts5(
+                    song_name, artists, album,
+                    content='downloaded_songs', content_rowid='song_id',
+                    tokenize='trigram case_sensitive 0'
+                )
+            ''')
+            fts_delete = '''
+                INSERT INTO song_fts (song_fts, rowid, song_name, artists, album)
+                VALUES ('delete', OLD.song_id, OLD.song_name, OLD.artists, OLD.album);
+            '''
+            fts_insert = '''
+                INSERT INTO song_fts (rowid, song_name, artists, album)
+                VALUES (NEW.song_id, NEW.song_name, NEW.artists, NEW.album);
+            '''
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS song_gram_fts USING fts5(
+                    grams, content='song_grams', content_rowid='song_id',
+                    tokenize='unicode61 remove_diacritics 0'
+                )
+            ''')
+            gram_delete = '''
+                INSERT INTO song_gram_fts (song_gram_fts, rowid, grams) VALUES ('delete', OLD.song_id, OLD.grams);
+            '''
+            gram_insert = '''
+                INSERT INTO song_gram_fts (rowid, grams) VALUES (NEW.song_id, NEW.grams);
+            '''
+            for table, content, name, event, body in (
+                ('song_fts', 'downloaded_songs', 'insert', 'INSERT', fts_insert),
+                ('song_fts', 'downloaded_songs', 'delete', 'DELETE', fts_delete),
+                ('song_fts', 'downloaded_songs', 'update', 'UPDATE OF song_name, artists, album',
+                 fts_delete + fts_insert),
+                ('song_gram_fts', 'song_grams', 'insert', 'INSERT', gram_insert),
+                ('song_gram_fts', 'song_grams', 'delete', 'DELETE', gram_delete),
+                ('song_gram_fts', 'song_grams', 'update', 'UPDATE OF grams', gram_delete + gram_insert)
+            ):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_{name} AFTER {event} ON {content}
+                    BEGIN
+                        {body}
+                    END
+                ''')
+            for table in ('song_fts', 'song_gram_fts'):
+                if table not in fts_tables:
+                    # 首次创建时为已有记录建立索引
+                    cursor.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+            self.fts_enabled = True
+        except sqlite3.OperationalError as e:
+            print(f"全文索引不可用，曲库搜索将逐行匹配: {e}")
+            self.fts_enabled = False
+
+        # 元数据表：songs_generation在downloaded_songs每次变化时加一，用于判断ID索引快照是否过期
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('songs_generation', 0)")
+        for event in ('INSERT', 'DELETE', 'UPDATE OF status'):
+            trigger = 'songs_generation_' + event.split()[0].lower()
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {trigger} AFTER {event} ON downloaded_songs
+                BEGIN
+                    UPDATE meta SET value = value + 1 WHERE key = 'songs_generation';
+                END
+            ''')
+
+        # 统计表：由触发器随downloaded_songs增量维护，读取统计信息时不再扫描全表
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'song_stats'")
+        stats_exist = cursor.fetchone() is not None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS song_stats (
+                status TEXT PRIMARY KEY,
+                song_count INTEGER NOT NULL DEFAULT 0,
+                total_size INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS artist_stats (
+                artists TEXT PRIMARY KEY,
+                song_count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('artist_count', 0)")
+        for name, event, body in (
+            ('insert', 'INSERT', STATS_ADD_SQL),
+            ('delete', 'DELETE', STATS_REMOVE_SQL),
+            ('update', 'UPDATE OF status, file_size, artists', STATS_REMOVE_SQL + STATS_ADD_SQL)
+        ):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS songs_stats_{name} AFTER {event} ON downloaded_songs
+                BEGIN
+                    {body}
+                END
+            ''')
+
+        if not stats_exist:
+            # 首次创建时从已有下载记录计算
+            self._recompute_statistics(cursor)
+
+        # 创建扫描进度表（分批扫描的任务记录处理到的位置，中断后可以继续）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scan_state (
+                name TEXT PRIMARY KEY,
+                position TEXT NOT NULL,
+                updated_time REAL NOT NULL
+            )
+        ''')
+
+        # 创建文件校验表（上次校验时文件的大小和修改时间，未变化且未到重新校验时间的文件不再读取）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS file_checks (
+                song_id INTEGER PRIMARY KEY,
+                file_path TEXT NOT NULL,
+                file_size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                checked_time REAL NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS file_checks_delete AFTER DELETE ON downloaded_songs
+            BEGIN
+                DELETE FROM file_checks WHERE song_id = OLD.song_id;
+            END
+        ''')
+
+        # 创建不可用歌曲表（负缓存：版权受限或缺少该音质的歌曲在有效期内不再请求接口）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS unavailable_songs (
+                song_id INTEGER NOT NULL,
+                quality TEXT NOT NULL,
+                reason TEXT DEFAULT '',
+                checked_time REAL NOT NULL,
+                expires_time REAL NOT NULL,
+                PRIMARY KEY (song_id, quality)
+            )
+        ''')
+
         conn.commit()
-        conn.close()
     
     def song_exists(self, song_id: int) -> bool:
         """
@@ -79,15 +1061,28 @@ class DownloadDatabase:
         Returns:
             bool: 歌曲是否已存在
         """
-        conn = sqlite3.connect(self.db_path)
+        self._sync([song_id])
+        conn = self._connect()
         cursor = conn.cursor()
         
         cursor.execute('SELECT 1 FROM downloaded_songs WHERE song_id = ?', (song_id,))
         exists = cursor.fetchone() is not None
         
-        conn.close()
         return exists
     
+    def is_downloaded(self, song_id: int) -> bool:
+        """
+        检查歌曲是否已成功下载（只查内存索引，不访问数据库，不检查文件是否存在）
+
+        Args:
+            song_id: 歌曲ID
+
+        Returns:
+            bool: 是否有成功的下载记录
+        """
+        self._sync([song_id])
+        return self._pool.index.contains(song_id)
+
     def get_song_info(self, song_id: int) -> Optional[DownloadedSong]:
         """
         获取歌曲下载信息
@@ -98,18 +1093,18 @@ class DownloadDatabase:
         Returns:
             DownloadedSong: 歌曲信息，如果不存在则返回None
         """
-        conn = sqlite3.connect(self.db_path)
+        self._sync([song_id])
+        conn = self._connect()
         cursor = conn.cursor()
         
         cursor.execute('''
             SELECT song_id, song_name, artists, album, file_path, file_size, 
-                   download_time, quality, status 
+                   download_time, quality, status, file_md5
             FROM downloaded_songs 
             WHERE song_id = ?
         ''', (song_id,))
         
         row = cursor.fetchone()
-        conn.close()
         
         if row:
             return DownloadedSong(
@@ -121,14 +1116,136 @@ class DownloadDatabase:
                 file_size=row[5],
                 download_time=row[6],
                 quality=row[7],
-                status=row[8]
+                status=row[8],
+                file_md5=row[9] or ""
             )
         return None
     
+    def _row_to_song(self, row) -> DownloadedSong:
+        """将查询结果行（前10列为SONG_COLUMNS）转换为下载记录"""
+        return DownloadedSong(
+            song_id=row[0],
+            song_name=row[1],
+            artists=row[2],
+            album=row[3],
+            file_path=row[4],
+            file_size=row[5],
+            download_time=row[6],
+            quality=row[7],
+            status=row[8],
+            file_md5=row[9] or ""
+        )
+
+    def get_songs_bulk(self, song_ids: List[int]) -> Dict[int, DownloadedSong]:
+        """
+        批量获取歌曲下载信息，整批歌曲只查询一次（按500个一组分批）
+
+        Args:
+            song_ids: 歌曲ID列表
+
+        Returns:
+            Dict[int, DownloadedSong]: 歌曲ID -> 下载记录，没有记录的歌曲不在其中
+        """
+        self._sync(song_ids)
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        songs = {}
+        unique_ids = list(dict.fromkeys(song_ids))
+        # 分批查询，避免超出SQLite参数个数限制
+        for start in range(0, len(unique_ids), 500):
+            batch = unique_ids[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            cursor.execute(
+                f'SELECT {SONG_COLUMNS} FROM downloaded_songs d WHERE d.song_id IN ({placeholders})',
+                batch
+            )
+            for row in cursor.fetchall():
+                songs[row[0]] = self._row_to_song(row)
+
+        return songs
+
+    def get_locations_bulk(self, song_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        批量获取歌曲的所有存放位置
+
+        Args:
+            song_ids: 歌曲ID列表
+
+        Returns:
+            Dict[int, List[Dict[str, Any]]]: 歌曲ID -> 位置列表（曲库副本排在最前），没有位置的歌曲不在其中
+        """
+        self._sync(song_ids)
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        locations = {}
+        unique_ids = list(dict.fromkeys(song_ids))
+        for start in range(0, len(unique_ids), 500):
+            batch = unique_ids[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            cursor.execute(f'''
+                SELECT file_path, song_id, quality, link_type FROM song_locations
+                WHERE song_id IN ({placeholders})
+                ORDER BY song_id, link_type != 'store', created_time
+            ''', batch)
+            for row in cursor.fetchall():
+                locations.setdefault(row[1], []).append(
+                    {'file_path': row[0], 'song_id': row[1], 'quality': row[2], 'link_type': row[3]}
+                )
+
+        return locations
+
+    def plan_downloads(self, song_ids: List[int], quality: str, include_locations: bool = False) -> DownloadPlan:
+        """
+        按请求的音质规划一批歌曲，一次批量查询得到跳过、升级和下载三类
+
+        已成功下载且文件存在的歌曲：音质不低于请求音质时跳过；低于请求音质时升级，
+        但请求音质在负缓存中（已确认不可用）时同样跳过，避免每次重新请求接口。
+
+        Args:
+            song_ids: 歌曲ID列表
+            quality: 请求的音质
+            include_locations: 是否同时取出跳过的歌曲的存放位置（批量任务检查目标目录时使用）
+
+        Returns:
+            DownloadPlan: 规划结果，download保持输入顺序
+        """
+        unique_ids = list(dict.fromkeys(song_ids))
+        self._sync(unique_ids)
+        # 内存索引中没有的歌曲一定没有成功的下载记录，不必查询数据库
+        candidates = [song_id for song_id in unique_ids if self._pool.index.contains(song_id)]
+        records = self.get_songs_bulk(candidates) if candidates else {}
+
+        # 文件是否存在优先查询曲库监视器的内存索引（延迟导入，避免循环依赖）
+        from library_watcher import path_exists
+
+        plan = DownloadPlan()
+        target_rank = quality_rank(quality)
+        for song_id in unique_ids:
+            song = records.get(song_id)
+            if song is None or song.status != 'success' or not song.file_path or not path_exists(song.file_path):
+                plan.download.append(song_id)
+            elif quality_rank(song.quality) >= target_rank:
+                plan.skip[song_id] = song
+            else:
+                plan.upgrade[song_id] = song
+
+        # 请求音质已确认不可用时，较低音质的文件就是能得到的最好结果
+        if plan.upgrade:
+            for song_id in self.get_unavailable(list(plan.upgrade), quality):
+                plan.skip[song_id] = plan.upgrade.pop(song_id)
+
+        if include_locations and plan.skip:
+            plan.locations = self.get_locations_bulk(list(plan.skip))
+        return plan
+
     def add_song(self, song_info: Dict[str, Any]) -> bool:
         """
         添加歌曲下载记录
         
+        启用延迟写入时记录先进入内存队列，由队列按数量或时间批量写入（见flush）。
+
         Args:
             song_info: 歌曲信息字典，包含以下字段：
                 - song_id: 歌曲ID
@@ -139,37 +1256,58 @@ class DownloadDatabase:
                 - file_size: 文件大小
                 - quality: 音质
                 - status: 状态 ('success', 'failed', 'skipped')
+                - file_md5: 校验通过的MD5（可选）
+                - content_md5: 写入文件的数据的MD5（可选，定期校验的基准）
                 
         Returns:
-            bool: 是否添加成功
+            bool: 是否添加成功（延迟写入时为是否已加入队列）
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT OR REPLACE INTO downloaded_songs 
-                (song_id, song_name, artists, album, file_path, file_size, 
-                 download_time, quality, status, updated_time)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
+            now = time.time()
+            row = (
                 song_info['song_id'],
                 song_info['song_name'],
                 song_info['artists'],
                 song_info.get('album', ''),
                 song_info['file_path'],
                 song_info.get('file_size', 0),
-                time.time(),
+                now,
                 song_info['quality'],
                 song_info['status'],
-                time.time()
-            ))
+                song_info.get('file_md5', ''),
+                now,
+                song_info.get('content_md5', '')
+            )
+
+            # 成功记录同时登记存放位置
+            location = None
+            if song_info['status'] == 'success' and song_info['file_path']:
+                location = (
+                    song_info['file_path'],
+                    song_info['song_id'],
+                    song_info['quality'],
+                    song_info.get('link_type', 'download'),
+                    now
+                )
+
+            if self._recorder is not None:
+                self._recorder.add_song(row, location)
+                return True
+
+            conn = self._connect()
+            cursor = conn.cursor()
+            for sql, params in _song_statements(row):
+                cursor.execute(sql, params)
+            if location is not None:
+                cursor.execute(INSERT_LOCATION_SQL, location)
             
             conn.commit()
-            conn.close()
+            if row[8] == 'success':
+                self._pool.index.apply([(row[0], row[8])])
             return True
             
         except Exception as e:
+            self._rollback()
             print(f"添加歌曲记录失败: {e}")
             return False
     
@@ -185,8 +1323,9 @@ class DownloadDatabase:
         Returns:
             bool: 是否更新成功
         """
+        self.flush()
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -196,50 +1335,240 @@ class DownloadDatabase:
             ''', (status, file_size, time.time(), song_id))
             
             conn.commit()
-            conn.close()
+            self._pool.index.apply([(song_id, status)])
             return cursor.rowcount > 0
             
         except Exception as e:
+            self._rollback()
             print(f"更新歌曲状态失败: {e}")
             return False
     
-    def get_songs_by_artist(self, artist: str) -> List[DownloadedSong]:
+    def add_song_location(self, song_id: int, quality: str, file_path: str, link_type: str) -> bool:
         """
-        获取指定歌手的所有已下载歌曲
+        登记歌曲存放位置
         
         Args:
-            artist: 歌手名称
+            song_id: 歌曲ID
+            quality: 音质
+            file_path: 文件路径
+            link_type: 存放方式 ('download', 'store', 'hardlink', 'reflink', 'symlink', 'copy')
             
         Returns:
-            List[DownloadedSong]: 歌曲列表
+            bool: 是否登记成功
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT song_id, song_name, artists, album, file_path, file_size, 
-                   download_time, quality, status 
-            FROM downloaded_songs 
-            WHERE artists LIKE ? 
-            ORDER BY download_time DESC
-        ''', (f'%{artist}%',))
+        try:
+            location = (file_path, song_id, quality, link_type, time.time())
+            if self._recorder is not None:
+                self._recorder.add_location(location)
+                return True
+
+            conn = self._connect()
+            cursor = conn.cursor()
+
+            cursor.execute(REPLACE_LOCATION_SQL, location)
+
+            conn.commit()
+            return True
+
+        except Exception as e:
+            self._rollback()
+            print(f"登记歌曲位置失败: {e}")
+            return False
+
+    def get_song_locations(self, song_id: int, quality: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        获取歌曲的所有存放位置
         
-        songs = []
-        for row in cursor.fetchall():
-            songs.append(DownloadedSong(
-                song_id=row[0],
-                song_name=row[1],
-                artists=row[2],
-                album=row[3],
-                file_path=row[4],
-                file_size=row[5],
-                download_time=row[6],
-                quality=row[7],
-                status=row[8]
-            ))
+        Args:
+            song_id: 歌曲ID
+            quality: 音质，为None时返回所有音质
+
+        Returns:
+            List[Dict[str, Any]]: 位置列表，曲库副本排在最前
+        """
+        self._sync([song_id])
+        conn = self._connect()
+        cursor = conn.cursor()
         
-        conn.close()
-        return songs
+        sql = 'SELECT file_path, song_id, quality, link_type FROM song_locations WHERE song_id = ?'
+        params = [song_id]
+        if quality is not None:
+            sql += ' AND quality = ?'
+            params.append(quality)
+        sql += " ORDER BY link_type != 'store', created_time"
+        cursor.execute(sql, params)
+
+        locations = [
+            {'file_path': row[0], 'song_id': row[1], 'quality': row[2], 'link_type': row[3]}
+            for row in cursor.fetchall()
+        ]
+
+        return locations
+
+    def remove_song_location(self, file_path: str) -> bool:
+        """
+        删除歌曲存放位置记录
+
+        Args:
+            file_path: 文件路径
+
+        Returns:
+            bool: 是否删除成功
+        """
+        self.flush()
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+
+            cursor.execute('DELETE FROM song_locations WHERE file_path = ?', (file_path,))
+
+            conn.commit()
+            return cursor.rowcount > 0
+
+        except Exception as e:
+            self._rollback()
+            print(f"删除歌曲位置失败: {e}")
+            return False
+
+    def get_location_statistics(self) -> Dict[str, int]:
+        """
+        按存放方式统计位置数量
+
+        Returns:
+            Dict[str, int]: 存放方式 -> 数量
+        """
+        self.flush()
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT link_type, COUNT(*) FROM song_locations GROUP BY link_type')
+        stats = {row[0]: row[1] for row in cursor.fetchall()}
+
+        return stats
+
+    def mark_unavailable(self, song_id: int, quality: str, reason: str = '', ttl: float = 86400) -> bool:
+        """
+        记录歌曲在指定音质下不可用
+
+        Args:
+            song_id: 歌曲ID
+            quality: 音质
+            reason: 不可用原因
+            ttl: 有效期（秒）
+
+        Returns:
+            bool: 是否记录成功
+        """
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+
+            now = time.time()
+            cursor.execute('''
+                INSERT OR REPLACE INTO unavailable_songs (song_id, quality, reason, checked_time, expires_time)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (song_id, quality, reason, now, now + ttl))
+
+            conn.commit()
+            return True
+
+        except Exception as e:
+            self._rollback()
+            print(f"记录不可用歌曲失败: {e}")
+            return False
+
+    def get_unavailable(self, song_ids: List[int], quality: str) -> Dict[int, str]:
+        """
+        批量查询仍在有效期内的不可用记录
+
+        Args:
+            song_ids: 歌曲ID列表
+            quality: 音质
+
+        Returns:
+            Dict[int, str]: 不可用的歌曲ID -> 原因
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        now = time.time()
+        unavailable = {}
+        # 分批查询，避免超出SQLite参数个数限制
+        for start in range(0, len(song_ids), 500):
+            batch = song_ids[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            cursor.execute(f'''
+                SELECT song_id, reason FROM unavailable_songs
+                WHERE quality = ? AND expires_time > ? AND song_id IN ({placeholders})
+            ''', [quality, now] + list(batch))
+            unavailable.update({row[0]: row[1] for row in cursor.fetchall()})
+
+        return unavailable
+
+    def clear_unavailable(self, song_id: Optional[int] = None, expired_only: bool = False) -> int:
+        """
+        清除不可用记录
+
+        Args:
+            song_id: 歌曲ID，为None时清除所有歌曲
+            expired_only: 是否只清除已过期的记录
+
+        Returns:
+            int: 清除的记录数
+        """
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+
+            sql = 'DELETE FROM unavailable_songs WHERE 1 = 1'
+            params = []
+            if song_id is not None:
+                sql += ' AND song_id = ?'
+                params.append(song_id)
+            if expired_only:
+                sql += ' AND expires_time <= ?'
+                params.append(time.time())
+            cursor.execute(sql, params)
+
+            conn.commit()
+            return cursor.rowcount
+
+        except Exception as e:
+            self._rollback()
+            print(f"清除不可用记录失败: {e}")
+            return 0
+
+    def get_songs_by_artist(self, artist: str, prefix: bool = False) -> List[DownloadedSong]:
+        """
+        获取指定歌手的所有已下载歌曲（通过歌手索引查找，合唱歌曲中的任一歌手均可匹配）
+
+        Args:
+            artist: 歌手名称（比较时忽略大小写和全半角）
+            prefix: 是否按前缀匹配歌手名，默认精确匹配
+
+        Returns:
+            List[DownloadedSong]: 歌曲列表
+        """
+        key = normalize_artist(artist)
+        if not key:
+            return []
+
+        self.flush()
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        if prefix:
+            # 以前缀开头的键都落在 [前缀, 前缀+最大码位) 区间内，可以使用索引范围扫描
+            condition, params = 'a.name_key >= ? AND a.name_key < ?', (key, key + '\U0010ffff')
+        else:
+            condition, params = 'a.name_key = ?', (key,)
+        cursor.execute(f'''
+            SELECT {SONG_COLUMNS} FROM downloaded_songs d
+            WHERE d.song_id IN (SELECT a.song_id FROM song_artists a WHERE {condition})
+            ORDER BY d.download_time DESC
+        ''', params)
+
+        return [self._row_to_song(row) for row in cursor.fetchall()]
     
     def get_recent_downloads(self, limit: int = 50) -> List[DownloadedSong]:
         """
@@ -251,12 +1580,13 @@ class DownloadDatabase:
         Returns:
             List[DownloadedSong]: 歌曲列表
         """
-        conn = sqlite3.connect(self.db_path)
+        self.flush()
+        conn = self._connect()
         cursor = conn.cursor()
         
         cursor.execute('''
             SELECT song_id, song_name, artists, album, file_path, file_size, 
-                   download_time, quality, status 
+                   download_time, quality, status, file_md5
             FROM downloaded_songs 
             ORDER BY download_time DESC 
             LIMIT ?
@@ -273,47 +1603,209 @@ class DownloadDatabase:
                 file_size=row[5],
                 download_time=row[6],
                 quality=row[7],
-                status=row[8]
+                status=row[8],
+                file_md5=row[9] or ""
             ))
         
-        conn.close()
         return songs
     
-    def get_statistics(self) -> Dict[str, Any]:
+    def search_library(self, query: str = '', limit: int = 20, cursor: Optional[str] = None,
+                       status: Optional[str] = 'success') -> Dict[str, Any]:
         """
-        获取下载统计信息
+        搜索曲库中的下载记录（按歌名、歌手、专辑全文匹配，游标分页）
+
+        不少于3个字符的词用三元组索引匹配，1到2个字符的词用短词索引匹配。匹配不超过FTS_RANK_LIMIT首时
+        按相关度排序，更宽泛的搜索按歌曲ID从新到旧排列；没有可用索引的搜索词（没有搜索词、只有标点，
+        或SQLite不支持FTS5）时按下载时间从新到旧排列，逐条LIKE匹配。翻页时从上一页最后一条之后继续查询，不使用OFFSET。
         
+        Args:
+            query: 搜索词，多个词以空白分隔，所有词都需匹配
+            limit: 每页数量（最多SEARCH_MAX_LIMIT）
+            cursor: 上一页返回的next_cursor，为None时从第一页开始
+            status: 只返回该状态的记录，为None时不限
+
         Returns:
-            Dict[str, Any]: 统计信息
+            Dict[str, Any]: songs为歌曲信息列表，order为排序方式，next_cursor为下一页游标（没有更多结果时为None）
+
+        Raises:
+            ValueError: 游标无效
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        limit = max(1, min(int(limit), SEARCH_MAX_LIMIT))
+        after = _decode_cursor(cursor) if cursor else None
+        phrases, gram_phrases, like_terms = _fts_phrases(query, self.fts_enabled)
+        # 可用索引匹配的搜索词：第一个索引驱动查询（决定候选集合和ID顺序），其余索引作为过滤条件
+        sources = [
+            (table, ' AND '.join(table_phrases))
+            for table, table_phrases in (('song_fts', phrases), ('song_gram_fts', gram_phrases))
+            if table_phrases
+        ]
+
+        self.flush()
+        conn = self._connect()
         
-        # 总歌曲数
-        cursor.execute('SELECT COUNT(*) FROM downloaded_songs')
-        total_songs = cursor.fetchone()[0]
+        if not sources:
+            order = 'time'
+        elif after:
+            # 翻页沿用第一页的排序方式
+            order = after[0]
+        else:
+            # 第一页先按相关度查询，匹配超过FTS_RANK_LIMIT首时改为按歌曲ID排列
+            order = 'rank'
         
-        # 成功下载数
-        cursor.execute('SELECT COUNT(*) FROM downloaded_songs WHERE status = "success"')
-        success_songs = cursor.fetchone()[0]
+        conditions, params = [], []
+        if status:
+            conditions.append('d.status = ?')
+            params.append(status)
+        for table, match in sources[1:]:
+            conditions.append(f'd.song_id IN (SELECT rowid FROM {table} WHERE {table} MATCH ?)')
+            params.append(match)
+        for term in like_terms:
+            pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            conditions.append(
+                "(d.song_name LIKE ? ESCAPE '\\' OR d.artists LIKE ? ESCAPE '\\' OR d.album LIKE ? ESCAPE '\\')"
+            )
+            params.extend([pattern] * 3)
+        if sources:
+            table, match = sources[0]
+
+        if order == 'rank':
+            # 匹配只取到FTS_RANK_LIMIT+1条即停止，在SQLite中计算相关度、排序并从游标位置继续，
+            # 游标为最后一条的 (相关度, 歌曲ID)。第一页只在匹配数不超过FTS_RANK_LIMIT时
+            # 才关联下载记录并计算相关度，超过时不返回记录，改为按歌曲ID排列
+            score_sql, score_params = _relevance_sql(query.split())
+            rank_conditions = ['matched.total <= ?'] + conditions
+            rank_params = [FTS_RANK_LIMIT] + params
+            seek = ''
+            if after:
+                seek = 'WHERE (score, song_id) > (?, ?)'
+                rank_params.extend(after[1:])
+            sql = f'''
+                SELECT * FROM (
+                    SELECT {SONG_COLUMNS}, {score_sql} AS score
+                    FROM (
+                        SELECT rowid, COUNT(*) OVER () AS total
+                        FROM (SELECT rowid FROM {table} WHERE {table} MATCH ? LIMIT ?)
+                    ) matched
+                    JOIN downloaded_songs d ON d.song_id = matched.rowid
+                    WHERE {' AND '.join(rank_conditions)}
+                )
+                {seek}
+                ORDER BY score, song_id
+                LIMIT ?
+            '''
+            rows = conn.execute(
+                sql, score_params + [match, FTS_RANK_LIMIT + 1] + rank_params + [limit + 1]
+            ).fetchall()
+            if not rows and not after:
+                # 匹配过多（或匹配的记录都不符合其他条件）
+                order = 'id'
+
+        if order != 'rank':
+            if order == 'id':
+                # 按歌曲ID倒序，全文索引按rowid有序，取满一页即停止，游标为最后一条的歌曲ID
+                conditions.insert(0, f'{table} MATCH ?')
+                params.insert(0, match)
+                if after:
+                    conditions.append(f'{table}.rowid < ?')
+                    params.append(after[2])
+                sql = f'''
+                    SELECT {SONG_COLUMNS}, 0 AS score
+                    FROM {table} JOIN downloaded_songs d ON d.song_id = {table}.rowid
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY {table}.rowid DESC
+                    LIMIT ?
+                '''
+            else:
+                # 沿idx_download_time索引倒序扫描，游标为最后一条的 (下载时间, 歌曲ID)
+                if after:
+                    conditions.append('(d.download_time, d.song_id) < (?, ?)')
+                    params.extend(after[1:])
+                sql = f'''
+                    SELECT {SONG_COLUMNS}, d.download_time AS score
+                    FROM downloaded_songs d
+                    WHERE {' AND '.join(conditions) or '1'}
+                    ORDER BY d.download_time DESC, d.song_id DESC
+                    LIMIT ?
+                '''
+            params.append(limit + 1)
+            rows = conn.execute(sql, params).fetchall()
         
-        # 失败下载数
-        cursor.execute('SELECT COUNT(*) FROM downloaded_songs WHERE status = "failed"')
-        failed_songs = cursor.fetchone()[0]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(order, rows[-1][10], rows[-1][0])
+        return {
+            'songs': [asdict(self._row_to_song(row)) for row in rows],
+            'order': order,
+            'next_cursor': next_cursor
+        }
+
+    def _recompute_statistics(self, cursor: sqlite3.Cursor):
+        """从downloaded_songs重新计算统计表（不提交事务）"""
+        cursor.execute('DELETE FROM song_stats')
+        cursor.execute('''
+            INSERT INTO song_stats (status, song_count, total_size)
+            SELECT status, COUNT(*), COALESCE(SUM(file_size), 0) FROM downloaded_songs GROUP BY status
+        ''')
+        cursor.execute('DELETE FROM artist_stats')
+        cursor.execute('''
+            INSERT INTO artist_stats (artists, song_count)
+            SELECT artists, COUNT(*) FROM downloaded_songs GROUP BY artists
+        ''')
+        cursor.execute(
+            "UPDATE meta SET value = (SELECT COUNT(*) FROM artist_stats) WHERE key = 'artist_count'"
+        )
+
+    def recompute_statistics(self) -> bool:
+        """
+        从下载记录重新计算统计表（统计表被外部修改或与记录不一致时使用）
+
+        Returns:
+            bool: 是否成功
+        """
+        self.flush()
+        try:
+            conn = self._connect()
+            self._recompute_statistics(conn.cursor())
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"重新计算统计信息失败: {e}")
+            self._rollback()
+            return False
+
+    def get_statistics(self, recompute: bool = False) -> Dict[str, Any]:
+        """
+        获取下载统计信息（读取触发器维护的统计表，耗时与曲库大小无关）
         
-        # 跳过下载数
-        cursor.execute('SELECT COUNT(*) FROM downloaded_songs WHERE status = "skipped"')
-        skipped_songs = cursor.fetchone()[0]
+        Args:
+            recompute: 是否先从下载记录重新计算统计表
+
+        Returns:
+            Dict[str, Any]: 统计信息
+        """
+        if recompute:
+            self.recompute_statistics()
+        else:
+            self.flush()
+        conn = self._connect()
+        cursor = conn.cursor()
         
-        # 总文件大小
-        cursor.execute('SELECT SUM(file_size) FROM downloaded_songs WHERE status = "success"')
-        total_size = cursor.fetchone()[0] or 0
+        # 按状态的歌曲数和文件大小
+        cursor.execute('SELECT status, song_count, total_size FROM song_stats')
+        by_status = {status: (count, size) for status, count, size in cursor.fetchall()}
+        total_songs = sum(count for count, _ in by_status.values())
+        success_songs, total_size = by_status.get('success', (0, 0))
+        failed_songs = by_status.get('failed', (0, 0))[0]
+        skipped_songs = by_status.get('skipped', (0, 0))[0]
         
         # 歌手数量
-        cursor.execute('SELECT COUNT(DISTINCT artists) FROM downloaded_songs')
+        cursor.execute("SELECT value FROM meta WHERE key = 'artist_count'")
         artist_count = cursor.fetchone()[0]
         
-        conn.close()
+        # 有效期内的不可用记录数
+        cursor.execute('SELECT COUNT(*) FROM unavailable_songs WHERE expires_time > ?', (time.time(),))
+        unavailable_count = cursor.fetchone()[0]
         
         return {
             'total_songs': total_songs,
@@ -322,32 +1814,388 @@ class DownloadDatabase:
             'skipped_songs': skipped_songs,
             'total_size': total_size,
             'artist_count': artist_count,
-            'success_rate': (success_songs / total_songs * 100) if total_songs > 0 else 0
+            'unavailable_count': unavailable_count,
+            'success_rate': (success_songs / total_songs * 100) if total_songs > 0 else 0,
+            'write_behind': self._pool.recorder.get_statistics(),
+            'id_index': self._pool.index.get_statistics()
         }
     
-    def cleanup_orphaned_records(self) -> int:
+    def get_file_paths_after(self, table: str, after: str, limit: int) -> List[str]:
         """
-        清理文件已不存在但数据库记录仍然存在的记录
+        按文件路径顺序分批读取记录的文件路径（沿路径索引扫描，同一目录的文件相邻）
         
+        Args:
+            table: PATH_TABLES中的表名
+            after: 上一批最后一个路径，从头开始时为空字符串
+            limit: 每批数量
+
         Returns:
-            int: 清理的记录数
+            List[str]: 文件路径列表（可能有重复）
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        if table not in PATH_TABLES:
+            raise ValueError(f"不支持扫描的表: {table}")
+        self.flush()
+        conn = self._connect()
+        rows = conn.execute(
+            f'SELECT file_path FROM {table} WHERE file_path > ? ORDER BY file_path LIMIT ?', (after, limit)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def count_file_paths(self, table: str, upto: Optional[str] = None) -> int:
+        """
+        统计记录数
         
-        # 获取所有记录
-        cursor.execute('SELECT song_id, file_path FROM downloaded_songs')
-        records = cursor.fetchall()
+        Args:
+            table: PATH_TABLES中的表名
+            upto: 只统计文件路径不大于该值的记录，为None时统计全部
+
+        Returns:
+            int: 记录数
+        """
+        if table not in PATH_TABLES:
+            raise ValueError(f"不支持扫描的表: {table}")
+        self.flush()
+        conn = self._connect()
+        if upto is None:
+            return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        return conn.execute(f'SELECT COUNT(*) FROM {table} WHERE file_path <= ?', (upto,)).fetchone()[0]
+
+    def delete_by_file_paths(self, table: str, file_paths: List[str]) -> int:
+        """
+        在一个事务中删除这些文件路径的记录
         
-        deleted_count = 0
-        for song_id, file_path in records:
-            if not Path(file_path).exists():
-                cursor.execute('DELETE FROM downloaded_songs WHERE song_id = ?', (song_id,))
-                deleted_count += 1
+        Args:
+            table: PATH_TABLES中的表名
+            file_paths: 文件路径列表
+
+        Returns:
+            int: 删除的记录数，失败时返回0
+        """
+        if table not in PATH_TABLES:
+            raise ValueError(f"不支持扫描的表: {table}")
+        if not file_paths:
+            return 0
         
-        conn.commit()
-        conn.close()
-        return deleted_count
+        self.flush()
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            deleted_ids = []
+            if table == 'downloaded_songs':
+                for start in range(0, len(file_paths), 500):
+                    chunk = file_paths[start:start + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    cursor.execute(
+                        f'SELECT song_id FROM downloaded_songs WHERE file_path IN ({placeholders})', chunk
+                    )
+                    deleted_ids.extend(row[0] for row in cursor.fetchall())
+                cursor.executemany('DELETE FROM downloaded_songs WHERE song_id = ?', [(i,) for i in deleted_ids])
+                deleted = len(deleted_ids)
+            else:
+                cursor.executemany('DELETE FROM song_locations WHERE file_path = ?', [(p,) for p in file_paths])
+                deleted = cursor.rowcount
+
+            conn.commit()
+            self._pool.index.apply((song_id, None) for song_id in deleted_ids)
+            return deleted
+
+        except Exception as e:
+            self._rollback()
+            print(f"删除记录失败: {e}")
+            return 0
+
+    def import_songs(self, songs: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        在一个事务中批量导入从文件标签读取的歌曲（由曲库导入任务调用）
+
+        没有成功记录（或记录中的文件已不存在）的歌曲写入下载记录；已有成功记录的歌曲
+        （或同一批中重复的歌曲）只登记存放位置，不覆盖原有记录。
+
+        Args:
+            songs: 歌曲信息字典列表，字段同add_song
+
+        Returns:
+            Dict[str, int]: 写入的下载记录数和只登记存放位置的文件数
+        """
+        result = {'imported': 0, 'located': 0}
+        if not songs:
+            return result
+
+        from library_watcher import path_exists
+
+        self.flush()
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            song_ids = list({song['song_id'] for song in songs})
+            recorded = set()
+            for start in range(0, len(song_ids), 500):
+                chunk = song_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f'''
+                    SELECT song_id, file_path FROM downloaded_songs
+                    WHERE song_id IN ({placeholders}) AND status = 'success'
+                ''', chunk)
+                recorded.update(song_id for song_id, file_path in cursor.fetchall() if path_exists(file_path))
+
+            now = time.time()
+            statements, locations, changes = [], [], []
+            for song in songs:
+                song_id = song['song_id']
+                locations.append((song['file_path'], song_id, song['quality'], 'download', now))
+                if song_id in recorded:
+                    result['located'] += 1
+                    continue
+                recorded.add(song_id)
+                row = (
+                    song_id, song['song_name'], song['artists'], song.get('album', ''),
+                    song['file_path'], song.get('file_size', 0), song.get('download_time', now),
+                    song['quality'], 'success', song.get('file_md5', ''), now, song.get('content_md5', '')
+                )
+                statements.extend(_song_statements(row))
+                changes.append((song_id, 'success'))
+                result['imported'] += 1
+
+            for sql, params in statements:
+                cursor.execute(sql, params)
+            cursor.executemany(INSERT_LOCATION_SQL, locations)
+
+            conn.commit()
+            self._pool.index.apply(changes)
+            return result
+
+        except Exception as e:
+            self._rollback()
+            print(f"导入歌曲记录失败: {e}")
+            return {'imported': 0, 'located': 0}
+
+    def apply_file_changes(self, present: Dict[str, int], removed: List[str]) -> Dict[str, int]:
+        """
+        在一个事务中同步文件系统的变化（由曲库监视器批量调用）
+
+        被删除或移走的文件：成功记录标记为missing，删除对应的存放位置；
+        重新出现的文件：missing记录恢复为成功并登记存放位置；大小变化的文件更新记录中的大小。
+
+        Args:
+            present: 新增或修改的文件路径 -> 文件大小
+            removed: 已不存在的文件路径
+
+        Returns:
+            Dict[str, int]: 标记为missing、恢复和更新大小的记录数
+        """
+        result = {'missing': 0, 'restored': 0, 'resized': 0}
+        paths = list(present) + list(removed)
+        if not paths:
+            return result
+
+        self.flush()
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            records = []
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f'''
+                    SELECT song_id, file_path, file_size, quality, status FROM downloaded_songs
+                    WHERE file_path IN ({placeholders})
+                ''', chunk)
+                records.extend(cursor.fetchall())
+
+            now = time.time()
+            updates, restored_locations, changes = [], [], []
+            for song_id, file_path, file_size, quality, status in records:
+                size = present.get(file_path)
+                if size is None:
+                    if status == 'success':
+                        updates.append(('missing', file_size, now, song_id))
+                        changes.append((song_id, 'missing'))
+                        result['missing'] += 1
+                elif status == 'missing':
+                    updates.append(('success', size, now, song_id))
+                    restored_locations.append((file_path, song_id, quality, 'download', now))
+                    changes.append((song_id, 'success'))
+                    result['restored'] += 1
+                elif status == 'success' and size != file_size:
+                    updates.append((status, size, now, song_id))
+                    result['resized'] += 1
+
+            cursor.executemany(
+                'UPDATE downloaded_songs SET status = ?, file_size = ?, updated_time = ? WHERE song_id = ?',
+                updates
+            )
+            cursor.executemany('DELETE FROM song_locations WHERE file_path = ?', [(p,) for p in removed])
+            cursor.executemany(INSERT_LOCATION_SQL, restored_locations)
+
+            conn.commit()
+            self._pool.index.apply(changes)
+            return result
+
+        except Exception as e:
+            self._rollback()
+            print(f"同步文件变化失败: {e}")
+            return result
+
+    def get_verify_candidates(self, after: int, limit: int) -> List[Dict[str, Any]]:
+        """
+        按歌曲ID顺序分批获取需要校验的成功下载记录及其上次校验的信息
+
+        Args:
+            after: 从大于该ID的记录开始
+            limit: 最多返回的记录数
+
+        Returns:
+            List[Dict[str, Any]]: 记录列表，从未校验过的记录checked_time为0
+        """
+        self.flush()
+        conn = self._connect()
+        cursor = conn.execute('''
+            SELECT d.song_id, d.file_path, d.quality, d.content_md5,
+                   c.file_path, c.file_size, c.mtime, c.checked_time
+            FROM downloaded_songs d LEFT JOIN file_checks c ON c.song_id = d.song_id
+            WHERE d.song_id > ? AND d.status = 'success'
+            ORDER BY d.song_id
+            LIMIT ?
+        ''', (after, limit))
+        return [
+            {
+                'song_id': row[0],
+                'file_path': row[1],
+                'quality': row[2],
+                'content_md5': row[3] or '',
+                'checked_path': row[4],
+                'checked_size': row[5],
+                'checked_mtime': row[6],
+                'checked_time': row[7] or 0
+            }
+            for row in cursor.fetchall()
+        ]
+
+    def count_verify_candidates(self, after: int = 0) -> int:
+        """
+        统计需要校验的成功下载记录数
+
+        Args:
+            after: 只统计大于该ID的记录
+
+        Returns:
+            int: 记录数
+        """
+        self.flush()
+        conn = self._connect()
+        return conn.execute(
+            "SELECT COUNT(*) FROM downloaded_songs WHERE song_id > ? AND status = 'success'", (after,)
+        ).fetchone()[0]
+
+    def save_file_checks(self, checks: List[Tuple[int, str, int, float]], baselines: Dict[int, str]) -> bool:
+        """
+        在一个事务中保存一批校验通过的文件
+
+        Args:
+            checks: (歌曲ID, 文件路径, 文件大小, 修改时间) 列表
+            baselines: 下载时没有记录MD5的歌曲ID -> 本次计算的MD5（作为之后校验的基准）
+
+        Returns:
+            bool: 是否成功
+        """
+        try:
+            conn = self._connect()
+            now = time.time()
+            conn.executemany(
+                'INSERT OR REPLACE INTO file_checks (song_id, file_path, file_size, mtime, checked_time) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [check + (now,) for check in checks]
+            )
+            conn.executemany(
+                "UPDATE downloaded_songs SET content_md5 = ? WHERE song_id = ? AND content_md5 = ''",
+                [(md5, song_id) for song_id, md5 in baselines.items()]
+            )
+            conn.commit()
+            return True
+        except Exception as e:
+            self._rollback()
+            print(f"保存文件校验结果失败: {e}")
+            return False
+
+    def mark_corrupt(self, song_id: int, file_paths: List[str]) -> bool:
+        """
+        将文件已损坏的下载记录标记为corrupt，并删除损坏文件的存放位置
+
+        Args:
+            song_id: 歌曲ID
+            file_paths: 损坏文件（及其硬链接）的路径
+
+        Returns:
+            bool: 是否成功
+        """
+        self.flush()
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE downloaded_songs SET status = 'corrupt', content_md5 = '', updated_time = ?
+                WHERE song_id = ?
+            ''', (time.time(), song_id))
+            cursor.executemany('DELETE FROM song_locations WHERE file_path = ?', [(p,) for p in file_paths])
+            cursor.execute('DELETE FROM file_checks WHERE song_id = ?', (song_id,))
+            conn.commit()
+            self._pool.index.apply([(song_id, 'corrupt')])
+            return True
+        except Exception as e:
+            self._rollback()
+            print(f"标记损坏记录失败: {e}")
+            return False
+
+    def get_scan_position(self, name: str) -> str:
+        """
+        获取分批扫描任务上次处理到的位置
+
+        Args:
+            name: 扫描任务名称
+
+        Returns:
+            str: 位置，没有记录时返回空字符串
+        """
+        conn = self._connect()
+        row = conn.execute('SELECT position FROM scan_state WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else ''
+
+    def set_scan_position(self, name: str, position: str) -> bool:
+        """
+        保存分批扫描任务处理到的位置（为空字符串时清除，下次从头开始）
+
+        Args:
+            name: 扫描任务名称
+            position: 位置
+
+        Returns:
+            bool: 是否成功
+        """
+        try:
+            conn = self._connect()
+            if position:
+                conn.execute(
+                    'INSERT OR REPLACE INTO scan_state (name, position, updated_time) VALUES (?, ?, ?)',
+                    (name, position, time.time())
+                )
+            else:
+                conn.execute('DELETE FROM scan_state WHERE name = ?', (name,))
+            conn.commit()
+            return True
+        except Exception as e:
+            self._rollback()
+            print(f"保存扫描进度失败: {e}")
+            return False
+
+    def cleanup_orphaned_records(self) -> int:
+        """
+        清理文件已不存在但数据库记录仍然存在的记录（按目录并行扫描，见orphan_scan.OrphanScanner）
+
+        Returns:
+            int: 清理的下载记录数
+        """
+        from orphan_scan import OrphanScanner
+        return OrphanScanner(self).run(resume=False)['deleted_songs']
 
 
 # 全局数据库实例
@@ -0,0 +1,255 @@
+"""HTTP连接池模块
+
+将网易云接口请求与CDN音频下载分到两个独立的连接池：
+- api：interface3.music.163.com 等元数据接口，超时短，优先保证交互请求
+- cdn：*.music.126.net 等音频和封面下载，超时长，单主机并发受限
+每个连接池按主机限制并发数，拥有独立的超时配置和运行指标。
+等待并发名额时定期检查取消并有超时上限；流式响应未被关闭时，由垃圾回收时的终结器归还名额。
+"""
+
+import threading
+import time
+import weakref
+from http.cookiejar import DefaultCookiePolicy
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# 各连接池的默认配置
+DEFAULT_POOL_CONFIG = {
+    'api': {'per_host_limit': 8, 'connect_timeout': 5, 'read_timeout': 15, 'acquire_timeout': 60},
+    'cdn': {'per_host_limit': 6, 'connect_timeout': 10, 'read_timeout': 30, 'acquire_timeout': 600}
+}
+
+# 等待并发名额时检查取消的间隔（秒）
+ACQUIRE_POLL_SECONDS = 0.5
+
+
+class PoolWaitTimeout(requests.exceptions.Timeout):
+    """等待主机并发名额超时异常类"""
+    pass
+
+
+class PoolWaitCancelled(requests.RequestException):
+    """等待主机并发名额时请求被取消异常类"""
+    pass
+
+
+class HostLimitedPool:
+    """按主机限制并发的HTTP连接池"""
+
+    def __init__(self, name: str, per_host_limit: int = 8, connect_timeout: float = 10,
+                 read_timeout: float = 30, acquire_timeout: float = 600):
+        """
+        初始化连接池
+
+        Args:
+            name: 连接池名称
+            per_host_limit: 单个主机的最大并发请求数
+            connect_timeout: 连接超时（秒）
+            read_timeout: 读取超时（秒）
+            acquire_timeout: 等待主机并发名额的最长时间（秒）
+        """
+        self.name = name
+        self.per_host_limit = max(1, per_host_limit)
+        self.timeout = (connect_timeout, read_timeout)
+        self.acquire_timeout = acquire_timeout
+
+        self.session = requests.Session()
+        # 请求时显式传入Cookie，不在会话中保存响应设置的Cookie，避免请求之间互相影响
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=self.per_host_limit)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self._host_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+
+        # 统计信息
+        self.requests = 0
+        self.errors = 0
+        self.wait_timeouts = 0
+        self.leaked = 0
+        self.in_flight = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_latency = 0.0
+        self.host_requests: Dict[str, int] = {}
+
+    def _host_semaphore(self, host: str) -> threading.BoundedSemaphore:
+        """获取主机对应的并发信号量"""
+        with self._lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                self._host_semaphores[host] = semaphore
+            return semaphore
+
+    def _acquire(self, semaphore: threading.BoundedSemaphore,
+                 should_cancel: Optional[Callable[[], bool]]) -> None:
+        """等待主机并发名额，定期检查取消，超过acquire_timeout时抛出PoolWaitTimeout"""
+        deadline = time.monotonic() + self.acquire_timeout
+        while not semaphore.acquire(timeout=max(0.0, min(ACQUIRE_POLL_SECONDS, deadline - time.monotonic()))):
+            if should_cancel is not None and should_cancel():
+                raise PoolWaitCancelled("等待连接名额时请求被取消")
+            if time.monotonic() >= deadline:
+                with self._lock:
+                    self.wait_timeouts += 1
+                raise PoolWaitTimeout(f"等待连接名额超时（{self.acquire_timeout}秒）")
+
+    def request(self, method: str, url: str, should_cancel: Optional[Callable[[], bool]] = None,
+                **kwargs) -> requests.Response:
+        """发送HTTP请求
+
+        未指定timeout时使用连接池的超时配置。stream=True时主机并发名额
+        保持到响应关闭为止，调用方必须关闭响应（未关闭的响应被回收时归还名额）。
+
+        Args:
+            method: 请求方法
+            url: 请求URL
+            should_cancel: 取消检查函数，等待并发名额期间定期调用
+            **kwargs: 传递给requests的其他参数
+
+        Returns:
+            响应对象
+
+        Raises:
+            PoolWaitCancelled: 等待并发名额时should_cancel返回True
+            PoolWaitTimeout: 等待并发名额超时
+            requests.RequestException: 请求失败时抛出
+        """
+        host = urlparse(url).hostname or ''
+        semaphore = self._host_semaphore(host)
+        kwargs.setdefault('timeout', self.timeout)
+
+        wait_started = time.monotonic()
+        self._acquire(semaphore, should_cancel)
+        started = time.monotonic()
+        with self._lock:
+            wait = started - wait_started
+            self.requests += 1
+            self.in_flight += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.host_requests[host] = self.host_requests.get(host, 0) + 1
+
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            self._release(semaphore, started)
+            raise
+
+        if not kwargs.get('stream'):
+            self._release(semaphore, started)
+            return response
+
+        # 流式响应在关闭时释放名额；调用方未关闭响应时，由响应被回收时的终结器释放
+        leak_finalizer = weakref.finalize(response, self._release_leaked, semaphore, started)
+        original_close = response.close
+
+        def close() -> None:
+            try:
+                original_close()
+            finally:
+                # detach返回None说明已经释放过（重复关闭）
+                if leak_finalizer.detach() is not None:
+                    self._release(semaphore, started)
+
+        response.close = close
+        return response
+
+    def _release(self, semaphore: threading.BoundedSemaphore, started: float) -> None:
+        """释放主机并发名额并记录耗时"""
+        with self._lock:
+            self.in_flight -= 1
+            self.total_latency += time.monotonic() - started
+        semaphore.release()
+
+    def _release_leaked(self, semaphore: threading.BoundedSemaphore, started: float) -> None:
+        """释放未关闭就被回收的流式响应占用的名额"""
+        with self._lock:
+            self.leaked += 1
+        self._release(semaphore, started)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """发送GET请求"""
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """发送POST请求"""
+        return self.request('POST', url, **kwargs)
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取连接池统计信息，耗时单位为毫秒"""
+        with self._lock:
+            completed = self.requests - self.in_flight
+            return {
+                'per_host_limit': self.per_host_limit,
+                'connect_timeout': self.timeout[0],
+                'read_timeout': self.timeout[1],
+                'acquire_timeout': self.acquire_timeout,
+                'requests': self.requests,
+                'errors': self.errors,
+                'wait_timeouts': self.wait_timeouts,
+                'leaked': self.leaked,
+                'in_flight': self.in_flight,
+                'avg_wait_ms': round(self.total_wait / self.requests * 1000, 2) if self.requests else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 2),
+                'avg_latency_ms': round(self.total_latency / completed * 1000, 2) if completed else 0.0,
+                'hosts': dict(self.host_requests)
+            }
+
+
+_pools: Dict[str, HostLimitedPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool_config(name: str) -> Dict[str, Any]:
+    """获取连接池配置（配置文件中的http_pools覆盖默认值）"""
+    pool_config = dict(DEFAULT_POOL_CONFIG.get(name, DEFAULT_POOL_CONFIG['api']))
+    try:
+        from main import config
+        pool_config.update(config.http_pools_config.get(name, {}))
+    except ImportError:
+        pass
+    return pool_config
+
+
+def get_http_pool(name: str) -> HostLimitedPool:
+    """获取全局连接池实例（首次调用时根据配置文件创建）
+
+    Args:
+        name: 连接池名称，api 或 cdn
+
+    Returns:
+        连接池实例
+    """
+    pool = _pools.get(name)
+    if pool is not None:
+        return pool
+
+    # 在加锁前读取配置，避免导入main时重入
+    pool_config = get_pool_config(name)
+
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = HostLimitedPool(
+                name,
+                per_host_limit=int(pool_config['per_host_limit']),
+                connect_timeout=float(pool_config['connect_timeout']),
+                read_timeout=float(pool_config['read_timeout']),
+                acquire_timeout=float(pool_config['acquire_timeout'])
+            )
+        return _pools[name]
+
+
+def get_pool_statistics() -> Dict[str, Any]:
+    """获取所有已创建连接池的统计信息"""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {name: pool.get_statistics() for name, pool in pools.items()}
@@ -0,0 +1,90 @@
+"""下载去重模块
+
+进程内以 (歌曲ID, 音质) 为键登记正在进行的下载：
+- 第一个请求者负责下载，其余并发请求等待其结果，再从曲库链接或复制
+- 下载失败或被取消时，等待者各自重新下载；等待超时时等待者不再等待，自行下载
+- 统计因去重节省的下载字节数
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, Hashable, Tuple
+
+
+class InflightRegistry:
+    """进行中下载的登记表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, Future] = {}
+
+        # 统计信息
+        self.leaders = 0
+        self.coalesced = 0
+        self.fallbacks = 0
+        self.timeouts = 0
+        self.bytes_saved = 0
+
+    def claim(self, key: Hashable) -> Tuple[bool, Future]:
+        """登记一次下载请求
+
+        Args:
+            key: 下载键，通常为 (歌曲ID, 音质)
+
+        Returns:
+            (是否为负责下载的请求者, 下载结果Future)
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return False, future
+
+            future = Future()
+            self._inflight[key] = future
+            self.leaders += 1
+            return True, future
+
+    def complete(self, key: Hashable, future: Future, result: Any) -> None:
+        """下载结束，通知所有等待者
+
+        Args:
+            key: 下载键
+            future: claim返回的Future
+            result: 下载结果（异常时为None）
+        """
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        future.set_result(result)
+
+    def record_saved(self, nbytes: int) -> None:
+        """记录一次复用他人下载结果节省的字节数"""
+        with self._lock:
+            self.bytes_saved += nbytes
+
+    def record_fallback(self) -> None:
+        """记录一次负责者下载失败、等待者自行下载的情况"""
+        with self._lock:
+            self.fallbacks += 1
+
+    def record_timeout(self) -> None:
+        """记录一次等待负责者超时、等待者自行下载的情况"""
+        with self._lock:
+            self.timeouts += 1
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取去重统计信息"""
+        with self._lock:
+            return {
+                'inflight': len(self._inflight),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'fallbacks': self.fallbacks,
+                'timeouts': self.timeouts,
+                'bytes_saved': self.bytes_saved
+            }
+
+
+# 全局下载去重登记表
+inflight_registry = InflightRegistry()
@@ -0,0 +1,264 @@
+"""曲库导入模块
+
+数据库丢失或挂载已有曲库时，从音频文件的标签重建下载记录，避免所有歌曲被重新下载：
+- 下载时在标签中写入歌曲ID和音质（见stream_tagger.SONG_ID_TAG），没有歌曲ID标签的文件不导入，
+  没有音质标签时按格式和码率推断音质
+- 读取标签是CPU密集的解析工作，按批交给进程池并行执行，主进程只负责遍历目录和写入数据库
+- 每批结果在一个事务中写入，已有成功记录且文件存在的歌曲只登记存放位置，不覆盖原有记录
+"""
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from mutagen.flac import FLAC
+from mutagen.id3 import ID3, ID3NoHeaderError
+from mutagen.mp3 import MP3
+from mutagen.mp4 import MP4
+
+from cancellation import CancellationToken
+from download_db import DownloadDatabase, ARTIST_SEPARATOR
+from stream_tagger import SONG_ID_TAG, QUALITY_TAG, MP4_TAG_NAMESPACE
+
+
+logger = logging.getLogger('library_import')
+
+# 读取标签的音频格式
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.m4a')
+
+# 每个进程任务读取的文件数（过小时进程间通信开销占比高，过大时进度更新不及时）
+IMPORT_BATCH_SIZE = 200
+
+# 推断音质：有损格式码率不低于该值时为极高音质（exhigh，320kbps，留出VBR的余量），否则为标准音质
+EXHIGH_MIN_BITRATE = 256000
+
+# 推断音质：FLAC采样率或位深超过该值时为Hi-Res
+LOSSLESS_MAX_SAMPLE_RATE = 48000
+LOSSLESS_MAX_BITS = 16
+
+
+def _import_config() -> Dict[str, Any]:
+    """读取导入配置"""
+    try:
+        from main import config
+        return config.library_import_config
+    except ImportError:
+        return {}
+
+
+def _text(values) -> str:
+    """把标签值（可能有多个）合并为一个字符串"""
+    return ARTIST_SEPARATOR.join(str(value) for value in values) if values else ''
+
+
+def _read_tags(file_path: str) -> Dict[str, str]:
+    """读取一个文件的标签（只解析标签，不解析音频数据）"""
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext == '.mp3':
+        try:
+            tags = ID3(file_path)
+        except ID3NoHeaderError:
+            return {}
+        get = lambda key: _text(tags[key].text) if key in tags else ''
+        return {
+            'song_id': get(f'TXXX:{SONG_ID_TAG}'),
+            'quality': get(f'TXXX:{QUALITY_TAG}'),
+            'song_name': get('TIT2'),
+            'artists': get('TPE1'),
+            'album': get('TALB')
+        }
+    if file_ext == '.flac':
+        tags = FLAC(file_path).tags or {}
+        get = lambda key: _text(tags.get(key))
+        return {
+            'song_id': get(SONG_ID_TAG),
+            'quality': get(QUALITY_TAG),
+            'song_name': get('TITLE'),
+            'artists': get('ARTIST'),
+            'album': get('ALBUM')
+        }
+    if file_ext == '.m4a':
+        tags = MP4(file_path).tags or {}
+        get = lambda key: _text(tags.get(key))
+        freeform = lambda key: _text(
+            bytes(value).decode('utf-8', 'replace') for value in tags.get(f'----:{MP4_TAG_NAMESPACE}:{key}', [])
+        )
+        return {
+            'song_id': freeform(SONG_ID_TAG),
+            'quality': freeform(QUALITY_TAG),
+            'song_name': get('\xa9nam'),
+            'artists': get('\xa9ART'),
+            'album': get('\xa9alb')
+        }
+    return {}
+
+
+def infer_quality(file_path: str) -> str:
+    """按格式和码率推断音质（没有音质标签时使用，需要解析音频信息）"""
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext == '.flac':
+        info = FLAC(file_path).info
+        if info.sample_rate > LOSSLESS_MAX_SAMPLE_RATE or info.bits_per_sample > LOSSLESS_MAX_BITS:
+            return 'hires'
+        return 'lossless'
+    if file_ext == '.m4a':
+        info = MP4(file_path).info
+        if info.codec == 'alac':
+            return 'lossless'
+    else:
+        info = MP3(file_path).info
+    return 'exhigh' if info.bitrate >= EXHIGH_MIN_BITRATE else 'standard'
+
+
+def read_song_file(file_path: str) -> Optional[Dict[str, Any]]:
+    """从文件标签读取歌曲信息
+
+    Args:
+        file_path: 音频文件路径
+
+    Returns:
+        歌曲信息字典（字段同DownloadDatabase.add_song，下载时间取文件修改时间），
+        没有歌曲ID标签时返回None
+    """
+    tags = _read_tags(file_path)
+    song_id = tags.get('song_id', '').strip()
+    if not song_id.isdigit():
+        return None
+
+    stat = os.stat(file_path)
+    return {
+        'song_id': int(song_id),
+        'song_name': tags['song_name'] or os.path.splitext(os.path.basename(file_path))[0],
+        'artists': tags['artists'],
+        'album': tags['album'],
+        'file_path': file_path,
+        'file_size': stat.st_size,
+        'download_time': stat.st_mtime,
+        'quality': tags['quality'] or infer_quality(file_path)
+    }
+
+
+def read_song_files(file_paths: List[str]) -> Tuple[List[Dict[str, Any]], int, int]:
+    """读取一批文件的标签（在子进程中执行）
+
+    Returns:
+        (歌曲信息列表, 没有歌曲ID标签的文件数, 读取失败的文件数)
+    """
+    songs = []
+    untagged = errors = 0
+    for file_path in file_paths:
+        try:
+            song = read_song_file(file_path)
+        except Exception:
+            errors += 1
+            continue
+        if song is None:
+            untagged += 1
+        else:
+            songs.append(song)
+    return songs, untagged, errors
+
+
+def iter_audio_files(root: str) -> Iterator[str]:
+    """遍历目录中的音频文件（跳过以"."开头的目录，如曲库.store和封面缓存.cache）"""
+    try:
+        with os.scandir(root) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+    except OSError as e:
+        logger.warning(f"无法读取目录 {root}: {e}")
+        return
+    for entry in entries:
+        if entry.name.startswith('.'):
+            continue
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_audio_files(entry.path)
+            elif entry.name.lower().endswith(AUDIO_EXTENSIONS) and entry.is_file():
+                yield entry.path
+        except OSError:
+            continue
+
+
+class LibraryImporter:
+    """曲库导入类"""
+
+    def __init__(self, db: DownloadDatabase, workers: Optional[int] = None, batch_size: Optional[int] = None):
+        """
+        初始化导入
+
+        Args:
+            db: 下载数据库实例
+            workers: 读取标签的进程数，为None时使用配置（配置为0时使用全部CPU核心）
+            batch_size: 每个进程任务读取的文件数，为None时使用配置
+        """
+        import_config = _import_config()
+        self.db = db
+        self.workers = workers or import_config.get('workers') or os.cpu_count() or 1
+        self.batch_size = batch_size or import_config.get('batch_size', IMPORT_BATCH_SIZE)
+
+    def run(self, root: str, cancel_token: Optional[CancellationToken] = None,
+            progress_callback: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+        """遍历目录并导入带有歌曲ID标签的文件
+
+        Args:
+            root: 曲库目录
+            cancel_token: 取消令牌，取消后不再处理剩余批次（已写入的记录保留）
+            progress_callback: 进度回调，参数为 (已处理文件数, 总文件数)
+
+        Returns:
+            导入结果：文件数、写入的下载记录数、只登记存放位置的文件数、没有标签和读取失败的文件数、是否被取消
+        """
+        file_paths = list(iter_audio_files(os.path.abspath(root)))
+        batches = [file_paths[i:i + self.batch_size] for i in range(0, len(file_paths), self.batch_size)]
+        result = {
+            'files': len(file_paths),
+            'imported': 0,
+            'located': 0,
+            'untagged': 0,
+            'errors': 0,
+            'processed': 0,
+            'cancelled': False
+        }
+
+        def collect(batch: List[str], outcome: Tuple[List[Dict[str, Any]], int, int]):
+            songs, untagged, errors = outcome
+            counts = self.db.import_songs(songs)
+            result['imported'] += counts['imported']
+            result['located'] += counts['located']
+            result['untagged'] += untagged
+            result['errors'] += errors
+            result['processed'] += len(batch)
+            if progress_callback:
+                progress_callback(result['processed'], len(file_paths))
+
+        def cancelled() -> bool:
+            if cancel_token is not None and cancel_token.is_cancelled():
+                cancel_token.mark_observed()
+                result['cancelled'] = True
+                return True
+            return False
+
+        if self.workers <= 1 or len(batches) <= 1:
+            # 单进程时直接读取，省去启动子进程的开销
+            for batch in batches:
+                if cancelled():
+                    break
+                collect(batch, read_song_files(batch))
+        else:
+            # 不使用fork：Web服务进程中有数据库连接、下载线程和锁，fork出的子进程会继承它们的状态。
+            # forkserver/spawn会以__mp_main__名称重新导入main.py，main.py中据此跳过服务实例的创建
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as executor:
+                futures = {executor.submit(read_song_files, batch): batch for batch in batches}
+                for future in as_completed(futures):
+                    if cancelled():
+                        for pending in futures:
+                            pending.cancel()
+                        break
+                    collect(futures[future], future.result())
+
+        logger.info(f"曲库导入{'已取消' if result['cancelled'] else '完成'}: {root}，{result}")
+        return result
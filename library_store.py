@@ -0,0 +1,260 @@
+"""曲库内容存储模块
+
+以 (歌曲ID, 音质) 为键保存已下载的音乐文件，把同一首歌放入多个歌单或歌手目录时
+通过链接复用已有文件，而不是重新下载：
+- 优先使用硬链接，其次reflink（写时复制克隆），再次符号链接，最后复制
+- 每个下载完成的文件以硬链接的形式登记到曲库目录，歌单目录中的文件被删除后仍可复用
+- 所有存放位置记录在数据库的song_locations表中
+"""
+
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from download_db import DownloadDatabase
+
+try:
+    import fcntl
+except ImportError:
+    # Windows下不支持reflink
+    fcntl = None
+
+
+# Linux FICLONE ioctl（btrfs/xfs等支持写时复制的文件系统）
+FICLONE = 0x40049409
+
+# 默认的链接方式优先顺序
+DEFAULT_LINK_MODES = ['hardlink', 'reflink', 'symlink', 'copy']
+
+
+def _hardlink(source: Path, target: Path) -> None:
+    os.link(source, target)
+
+
+def _reflink(source: Path, target: Path) -> None:
+    if fcntl is None:
+        raise OSError('当前平台不支持reflink')
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            target.unlink()
+            raise
+
+
+def _symlink(source: Path, target: Path) -> None:
+    os.symlink(source.resolve(), target)
+
+
+def _copy(source: Path, target: Path) -> None:
+    shutil.copy2(source, target)
+
+
+LINKERS = {
+    'hardlink': _hardlink,
+    'reflink': _reflink,
+    'symlink': _symlink,
+    'copy': _copy
+}
+
+
+def place_file(source: Path, target: Path, link_modes: Optional[List[str]] = None) -> Optional[str]:
+    """按优先顺序把源文件放到目标位置
+
+    Args:
+        source: 源文件路径
+        target: 目标文件路径（不能已存在）
+        link_modes: 链接方式优先顺序，为None时使用默认顺序
+
+    Returns:
+        实际使用的链接方式，全部失败时返回None
+    """
+    target.parent.mkdir(exist_ok=True, parents=True)
+    for mode in link_modes or DEFAULT_LINK_MODES:
+        try:
+            LINKERS[mode](source, target)
+            return mode
+        except OSError:
+            continue
+    return None
+
+
+class LibraryStore:
+    """曲库内容存储类"""
+
+    def __init__(self, store_dir: str = "downloads/.store", link_modes: Optional[List[str]] = None,
+                 db: Optional[DownloadDatabase] = None):
+        """
+        初始化曲库存储
+
+        Args:
+            store_dir: 曲库目录
+            link_modes: 链接方式优先顺序，可选 hardlink/reflink/symlink/copy
+            db: 下载数据库实例
+        """
+        self.store_dir = Path(store_dir)
+        self.link_modes = [mode for mode in (link_modes or DEFAULT_LINK_MODES) if mode in LINKERS]
+        self.db = db or DownloadDatabase()
+        self.store_dir.mkdir(exist_ok=True, parents=True)
+
+        self._lock = threading.Lock()
+        self.placements: Dict[str, int] = {mode: 0 for mode in LINKERS}
+        self.network_bytes_saved = 0
+        self.disk_bytes_saved = 0
+
+    def _store_path(self, song_id: int, quality: str, file_ext: str) -> Path:
+        """获取曲库中的文件路径"""
+        return self.store_dir / f"{song_id % 256:02x}" / f"{song_id}_{quality}{file_ext}"
+
+    def find_source(self, song_id: int, quality: str) -> Optional[Path]:
+        """查找可作为链接源的已有文件
+
+        Args:
+            song_id: 歌曲ID
+            quality: 音质
+
+        Returns:
+            已存在的文件路径（曲库副本优先），不存在时返回None
+        """
+        for location in self.db.get_song_locations(song_id, quality):
+            path = Path(location['file_path'])
+            if path.is_file():
+                return path
+        return None
+
+    def adopt(self, file_path: Path, song_id: int, quality: str) -> bool:
+        """将新下载的文件登记到曲库
+
+        只使用硬链接，不额外占用磁盘空间；跨文件系统时跳过，
+        此时下载位置本身仍可作为后续链接的源文件。
+
+        Args:
+            file_path: 已下载的文件路径
+            song_id: 歌曲ID
+            quality: 音质
+
+        Returns:
+            是否登记成功
+        """
+        store_path = self._store_path(song_id, quality, file_path.suffix)
+        try:
+            store_path.parent.mkdir(exist_ok=True)
+            if store_path.exists():
+                if os.path.samefile(store_path, file_path):
+                    return True
+                store_path.unlink()
+            os.link(file_path, store_path)
+        except OSError:
+            return False
+
+        return self.db.add_song_location(song_id, quality, str(store_path), 'store')
+
+    def place(self, source: Path, target: Path) -> Optional[str]:
+        """按优先顺序把源文件放到目标位置
+
+        Args:
+            source: 源文件路径
+            target: 目标文件路径
+
+        Returns:
+            实际使用的链接方式，全部失败时返回None
+        """
+        return place_file(source, target, self.link_modes)
+
+    def place_song(self, song_id: int, quality: str, target_stem: Path) -> Optional[Path]:
+        """把曲库中的歌曲放到指定位置
+
+        Args:
+            song_id: 歌曲ID
+            quality: 音质
+            target_stem: 目标路径（不含扩展名，扩展名沿用源文件）
+
+        Returns:
+            放置后的文件路径，曲库中没有该歌曲或放置失败时返回None
+        """
+        source = self.find_source(song_id, quality)
+        if source is None:
+            return None
+
+        target = target_stem.with_name(target_stem.name + source.suffix)
+        if target.exists():
+            # 目标位置已有同一文件（例如之前已链接过），直接登记
+            if os.path.samefile(source, target):
+                self.db.add_song_location(song_id, quality, str(target), 'hardlink')
+                return target
+            return None
+
+        mode = self.place(source, target)
+        if mode is None:
+            return None
+
+        self.db.add_song_location(song_id, quality, str(target), mode)
+        self._place_lyric(song_id, quality, target)
+
+        size = source.stat().st_size
+        with self._lock:
+            self.placements[mode] += 1
+            self.network_bytes_saved += size
+            if mode != 'copy':
+                self.disk_bytes_saved += size
+        return target
+
+    def _place_lyric(self, song_id: int, quality: str, target: Path) -> None:
+        """复制歌词文件（歌词文件很小，直接复制）"""
+        lyric_target = target.with_suffix('.lrc')
+        if lyric_target.exists():
+            return
+        for location in self.db.get_song_locations(song_id, quality):
+            lyric_source = Path(location['file_path']).with_suffix('.lrc')
+            if lyric_source.is_file():
+                try:
+                    shutil.copy2(lyric_source, lyric_target)
+                except OSError:
+                    pass
+                return
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取曲库统计信息"""
+        with self._lock:
+            return {
+                'store_dir': str(self.store_dir),
+                'link_modes': self.link_modes,
+                'placements': dict(self.placements),
+                'network_bytes_saved': self.network_bytes_saved,
+                'disk_bytes_saved': self.disk_bytes_saved,
+                'locations': self.db.get_location_statistics()
+            }
+
+
+_library_store: Optional[LibraryStore] = None
+_library_store_lock = threading.Lock()
+
+
+def get_library_store() -> Optional[LibraryStore]:
+    """获取全局曲库实例（首次调用时根据配置文件创建，未启用时返回None）"""
+    global _library_store
+    if _library_store is not None:
+        return _library_store
+
+    # 在加锁前读取配置，避免导入main时重入
+    try:
+        from main import config
+        base_dir = config.download_config.get('base_dir', 'downloads')
+        store_config = config.library_store_config
+    except ImportError:
+        base_dir = 'downloads'
+        store_config = {}
+
+    if not store_config.get('enabled', True):
+        return None
+
+    with _library_store_lock:
+        if _library_store is None:
+            _library_store = LibraryStore(
+                store_dir=store_config.get('store_dir') or str(Path(base_dir) / '.store'),
+                link_modes=store_config.get('link_modes')
+            )
+        return _library_store
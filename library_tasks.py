@@ -0,0 +1,235 @@
+"""
+曲库维护任务函数
+为任务管理器提供在后台执行的曲库维护任务（清理孤立记录、从文件标签导入、校验文件等）
+"""
+
+from typing import Any, Dict, Optional
+import logging
+import threading
+
+from task_manager import task_manager, TaskStatus
+from cancellation import CancellationToken
+from download_db import DownloadDatabase
+from orphan_scan import OrphanScanner
+from library_import import LibraryImporter
+from library_verify import LibraryVerifier
+
+
+logger = logging.getLogger('library_tasks')
+
+
+def _get_cancel_token(task_id: str, kwargs: Dict[str, Any]) -> CancellationToken:
+    """获取任务取消令牌（由任务管理器通过kwargs传入）"""
+    return kwargs.get('cancel_token') or task_manager.get_cancel_token(task_id)
+
+
+def sync_cleanup_orphans(resume: bool = True, workers: Optional[int] = None, **kwargs) -> Dict[str, Any]:
+    """清理文件已不存在的下载记录和存放位置（在后台线程中执行）
+
+    Args:
+        resume: 是否从上次取消或中断的位置继续
+        workers: 并行列出目录的线程数，为None时使用配置
+        **kwargs: 其他参数
+
+    Returns:
+        清理结果
+    """
+    task_id = kwargs.get('task_id', 'unknown')
+    cancel_token = _get_cancel_token(task_id, kwargs)
+
+    def report(processed: int, total: int):
+        if not cancel_token.is_cancelled():
+            # 完成前不报告100%，避免任务提前被标记为已完成
+            progress = min(processed / total * 100, 99.9) if total else 0.0
+            task_manager.update_task_progress(task_id, progress, processed, total)
+
+    try:
+        logger.info(f"开始清理孤立记录，任务ID: {task_id}，继续上次进度: {resume}")
+        scanner = OrphanScanner(DownloadDatabase(), workers=workers)
+        result = scanner.run(cancel_token=cancel_token, progress_callback=report, resume=resume)
+
+        if not result['cancelled']:
+            task_manager.update_task_progress(task_id, 100.0, result['processed'], result['total'])
+        return {'success': not result['cancelled'], **result}
+
+    except Exception as e:
+        logger.error(f"清理孤立记录异常: {e}")
+        if not cancel_token.is_cancelled():
+            task_manager.update_task_progress(task_id, 100.0, 0, 0)
+        return {
+            'success': False,
+            'error_message': str(e)
+        }
+
+
+def submit_orphan_cleanup_task(resume: bool = True, workers: Optional[int] = None) -> str:
+    """提交孤立记录清理任务
+
+    Args:
+        resume: 是否从上次取消或中断的位置继续
+        workers: 并行列出目录的线程数
+
+    Returns:
+        任务ID
+    """
+    return task_manager.create_task(
+        task_type="orphan_cleanup",
+        task_func=sync_cleanup_orphans,
+        resume=resume,
+        workers=workers,
+        content_name="清理孤立记录"
+    )
+
+
+def sync_import_library(root: str, workers: Optional[int] = None, **kwargs) -> Dict[str, Any]:
+    """从文件标签导入下载记录（在后台线程中执行，读取标签在进程池中并行）
+
+    Args:
+        root: 曲库目录
+        workers: 读取标签的进程数，为None时使用配置
+        **kwargs: 其他参数
+
+    Returns:
+        导入结果
+    """
+    task_id = kwargs.get('task_id', 'unknown')
+    cancel_token = _get_cancel_token(task_id, kwargs)
+
+    def report(processed: int, total: int):
+        if not cancel_token.is_cancelled():
+            progress = min(processed / total * 100, 99.9) if total else 0.0
+            task_manager.update_task_progress(task_id, progress, processed, total)
+
+    try:
+        logger.info(f"开始导入曲库，任务ID: {task_id}，目录: {root}")
+        importer = LibraryImporter(DownloadDatabase(), workers=workers)
+        result = importer.run(root, cancel_token=cancel_token, progress_callback=report)
+
+        if not result['cancelled']:
+            task_manager.update_task_progress(task_id, 100.0, result['processed'], result['files'])
+        return {'success': not result['cancelled'], **result}
+
+    except Exception as e:
+        logger.error(f"导入曲库异常: {e}")
+        if not cancel_token.is_cancelled():
+            task_manager.update_task_progress(task_id, 100.0, 0, 0)
+        return {
+            'success': False,
+            'error_message': str(e)
+        }
+
+
+def submit_library_import_task(root: str, workers: Optional[int] = None) -> str:
+    """提交曲库导入任务
+
+    Args:
+        root: 曲库目录
+        workers: 读取标签的进程数
+
+    Returns:
+        任务ID
+    """
+    return task_manager.create_task(
+        task_type="library_import",
+        task_func=sync_import_library,
+        root=root,
+        workers=workers,
+        content_name="导入曲库"
+    )
+
+
+def sync_verify_library(resume: bool = True, requeue: bool = True, workers: Optional[int] = None,
+                        **kwargs) -> Dict[str, Any]:
+    """校验已下载文件的MD5，损坏的文件提交重新下载（在后台线程中执行）
+
+    Args:
+        resume: 是否从上次取消或中断的位置继续
+        requeue: 是否为损坏的文件提交重新下载任务
+        workers: 并行校验的线程数，为None时使用配置
+        **kwargs: 其他参数
+
+    Returns:
+        校验结果，包含重新下载的任务ID
+    """
+    task_id = kwargs.get('task_id', 'unknown')
+    cancel_token = _get_cancel_token(task_id, kwargs)
+
+    def report(processed: int, total: int):
+        if not cancel_token.is_cancelled():
+            progress = min(processed / total * 100, 99.9) if total else 0.0
+            task_manager.update_task_progress(task_id, progress, processed, total)
+
+    try:
+        logger.info(f"开始校验曲库，任务ID: {task_id}，继续上次进度: {resume}")
+        verifier = LibraryVerifier(DownloadDatabase(), workers=workers)
+        result = verifier.run(cancel_token=cancel_token, progress_callback=report, resume=resume)
+
+        redownload_tasks = []
+        if requeue and result['corrupted']:
+            # 延迟导入：下载任务模块依赖下载器，曲库维护任务本身不需要
+            from async_downloader import submit_music_download_task
+            for song_id, quality in result['corrupted']:
+                redownload_tasks.append(submit_music_download_task(str(song_id), quality))
+            logger.info(f"已为 {len(redownload_tasks)} 个损坏的文件提交重新下载")
+
+        if not result['cancelled']:
+            task_manager.update_task_progress(task_id, 100.0, result['processed'], result['total'])
+        return {'success': not result['cancelled'], 'redownload_tasks': redownload_tasks, **result}
+
+    except Exception as e:
+        logger.error(f"校验曲库异常: {e}")
+        if not cancel_token.is_cancelled():
+            task_manager.update_task_progress(task_id, 100.0, 0, 0)
+        return {
+            'success': False,
+            'error_message': str(e)
+        }
+
+
+def submit_library_verify_task(resume: bool = True, requeue: bool = True, workers: Optional[int] = None) -> str:
+    """提交曲库校验任务
+
+    Args:
+        resume: 是否从上次取消或中断的位置继续
+        requeue: 是否为损坏的文件提交重新下载任务
+        workers: 并行校验的线程数
+
+    Returns:
+        任务ID
+    """
+    return task_manager.create_task(
+        task_type="library_verify",
+        task_func=sync_verify_library,
+        resume=resume,
+        requeue=requeue,
+        workers=workers,
+        content_name="校验曲库"
+    )
+
+
+_verify_schedule_stop = threading.Event()
+
+
+def start_verify_schedule(interval: float) -> threading.Thread:
+    """按固定间隔提交曲库校验任务（上一次校验尚未结束时跳过本次）
+
+    Args:
+        interval: 间隔（秒）
+
+    Returns:
+        调度线程
+    """
+    def run():
+        last_task_id = None
+        while not _verify_schedule_stop.wait(interval):
+            last_task = task_manager.get_task(last_task_id) if last_task_id else None
+            if last_task is not None and last_task.status in (TaskStatus.PENDING, TaskStatus.RUNNING):
+                logger.info(f"上一次曲库校验尚未结束，跳过本次: {last_task_id}")
+                continue
+            last_task_id = submit_library_verify_task()
+
+    _verify_schedule_stop.clear()
+    task_manager.register_shutdown_callback(_verify_schedule_stop.set)
+    thread = threading.Thread(target=run, name='library-verify-schedule', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,245 @@
+"""曲库校验模块
+
+定期重新计算已下载文件的MD5，找出写入后被静默损坏或截断的文件：
+- 与下载时记录的写入数据MD5（content_md5）比对；下载时没有记录（下载后才写入标签、从标签导入）的文件，
+  首次校验的结果作为之后的基准
+- 增量校验：文件大小和修改时间与上次校验时相同、且距上次校验未超过重新校验间隔的文件不再读取
+- hashlib计算MD5时释放GIL，文件在线程池中并行读取和计算，读取速度由独立的令牌桶限速，不影响下载
+- 损坏的文件（及其硬链接）改名为.corrupt后缀保留，记录标记为corrupt，由调用方提交重新下载
+"""
+
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bandwidth import BandwidthScheduler
+from cancellation import CancellationToken
+from download_db import DownloadDatabase
+
+
+logger = logging.getLogger('library_verify')
+
+# 并行校验的线程数
+VERIFY_WORKERS = 4
+
+# 每批读取的记录数
+VERIFY_CHUNK_SIZE = 500
+
+# 读取速度上限（字节/秒），为0时不限速
+VERIFY_READ_LIMIT = 50 * 1024 * 1024
+
+# 文件未变化时的重新校验间隔（秒）
+REVERIFY_INTERVAL = 30 * 86400
+
+# 每次读取的块大小
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# 损坏文件改名后的后缀
+CORRUPT_SUFFIX = '.corrupt'
+
+# 保存校验位置时使用的名称
+VERIFY_STATE_NAME = 'verify'
+
+
+def _verify_config() -> Dict[str, Any]:
+    """读取校验配置"""
+    try:
+        from main import config
+        return config.library_verify_config
+    except ImportError:
+        return {}
+
+
+def hash_file(file_path: str, throttle: Optional[Callable[[int], None]] = None,
+              should_cancel: Optional[Callable[[], bool]] = None) -> Optional[str]:
+    """计算文件的MD5
+
+    Args:
+        file_path: 文件路径
+        throttle: 限速回调，参数为本次读取的字节数
+        should_cancel: 取消检查函数，每个块调用一次
+
+    Returns:
+        MD5十六进制字符串，被取消时返回None
+    """
+    md5 = hashlib.md5()
+    buffer = bytearray(HASH_BLOCK_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            if should_cancel is not None and should_cancel():
+                return None
+            nbytes = f.readinto(buffer)
+            if not nbytes:
+                break
+            md5.update(view[:nbytes])
+            if throttle is not None:
+                throttle(nbytes)
+    return md5.hexdigest()
+
+
+class LibraryVerifier:
+    """曲库校验类"""
+
+    def __init__(self, db: DownloadDatabase, workers: Optional[int] = None, read_limit: Optional[float] = None,
+                 reverify_interval: Optional[float] = None, chunk_size: Optional[int] = None):
+        """
+        初始化校验
+
+        Args:
+            db: 下载数据库实例
+            workers: 并行校验的线程数，为None时使用配置
+            read_limit: 读取速度上限（字节/秒，0为不限速），为None时使用配置
+            reverify_interval: 文件未变化时的重新校验间隔（秒），为None时使用配置
+            chunk_size: 每批读取的记录数，为None时使用配置
+        """
+        verify_config = _verify_config()
+        self.db = db
+        self.workers = workers or verify_config.get('workers', VERIFY_WORKERS)
+        self.chunk_size = chunk_size or verify_config.get('chunk_size', VERIFY_CHUNK_SIZE)
+        if read_limit is None:
+            read_limit = verify_config.get('read_limit_mb', VERIFY_READ_LIMIT / 1024 / 1024) * 1024 * 1024
+        if reverify_interval is None:
+            reverify_interval = verify_config.get('reverify_days', REVERIFY_INTERVAL / 86400) * 86400
+        self.reverify_interval = reverify_interval
+        self.scheduler = BandwidthScheduler(global_limit=read_limit) if read_limit else None
+        self._cancel_token: Optional[CancellationToken] = None
+
+    def _should_cancel(self) -> bool:
+        return self._cancel_token is not None and self._cancel_token.is_cancelled()
+
+    def _throttle(self, nbytes: int) -> None:
+        self.scheduler.throttle(nbytes, should_cancel=self._should_cancel)
+
+    def _check(self, record: Dict[str, Any]) -> Tuple[str, Any]:
+        """校验一个文件（在线程池中执行）
+
+        Returns:
+            (结果, 数据)：missing/unchanged/error/cancelled时数据为None，ok为(大小, 修改时间)，
+            baseline为(大小, 修改时间, MD5)，corrupt为实际的MD5
+        """
+        file_path = record['file_path']
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            # 文件不存在由曲库监视和孤立记录清理处理
+            return 'missing', None
+
+        unchanged = (
+            record['content_md5']
+            and record['checked_path'] == file_path
+            and record['checked_size'] == stat.st_size
+            and record['checked_mtime'] == stat.st_mtime
+            and time.time() - record['checked_time'] < self.reverify_interval
+        )
+        if unchanged:
+            return 'unchanged', None
+
+        try:
+            md5 = hash_file(file_path, self._throttle if self.scheduler else None, self._should_cancel)
+        except OSError as e:
+            logger.warning(f"无法读取文件 {file_path}: {e}")
+            return 'error', None
+        if md5 is None:
+            return 'cancelled', None
+
+        if not record['content_md5']:
+            return 'baseline', (stat.st_size, stat.st_mtime, md5)
+        if md5 == record['content_md5']:
+            return 'ok', (stat.st_size, stat.st_mtime)
+        return 'corrupt', md5
+
+    def _quarantine(self, record: Dict[str, Any]) -> List[str]:
+        """把损坏的文件及其硬链接改名保留，返回改名前的路径"""
+        file_path = record['file_path']
+        paths = [file_path]
+        for location in self.db.get_song_locations(record['song_id']):
+            other = location['file_path']
+            try:
+                if other != file_path and os.path.samefile(other, file_path):
+                    paths.append(other)
+            except OSError:
+                continue
+
+        for path in paths:
+            try:
+                os.replace(path, path + CORRUPT_SUFFIX)
+            except OSError as e:
+                logger.warning(f"无法改名损坏的文件 {path}: {e}")
+        return paths
+
+    def run(self, cancel_token: Optional[CancellationToken] = None,
+            progress_callback: Optional[Callable[[int, int], None]] = None,
+            resume: bool = True) -> Dict[str, Any]:
+        """校验所有成功下载的文件
+
+        Args:
+            cancel_token: 取消令牌，取消后立即停止，当前批次中未读完的文件下次重新校验
+            progress_callback: 进度回调，参数为 (已处理记录数, 总记录数)
+            resume: 是否从上次中断的位置继续，否则从头校验
+
+        Returns:
+            校验结果：各类文件数、损坏的歌曲 [(歌曲ID, 音质)]、是否被取消
+        """
+        self._cancel_token = cancel_token
+        position = int(self.db.get_scan_position(VERIFY_STATE_NAME) or 0) if resume else 0
+        total = self.db.count_verify_candidates()
+        processed = total - self.db.count_verify_candidates(position) if position else 0
+        counts = {'ok': 0, 'baseline': 0, 'unchanged': 0, 'missing': 0, 'error': 0, 'corrupt': 0}
+        corrupted: List[Tuple[int, str]] = []
+        cancelled = False
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='library-verify') as executor:
+            while True:
+                if cancel_token is not None and cancel_token.is_cancelled():
+                    cancel_token.mark_observed()
+                    cancelled = True
+                    break
+
+                records = self.db.get_verify_candidates(position, self.chunk_size)
+                if not records:
+                    break
+
+                checks, baselines = [], {}
+                for record, (outcome, data) in zip(records, executor.map(self._check, records)):
+                    if outcome == 'cancelled':
+                        continue
+                    counts[outcome] += 1
+                    if outcome == 'ok':
+                        checks.append((record['song_id'], record['file_path']) + data)
+                    elif outcome == 'baseline':
+                        checks.append((record['song_id'], record['file_path']) + data[:2])
+                        baselines[record['song_id']] = data[2]
+                    elif outcome == 'corrupt':
+                        logger.warning(f"文件已损坏: {record['file_path']}，MD5 {data}，"
+                                       f"应为 {record['content_md5']}")
+                        self.db.mark_corrupt(record['song_id'], self._quarantine(record))
+                        corrupted.append((record['song_id'], record['quality']))
+                self.db.save_file_checks(checks, baselines)
+
+                # 取消时可能有文件未读完，该批次不保存位置，下次重新校验
+                if self._should_cancel():
+                    continue
+                position = records[-1]['song_id']
+                self.db.set_scan_position(VERIFY_STATE_NAME, str(position))
+                processed += len(records)
+                if progress_callback:
+                    progress_callback(min(processed, total), total)
+
+        if not cancelled:
+            # 全部校验完成，下次从头开始
+            self.db.set_scan_position(VERIFY_STATE_NAME, '')
+
+        result = {
+            **counts,
+            'processed': processed,
+            'total': total,
+            'corrupted': corrupted,
+            'cancelled': cancelled
+        }
+        logger.info(f"曲库校验{'已取消' if cancelled else '完成'}: "
+                    f"{ {key: value for key, value in result.items() if key != 'corrupted'} }")
+        return result
@@ -0,0 +1,391 @@
+"""曲库文件监视模块
+
+监视下载目录中的文件变化，增量同步到下载数据库，并在内存中维护 路径 -> 文件大小 索引：
+- Linux下使用inotify（通过ctypes调用libc，不需要额外依赖），其他平台或inotify不可用时定期用os.scandir重新扫描
+- 文件被删除或移走时把成功的下载记录标记为missing，文件重新出现时恢复，变化按批写入数据库
+- 批量任务判断歌曲是否已下载时查询内存索引，不必逐个文件访问文件系统
+- 以"."开头的目录（曲库.store、封面缓存.cache等）和下载中的.part临时文件不在监视范围内
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from download_db import DownloadDatabase
+
+
+logger = logging.getLogger('library_watcher')
+
+# 定期重新扫描的间隔（秒），inotify不可用时使用
+RESCAN_INTERVAL = 300.0
+
+# 文件变化写入数据库的间隔（秒）
+BATCH_INTERVAL = 2.0
+
+# 下载中的临时文件后缀
+PART_SUFFIX = '.part'
+
+# inotify事件
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+# inotify_event结构：wd, mask, cookie, len，之后是len字节的文件名
+EVENT_HEADER = struct.Struct('iIII')
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    _libc.inotify_init1.argtypes = [ctypes.c_int]
+    _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    _libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+except (OSError, AttributeError):
+    # 非Linux平台没有inotify，使用定期扫描
+    _libc = None
+
+
+def _ignored(name: str) -> bool:
+    """是否不在监视范围内（隐藏目录或文件、下载中的临时文件）"""
+    return name.startswith('.') or name.endswith(PART_SUFFIX)
+
+
+class LibraryWatcher:
+    """曲库文件监视类"""
+
+    def __init__(self, root: str, db: Optional[DownloadDatabase] = None, use_inotify: bool = True,
+                 rescan_interval: float = RESCAN_INTERVAL, batch_interval: float = BATCH_INTERVAL):
+        """
+        初始化监视器
+
+        Args:
+            root: 监视的根目录（下载目录）
+            db: 下载数据库实例，为None时使用默认数据库
+            use_inotify: 是否使用inotify，为False或不可用时定期重新扫描
+            rescan_interval: 定期重新扫描的间隔（秒）
+            batch_interval: 文件变化写入数据库的间隔（秒）
+        """
+        self.root = os.path.abspath(root)
+        self.db = db or DownloadDatabase()
+        self.use_inotify = use_inotify and _libc is not None
+        self.rescan_interval = rescan_interval
+        self.batch_interval = batch_interval
+
+        self._lock = threading.Lock()
+        self._sizes: Dict[str, int] = {}
+        # 尚未写入数据库的变化：路径 -> 文件大小（已删除为None）
+        self._pending: Dict[str, Optional[int]] = {}
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._fd: Optional[int] = None
+        self._watches: Dict[int, str] = {}
+        self.mode = 'rescan'
+
+        # 统计信息
+        self.events = 0
+        self.rescans = 0
+        self.batches = 0
+        self.missing = 0
+        self.restored = 0
+
+    def start(self) -> None:
+        """在后台线程中完成首次扫描并开始监视"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='library-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """停止监视并写入尚未同步的变化"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._flush()
+
+    def covers(self, file_path: str) -> bool:
+        """路径是否在监视范围内且首次扫描已完成（否则需要直接访问文件系统）"""
+        if not self._ready.is_set():
+            return False
+        path = os.path.abspath(file_path)
+        if not path.startswith(self.root + os.sep):
+            return False
+        return not any(_ignored(part) for part in Path(os.path.relpath(path, self.root)).parts)
+
+    def lookup(self, file_path: str) -> Optional[int]:
+        """查询索引中的文件大小，文件不在索引中时返回None"""
+        with self._lock:
+            return self._sizes.get(os.path.abspath(file_path))
+
+    def _set(self, path: str, size: Optional[int]) -> None:
+        """记录一个文件的变化（需持有锁）"""
+        if size is None:
+            if self._sizes.pop(path, None) is not None:
+                self._pending[path] = None
+        elif self._sizes.get(path) != size:
+            self._sizes[path] = size
+            self._pending[path] = size
+
+    def _scan(self, directory: str, sizes: Dict[str, int]) -> None:
+        """递归扫描目录中的文件，启用inotify时同时为每个目录添加监视"""
+        if self._fd is not None:
+            self._add_watch(directory)
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if _ignored(entry.name):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            self._scan(entry.path, sizes)
+                        elif entry.is_file():
+                            sizes[entry.path] = entry.stat().st_size
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.warning(f"无法扫描目录 {directory}: {e}")
+
+    def _rescan(self, directory: Optional[str] = None) -> None:
+        """重新扫描根目录（或其中一个子目录），与索引比较得到变化"""
+        directory = directory or self.root
+        sizes: Dict[str, int] = {}
+        self._scan(directory, sizes)
+        prefix = directory + os.sep
+        with self._lock:
+            for path in [path for path in self._sizes if path.startswith(prefix) and path not in sizes]:
+                self._set(path, None)
+            for path, size in sizes.items():
+                self._set(path, size)
+        self.rescans += 1
+
+    def _forget_dir(self, directory: str) -> None:
+        """目录被删除或移走时移除其中的所有文件，移走的目录不再监视"""
+        prefix = directory + os.sep
+        if self._fd is not None:
+            for wd, path in list(self._watches.items()):
+                if path == directory or path.startswith(prefix):
+                    _libc.inotify_rm_watch(self._fd, wd)
+                    self._watches.pop(wd, None)
+        with self._lock:
+            for path in [path for path in self._sizes if path.startswith(prefix)]:
+                self._set(path, None)
+
+    def _add_watch(self, directory: str) -> None:
+        """为目录添加inotify监视，数量超过系统上限时改为定期扫描"""
+        wd = _libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                logger.warning("inotify监视数量达到系统上限（fs.inotify.max_user_watches），改为定期扫描")
+                self._close_inotify()
+                self.mode = 'rescan'
+            elif err not in (errno.ENOENT, errno.ENOTDIR):
+                logger.warning(f"无法监视目录 {directory}: {os.strerror(err)}")
+            return
+        self._watches[wd] = directory
+
+    def _close_inotify(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self._watches.clear()
+
+    def _handle_events(self, data: bytes) -> None:
+        """处理一次读取到的inotify事件"""
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            self.events += 1
+
+            if mask & IN_Q_OVERFLOW:
+                # 事件队列溢出，丢失的变化只能通过重新扫描得到
+                logger.warning("inotify事件队列溢出，重新扫描")
+                self._rescan()
+                continue
+            directory = self._watches.get(wd)
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            if directory is None or not name:
+                continue
+
+            name = os.fsdecode(name)
+            if _ignored(name):
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._rescan(path)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._forget_dir(path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                with self._lock:
+                    self._set(path, None)
+            elif mask & (IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO):
+                try:
+                    size = os.stat(path).st_size
+                except OSError:
+                    size = None
+                with self._lock:
+                    self._set(path, size)
+
+    def _flush(self) -> None:
+        """把尚未同步的变化写入数据库"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        present = {path: size for path, size in pending.items() if size is not None}
+        removed = [path for path, size in pending.items() if size is None]
+        result = self.db.apply_file_changes(present, removed)
+        self.batches += 1
+        self.missing += result['missing']
+        self.restored += result['restored']
+        if result['missing'] or result['restored']:
+            logger.info(f"同步文件变化: {len(pending)}个文件，{result}")
+
+    def _run(self) -> None:
+        """首次扫描，之后处理inotify事件或定期重新扫描，并按批写入数据库"""
+        if self.use_inotify:
+            fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                logger.warning(f"inotify初始化失败: {os.strerror(ctypes.get_errno())}，改为定期扫描")
+            else:
+                self._fd = fd
+                self.mode = 'inotify'
+
+        start = time.time()
+        sizes: Dict[str, int] = {}
+        self._scan(self.root, sizes)
+        with self._lock:
+            self._sizes = sizes
+        self._ready.set()
+        logger.info(f"曲库监视已启动: {self.root}，文件数: {len(sizes)}，耗时: {time.time() - start:.1f}s，"
+                    f"方式: {self.mode}")
+
+        last_flush = last_rescan = time.time()
+        while not self._stop.is_set():
+            if self._fd is not None:
+                readable, _, _ = select.select([self._fd], [], [], self.batch_interval)
+                if readable:
+                    try:
+                        self._handle_events(os.read(self._fd, 64 * 1024))
+                    except BlockingIOError:
+                        pass
+            else:
+                self._stop.wait(self.batch_interval)
+                if time.time() - last_rescan >= self.rescan_interval:
+                    self._rescan()
+                    last_rescan = time.time()
+
+            if time.time() - last_flush >= self.batch_interval:
+                self._flush()
+                last_flush = time.time()
+
+        self._close_inotify()
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """获取监视统计信息"""
+        with self._lock:
+            files = len(self._sizes)
+            pending = len(self._pending)
+        return {
+            'root': self.root,
+            'mode': self.mode,
+            'ready': self._ready.is_set(),
+            'files': files,
+            'watched_dirs': len(self._watches),
+            'pending': pending,
+            'events': self.events,
+            'rescans': self.rescans,
+            'batches': self.batches,
+            'missing': self.missing,
+            'restored': self.restored
+        }
+
+
+_library_watcher: Optional[LibraryWatcher] = None
+_library_watcher_lock = threading.Lock()
+# 配置未启用监视（记住结果，逐个文件判断时不必反复读取配置）
+_library_watch_disabled = False
+
+
+def get_library_watcher() -> Optional[LibraryWatcher]:
+    """获取全局曲库监视器（首次调用时根据配置文件创建并启动，未启用时返回None）"""
+    global _library_watcher, _library_watch_disabled
+    if _library_watcher is not None or _library_watch_disabled:
+        return _library_watcher
+
+    # 在加锁前读取配置，避免导入main时重入
+    try:
+        from main import config
+        base_dir = config.download_config.get('base_dir', 'downloads')
+        watch_config = config.library_watch_config
+    except ImportError:
+        base_dir = 'downloads'
+        watch_config = {}
+
+    if not watch_config.get('enabled', False):
+        _library_watch_disabled = True
+        return None
+
+    with _library_watcher_lock:
+        if _library_watcher is None:
+            _library_watcher = LibraryWatcher(
+                root=base_dir,
+                use_inotify=watch_config.get('use_inotify', True),
+                rescan_interval=watch_config.get('rescan_interval', RESCAN_INTERVAL),
+                batch_interval=watch_config.get('batch_interval', BATCH_INTERVAL)
+            )
+            _library_watcher.start()
+        return _library_watcher
+
+
+def file_size(file_path: str) -> Optional[int]:
+    """获取文件大小，文件不存在时返回None
+
+    启用监视器且路径在监视范围内时先查内存索引；索引中没有时（可能是刚写入、事件尚未处理）
+    再访问文件系统确认，因此只有"文件存在"的判断完全不访问文件系统。
+
+    Args:
+        file_path: 文件路径
+
+    Returns:
+        文件大小（字节），文件不存在时为None
+    """
+    watcher = get_library_watcher()
+    if watcher is not None and watcher.covers(file_path):
+        size = watcher.lookup(file_path)
+        if size is not None:
+            return size
+    try:
+        return os.stat(file_path).st_size
+    except OSError:
+        return None
+
+
+def path_exists(file_path: str) -> bool:
+    """判断文件是否存在（见file_size）"""
+    return file_size(file_path) is not None
@@ -33,12 +33,16 @@ try:
     from artist_downloader import ArtistDownloader, ArtistDownloadConfig
     from hot_playlist_fetcher import HotPlaylistFetcher
     from qr_login import QRLoginClient
+    from scheduling import SCHEDULE_POLICIES
     from task_manager import task_manager, init_task_manager, shutdown_task_manager
     from async_downloader import (
         submit_music_download_task, 
         submit_playlist_download_task, 
         submit_artist_download_task
     )
+    from library_tasks import (
+        submit_orphan_cleanup_task, submit_library_import_task, submit_library_verify_task, start_verify_schedule
+    )
 except ImportError as e:
     print(f"导入模块失败: {e}")
     print("请确保所有依赖模块存在且可用")
@@ -77,6 +81,15 @@ class APIConfig:
         self.artist_download_config = config_data.get('artist_download', {})
         self.database_config = config_data.get('database', {})
         self.cookie_config = config_data.get('cookie', {})
+        self.cover_cache_config = config_data.get('cover_cache', {})
+        self.library_store_config = config_data.get('library_store', {})
+        self.library_scan_config = config_data.get('library_scan', {})
+        self.library_watch_config = config_data.get('library_watch', {})
+        self.library_import_config = config_data.get('library_import', {})
+        self.library_verify_config = config_data.get('library_verify', {})
+        self.http_pools_config = config_data.get('http_pools', {})
+        self.bandwidth_config = config_data.get('bandwidth', {})
+        self.availability_config = config_data.get('availability', {})
         self.api_config = config_data.get('api', {})
         self.debug_config = config_data.get('debug_config', {})
         
@@ -258,8 +271,11 @@ class MusicAPIService:
 config = APIConfig()
 app = Flask(__name__)
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
-api_service = MusicAPIService(config)
-qr_login_client = QRLoginClient()
+# 曲库导入的进程池（forkserver/spawn）启动时会以__mp_main__名称重新导入本模块，
+# 此时不创建服务实例，避免子进程打开日志文件、Cookie和下载器
+if __name__ != '__mp_main__':
+    api_service = MusicAPIService(config)
+    qr_login_client = QRLoginClient()
 
 
 def send_task_progress_update(task_id):
@@ -480,6 +496,10 @@ def save_cookie():
         
         if success:
             api_service.logger.info("Cookie保存成功")
+            # 账号变化后歌曲的可用音质可能不同，清空不可用歌曲的负缓存
+            cleared = api_service.downloader.db.clear_unavailable()
+            if cleared:
+                api_service.logger.info(f"已清除 {cleared} 条不可用歌曲记录")
             return APIResponse.success({'cookie_status': 'valid'}, "Cookie保存成功")
         else:
             api_service.logger.error("Cookie保存失败")
@@ -887,6 +907,7 @@ def download_playlist():
             include_lyric = True
         max_concurrent = int(data.get('max_concurrent', 3))
         selected_songs = data.get('selected_songs')  # 选中的歌曲ID列表
+        schedule_policy = data.get('schedule_policy') or None  # 下载顺序策略，未指定时使用配置
         # 处理async参数，支持布尔值和字符串值
         async_param = data.get('async', 'false')
         if isinstance(async_param, bool):
@@ -904,6 +925,10 @@ def download_playlist():
         if quality not in valid_qualities:
             return APIResponse.error(f"无效的音质参数，支持: {', '.join(valid_qualities)}")
         
+        # 验证下载顺序策略
+        if schedule_policy and schedule_policy not in SCHEDULE_POLICIES:
+            return APIResponse.error(f"无效的下载顺序策略，支持: {', '.join(SCHEDULE_POLICIES)}")
+
         # 如果是异步模式，提交任务并返回任务ID
         if async_mode:
             task_id = submit_playlist_download_task(
@@ -911,7 +936,8 @@ def download_playlist():
                 quality=quality,
                 include_lyric=include_lyric,
                 max_concurrent=max_concurrent,
-                selected_songs=selected_songs
+                selected_songs=selected_songs,
+                schedule_policy=schedule_policy
             )
             return APIResponse.success(
                 {'task_id': task_id, 'async': True}, 
@@ -933,7 +959,8 @@ def download_playlist():
             download_dir=str(playlist_download_dir),
             include_lyric=include_lyric,
             max_concurrent=max_concurrent,
-            selected_songs=selected_songs  # 添加选中的歌曲ID列表
+            selected_songs=selected_songs,  # 添加选中的歌曲ID列表
+            schedule_policy=schedule_policy
         )
         
         # 创建下载器并执行
@@ -997,6 +1024,11 @@ def download_artist_songs():
         if match_mode not in valid_modes:
             return APIResponse.error(f"无效的匹配模式，支持: {', '.join(valid_modes)}")
         
+        # 验证下载顺序策略
+        schedule_policy = data.get('schedule_policy') or None
+        if schedule_policy and schedule_policy not in SCHEDULE_POLICIES:
+            return APIResponse.error(f"无效的下载顺序策略，支持: {', '.join(SCHEDULE_POLICIES)}")
+
         # 如果是异步模式，提交任务并返回任务ID
         if async_mode:
             task_id = submit_artist_download_task(
@@ -1005,7 +1037,8 @@ def download_artist_songs():
                 limit=limit,
                 match_mode=match_mode,
                 include_lyric=include_lyric,
-                max_concurrent=max_concurrent
+                max_concurrent=max_concurrent,
+                schedule_policy=schedule_policy
             )
             return APIResponse.success(
                 {'task_id': task_id, 'async': True}, 
@@ -1028,7 +1061,8 @@ def download_artist_songs():
             match_mode=match_mode,
             download_dir=str(artist_download_dir),
             include_lyric=include_lyric,
-            max_concurrent=max_concurrent
+            max_concurrent=max_concurrent,
+            schedule_policy=schedule_policy
         )
         
         # 创建下载器并执行
@@ -1129,6 +1163,230 @@ def get_all_tasks():
         return APIResponse.error(f"获取任务列表失败: {str(e)}", 500)
 
 
+@app.route('/api/tasks/metrics', methods=['GET'])
+def get_task_metrics():
+    """获取任务管理器运行指标API（队列深度、取消响应延迟等）"""
+    try:
+        return APIResponse.success(task_manager.get_metrics(), "获取任务指标成功")
+    except Exception as e:
+        api_service.logger.error(f"获取任务指标异常: {e}")
+        return APIResponse.error(f"获取任务指标失败: {str(e)}", 500)
+
+
+@app.route('/api/http/metrics', methods=['GET'])
+def get_http_metrics():
+    """获取HTTP连接池运行指标API（接口池与CDN池分别统计）"""
+    try:
+        from http_pool import get_pool_statistics
+        return APIResponse.success(get_pool_statistics(), "获取连接池指标成功")
+    except Exception as e:
+        api_service.logger.error(f"获取连接池指标异常: {e}")
+        return APIResponse.error(f"获取连接池指标失败: {str(e)}", 500)
+
+
+@app.route('/api/bandwidth', methods=['GET', 'POST'])
+def bandwidth_settings():
+    """下载带宽API
+
+    GET返回当前限速配置和各任务的带宽统计；POST在运行时调整限速，
+    正在进行的下载从下一个分块开始按新配置限速。速率单位为KB/s，0表示不限速。
+
+    POST参数:
+        global_limit_kb: 全局速率上限
+        task_limit_kb: 单任务默认速率上限
+        burst_seconds: 突发容量（秒）
+        task_id: 单独调整的任务ID
+        limit_kb: 该任务的速率上限，-1表示恢复使用默认上限
+        weight: 该任务分享全局带宽时的权重
+    """
+    try:
+        from bandwidth import get_bandwidth_scheduler
+        scheduler = get_bandwidth_scheduler()
+
+        if request.method == 'POST':
+            data = api_service._safe_get_request_data()
+
+            def read_number(key: str) -> Optional[float]:
+                value = data.get(key)
+                return None if value is None or value == '' else float(value)
+
+            try:
+                global_limit_kb = read_number('global_limit_kb')
+                task_limit_kb = read_number('task_limit_kb')
+                burst_seconds = read_number('burst_seconds')
+                limit_kb = read_number('limit_kb')
+                weight = read_number('weight')
+            except (TypeError, ValueError):
+                return APIResponse.error("限速参数必须是数字")
+
+            if weight is not None and weight <= 0:
+                return APIResponse.error("权重必须大于0")
+
+            scheduler.set_limits(
+                global_limit=None if global_limit_kb is None else global_limit_kb * 1024,
+                task_limit=None if task_limit_kb is None else task_limit_kb * 1024,
+                burst_seconds=burst_seconds
+            )
+
+            task_id = data.get('task_id')
+            if task_id:
+                scheduler.set_task_limit(
+                    task_id,
+                    limit=None if limit_kb is None else (limit_kb * 1024 if limit_kb >= 0 else -1),
+                    weight=weight
+                )
+            elif limit_kb is not None or weight is not None:
+                return APIResponse.error("调整单个任务的限速需要提供task_id")
+
+            return APIResponse.success(scheduler.get_statistics(), "带宽配置已更新")
+
+        return APIResponse.success(scheduler.get_statistics(), "获取带宽配置成功")
+    except Exception as e:
+        api_service.logger.error(f"下载带宽API异常: {e}")
+        return APIResponse.error(f"下载带宽配置失败: {str(e)}", 500)
+
+
+@app.route('/api/library/store', methods=['GET'])
+def get_library_store_stats():
+    """获取曲库统计信息API（链接方式、节省的流量和磁盘空间）"""
+    try:
+        from library_store import get_library_store
+        library = get_library_store()
+        if library is None:
+            return APIResponse.error("曲库未启用", 404)
+        return APIResponse.success(library.get_statistics(), "获取曲库统计成功")
+    except Exception as e:
+        api_service.logger.error(f"获取曲库统计异常: {e}")
+        return APIResponse.error(f"获取曲库统计失败: {str(e)}", 500)
+
+
+@app.route('/api/library/watch', methods=['GET'])
+def get_library_watch_stats():
+    """获取曲库文件监视统计信息API（监视方式、索引文件数、同步的变化）"""
+    try:
+        from library_watcher import get_library_watcher
+        watcher = get_library_watcher()
+        if watcher is None:
+            return APIResponse.error("曲库文件监视未启用", 404)
+        return APIResponse.success(watcher.get_statistics(), "获取曲库文件监视统计成功")
+    except Exception as e:
+        api_service.logger.error(f"获取曲库文件监视统计异常: {e}")
+        return APIResponse.error(f"获取曲库文件监视统计失败: {str(e)}", 500)
+
+
+@app.route('/api/library/cleanup', methods=['POST'])
+def cleanup_library():
+    """清理孤立记录API（文件已不存在的下载记录和存放位置，作为可取消的后台任务执行）"""
+    try:
+        data = api_service._safe_get_request_data()
+        resume_param = data.get('resume', 'true')
+        if isinstance(resume_param, bool):
+            resume = resume_param
+        else:
+            resume = str(resume_param).lower() == 'true'  # 是否从上次中断的位置继续
+        workers = data.get('workers')
+        try:
+            workers = int(workers) if workers else None
+        except (TypeError, ValueError):
+            return APIResponse.error("workers必须是整数", 400)
+
+        task_id = submit_orphan_cleanup_task(resume=resume, workers=workers)
+        return APIResponse.success(
+            {'task_id': task_id, 'async': True},
+            "孤立记录清理任务已提交，请使用任务ID查询进度"
+        )
+    except Exception as e:
+        api_service.logger.error(f"提交孤立记录清理任务异常: {e}")
+        return APIResponse.error(f"提交孤立记录清理任务失败: {str(e)}", 500)
+
+
+@app.route('/api/library/import', methods=['POST'])
+def import_library():
+    """导入曲库API（从文件标签中的歌曲ID重建下载记录，作为可取消的后台任务执行；root默认为下载目录）"""
+    try:
+        data = api_service._safe_get_request_data()
+        root = data.get('root') or config.downloads_dir
+        if not Path(root).is_dir():
+            return APIResponse.error(f"目录不存在: {root}", 400)
+        workers = data.get('workers')
+        try:
+            workers = int(workers) if workers else None
+        except (TypeError, ValueError):
+            return APIResponse.error("workers必须是整数", 400)
+
+        task_id = submit_library_import_task(root=root, workers=workers)
+        return APIResponse.success(
+            {'task_id': task_id, 'async': True},
+            "曲库导入任务已提交，请使用任务ID查询进度"
+        )
+    except Exception as e:
+        api_service.logger.error(f"提交曲库导入任务异常: {e}")
+        return APIResponse.error(f"提交曲库导入任务失败: {str(e)}", 500)
+
+
+@app.route('/api/library/verify', methods=['POST'])
+def verify_library():
+    """校验曲库API（重新计算已下载文件的MD5，损坏的文件提交重新下载，作为可取消的后台任务执行）"""
+    try:
+        data = api_service._safe_get_request_data()
+        flags = {}
+        for name in ('resume', 'requeue'):
+            value = data.get(name, 'true')
+            flags[name] = value if isinstance(value, bool) else str(value).lower() == 'true'
+        workers = data.get('workers')
+        try:
+            workers = int(workers) if workers else None
+        except (TypeError, ValueError):
+            return APIResponse.error("workers必须是整数", 400)
+
+        task_id = submit_library_verify_task(workers=workers, **flags)
+        return APIResponse.success(
+            {'task_id': task_id, 'async': True},
+            "曲库校验任务已提交，请使用任务ID查询进度"
+        )
+    except Exception as e:
+        api_service.logger.error(f"提交曲库校验任务异常: {e}")
+        return APIResponse.error(f"提交曲库校验任务失败: {str(e)}", 500)
+
+
+@app.route('/api/library/search', methods=['GET'])
+def search_library():
+    """搜索已下载歌曲API（q为搜索词，为空时按下载时间倒序；cursor为上一页返回的next_cursor）"""
+    try:
+        data = api_service._safe_get_request_data()
+        query = data.get('q', '')
+        cursor = data.get('cursor') or None
+        status = data.get('status', 'success')
+        try:
+            limit = int(data.get('limit', 20))
+        except ValueError:
+            return APIResponse.error("limit必须是整数", 400)
+
+        try:
+            result = api_service.downloader.db.search_library(
+                query, limit=limit, cursor=cursor, status=None if status == 'all' else status
+            )
+        except ValueError as e:
+            return APIResponse.error(str(e), 400)
+        return APIResponse.success(result, "搜索曲库成功")
+    except Exception as e:
+        api_service.logger.error(f"搜索曲库异常: {e}")
+        return APIResponse.error(f"搜索曲库失败: {str(e)}", 500)
+
+
+@app.route('/api/downloads/stats', methods=['GET'])
+def get_download_stats():
+    """获取下载记录统计信息API（recompute=true时先从下载记录重新计算统计表）"""
+    try:
+        data = api_service._safe_get_request_data()
+        recompute = str(data.get('recompute', 'false')).lower() == 'true'
+        stats = api_service.downloader.db.get_statistics(recompute=recompute)
+        return APIResponse.success(stats, "获取下载统计成功")
+    except Exception as e:
+        api_service.logger.error(f"获取下载统计异常: {e}")
+        return APIResponse.error(f"获取下载统计失败: {str(e)}", 500)
+
+
 @app.route('/api/tasks/<task_id>', methods=['GET'])
 def get_task_info(task_id):
     """获取单个任务信息API"""
@@ -1298,6 +1556,17 @@ async def start_api_server_async():
         task_manager.set_progress_callback(send_task_progress_update)
         print("✅ 任务管理器初始化完成，WebSocket回调已注册")
         
+        # 定期校验曲库文件（间隔为0时不启用）
+        verify_interval = config.library_verify_config.get('interval_hours', 0)
+        if verify_interval > 0:
+            start_verify_schedule(verify_interval * 3600)
+            print(f"🔍 曲库定期校验已启用，间隔: {verify_interval}小时")
+
+        # 启动曲库文件监视（未启用时不做任何事）
+        from library_watcher import get_library_watcher
+        if get_library_watcher() is not None:
+            print("👀 曲库文件监视已启动")
+
         print("🌟 服务已就绪，等待请求...\n")
         
         # 启动SocketIO服务器（支持WebSocket）
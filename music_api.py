@@ -21,6 +21,8 @@ import requests
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
+from http_pool import get_http_pool
+
 
 class QualityLevel(Enum):
     """音质等级枚举"""
@@ -122,8 +124,8 @@ class HTTPClient:
         request_cookies.update(cookies)
         
         try:
-            response = requests.post(url, headers=headers, cookies=request_cookies, 
-                                   data={"params": params}, timeout=30)
+            response = get_http_pool('api').post(url, headers=headers, cookies=request_cookies,
+                                               data={"params": params})
             response.raise_for_status()
             return response.text
         except requests.RequestException as e:
@@ -141,8 +143,8 @@ class HTTPClient:
         request_cookies.update(cookies)
         
         try:
-            response = requests.post(url, headers=headers, cookies=request_cookies, 
-                                   data={"params": params}, timeout=30)
+            response = get_http_pool('api').post(url, headers=headers, cookies=request_cookies,
+                                               data={"params": params})
             response.raise_for_status()
             return response
         except requests.RequestException as e:
@@ -172,6 +174,22 @@ class NeteaseAPI:
         Returns:
             包含歌曲URL信息的字典
             
+        Raises:
+            APIException: API调用失败时抛出
+        """
+        return self.get_song_urls([song_id], quality, cookies)
+
+    def get_song_urls(self, song_ids: List[int], quality: str, cookies: Dict[str, str]) -> Dict[str, Any]:
+        """批量获取歌曲播放URL（一次请求解析多首歌曲的URL、大小和MD5）
+
+        Args:
+            song_ids: 歌曲ID列表
+            quality: 音质等级 (standard, exhigh, lossless, hires, sky, jyeffect, jymaster)
+            cookies: 用户cookies
+
+        Returns:
+            包含歌曲URL信息的字典，data中每项对应一首歌曲（顺序不保证与输入一致）
+
         Raises:
             APIException: API调用失败时抛出
         """
@@ -180,7 +198,7 @@ class NeteaseAPI:
             config["requestId"] = str(randrange(20000000, 30000000))
             
             payload = {
-                'ids': [song_id],
+                'ids': list(song_ids),
                 'level': quality,
                 'encodeType': 'flac',
                 'header': json.dumps(config),
@@ -214,7 +232,7 @@ class NeteaseAPI:
         """
         try:
             data = {'c': json.dumps([{"id": song_id, "v": 0}])}
-            response = requests.post(APIConstants.SONG_DETAIL_V3, data=data, timeout=30)
+            response = get_http_pool('api').post(APIConstants.SONG_DETAIL_V3, data=data)
             response.raise_for_status()
             
             result = response.json()
@@ -258,8 +276,8 @@ class NeteaseAPI:
                 'Referer': APIConstants.REFERER
             }
             
-            response = requests.post(APIConstants.LYRIC_API, data=data, 
-                                   headers=headers, cookies=cookies, timeout=30)
+            response = get_http_pool('api').post(APIConstants.LYRIC_API, data=data,
+                                               headers=headers, cookies=cookies)
             response.raise_for_status()
             
             result = response.json()
@@ -295,8 +313,8 @@ class NeteaseAPI:
                 'Referer': APIConstants.REFERER
             }
             
-            response = requests.post(APIConstants.SEARCH_API, data=data, 
-                                   headers=headers, cookies=cookies, timeout=30)
+            response = get_http_pool('api').post(APIConstants.SEARCH_API, data=data,
+                                               headers=headers, cookies=cookies)
             response.raise_for_status()
             
             result = response.json()
@@ -400,16 +418,16 @@ class NeteaseAPI:
                 'Content-Type': 'application/x-www-form-urlencoded'
             }
             
-            response = requests.post(APIConstants.PLAYLIST_DETAIL_API, data=data, 
-                                   headers=headers, cookies=cookies, timeout=30)
+            response = get_http_pool('api').post(APIConstants.PLAYLIST_DETAIL_API, data=data,
+                                               headers=headers, cookies=cookies)
             response.raise_for_status()
             
             result = response.json()
             if result.get('code') != 200:
                 # 如果v3版本失败，尝试使用更兼容的版本
                 fallback_api = 'https://music.163.com/api/playlist/detail'
-                fallback_response = requests.post(fallback_api, data={'id': playlist_id}, 
-                                                headers=headers, cookies=cookies, timeout=30)
+                fallback_response = get_http_pool('api').post(fallback_api, data={'id': playlist_id},
+                                                            headers=headers, cookies=cookies)
                 fallback_response.raise_for_status()
                 result = fallback_response.json()
                 
@@ -433,8 +451,8 @@ class NeteaseAPI:
                 batch_ids = track_ids[i:i+100]
                 song_data = {'c': json.dumps([{'id': int(sid), 'v': 0} for sid in batch_ids])}
                 
-                song_resp = requests.post(APIConstants.SONG_DETAIL_V3, data=song_data, 
-                                        headers=headers, cookies=cookies, timeout=30)
+                song_resp = get_http_pool('api').post(APIConstants.SONG_DETAIL_V3, data=song_data,
+                                                    headers=headers, cookies=cookies)
                 song_resp.raise_for_status()
                 
                 song_result = song_resp.json()
@@ -475,7 +493,7 @@ class NeteaseAPI:
                 'Referer': APIConstants.REFERER
             }
             
-            response = requests.get(url, headers=headers, cookies=cookies, timeout=30)
+            response = get_http_pool('api').get(url, headers=headers, cookies=cookies)
             response.raise_for_status()
             
             result = response.json()
@@ -580,12 +598,11 @@ class NeteaseAPI:
                     'offset': offset
                 }
                 
-                response = requests.get(
+                response = get_http_pool('api').get(
                     APIConstants.PERSONALIZED_PLAYLIST_API, 
                     headers=headers, 
                     cookies=cookies, 
-                    params=params,
-                    timeout=30
+                    params=params
                 )
                 response.raise_for_status()
                 
@@ -650,11 +667,10 @@ class NeteaseAPI:
                 'Referer': APIConstants.REFERER
             }
             
-            response = requests.get(
+            response = get_http_pool('api').get(
                 APIConstants.PLAYLIST_CATEGORY_API, 
                 headers=headers, 
-                cookies=cookies, 
-                timeout=30
+                cookies=cookies
             )
             response.raise_for_status()
             
@@ -767,12 +783,11 @@ class NeteaseAPI:
                     'offset': offset
                 }
                 
-                search_response = requests.post(
+                search_response = get_http_pool('api').post(
                     APIConstants.SEARCH_API,
                     headers=headers,
                     cookies=cookies,
-                    data=search_params,
-                    timeout=30
+                    data=search_params
                 )
                 search_response.raise_for_status()
                 
@@ -859,12 +874,11 @@ class NeteaseAPI:
                             'cat': category
                         }
                         
-                        response = requests.get(
+                        response = get_http_pool('api').get(
                             'https://music.163.com/api/discovery/playlist',
                             headers=headers,
                             cookies=cookies,
-                            params=params,
-                            timeout=30
+                            params=params
                         )
                         response.raise_for_status()
                         
@@ -943,12 +957,11 @@ class NeteaseAPI:
                         'cat': category  # 添加分类参数
                     }
                     
-                    response = requests.get(
+                    response = get_http_pool('api').get(
                         'https://music.163.com/api/top/playlist',
                         headers=headers,
                         cookies=cookies,
-                        params=params,
-                        timeout=30
+                        params=params
                     )
                     response.raise_for_status()
                     
@@ -1025,12 +1038,11 @@ class NeteaseAPI:
                         'offset': offset
                     }
                     
-                    search_response = requests.post(
+                    search_response = get_http_pool('api').post(
                         APIConstants.SEARCH_API,
                         headers=headers,
                         cookies=cookies,
-                        data=search_params,
-                        timeout=30
+                        data=search_params
                     )
                     search_response.raise_for_status()
                     
@@ -1132,12 +1144,11 @@ class NeteaseAPI:
                     'before': 0,     # 时间戳参数
                 }
                 
-                response = requests.get(
+                response = get_http_pool('api').get(
                     APIConstants.HIGH_QUALITY_PLAYLIST_API, 
                     headers=headers, 
                     cookies=cookies, 
-                    params=params,
-                    timeout=30
+                    params=params
                 )
                 response.raise_for_status()
                 
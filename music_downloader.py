@@ -14,9 +14,14 @@
 
 import os
 import re
+import socket
 import asyncio
+import threading
+import time
+import uuid
+import logging
 import aiohttp
-import aiofiles
+from http.client import IncompleteRead
 from io import BytesIO
 from typing import Dict, List, Optional, Tuple, Any, Union
 from pathlib import Path
@@ -24,14 +29,40 @@ from dataclasses import dataclass
 from enum import Enum
 
 import requests
+from requests.exceptions import ChunkedEncodingError
+from urllib3.exceptions import ProtocolError
 from mutagen.flac import FLAC
 from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, TIT2, TPE1, TALB, TDRC, TRCK, APIC
-from mutagen.mp4 import MP4
+from mutagen.id3 import ID3, TIT2, TPE1, TALB, TDRC, TRCK, TXXX, APIC
+from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm
 
 from music_api import NeteaseAPI, APIException
 from cookie_manager import CookieManager
-from download_db import DownloadDatabase
+from download_db import DownloadDatabase, DownloadedSong, DownloadPlan
+from cancellation import CancellationToken
+from cover_cache import get_cover_cache, guess_image_mime
+from library_store import get_library_store, place_file
+from library_watcher import file_size as indexed_file_size
+from library_verify import hash_file
+from inflight import inflight_registry
+from http_pool import PoolWaitCancelled, get_http_pool, get_pool_config
+from bandwidth import get_bandwidth_scheduler
+from availability import AvailabilityProbe, ProbeResult
+from stream_fetcher import (
+    FetchCancelled, IntegrityChecker, get_content_length, stream_to_file, stream_to_file_async
+)
+from stream_tagger import (
+    StreamTagRewriter, create_tag_rewriter, supports_stream_tagging,
+    SONG_ID_TAG, QUALITY_TAG, MP4_TAG_NAMESPACE
+)
+
+
+# 等待其他任务下载同一首歌的最长时间（秒），超时后自行下载
+INFLIGHT_WAIT_TIMEOUT = 300
+
+# 读取响应内容时连接中断、数据不完整的异常，与完整性校验失败一样重新下载
+TRUNCATED_READ_ERRORS = (ProtocolError, IncompleteRead, ChunkedEncodingError)
+ASYNC_TRUNCATED_READ_ERRORS = (aiohttp.ClientPayloadError,)
 
 
 class AudioFormat(Enum):
@@ -70,6 +101,7 @@ class MusicInfo:
     quality: str
     lyric: str = ""
     tlyric: str = ""
+    md5: str = ""
 
 
 @dataclass
@@ -100,6 +132,7 @@ class MusicDownloader:
             create_artist_dir: 是否创建歌手目录，默认为True
         """
         self.create_artist_dir = create_artist_dir
+        self.logger = logging.getLogger('music_downloader')
         
         # 从配置文件读取默认配置
         try:
@@ -119,6 +152,13 @@ class MusicDownloader:
                     self.download_dir = Path(base_dir)
             
             self.max_concurrent = max_concurrent or config.music_download_config.get('max_concurrent', 3)
+            self.stream_tagging = config.music_download_config.get('stream_tagging', True)
+            self.verify_retries = config.music_download_config.get('verify_retries', 2)
+            self.inflight_wait_timeout = config.music_download_config.get(
+                'inflight_wait_seconds', INFLIGHT_WAIT_TIMEOUT
+            )
+            self.async_session_config = config.music_download_config.get('async_session', {})
+            availability_config = config.availability_config
         except ImportError:
             # 如果无法导入config，使用默认值
             if download_dir:
@@ -126,6 +166,11 @@ class MusicDownloader:
             else:
                 self.download_dir = Path("downloads") / "music"
             self.max_concurrent = max_concurrent or 3
+            self.stream_tagging = True
+            self.verify_retries = 2
+            self.inflight_wait_timeout = INFLIGHT_WAIT_TIMEOUT
+            self.async_session_config = {}
+            availability_config = {}
         
         self.download_dir.mkdir(exist_ok=True, parents=True)
         
@@ -133,6 +178,24 @@ class MusicDownloader:
         self.cookie_manager = CookieManager()
         self.api = NeteaseAPI()
         self.db = DownloadDatabase()
+        self.cover_cache = get_cover_cache()
+        self.library = get_library_store()
+
+        # 可用性预检与负缓存
+        self.availability_enabled = availability_config.get('enabled', True)
+        self.negative_ttl = float(availability_config.get('negative_ttl_hours', 24)) * 3600
+        self.url_reuse_seconds = float(availability_config.get('url_reuse_seconds', 600))
+        self.availability_probe = AvailabilityProbe(
+            self.api, self.db,
+            ladder=availability_config.get('quality_ladder'),
+            negative_ttl=self.negative_ttl
+        )
+        # 预检得到的链接信息：(歌曲ID, 音质) -> (链接信息, 获取时间)
+        self._prefetched_urls: Dict[Tuple[int, str], Tuple[Dict[str, Any], float]] = {}
+
+        # 异步下载使用的长连接会话（首次使用时在当前事件循环中创建）
+        self._async_session: Optional[aiohttp.ClientSession] = None
+        self._async_session_loop: Optional[asyncio.AbstractEventLoop] = None
         
         # 支持的文件格式
         self.supported_formats = {
@@ -163,6 +226,229 @@ class MusicDownloader:
         
         return filename or "unknown"
     
+    def _target_stem(self, name: str, artists: str) -> Path:
+        """获取歌曲的目标路径（不含扩展名）
+
+        Args:
+            name: 歌曲名称
+            artists: 歌手（多个歌手以/分隔）
+
+        Returns:
+            目标路径，create_artist_dir为True时位于第一个歌手的目录下
+        """
+        safe_filename = self._sanitize_filename(f"{artists} - {name}")
+
+        # 根据create_artist_dir参数决定文件路径
+        if self.create_artist_dir:
+            # 提取第一个歌手名称并创建歌手目录
+            artist_names = artists.split('/')
+            primary_artist = artist_names[0] if artist_names else 'Unknown'
+            artist_dir = self.download_dir / self._sanitize_filename(primary_artist)
+            artist_dir.mkdir(exist_ok=True, parents=True)
+            return artist_dir / safe_filename
+
+        # 直接在基础目录中保存文件
+        return self.download_dir / safe_filename
+
+    def place_from_library(self, music_id: int, quality: str, name: str, artists: str,
+                           album: str = "") -> Optional[DownloadResult]:
+        """不请求网络，直接把曲库中已有的歌曲放到当前下载目录
+
+        Args:
+            music_id: 音乐ID
+            quality: 音质等级
+            name: 歌曲名称
+            artists: 歌手
+            album: 专辑
+
+        Returns:
+            放置成功时返回下载结果，曲库中没有该歌曲时返回None
+        """
+        return self._place_from_library(music_id, quality, self._target_stem(name, artists),
+                                        song_meta={'name': name, 'artists': artists, 'album': album})
+
+    def _place_from_library(self, music_id: int, quality: str, target_stem: Path,
+                            music_info: Optional[MusicInfo] = None,
+                            song_meta: Optional[Dict[str, str]] = None,
+                            source: Optional[Path] = None) -> Optional[DownloadResult]:
+        """从曲库放置歌曲并记录到数据库
+
+        Args:
+            music_id: 音乐ID
+            quality: 音质等级
+            target_stem: 目标路径（不含扩展名）
+            music_info: 音乐信息（已获取时传入）
+            song_meta: 歌曲名称、歌手、专辑（未获取音乐信息时传入）
+            source: 已知的源文件，未启用曲库时直接从该文件链接或复制
+
+        Returns:
+            放置成功时返回下载结果，否则返回None
+        """
+        try:
+            if self.library:
+                file_path = self.library.place_song(music_id, quality, target_stem)
+            elif source and source.is_file():
+                file_path = target_stem.with_name(target_stem.name + source.suffix)
+                if not (file_path.exists() and os.path.samefile(source, file_path)):
+                    if file_path.exists() or place_file(source, file_path) is None:
+                        file_path = None
+            else:
+                return None
+        except OSError as e:
+            self.logger.warning(f"从曲库放置歌曲失败: {e}")
+            return None
+        if file_path is None:
+            return None
+
+        if music_info:
+            song_meta = {'name': music_info.name, 'artists': music_info.artists, 'album': music_info.album}
+        file_size = file_path.stat().st_size
+        self.db.add_song({
+            'song_id': music_id,
+            'song_name': song_meta['name'],
+            'artists': song_meta['artists'],
+            'album': song_meta.get('album', ''),
+            'file_path': str(file_path),
+            'file_size': file_size,
+            'quality': quality,
+            'status': 'success'
+        })
+        self.logger.info(f"从曲库放置歌曲: {file_path}")
+
+        return DownloadResult(
+            success=True,
+            file_path=str(file_path),
+            file_size=file_size,
+            music_info=music_info
+        )
+
+    def _reuse_inflight_result(self, music_id: int, quality: str,
+                               shared: Optional[DownloadResult]) -> Optional[DownloadResult]:
+        """复用其他任务刚完成的下载结果，链接或复制到当前下载目录
+
+        Args:
+            music_id: 音乐ID
+            quality: 音质等级
+            shared: 负责下载的任务返回的结果
+
+        Returns:
+            放置成功时返回下载结果，负责者下载失败或放置失败时返回None
+        """
+        if not shared or not shared.success or not shared.file_path:
+            return None
+
+        if shared.music_info:
+            song_meta = {
+                'name': shared.music_info.name,
+                'artists': shared.music_info.artists,
+                'album': shared.music_info.album
+            }
+        else:
+            song = self.db.get_song_info(music_id)
+            if not song:
+                return None
+            song_meta = {'name': song.song_name, 'artists': song.artists, 'album': song.album}
+
+        target_stem = self._target_stem(song_meta['name'], song_meta['artists'])
+        result = self._place_from_library(music_id, quality, target_stem, shared.music_info, song_meta,
+                                          source=Path(shared.file_path))
+        if result:
+            inflight_registry.record_saved(result.file_size)
+        return result
+
+    def _part_path(self, file_path: Path, unique: bool = False) -> Path:
+        """获取下载过程中使用的临时文件路径
+
+        Args:
+            file_path: 正式文件路径
+            unique: 是否使用独立的临时文件（等待超时后自行下载时，负责下载的任务可能仍在写入同名临时文件）
+        """
+        if unique:
+            return file_path.with_name(f"{file_path.name}.{uuid.uuid4().hex[:8]}.part")
+        return file_path.with_name(file_path.name + '.part')
+
+    def _music_info_from_record(self, song: DownloadedSong) -> MusicInfo:
+        """根据数据库记录构建音乐信息（跳过下载时使用，不包含下载链接和歌词）"""
+        return MusicInfo(
+            id=song.song_id,
+            name=song.song_name,
+            artists=song.artists,
+            album=song.album or '',
+            pic_url='',
+            duration=0,
+            track_number=0,
+            download_url='',
+            file_type=Path(song.file_path).suffix.lstrip('.'),
+            file_size=song.file_size,
+            quality=song.quality,
+            md5=song.file_md5
+        )
+
+    def _use_existing(self, music_id: int, existing_song: DownloadedSong) -> Optional[DownloadResult]:
+        """使用已有的同等或更高音质文件，不请求接口
+
+        文件在当前下载目录下时直接返回，否则按已有文件的音质从曲库放置到当前目录。
+
+        Args:
+            music_id: 音乐ID
+            existing_song: 数据库中的下载记录（文件已确认存在）
+
+        Returns:
+            下载结果，放置失败时返回None（由调用方按正常流程下载）
+        """
+        music_info = self._music_info_from_record(existing_song)
+        existing_file_path = Path(existing_song.file_path)
+        if existing_file_path.parent == self.download_dir or (
+                self.create_artist_dir and existing_file_path.parent.parent == self.download_dir):
+            return DownloadResult(
+                success=True,
+                file_path=existing_song.file_path,
+                file_size=existing_song.file_size,
+                music_info=music_info
+            )
+
+        target_stem = self._target_stem(existing_song.song_name, existing_song.artists)
+        return self._place_from_library(music_id, existing_song.quality, target_stem, music_info,
+                                        source=existing_file_path)
+
+    def _retire_replaced_file(self, replaced: Optional[DownloadedSong], new_path: Path) -> None:
+        """升级完成后删除同一目录下被替换的低音质文件
+
+        同一路径的文件已由os.replace原子替换；扩展名不同（如mp3升级为flac）时删除旧文件，
+        其他目录中链接的旧文件保持不变。
+
+        Args:
+            replaced: 被升级的下载记录，为None时不做处理
+            new_path: 新文件路径
+        """
+        if replaced is None or not replaced.file_path:
+            return
+        old_path = Path(replaced.file_path)
+        if old_path == new_path or old_path.parent != new_path.parent:
+            return
+        try:
+            old_path.unlink()
+            self.logger.info(f"已替换低音质文件: {old_path} -> {new_path}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.logger.warning(f"删除被替换的文件失败: {e}")
+            return
+        self.db.remove_song_location(str(old_path))
+
+    def _remove_partial_file(self, file_path: Optional[Path]) -> None:
+        """删除下载中断后残留的部分文件
+
+        Args:
+            file_path: 部分下载的文件路径，为None（尚未开始下载）时不做处理
+        """
+        if file_path is not None and file_path.exists():
+            try:
+                file_path.unlink()
+                self.logger.info(f"已删除部分下载的文件: {file_path}")
+            except Exception as e:
+                self.logger.warning(f"删除部分下载文件失败: {e}")
+
     def _determine_file_extension(self, url: str, content_type: str = "") -> str:
         """根据URL和Content-Type确定文件扩展名
         
@@ -205,18 +491,28 @@ class MusicDownloader:
         Raises:
             DownloadException: 获取信息失败时抛出
         """
+        # 负缓存中的歌曲在有效期内不再请求接口
+        if self.availability_enabled:
+            unavailable = self.db.get_unavailable([music_id], quality)
+            if music_id in unavailable:
+                raise DownloadException(f"音乐ID {music_id} 不可用: {unavailable[music_id]}（已缓存）")
+
         try:
             # 获取cookies
             cookies = self.cookie_manager.parse_cookies()
             
-            # 获取音乐URL信息
-            url_result = self.api.get_song_url(music_id, quality, cookies)
-            if not url_result.get('data') or not url_result['data']:
-                raise DownloadException(f"无法获取音乐ID {music_id} 的播放链接")
+            # 优先复用预检时获取的链接信息，过期或没有时重新获取
+            song_data = self._take_prefetched_url(music_id, quality)
+            if song_data is None:
+                url_result = self.api.get_song_url(music_id, quality, cookies)
+                if not url_result.get('data') or not url_result['data']:
+                    raise DownloadException(f"无法获取音乐ID {music_id} 的播放链接")
+                song_data = url_result['data'][0]
             
-            song_data = url_result['data'][0]
             download_url = song_data.get('url', '')
             if not download_url:
+                if self.availability_enabled:
+                    self.db.mark_unavailable(music_id, quality, "无可用的下载链接", self.negative_ttl)
                 raise DownloadException(f"音乐ID {music_id} 无可用的下载链接")
             
             # 获取音乐详情
@@ -248,99 +544,205 @@ class MusicDownloader:
                 file_size=song_data.get('size', 0),
                 quality=quality,
                 lyric=lyric,
-                tlyric=tlyric
+                tlyric=tlyric,
+                md5=song_data.get('md5') or ''
             )
             
             return music_info
             
         except APIException as e:
             raise DownloadException(f"API调用失败: {e}")
+        except DownloadException:
+            raise
         except Exception as e:
             raise DownloadException(f"获取音乐信息时发生错误: {e}")
     
-    def download_music_file(self, music_id: int, quality: str = "standard", task_id: str = None) -> DownloadResult:
+    def _take_prefetched_url(self, music_id: int, quality: str) -> Optional[Dict[str, Any]]:
+        """取出预检时获取的链接信息（只使用一次，超过复用时限的视为过期）"""
+        prefetched = self._prefetched_urls.pop((music_id, quality), None)
+        if prefetched is None:
+            return None
+        song_data, fetched_time = prefetched
+        if time.time() - fetched_time > self.url_reuse_seconds:
+            return None
+        return song_data
+
+    def probe_availability(self, music_ids: List[int], quality: str) -> Dict[int, ProbeResult]:
+        """批量预检歌曲可用性，为每首歌选出降级顺序中可用的最高音质
+
+        预检得到的链接信息会在随后下载该歌曲时复用，不再重复请求。
+
+        Args:
+            music_ids: 音乐ID列表
+            quality: 请求的音质
+
+        Returns:
+            音乐ID到预检结果的映射，预检请求失败的歌曲不在其中；未启用预检时返回空字典
+        """
+        if not self.availability_enabled or not music_ids:
+            return {}
+
+        # 清理已过期（或被跳过而未使用）的链接信息
+        now = time.time()
+        for key, (_, fetched_time) in list(self._prefetched_urls.items()):
+            if now - fetched_time > self.url_reuse_seconds:
+                self._prefetched_urls.pop(key, None)
+
+        cookies = self.cookie_manager.parse_cookies()
+        results = self.availability_probe.probe(music_ids, quality, cookies)
+        for result in results.values():
+            if result.available and result.song_data:
+                self._prefetched_urls[(result.song_id, result.quality)] = (result.song_data, result.probed_time)
+        return results
+
+    def _resolve_cancel_token(self, task_id: Optional[str],
+                              cancel_token: Optional[CancellationToken]) -> Optional[CancellationToken]:
+        """获取用于取消检查的令牌，未显式传入时按任务ID从任务管理器获取"""
+        if cancel_token is None and task_id:
+            from task_manager import task_manager
+            cancel_token = task_manager.get_cancel_token(task_id)
+        return cancel_token
+
+    def _cancelled_result(self, music_id: int, cancel_token: CancellationToken) -> DownloadResult:
+        """记录取消响应延迟并构建取消结果"""
+        latency = cancel_token.mark_observed()
+        self.logger.info(
+            f"任务 {cancel_token.task_id} 已被取消，停止下载音乐: {music_id}"
+            + (f"（响应延迟 {latency * 1000:.0f}ms）" if latency is not None else "")
+        )
+        return DownloadResult(
+            success=False,
+            error_message='任务已被用户取消'
+        )
+
+    def _abort_response_on_cancel(self, response: requests.Response,
+                                  cancel_token: Optional[CancellationToken]):
+        """注册取消回调，在取消时关闭底层连接以唤醒阻塞中的读取
+
+        Returns:
+            注销回调的函数
+        """
+        if cancel_token is None:
+            return lambda: None
+
+        def abort() -> None:
+            # shutdown可以唤醒其他线程中阻塞的recv，close本身不能
+            connection = getattr(response.raw, '_connection', None)
+            sock = getattr(connection, 'sock', None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+        return cancel_token.register(abort)
+
+    def download_music_file(self, music_id: int, quality: str = "standard", task_id: str = None,
+                            cancel_token: Optional[CancellationToken] = None,
+                            plan: Optional[DownloadPlan] = None) -> DownloadResult:
         """下载音乐文件到本地
         
+        同一首歌（相同音质）正在被其他任务下载时，等待其完成后直接链接到当前目录。
+
         Args:
             music_id: 音乐ID
             quality: 音质等级
-            task_id: 任务ID（用于取消检查）
+            task_id: 任务ID（未传入cancel_token时用于获取取消令牌）
+            cancel_token: 取消令牌
+            plan: 批量任务按同一音质生成的下载规划，传入时不再单独查询数据库
             
         Returns:
             下载结果对象
         """
+        cancel_token = self._resolve_cancel_token(task_id, cancel_token)
+        key = (music_id, quality)
+        is_leader, future = inflight_registry.claim(key)
+
+        if is_leader:
+            result = None
+            try:
+                result = self._fetch_music_file(music_id, quality, cancel_token, plan)
+                return result
+            finally:
+                inflight_registry.complete(key, future, result)
+
+        # 等待负责下载的任务完成，取消时立即返回
+        wakeup = threading.Event()
+        future.add_done_callback(lambda _: wakeup.set())
+        unregister = cancel_token.register(wakeup.set) if cancel_token else (lambda: None)
+        try:
+            finished = wakeup.wait(self.inflight_wait_timeout)
+        finally:
+            unregister()
+
+        if cancel_token and cancel_token.is_cancelled():
+            return self._cancelled_result(music_id, cancel_token)
+
+        if not finished:
+            # 负责下载的任务长时间未结束（连接卡住等），不再等待，使用独立的临时文件自行下载
+            self.logger.warning(f"等待其他任务下载超时，自行下载: {music_id} ({quality})")
+            inflight_registry.record_timeout()
+            return self._fetch_music_file(music_id, quality, cancel_token, plan, independent=True)
+
+        shared = self._reuse_inflight_result(music_id, quality, future.result())
+        if shared:
+            return shared
+
+        # 负责下载的任务失败或被取消，重新登记后自行下载
+        inflight_registry.record_fallback()
+        return self.download_music_file(music_id, quality, cancel_token=cancel_token)
+
+    def _fetch_music_file(self, music_id: int, quality: str,
+                          cancel_token: Optional[CancellationToken],
+                          plan: Optional[DownloadPlan] = None, independent: bool = False) -> DownloadResult:
+        """下载音乐文件到本地（不经过下载去重）
+
+        Args:
+            music_id: 音乐ID
+            quality: 音质等级
+            cancel_token: 取消令牌
+            plan: 已有的下载规划，为None时查询数据库生成
+            independent: 是否使用独立的临时文件（等待其他任务下载超时后自行下载时）
+
+        Returns:
+            下载结果对象
+        """
+        part_path = None
         try:
             # 检查任务是否已被取消
-            if task_id:
-                from task_manager import task_manager, TaskStatus
-                task_info = task_manager.get_task(task_id)
-                if task_info and task_info.status == TaskStatus.CANCELLED:
-                    self.logger.info(f"任务 {task_id} 已被取消，停止下载音乐: {music_id}")
-                    return DownloadResult(
-                        success=False,
-                        error_message='任务已被用户取消'
-                    )
+            if cancel_token and cancel_token.is_cancelled():
+                return self._cancelled_result(music_id, cancel_token)
+
+            # 已有同等或更高音质的文件时直接使用，不请求接口
+            if plan is None:
+                plan = self.db.plan_downloads([music_id], quality)
+            if music_id in plan.skip:
+                skipped = self._use_existing(music_id, plan.skip[music_id])
+                if skipped:
+                    return skipped
+            upgrade_from = plan.upgrade.get(music_id)
             
             # 获取音乐信息
             music_info = self.get_music_info(music_id, quality)
             
             # 检查任务是否已被取消（在获取信息后再次检查）
-            if task_id:
-                task_info = task_manager.get_task(task_id)
-                if task_info and task_info.status == TaskStatus.CANCELLED:
-                    self.logger.info(f"任务 {task_id} 已被取消，停止下载音乐: {music_id}")
-                    return DownloadResult(
-                        success=False,
-                        error_message='任务已被用户取消'
-                    )
-            
-            # 生成文件名
-            filename = f"{music_info.artists} - {music_info.name}"
-            safe_filename = self._sanitize_filename(filename)
+            if cancel_token and cancel_token.is_cancelled():
+                return self._cancelled_result(music_id, cancel_token)
             
-            # 确定文件扩展名
+            # 确定文件扩展名和文件路径
             file_ext = self._determine_file_extension(music_info.download_url)
-            
-            # 根据create_artist_dir参数决定文件路径
-            if self.create_artist_dir:
-                # 提取第一个歌手名称并创建歌手目录
-                artist_names = music_info.artists.split('/')
-                primary_artist = artist_names[0] if artist_names else 'Unknown'
-                safe_artist_name = self._sanitize_filename(primary_artist)
-                
-                # 创建歌手目录
-                artist_dir = self.download_dir / safe_artist_name
-                artist_dir.mkdir(exist_ok=True, parents=True)
-                file_path = artist_dir / f"{safe_filename}{file_ext}"
-            else:
-                # 直接在基础目录中保存文件
-                file_path = self.download_dir / f"{safe_filename}{file_ext}"
-            
-            # 检查数据库记录是否已存在
-            if self.db.song_exists(music_id):
-                existing_song = self.db.get_song_info(music_id)
-                if existing_song and existing_song.status == 'success':
-                    # 如果数据库记录存在且状态为成功，检查文件是否存在
-                    if Path(existing_song.file_path).exists():
-                        # 检查文件是否在当前下载目录下
-                        existing_file_path = Path(existing_song.file_path)
-                        if existing_file_path.parent == self.download_dir or (self.create_artist_dir and existing_file_path.parent.parent == self.download_dir):
-                            # 文件在当前下载目录下，直接返回
-                            return DownloadResult(
-                                success=True,
-                                file_path=existing_song.file_path,
-                                file_size=existing_song.file_size,
-                                music_info=music_info
-                            )
-                        else:
-                            # 文件不在当前下载目录下，需要重新下载到正确目录
-                            print(f"文件路径不匹配，重新下载到正确目录: {existing_song.file_path} -> {file_path}")
-                    else:
-                        # 文件不存在但数据库记录存在，清理孤儿记录
-                        self.db.update_song_status(music_id, 'failed')
-            
-            # 检查文件是否已存在（本地文件系统检查）
-            if file_path.exists():
+            target_stem = self._target_stem(music_info.name, music_info.artists)
+            file_path = target_stem.with_name(target_stem.name + file_ext)
+
+            # 曲库中已有该歌曲时直接链接，无需重新下载
+            placed = self._place_from_library(music_id, quality, target_stem, music_info)
+            if placed:
+                self._retire_replaced_file(upgrade_from, Path(placed.file_path))
+                return placed
+
+            # 检查文件是否已存在（优先查询曲库监视器的索引，升级时已有文件为较低音质，不能直接使用）
+            existing_size = indexed_file_size(str(file_path)) if upgrade_from is None else None
+            if existing_size is not None:
                 # 如果文件存在但数据库没有记录，添加数据库记录
                 song_info = {
                     'song_id': music_id,
@@ -348,7 +750,7 @@ class MusicDownloader:
                     'artists': music_info.artists,
                     'album': music_info.album,
                     'file_path': str(file_path),
-                    'file_size': file_path.stat().st_size,
+                    'file_size': existing_size,
                     'quality': quality,
                     'status': 'success'
                 }
@@ -357,40 +759,75 @@ class MusicDownloader:
                 return DownloadResult(
                     success=True,
                     file_path=str(file_path),
-                    file_size=file_path.stat().st_size,
+                    file_size=existing_size,
                     music_info=music_info
                 )
             
-            # 下载文件
-            response = requests.get(music_info.download_url, stream=True, timeout=30)
-            response.raise_for_status()
+            # 下载到临时文件，完成后原子替换正式文件（升级时不会留下不完整的文件）
+            part_path = self._part_path(file_path, independent)
             
-            # 写入文件，并在每次写入时检查任务取消状态
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    # 检查任务是否已被取消
-                    if task_id:
-                        from task_manager import task_manager, TaskStatus
-                        task_info = task_manager.get_task(task_id)
-                        if task_info and task_info.status == TaskStatus.CANCELLED:
-                            self.logger.info(f"任务 {task_id} 已被取消，停止下载音乐: {music_id}")
-                            # 删除已下载的部分文件
-                            if file_path.exists():
-                                try:
-                                    file_path.unlink()
-                                    self.logger.info(f"已删除部分下载的文件: {file_path}")
-                                except Exception as e:
-                                    self.logger.warning(f"删除部分下载文件失败: {e}")
-                            return DownloadResult(
-                                success=False,
-                                error_message='任务已被用户取消'
-                            )
-                    
-                    if chunk:
-                        f.write(chunk)
-            
-            # 写入音乐标签
-            self._write_music_tags(file_path, music_info)
+            # 下载文件，完整性校验失败时重新下载
+            for attempt in range(self.verify_retries + 1):
+                # 下载前准备标签，写入数据流时直接替换文件头部
+                rewriter = self._create_tag_rewriter(file_path, music_info)
+
+                # 等待连接名额时也检查取消令牌
+                try:
+                    response = get_http_pool('cdn').get(
+                        music_info.download_url, stream=True,
+                        should_cancel=cancel_token.is_cancelled if cancel_token else None
+                    )
+                except PoolWaitCancelled:
+                    return self._cancelled_result(music_id, cancel_token)
+                unregister_abort = self._abort_response_on_cancel(response, cancel_token)
+                read_error = None
+                try:
+                    response.raise_for_status()
+                    # 由raw直接读取时需要自行处理Content-Encoding
+                    response.raw.decode_content = True
+                    checker = self._create_integrity_checker(music_info, response.headers)
+
+                    # 写入文件，每个分块检查一次取消令牌
+                    stream_to_file(
+                        response.raw, part_path,
+                        expected_size=get_content_length(response.headers),
+                        should_cancel=cancel_token.is_cancelled if cancel_token else None,
+                        rewriter=rewriter,
+                        checker=checker,
+                        throttle=self._create_throttle(cancel_token)
+                    )
+                except TRUNCATED_READ_ERRORS as e:
+                    # 数据不完整，与校验失败一样重新下载（取消导致的中断在下面按取消处理）
+                    read_error = e
+                except Exception:
+                    # 取消回调关闭连接后读取会以网络异常结束，按取消处理
+                    if not (cancel_token and cancel_token.is_cancelled()):
+                        raise
+                finally:
+                    unregister_abort()
+                    response.close()
+
+                # 连接被中断时读取也可能以EOF结束，此时文件不完整
+                if cancel_token and cancel_token.is_cancelled():
+                    # 删除已下载的部分文件
+                    self._remove_partial_file(part_path)
+                    return self._cancelled_result(music_id, cancel_token)
+
+                integrity_error = f"读取中断: {read_error}" if read_error is not None else checker.verify()
+                if integrity_error is None:
+                    break
+                self.logger.warning(f"完整性校验失败（第{attempt + 1}次）: {music_info.name} - {integrity_error}")
+                self._remove_partial_file(part_path)
+            else:
+                return DownloadResult(
+                    success=False,
+                    error_message=f"完整性校验失败: {integrity_error}",
+                    music_info=music_info
+                )
+
+            content_md5 = self._finish_tags(part_path, music_info, file_ext, rewriter, checker)
+            os.replace(part_path, file_path)
+            self._retire_replaced_file(upgrade_from, file_path)
             
             # 保存歌词文件
             self._save_lyric_file(file_path, music_info)
@@ -398,6 +835,10 @@ class MusicDownloader:
             # 获取文件大小
             file_size = file_path.stat().st_size
             
+            # 登记到曲库，供其他歌单/歌手目录链接复用
+            if self.library:
+                self.library.adopt(file_path, music_id, quality)
+
             # 添加数据库记录
             song_info = {
                 'song_id': music_id,
@@ -407,7 +848,9 @@ class MusicDownloader:
                 'file_path': str(file_path),
                 'file_size': file_size,
                 'quality': quality,
-                'status': 'success'
+                'status': 'success',
+                'file_md5': checker.hexdigest(),
+                'content_md5': content_md5
             }
             self.db.add_song(song_info)
             
@@ -419,79 +862,115 @@ class MusicDownloader:
             )
             
         except DownloadException:
+            self._remove_partial_file(part_path)
             raise
         except requests.RequestException as e:
+            self._remove_partial_file(part_path)
             return DownloadResult(
                 success=False,
                 error_message=f"下载请求失败: {e}"
             )
         except Exception as e:
+            self._remove_partial_file(part_path)
             return DownloadResult(
                 success=False,
                 error_message=f"下载过程中发生错误: {e}"
             )
     
-    async def download_music_file_async(self, music_id: int, quality: str = "standard") -> DownloadResult:
+    async def download_music_file_async(self, music_id: int, quality: str = "standard",
+                                        cancel_token: Optional[CancellationToken] = None) -> DownloadResult:
         """异步下载音乐文件到本地
         
+        同一首歌（相同音质）正在被其他任务下载时，等待其完成后直接链接到当前目录。
+
         Args:
             music_id: 音乐ID
             quality: 音质等级
+            cancel_token: 取消令牌
             
         Returns:
             下载结果对象
         """
+        key = (music_id, quality)
+        is_leader, future = inflight_registry.claim(key)
+
+        if is_leader:
+            result = None
+            try:
+                result = await self._fetch_music_file_async(music_id, quality, cancel_token)
+                return result
+            finally:
+                inflight_registry.complete(key, future, result)
+
+        # 不能取消包装后的Future，否则会连带取消负责者的Future
+        waiter = asyncio.wrap_future(future)
+        waits = {waiter}
+        if cancel_token:
+            cancel_wait = asyncio.ensure_future(cancel_token.wait_async())
+            waits.add(cancel_wait)
+        await asyncio.wait(waits, timeout=self.inflight_wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+        if cancel_token:
+            cancel_wait.cancel()
+            if cancel_token.is_cancelled():
+                return self._cancelled_result(music_id, cancel_token)
+
+        if not waiter.done():
+            # 负责下载的任务长时间未结束，不再等待，使用独立的临时文件自行下载
+            self.logger.warning(f"等待其他任务下载超时，自行下载: {music_id} ({quality})")
+            inflight_registry.record_timeout()
+            return await self._fetch_music_file_async(music_id, quality, cancel_token, independent=True)
+
+        shared = self._reuse_inflight_result(music_id, quality, await waiter)
+        if shared:
+            return shared
+
+        inflight_registry.record_fallback()
+        return await self.download_music_file_async(music_id, quality, cancel_token=cancel_token)
+
+    async def _fetch_music_file_async(self, music_id: int, quality: str,
+                                      cancel_token: Optional[CancellationToken],
+                                      independent: bool = False) -> DownloadResult:
+        """异步下载音乐文件到本地（不经过下载去重）
+
+        Args:
+            music_id: 音乐ID
+            quality: 音质等级
+            cancel_token: 取消令牌
+            independent: 是否使用独立的临时文件（等待其他任务下载超时后自行下载时）
+
+        Returns:
+            下载结果对象
+        """
+        part_path = None
         try:
+            if cancel_token and cancel_token.is_cancelled():
+                return self._cancelled_result(music_id, cancel_token)
+
+            # 已有同等或更高音质的文件时直接使用，不请求接口
+            plan = self.db.plan_downloads([music_id], quality)
+            if music_id in plan.skip:
+                skipped = self._use_existing(music_id, plan.skip[music_id])
+                if skipped:
+                    return skipped
+            upgrade_from = plan.upgrade.get(music_id)
+
             # 获取音乐信息（同步操作）
             music_info = self.get_music_info(music_id, quality)
             
-            # 生成文件名
-            filename = f"{music_info.artists} - {music_info.name}"
-            safe_filename = self._sanitize_filename(filename)
-            
-            # 确定文件扩展名
+            # 确定文件扩展名和文件路径
             file_ext = self._determine_file_extension(music_info.download_url)
-            
-            # 根据create_artist_dir参数决定文件路径
-            if self.create_artist_dir:
-                # 提取第一个歌手名称并创建歌手目录
-                artist_names = music_info.artists.split('/')
-                primary_artist = artist_names[0] if artist_names else 'Unknown'
-                safe_artist_name = self._sanitize_filename(primary_artist)
-                
-                # 创建歌手目录
-                artist_dir = self.download_dir / safe_artist_name
-                artist_dir.mkdir(exist_ok=True, parents=True)
-                file_path = artist_dir / f"{safe_filename}{file_ext}"
-            else:
-                # 直接在基础目录中保存文件
-                file_path = self.download_dir / f"{safe_filename}{file_ext}"
-            
-            # 检查数据库记录是否已存在
-            if self.db.song_exists(music_id):
-                existing_song = self.db.get_song_info(music_id)
-                if existing_song and existing_song.status == 'success':
-                    # 如果数据库记录存在且状态为成功，检查文件是否存在
-                    if Path(existing_song.file_path).exists():
-                        # 检查文件是否在当前下载目录下
-                        existing_file_path = Path(existing_song.file_path)
-                        if existing_file_path.parent == self.download_dir or (self.create_artist_dir and existing_file_path.parent.parent == self.download_dir):
-                            # 文件在当前下载目录下，直接返回
-                            return DownloadResult(
-                                success=True,
-                                file_path=existing_song.file_path,
-                                file_size=existing_song.file_size,
-                                music_info=music_info
-                            )
-                        else:
-                            # 文件不在当前下载目录下，需要重新下载到正确目录
-                            print(f"文件路径不匹配，重新下载到正确目录: {existing_song.file_path} -> {file_path}")
-                    else:
-                        # 文件不存在但数据库记录存在，清理孤儿记录
-                        self.db.update_song_status(music_id, 'failed')
-            
-            # 检查文件是否已存在（本地文件系统检查）
-            if file_path.exists():
+            target_stem = self._target_stem(music_info.name, music_info.artists)
+            file_path = target_stem.with_name(target_stem.name + file_ext)
+
+            # 曲库中已有该歌曲时直接链接，无需重新下载
+            placed = self._place_from_library(music_id, quality, target_stem, music_info)
+            if placed:
+                self._retire_replaced_file(upgrade_from, Path(placed.file_path))
+                return placed
+
+            # 检查文件是否已存在（优先查询曲库监视器的索引，升级时已有文件为较低音质，不能直接使用）
+            existing_size = indexed_file_size(str(file_path)) if upgrade_from is None else None
+            if existing_size is not None:
                 # 如果文件存在但数据库没有记录，添加数据库记录
                 song_info = {
                     'song_id': music_id,
@@ -499,7 +978,7 @@ class MusicDownloader:
                     'artists': music_info.artists,
                     'album': music_info.album,
                     'file_path': str(file_path),
-                    'file_size': file_path.stat().st_size,
+                    'file_size': existing_size,
                     'quality': quality,
                     'status': 'success'
                 }
@@ -508,21 +987,69 @@ class MusicDownloader:
                 return DownloadResult(
                     success=True,
                     file_path=str(file_path),
-                    file_size=file_path.stat().st_size,
+                    file_size=existing_size,
                     music_info=music_info
                 )
             
-            # 异步下载文件
-            async with aiohttp.ClientSession() as session:
+            # 下载到临时文件，完成后原子替换正式文件（升级时不会留下不完整的文件）
+            part_path = self._part_path(file_path, independent)
+
+            # 异步下载文件（复用长连接会话），完整性校验失败时重新下载
+            session = self._get_async_session()
+            for attempt in range(self.verify_retries + 1):
+                # 下载前准备标签，写入数据流时直接替换文件头部
+                rewriter = self._create_tag_rewriter(file_path, music_info)
+
                 async with session.get(music_info.download_url) as response:
                     response.raise_for_status()
-                    
-                    async with aiofiles.open(file_path, 'wb') as f:
-                        async for chunk in response.content.iter_chunked(8192):
-                            await f.write(chunk)
+                    checker = self._create_integrity_checker(music_info, response.headers)
+
+                    fetch = asyncio.ensure_future(stream_to_file_async(
+                        response.content, part_path,
+                        expected_size=get_content_length(response.headers),
+                        should_cancel=cancel_token.is_cancelled if cancel_token else None,
+                        rewriter=rewriter,
+                        checker=checker,
+                        throttle=self._create_async_throttle(cancel_token)
+                    ))
+                    # 取消时直接取消读取协程，不必等待下一个分块
+                    unregister_abort = lambda: None
+                    if cancel_token:
+                        loop = asyncio.get_running_loop()
+                        unregister_abort = cancel_token.register(
+                            lambda: loop.call_soon_threadsafe(fetch.cancel)
+                        )
+                    read_error = None
+                    try:
+                        await fetch
+                    except (asyncio.CancelledError, FetchCancelled):
+                        if not (cancel_token and cancel_token.is_cancelled()):
+                            raise
+                        self._remove_partial_file(part_path)
+                        return self._cancelled_result(music_id, cancel_token)
+                    except ASYNC_TRUNCATED_READ_ERRORS as e:
+                        # 数据不完整，与校验失败一样重新下载
+                        read_error = e
+                    finally:
+                        unregister_abort()
+
+                integrity_error = f"读取中断: {read_error}" if read_error is not None else checker.verify()
+                if integrity_error is None:
+                    break
+                self.logger.warning(f"完整性校验失败（第{attempt + 1}次）: {music_info.name} - {integrity_error}")
+                self._remove_partial_file(part_path)
+            else:
+                return DownloadResult(
+                    success=False,
+                    error_message=f"完整性校验失败: {integrity_error}",
+                    music_info=music_info
+                )
             
-            # 写入音乐标签
-            self._write_music_tags(file_path, music_info)
+            content_md5 = await asyncio.get_running_loop().run_in_executor(
+                None, self._finish_tags, part_path, music_info, file_ext, rewriter, checker
+            )
+            os.replace(part_path, file_path)
+            self._retire_replaced_file(upgrade_from, file_path)
             
             # 保存歌词文件
             self._save_lyric_file(file_path, music_info)
@@ -530,6 +1057,10 @@ class MusicDownloader:
             # 获取文件大小
             file_size = file_path.stat().st_size
             
+            # 登记到曲库，供其他歌单/歌手目录链接复用
+            if self.library:
+                self.library.adopt(file_path, music_id, quality)
+
             # 添加数据库记录
             song_info = {
                 'song_id': music_id,
@@ -539,7 +1070,9 @@ class MusicDownloader:
                 'file_path': str(file_path),
                 'file_size': file_size,
                 'quality': quality,
-                'status': 'success'
+                'status': 'success',
+                'file_md5': checker.hexdigest(),
+                'content_md5': content_md5
             }
             self.db.add_song(song_info)
             
@@ -551,13 +1084,16 @@ class MusicDownloader:
             )
             
         except DownloadException:
+            self._remove_partial_file(part_path)
             raise
         except aiohttp.ClientError as e:
+            self._remove_partial_file(part_path)
             return DownloadResult(
                 success=False,
                 error_message=f"异步下载请求失败: {e}"
             )
         except Exception as e:
+            self._remove_partial_file(part_path)
             return DownloadResult(
                 success=False,
                 error_message=f"异步下载过程中发生错误: {e}"
@@ -581,7 +1117,7 @@ class MusicDownloader:
             music_info = self.get_music_info(music_id, quality)
             
             # 下载到内存
-            response = requests.get(music_info.download_url, timeout=30)
+            response = get_http_pool('cdn').get(music_info.download_url)
             response.raise_for_status()
             
             # 创建BytesIO对象
@@ -599,6 +1135,8 @@ class MusicDownloader:
     async def download_batch_async(self, music_ids: List[int], quality: str = "standard") -> List[DownloadResult]:
         """批量异步下载音乐
         
+        所有下载共用同一个长连接会话，调用方不再使用该下载器时应调用close()。
+
         Args:
             music_ids: 音乐ID列表
             quality: 音质等级
@@ -628,15 +1166,132 @@ class MusicDownloader:
         
         return processed_results
     
-    def _write_music_tags(self, file_path: Path, music_info: MusicInfo) -> None:
+    def _get_async_session(self) -> aiohttp.ClientSession:
+        """获取异步下载会话
+
+        会话在多次下载之间复用，连接池保持与CDN的长连接，避免每首歌重新进行
+        DNS解析和TLS握手。aiohttp会话绑定事件循环，在其他事件循环中使用时重新创建。
+
+        Returns:
+            aiohttp客户端会话
+        """
+        loop = asyncio.get_running_loop()
+        if (self._async_session is None or self._async_session.closed
+                or self._async_session_loop is not loop):
+            session_config = self.async_session_config
+            connector = aiohttp.TCPConnector(
+                limit=session_config.get('limit', 32),
+                # 单主机并发默认与同步下载使用的cdn连接池一致
+                limit_per_host=session_config.get('limit_per_host', get_pool_config('cdn')['per_host_limit']),
+                ttl_dns_cache=session_config.get('dns_cache_ttl', 300),
+                keepalive_timeout=session_config.get('keepalive_timeout', 60),
+                enable_cleanup_closed=True
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=session_config.get('connect_timeout', 10),
+                sock_read=session_config.get('read_timeout', 30)
+            )
+            self._async_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self._async_session_loop = loop
+        return self._async_session
+
+    async def close(self) -> None:
+        """关闭异步下载会话，释放连接池"""
+        session, self._async_session = self._async_session, None
+        self._async_session_loop = None
+        if session is not None and not session.closed:
+            await session.close()
+
+    def _create_integrity_checker(self, music_info: MusicInfo, headers) -> IntegrityChecker:
+        """创建下载时使用的完整性校验器
+
+        Args:
+            music_info: 音乐信息（包含接口返回的size和md5）
+            headers: HTTP响应头
+
+        Returns:
+            完整性校验器
+        """
+        # 经过Content-Encoding压缩的响应，Content-Length不是解码后的长度
+        content_length = 0 if headers.get('Content-Encoding') else get_content_length(headers)
+        return IntegrityChecker(music_info.file_size, music_info.md5, content_length)
+
+    def _create_throttle(self, cancel_token: Optional[CancellationToken]):
+        """创建同步写入循环使用的限速回调，同一任务的所有下载共享该任务的带宽配额
+
+        Args:
+            cancel_token: 取消令牌（其任务ID作为带宽调度的任务键）
+
+        Returns:
+            限速回调，参数为本次读取的字节数，返回下一次读取的建议上限
+        """
+        scheduler = get_bandwidth_scheduler()
+        task_id = cancel_token.task_id if cancel_token else None
+        should_cancel = cancel_token.is_cancelled if cancel_token else None
+        return lambda nbytes: scheduler.throttle(nbytes, task_id, should_cancel)
+
+    def _create_async_throttle(self, cancel_token: Optional[CancellationToken]):
+        """创建异步写入循环使用的限速回调
+
+        Args:
+            cancel_token: 取消令牌（其任务ID作为带宽调度的任务键）
+
+        Returns:
+            异步限速回调，参数为本次读取的字节数，返回下一次读取的建议上限
+        """
+        scheduler = get_bandwidth_scheduler()
+        task_id = cancel_token.task_id if cancel_token else None
+        should_cancel = cancel_token.is_cancelled if cancel_token else None
+        return lambda nbytes: scheduler.throttle_async(nbytes, task_id, should_cancel)
+
+    def _create_tag_rewriter(self, file_path: Path, music_info: MusicInfo) -> Optional[StreamTagRewriter]:
+        """创建下载时使用的标签改写器
+
+        Args:
+            file_path: 音乐文件路径
+            music_info: 音乐信息
+
+        Returns:
+            标签改写器，未启用或格式不支持时返回None
+        """
+        if not self.stream_tagging or not supports_stream_tagging(file_path.suffix):
+            return None
+
+        try:
+            # 封面下载失败不影响主流程
+            cover_data = self.cover_cache.get(music_info.pic_url)
+            return create_tag_rewriter(file_path.suffix, music_info, cover_data)
+        except Exception as e:
+            self.logger.warning(f"创建标签改写器失败，将在下载后写入标签: {e}")
+            return None
+
+    def _finish_tags(self, part_path: Path, music_info: MusicInfo, file_ext: str, rewriter,
+                     checker: IntegrityChecker) -> str:
+        """为下载完成的临时文件补写标签，返回文件内容的MD5（定期校验的基准）
+
+        下载时已写入标签的直接使用写入时累计的MD5；未能在下载时写入标签的格式，
+        写入标签后重新读取一次文件计算MD5，读取失败时返回空字符串（由首次定期校验记录基准）。
+        """
+        if rewriter and rewriter.applied:
+            return checker.content_hexdigest()
+        self._write_music_tags(part_path, music_info, file_ext)
+        try:
+            return hash_file(str(part_path))
+        except OSError as e:
+            self.logger.warning(f"计算文件MD5失败: {part_path} - {e}")
+            return ''
+
+    def _write_music_tags(self, file_path: Path, music_info: MusicInfo, file_ext: Optional[str] = None) -> None:
         """写入音乐标签信息
         
         Args:
             file_path: 音乐文件路径
             music_info: 音乐信息
+            file_ext: 文件格式扩展名，为None时取文件路径的扩展名（写入临时文件时需显式传入）
         """
         try:
-            file_ext = file_path.suffix.lower()
+            file_ext = (file_ext or file_path.suffix).lower()
             
             if file_ext == '.mp3':
                 self._write_mp3_tags(file_path, music_info)
@@ -661,20 +1316,20 @@ class MusicDownloader:
             if music_info.track_number > 0:
                 audio.tags.add(TRCK(encoding=3, text=str(music_info.track_number)))
             
-            # 下载并添加封面
-            if music_info.pic_url:
-                try:
-                    pic_response = requests.get(music_info.pic_url, timeout=10)
-                    pic_response.raise_for_status()
-                    audio.tags.add(APIC(
-                        encoding=3,
-                        mime='image/jpeg',
-                        type=3,
-                        desc='Cover',
-                        data=pic_response.content
-                    ))
-                except:
-                    pass  # 封面下载失败不影响主流程
+            # 歌曲ID和音质，用于从文件重建下载记录
+            audio.tags.add(TXXX(encoding=3, desc=SONG_ID_TAG, text=str(music_info.id)))
+            audio.tags.add(TXXX(encoding=3, desc=QUALITY_TAG, text=music_info.quality))
+
+            # 添加封面（封面下载失败不影响主流程）
+            cover_data = self.cover_cache.get(music_info.pic_url)
+            if cover_data:
+                audio.tags.add(APIC(
+                    encoding=3,
+                    mime=guess_image_mime(cover_data),
+                    type=3,
+                    desc='Cover',
+                    data=cover_data
+                ))
             
             audio.save()
         except Exception as e:
@@ -692,21 +1347,20 @@ class MusicDownloader:
             if music_info.track_number > 0:
                 audio['TRACKNUMBER'] = str(music_info.track_number)
             
-            # 下载并添加封面
-            if music_info.pic_url:
-                try:
-                    pic_response = requests.get(music_info.pic_url, timeout=10)
-                    pic_response.raise_for_status()
-                    
-                    from mutagen.flac import Picture
-                    picture = Picture()
-                    picture.type = 3  # Cover (front)
-                    picture.mime = 'image/jpeg'
-                    picture.desc = 'Cover'
-                    picture.data = pic_response.content
-                    audio.add_picture(picture)
-                except:
-                    pass  # 封面下载失败不影响主流程
+            # 歌曲ID和音质，用于从文件重建下载记录
+            audio[SONG_ID_TAG] = str(music_info.id)
+            audio[QUALITY_TAG] = music_info.quality
+
+            # 添加封面（封面下载失败不影响主流程）
+            cover_data = self.cover_cache.get(music_info.pic_url)
+            if cover_data:
+                from mutagen.flac import Picture
+                picture = Picture()
+                picture.type = 3  # Cover (front)
+                picture.mime = guess_image_mime(cover_data)
+                picture.desc = 'Cover'
+                picture.data = cover_data
+                audio.add_picture(picture)
             
             audio.save()
         except Exception as e:
@@ -724,14 +1378,15 @@ class MusicDownloader:
             if music_info.track_number > 0:
                 audio['trkn'] = [(music_info.track_number, 0)]
             
-            # 下载并添加封面
-            if music_info.pic_url:
-                try:
-                    pic_response = requests.get(music_info.pic_url, timeout=10)
-                    pic_response.raise_for_status()
-                    audio['covr'] = [pic_response.content]
-                except:
-                    pass  # 封面下载失败不影响主流程
+            # 歌曲ID和音质，用于从文件重建下载记录
+            audio[f'----:{MP4_TAG_NAMESPACE}:{SONG_ID_TAG}'] = [MP4FreeForm(str(music_info.id).encode())]
+            audio[f'----:{MP4_TAG_NAMESPACE}:{QUALITY_TAG}'] = [MP4FreeForm(music_info.quality.encode())]
+
+            # 添加封面（封面下载失败不影响主流程）
+            cover_data = self.cover_cache.get(music_info.pic_url)
+            if cover_data:
+                image_format = MP4Cover.FORMAT_PNG if guess_image_mime(cover_data) == 'image/png' else MP4Cover.FORMAT_JPEG
+                audio['covr'] = [MP4Cover(cover_data, imageformat=image_format)]
             
             audio.save()
         except Exception as e:
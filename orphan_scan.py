@@ -0,0 +1,175 @@
+"""孤立记录扫描模块
+
+找出文件已不存在的下载记录和存放位置记录并删除：
+- 按文件路径顺序分批读取记录，同一目录的文件相邻，每个目录只用一次os.scandir列出文件名
+- 目录列表在线程池中并行获取，NAS等高延迟文件系统上不必逐个文件等待stat
+- 每批的删除在一个事务中完成，扫描期间不长时间占用数据库
+- 每批处理完保存扫描位置，任务取消或中断后可从该位置继续
+"""
+
+import logging
+import os
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from cancellation import CancellationToken
+from download_db import DownloadDatabase, PATH_TABLES
+
+
+logger = logging.getLogger('orphan_scan')
+
+# 并行列出目录的线程数
+SCAN_WORKERS = 8
+
+# 每批读取的记录数
+SCAN_CHUNK_SIZE = 2000
+
+# 缓存最近列出的目录数（子目录中的文件可能把同一目录的文件分到不同批次）
+DIR_CACHE_SIZE = 256
+
+# 保存扫描位置时使用的名称前缀
+SCAN_STATE_PREFIX = 'orphans:'
+
+
+def _scan_config() -> Dict[str, Any]:
+    """读取扫描配置"""
+    try:
+        from main import config
+        return config.library_scan_config
+    except ImportError:
+        return {}
+
+
+def list_dir(directory: str) -> Optional[Set[str]]:
+    """列出目录中存在的文件名
+
+    Args:
+        directory: 目录路径
+
+    Returns:
+        文件名集合（不含指向不存在目标的符号链接），目录不存在时为空集合；
+        无法读取（权限、网络文件系统错误等）时返回None，该目录下的记录不作处理
+    """
+    try:
+        with os.scandir(directory or '.') as entries:
+            return {
+                entry.name for entry in entries
+                if not entry.is_symlink() or os.path.exists(entry.path)
+            }
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
+    except OSError as e:
+        logger.warning(f"无法读取目录 {directory}: {e}")
+        return None
+
+
+class OrphanScanner:
+    """孤立记录扫描类"""
+
+    def __init__(self, db: DownloadDatabase, workers: Optional[int] = None, chunk_size: Optional[int] = None):
+        """
+        初始化扫描
+
+        Args:
+            db: 下载数据库实例
+            workers: 并行列出目录的线程数，为None时使用配置
+            chunk_size: 每批读取的记录数，为None时使用配置
+        """
+        scan_config = _scan_config()
+        self.db = db
+        self.workers = workers or scan_config.get('workers', SCAN_WORKERS)
+        self.chunk_size = chunk_size or scan_config.get('chunk_size', SCAN_CHUNK_SIZE)
+        self._dir_cache: 'OrderedDict[str, Optional[Set[str]]]' = OrderedDict()
+
+    def _find_missing(self, file_paths: List[str], executor: ThreadPoolExecutor) -> List[str]:
+        """找出一批路径中文件已不存在的路径"""
+        by_dir: Dict[str, List[str]] = defaultdict(list)
+        for file_path in file_paths:
+            by_dir[os.path.dirname(file_path)].append(file_path)
+
+        uncached = [directory for directory in by_dir if directory not in self._dir_cache]
+        for directory, names in zip(uncached, executor.map(list_dir, uncached)):
+            self._dir_cache[directory] = names
+        while len(self._dir_cache) > max(DIR_CACHE_SIZE, len(by_dir)):
+            self._dir_cache.popitem(last=False)
+
+        candidates = []
+        for directory, paths in by_dir.items():
+            names = self._dir_cache[directory]
+            if names is None:
+                continue
+            candidates.extend(path for path in paths if os.path.basename(path) not in names)
+
+        # 目录列表可能是之前批次缓存的，扫描期间新下载到该目录的文件不在其中，删除前逐个确认
+        exists = executor.map(os.path.exists, candidates)
+        return [path for path, found in zip(candidates, exists) if not found]
+
+    def run(self, cancel_token: Optional[CancellationToken] = None,
+            progress_callback: Optional[Callable[[int, int], None]] = None,
+            resume: bool = True) -> Dict[str, Any]:
+        """扫描并删除孤立记录
+
+        Args:
+            cancel_token: 取消令牌，取消后处理完当前批次即停止并保存位置
+            progress_callback: 进度回调，参数为 (已处理记录数, 总记录数)
+            resume: 是否从上次中断的位置继续，否则从头扫描
+
+        Returns:
+            扫描结果：各表删除的记录数、处理的记录数、无法读取的目录数、是否被取消
+        """
+        positions = {
+            table: self.db.get_scan_position(SCAN_STATE_PREFIX + table) if resume else ''
+            for table in PATH_TABLES
+        }
+        total = sum(self.db.count_file_paths(table) for table in PATH_TABLES)
+        processed = sum(
+            self.db.count_file_paths(table, position) for table, position in positions.items() if position
+        )
+        deleted = {table: 0 for table in PATH_TABLES}
+        unreadable: Set[str] = set()
+        cancelled = False
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='orphan-scan') as executor:
+            for table in PATH_TABLES:
+                state_name = SCAN_STATE_PREFIX + table
+                position = positions[table]
+                self._dir_cache.clear()
+                while True:
+                    if cancel_token is not None and cancel_token.is_cancelled():
+                        cancel_token.mark_observed()
+                        cancelled = True
+                        break
+
+                    file_paths = self.db.get_file_paths_after(table, position, self.chunk_size)
+                    if not file_paths:
+                        break
+
+                    missing = self._find_missing(file_paths, executor)
+                    deleted[table] += self.db.delete_by_file_paths(table, missing)
+                    unreadable.update(
+                        directory for directory, names in self._dir_cache.items() if names is None
+                    )
+
+                    position = file_paths[-1]
+                    self.db.set_scan_position(state_name, position)
+                    processed += len(file_paths)
+                    if progress_callback:
+                        progress_callback(min(processed, total), total)
+
+                if cancelled:
+                    break
+                # 整张表扫描完成，下次从头开始
+                self.db.set_scan_position(state_name, '')
+
+        result = {
+            'deleted_songs': deleted['downloaded_songs'],
+            'deleted_locations': deleted['song_locations'],
+            # 扫描期间新增的记录也会被处理，已处理数不超过开始时统计的总数
+            'processed': min(processed, total),
+            'total': total,
+            'unreadable_dirs': len(unreadable),
+            'cancelled': cancelled
+        }
+        logger.info(f"孤立记录扫描{'已取消' if cancelled else '完成'}: {result}")
+        return result
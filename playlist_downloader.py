@@ -21,7 +21,10 @@ try:
     from music_api import NeteaseAPI, APIException, playlist_detail, lyric_v1
     from cookie_manager import CookieManager, CookieException
     from music_downloader import MusicDownloader, DownloadException, DownloadResult
-    from download_db import DownloadDatabase
+    from download_db import DownloadDatabase, DownloadPlan
+    from library_watcher import path_exists
+    from cancellation import CancellationToken
+    from scheduling import order_songs, schedule_songs
 except ImportError as e:
     print(f"导入模块失败: {e}")
     print("请确保所有依赖模块存在且可用")
@@ -37,6 +40,7 @@ class PlaylistDownloadConfig:
     include_lyric: bool = True
     max_concurrent: int = None
     selected_songs: list = None  # 选中的歌曲ID列表
+    schedule_policy: str = None  # 下载顺序: list, smallest_first, largest_first
     
     def __post_init__(self):
         """初始化后处理，从配置文件读取默认值"""
@@ -62,6 +66,8 @@ class PlaylistDownloadConfig:
                 self.include_lyric = config.playlist_download_config.get('include_lyric', True)
             if self.selected_songs is None:
                 self.selected_songs = []  # 默认空列表
+            if self.schedule_policy is None:
+                self.schedule_policy = config.playlist_download_config.get('schedule_policy', 'list')
         except ImportError:
             # 如果无法导入config，使用默认值
             if self.quality is None:
@@ -72,6 +78,8 @@ class PlaylistDownloadConfig:
                 self.max_concurrent = 3
             if self.selected_songs is None:
                 self.selected_songs = []  # 默认空列表
+            if self.schedule_policy is None:
+                self.schedule_policy = "list"
 
 
 @dataclass
@@ -160,6 +168,73 @@ class PlaylistDownloader:
             self.logger.warning(f"获取Cookie失败: {e}")
             return {}
     
+    def _plan_songs(self, songs: List[Dict[str, Any]]) -> DownloadPlan:
+        """一次查询数据库，将歌曲分为跳过、升级和下载三组
+
+        Args:
+            songs: 歌曲列表
+
+        Returns:
+            下载规划
+        """
+        plan = self.db.plan_downloads(
+            [song['id'] for song in songs], self.config.quality, include_locations=True
+        )
+        if plan.skip or plan.upgrade:
+            self.logger.info(
+                f"下载规划: 跳过 {len(plan.skip)} 首，升级音质 {len(plan.upgrade)} 首，下载 {len(plan.download)} 首"
+            )
+        return plan
+
+    def _schedule_songs(self, songs: List[Dict[str, Any]], plan: Optional[DownloadPlan] = None) -> List[Dict[str, Any]]:
+        """预检待下载歌曲的可用性，并按配置的调度策略排列
+
+        预检结果写入歌曲信息：quality为选出的音质，为None表示不可用（unavailable_reason为原因）。
+        规划为跳过的歌曲不参与预检。
+
+        Args:
+            songs: 歌曲列表
+            plan: 下载规划，为None时重新生成
+
+        Returns:
+            排列后的歌曲列表
+        """
+        if plan is None:
+            plan = self._plan_songs(songs)
+        pending_ids = plan.download + list(plan.upgrade)
+
+        probe_results = self.downloader.probe_availability(pending_ids, self.config.quality)
+        sizes = {}
+        for song in songs:
+            result = probe_results.get(song['id'])
+            if result is None:
+                continue
+            song['quality'] = result.quality
+            if result.available:
+                sizes[song['id']] = int(result.song_data.get('size') or 0)
+            else:
+                song['unavailable_reason'] = result.reason
+
+        if probe_results:
+            unavailable = sum(1 for result in probe_results.values() if not result.available)
+            downgraded = sum(
+                1 for result in probe_results.values()
+                if result.available and result.quality != self.config.quality
+            )
+            self.logger.info(f"可用性预检完成: {len(probe_results)} 首，不可用 {unavailable} 首，降级 {downgraded} 首")
+
+        policy = self.config.schedule_policy
+        if policy == 'list':
+            return songs
+
+        # 预检已获得文件大小时直接排序，否则单独批量解析
+        if probe_results:
+            ordered = order_songs(songs, policy, sizes)
+        else:
+            ordered = schedule_songs(self.api, songs, policy, self.config.quality, self._get_cookies())
+        self.logger.info(f"按调度策略 {policy} 排列 {len(ordered)} 首歌曲")
+        return ordered
+
     def _format_file_size(self, size_bytes: int) -> str:
         """格式化文件大小"""
         for unit in ['B', 'KB', 'MB', 'GB']:
@@ -292,12 +367,16 @@ class PlaylistDownloader:
             self.logger.error(f"详细错误信息: {traceback.format_exc()}")
             return []
     
-    def download_song(self, song: Dict[str, Any], task_id: str = None) -> SongDownloadResult:
+    def download_song(self, song: Dict[str, Any], task_id: str = None,
+                      cancel_token: Optional[CancellationToken] = None,
+                      plan: Optional[DownloadPlan] = None) -> SongDownloadResult:
         """下载单首歌曲
         
         Args:
             song: 歌曲信息
-            task_id: 任务ID（用于取消检查）
+            task_id: 任务ID（未传入cancel_token时用于获取取消令牌）
+            cancel_token: 取消令牌
+            plan: 批量任务的下载规划，歌曲按任务音质下载时复用，避免逐首查询数据库
         """
         try:
             song_id = song['id']
@@ -308,22 +387,38 @@ class PlaylistDownloader:
             self.logger.info(f"开始下载: {song_name} - {artists}")
             
             # 检查任务是否已被取消
-            if task_id:
-                from task_manager import task_manager, TaskStatus
-                task_info = task_manager.get_task(task_id)
-                if task_info and task_info.status == TaskStatus.CANCELLED:
-                    self.logger.info(f"任务 {task_id} 已被取消，停止下载歌曲: {song_name}")
-                    return SongDownloadResult(
-                        song_id=song_id,
-                        name=song_name,
-                        artists=artists,
-                        album=album,
-                        status='cancelled',
-                        error_message='任务已被用户取消'
-                    )
+            if cancel_token is None and task_id:
+                from task_manager import task_manager
+                cancel_token = task_manager.get_cancel_token(task_id)
+            if cancel_token and cancel_token.is_cancelled():
+                cancel_token.mark_observed()
+                self.logger.info(f"任务 {cancel_token.task_id} 已被取消，停止下载歌曲: {song_name}")
+                return SongDownloadResult(
+                    song_id=song_id,
+                    name=song_name,
+                    artists=artists,
+                    album=album,
+                    status='cancelled',
+                    error_message='任务已被用户取消'
+                )
             
-            # 下载歌曲文件
-            download_result = self.downloader.download_music_file(song_id, self.config.quality, task_id=task_id)
+            # 预检确认不可用的歌曲不再请求接口
+            if 'quality' in song and song['quality'] is None:
+                return SongDownloadResult(
+                    song_id=song_id,
+                    name=song_name,
+                    artists=artists,
+                    album=album,
+                    status='failed',
+                    error_message=f"歌曲不可用: {song.get('unavailable_reason') or '预检不可用'}"
+                )
+
+            # 下载歌曲文件（使用预检选出的音质）
+            quality = song.get('quality') or self.config.quality
+            download_result = self.downloader.download_music_file(
+                song_id, quality, cancel_token=cancel_token,
+                plan=plan if quality == self.config.quality else None
+            )
             
             if download_result.success:
                 # 获取歌词信息（从download_result中获取，避免重复API调用）
@@ -352,7 +447,7 @@ class PlaylistDownloader:
                     name=song_name,
                     artists=artists,
                     album=album,
-                    status='failed',
+                    status='cancelled' if cancel_token and cancel_token.is_cancelled() else 'failed',
                     error_message=download_result.error_message
                 )
                 
@@ -367,14 +462,40 @@ class PlaylistDownloader:
                 error_message=str(e)
             )
     
-    def download_playlist_songs(self, task_id: str = None) -> Dict[str, Any]:
+    def _find_location_in_dir(self, song_id: int, db_song, directory: Path,
+                              locations: Optional[List[Dict[str, Any]]] = None) -> Optional[str]:
+        """查找歌曲在指定目录下的已有文件
+
+        Args:
+            song_id: 歌曲ID
+            db_song: 数据库中的下载记录
+            directory: 目录
+            locations: 已批量查询的存放位置，为None时单独查询
+
+        Returns:
+            已存在的文件路径，不存在时返回None
+        """
+        if locations is None:
+            locations = self.db.get_song_locations(song_id)
+        candidates = [db_song.file_path] + [location['file_path'] for location in locations]
+        for file_path in candidates:
+            path = Path(file_path)
+            if path.parent == directory and path_exists(file_path):
+                return file_path
+        return None
+
+    def download_playlist_songs(self, task_id: str = None,
+                                cancel_token: Optional[CancellationToken] = None) -> Dict[str, Any]:
         """批量下载歌单中的歌曲
         
         Args:
             task_id: 任务ID，用于进度更新
+            cancel_token: 取消令牌
         """
         # 导入任务管理器
         from task_manager import task_manager
+        if cancel_token is None and task_id:
+            cancel_token = task_manager.get_cancel_token(task_id)
         
         # 获取歌单歌曲
         playlist_songs = self.get_playlist_songs()
@@ -385,6 +506,10 @@ class PlaylistDownloader:
                 'error': f"无法获取歌单 {self.config.playlist_id} 的歌曲"
             }
         
+        # 按调度策略决定下载顺序（例如小文件优先）
+        plan = self._plan_songs(playlist_songs)
+        playlist_songs = self._schedule_songs(playlist_songs, plan)
+
         # 批量下载
         download_results = []
         total_count = len(playlist_songs)
@@ -396,6 +521,11 @@ class PlaylistDownloader:
         start_time = time.time()
         
         for i, song in enumerate(playlist_songs, 1):
+            if cancel_token and cancel_token.is_cancelled():
+                cancel_token.mark_observed()
+                self.logger.info(f"任务已被取消，停止批量下载，已处理 {i - 1}/{total_count}")
+                break
+
             self.logger.info(f"进度: {i}/{total_count}")
             
             # 更新任务进度
@@ -409,58 +539,61 @@ class PlaylistDownloader:
             artists = song['artists']
             album = song.get('album', '未知专辑')
             
-            # 使用数据库检查歌曲是否已下载
-            if self.db.song_exists(song_id):
-                # 从数据库获取歌曲信息
-                db_song = self.db.get_song_info(song_id)
-                if db_song and db_song.status == 'success':
-                    # 检查文件是否在正确的歌单目录下
-                    db_file_path = Path(db_song.file_path)
-                    expected_dir = self.download_path
-                    
-                    # 如果文件不在当前歌单目录下，重新下载到正确目录
-                    if db_file_path.parent != expected_dir:
-                        self.logger.info(f"文件不在歌单目录下，重新下载: {song_name}")
-                        # 继续正常下载流程
-                    else:
-                        skipped_count += 1
-                        self.logger.info(f"⏭️  跳过已下载: {song_name} - 数据库记录存在")
-                        
-                        # 创建跳过结果
+            # 按下载规划检查是否已有同等或更高音质的文件
+            result = None
+            db_song = plan.skip.get(song_id)
+            if db_song:
+                # 检查文件是否在正确的歌单目录下
+                existing_path = self._find_location_in_dir(
+                    song_id, db_song, self.download_path, plan.locations.get(song_id, [])
+                )
+
+                # 如果文件不在当前歌单目录下，从曲库链接到歌单目录，避免重新下载
+                if existing_path is None:
+                    self.logger.info(f"文件不在歌单目录下，从曲库放置: {song_name}")
+                    placed = self.downloader.place_from_library(
+                        song_id, db_song.quality, song_name, artists, album
+                    )
+                    if placed:
                         result = SongDownloadResult(
                             song_id=song_id,
                             name=song_name,
                             artists=artists,
                             album=album,
-                            status='skipped',
-                            file_path=db_song.file_path,
-                            file_size=db_song.file_size
+                            status='success',
+                            file_path=placed.file_path,
+                            file_size=placed.file_size
                         )
-                        download_results.append(result)
-                        continue
-            
+                    # 曲库中没有可用文件时继续正常下载流程
+                else:
+                    skipped_count += 1
+                    self.logger.info(f"⏭️  跳过已下载: {song_name} - 数据库记录存在")
+
+                    # 创建跳过结果
+                    result = SongDownloadResult(
+                        song_id=song_id,
+                        name=song_name,
+                        artists=artists,
+                        album=album,
+                        status='skipped',
+                        file_path=existing_path,
+                        file_size=db_song.file_size
+                    )
+                    download_results.append(result)
+                    continue
+
             # 歌曲未下载或下载失败，正常下载
-            result = self.download_song(song, task_id=task_id)
+            if result is None:
+                result = self.download_song(song, task_id=task_id, cancel_token=cancel_token, plan=plan)
             download_results.append(result)
             
             # 记录下载结果到数据库
             if result.status == 'success':
                 success_count += 1
+                # 下载器已按文件的实际音质记录到数据库（包括从曲库放置的已有文件），这里不再重复写入，
+                # 否则请求的音质会覆盖已有的更高音质
                 self.logger.info(f"✅ 下载成功: {result.name}")
                 
-                # 记录成功下载到数据库
-                song_info = {
-                    'song_id': song_id,
-                    'song_name': song_name,
-                    'artists': artists,
-                    'album': album,
-                    'file_path': result.file_path,
-                    'file_size': result.file_size,
-                    'quality': self.config.quality,
-                    'status': 'success'
-                }
-                self.db.add_song(song_info)
-                
             elif result.status == 'failed':
                 failed_count += 1
                 self.logger.error(f"❌ 下载失败: {result.name} - {result.error_message}")
@@ -521,15 +654,19 @@ class PlaylistDownloader:
         
         return result_data
 
-    def download_selected_songs(self, selected_song_ids: List[int], task_id: str = None) -> Dict[str, Any]:
+    def download_selected_songs(self, selected_song_ids: List[int], task_id: str = None,
+                                cancel_token: Optional[CancellationToken] = None) -> Dict[str, Any]:
         """下载选中的歌曲
         
         Args:
             selected_song_ids: 选中的歌曲ID列表
             task_id: 任务ID，用于进度更新
+            cancel_token: 取消令牌
         """
         # 导入任务管理器
         from task_manager import task_manager
+        if cancel_token is None and task_id:
+            cancel_token = task_manager.get_cancel_token(task_id)
         
         # 获取歌单中的所有歌曲
         playlist_songs = self.get_playlist_songs()
@@ -552,6 +689,10 @@ class PlaylistDownloader:
                 'error': f"未找到选中的歌曲，请检查歌曲ID是否正确"
             }
         
+        # 按调度策略决定下载顺序（例如小文件优先）
+        plan = self._plan_songs(selected_songs)
+        selected_songs = self._schedule_songs(selected_songs, plan)
+
         # 批量下载选中的歌曲
         download_results = []
         total_count = len(selected_songs)
@@ -563,6 +704,11 @@ class PlaylistDownloader:
         start_time = time.time()
         
         for i, song in enumerate(selected_songs, 1):
+            if cancel_token and cancel_token.is_cancelled():
+                cancel_token.mark_observed()
+                self.logger.info(f"任务已被取消，停止批量下载，已处理 {i - 1}/{total_count}")
+                break
+
             self.logger.info(f"进度: {i}/{total_count}")
             
             # 更新任务进度
@@ -576,58 +722,61 @@ class PlaylistDownloader:
             artists = song['artists']
             album = song.get('album', '未知专辑')
             
-            # 使用数据库检查歌曲是否已下载
-            if self.db.song_exists(song_id):
-                # 从数据库获取歌曲信息
-                db_song = self.db.get_song_info(song_id)
-                if db_song and db_song.status == 'success':
-                    # 检查文件是否在正确的歌单目录下
-                    db_file_path = Path(db_song.file_path)
-                    expected_dir = self.download_path
-                    
-                    # 如果文件不在当前歌单目录下，重新下载到正确目录
-                    if db_file_path.parent != expected_dir:
-                        self.logger.info(f"文件不在歌单目录下，重新下载: {song_name}")
-                        # 继续正常下载流程
-                    else:
-                        skipped_count += 1
-                        self.logger.info(f"⏭️  跳过已下载: {song_name} - 数据库记录存在")
-                        
-                        # 创建跳过结果
+            # 按下载规划检查是否已有同等或更高音质的文件
+            result = None
+            db_song = plan.skip.get(song_id)
+            if db_song:
+                # 检查文件是否在正确的歌单目录下
+                existing_path = self._find_location_in_dir(
+                    song_id, db_song, self.download_path, plan.locations.get(song_id, [])
+                )
+
+                # 如果文件不在当前歌单目录下，从曲库链接到歌单目录，避免重新下载
+                if existing_path is None:
+                    self.logger.info(f"文件不在歌单目录下，从曲库放置: {song_name}")
+                    placed = self.downloader.place_from_library(
+                        song_id, db_song.quality, song_name, artists, album
+                    )
+                    if placed:
                         result = SongDownloadResult(
                             song_id=song_id,
                             name=song_name,
                             artists=artists,
                             album=album,
-                            status='skipped',
-                            file_path=db_song.file_path,
-                            file_size=db_song.file_size
+                            status='success',
+                            file_path=placed.file_path,
+                            file_size=placed.file_size
                         )
-                        download_results.append(result)
-                        continue
-            
+                    # 曲库中没有可用文件时继续正常下载流程
+                else:
+                    skipped_count += 1
+                    self.logger.info(f"⏭️  跳过已下载: {song_name} - 数据库记录存在")
+
+                    # 创建跳过结果
+                    result = SongDownloadResult(
+                        song_id=song_id,
+                        name=song_name,
+                        artists=artists,
+                        album=album,
+                        status='skipped',
+                        file_path=existing_path,
+                        file_size=db_song.file_size
+                    )
+                    download_results.append(result)
+                    continue
+
             # 歌曲未下载或下载失败，正常下载
-            result = self.download_song(song, task_id=task_id)
+            if result is None:
+                result = self.download_song(song, task_id=task_id, cancel_token=cancel_token, plan=plan)
             download_results.append(result)
             
             # 记录下载结果到数据库
             if result.status == 'success':
                 success_count += 1
+                # 下载器已按文件的实际音质记录到数据库（包括从曲库放置的已有文件），这里不再重复写入，
+                # 否则请求的音质会覆盖已有的更高音质
                 self.logger.info(f"✅ 下载成功: {result.name}")
                 
-                # 记录成功下载到数据库
-                song_info = {
-                    'song_id': song_id,
-                    'song_name': song_name,
-                    'artists': artists,
-                    'album': album,
-                    'file_path': result.file_path,
-                    'file_size': result.file_size,
-                    'quality': self.config.quality,
-                    'status': 'success'
-                }
-                self.db.add_song(song_info)
-                
             elif result.status == 'failed':
                 failed_count += 1
                 self.logger.error(f"❌ 下载失败: {result.name} - {result.error_message}")
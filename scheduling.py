@@ -0,0 +1,93 @@
+"""批量下载调度策略模块
+
+决定歌单、歌手等批量任务中歌曲的下载顺序：
+- list：按列表原有顺序
+- smallest_first：小文件优先（短作业优先），让多数歌曲尽早完成，降低平均完成时间
+- largest_first：大文件优先，让耗时最长的歌曲尽早开始，与其余下载重叠
+文件大小通过批量解析下载URL获得，大小未知的歌曲保持原有相对顺序排在最后。
+"""
+
+from typing import Any, Callable, Dict, List
+
+from music_api import NeteaseAPI, APIException
+
+
+# 支持的调度策略
+SCHEDULE_POLICIES = ('list', 'smallest_first', 'largest_first')
+
+# 每次批量解析URL的歌曲数
+URL_BATCH_SIZE = 100
+
+
+def resolve_song_sizes(api: NeteaseAPI, song_ids: List[int], quality: str,
+                       cookies: Dict[str, str], batch_size: int = URL_BATCH_SIZE) -> Dict[int, int]:
+    """批量解析歌曲在指定音质下的文件大小
+
+    Args:
+        api: 网易云API实例
+        song_ids: 歌曲ID列表
+        quality: 音质等级
+        cookies: 用户cookies
+        batch_size: 每次请求解析的歌曲数
+
+    Returns:
+        歌曲ID到文件大小（字节）的映射，解析失败或无可用链接的歌曲不在其中
+    """
+    sizes: Dict[int, int] = {}
+    for start in range(0, len(song_ids), batch_size):
+        batch = song_ids[start:start + batch_size]
+        try:
+            result = api.get_song_urls(batch, quality, cookies)
+        except APIException as e:
+            # 单批解析失败不影响下载，这一批歌曲按大小未知处理
+            print(f"批量解析歌曲URL失败: {e}")
+            continue
+        for item in result.get('data') or []:
+            if item.get('url') and item.get('size'):
+                sizes[item['id']] = int(item['size'])
+    return sizes
+
+
+def order_songs(songs: List[Dict[str, Any]], policy: str, sizes: Dict[int, int],
+                key: Callable[[Dict[str, Any]], int] = lambda song: song['id']) -> List[Dict[str, Any]]:
+    """按调度策略排列歌曲
+
+    Args:
+        songs: 歌曲列表
+        policy: 调度策略，见SCHEDULE_POLICIES
+        sizes: 歌曲ID到文件大小的映射
+        key: 从歌曲信息中取歌曲ID的函数
+
+    Returns:
+        排列后的新列表（排序稳定，大小相同的歌曲保持原有顺序）
+    """
+    if policy not in ('smallest_first', 'largest_first'):
+        return list(songs)
+
+    known = [song for song in songs if key(song) in sizes]
+    unknown = [song for song in songs if key(song) not in sizes]
+    known.sort(key=lambda song: sizes[key(song)], reverse=policy == 'largest_first')
+    return known + unknown
+
+
+def schedule_songs(api: NeteaseAPI, songs: List[Dict[str, Any]], policy: str, quality: str,
+                   cookies: Dict[str, str]) -> List[Dict[str, Any]]:
+    """解析文件大小并按调度策略排列歌曲
+
+    list策略不发起任何请求，直接返回原顺序。
+
+    Args:
+        api: 网易云API实例
+        songs: 歌曲列表（每项包含id）
+        policy: 调度策略
+        quality: 音质等级
+        cookies: 用户cookies
+
+    Returns:
+        排列后的歌曲列表
+    """
+    if policy not in ('smallest_first', 'largest_first') or len(songs) < 2:
+        return list(songs)
+
+    sizes = resolve_song_sizes(api, [song['id'] for song in songs], quality, cookies)
+    return order_songs(songs, policy, sizes)
@@ -0,0 +1,363 @@
+"""下载数据流写入模块
+
+为音乐文件下载提供热路径写入循环，包括：
+- 复用预分配缓冲区（readinto + memoryview），避免每个分块创建新的bytes对象
+- 根据实测吞吐量自适应调整分块大小（64KB ~ 4MB）
+- 根据Content-Length预分配目标文件
+- 同步（requests）与异步（aiohttp）两种数据源
+- 可选的标签改写器，在写入过程中替换文件头部的元数据
+- 可选的完整性校验，在写入过程中累计上游数据的长度和MD5，以及写入文件的数据的MD5（定期校验的基准）
+- 可选的限速回调，每个分块读取后按带宽调度器的要求等待，限速时分块大小不超过突发容量
+"""
+
+import hashlib
+import os
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Union
+
+import aiofiles
+
+
+# 分块大小配置
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+TARGET_READ_SECONDS = 0.25
+
+# 限速时分块大小的下限（速率很低时允许小于MIN_CHUNK_SIZE）
+THROTTLED_MIN_CHUNK_SIZE = 16 * 1024
+
+
+class FetchCancelled(Exception):
+    """数据流写入被取消异常类"""
+    pass
+
+
+class IntegrityChecker:
+    """数据流完整性校验器
+
+    在写入循环中累计上游原始数据（标签改写之前）的长度和MD5，
+    下载结束后与接口返回的size/md5以及Content-Length比对，不需要重新读取文件。
+    同时累计实际写入文件的数据（标签改写之后）的MD5，作为曲库定期校验的基准（见library_verify）；
+    没有改写标签时写入的数据就是上游数据，直接使用上游数据的MD5，不重复计算。
+    """
+
+    def __init__(self, expected_size: int = 0, expected_md5: str = "", content_length: int = 0):
+        """
+        初始化完整性校验器
+
+        Args:
+            expected_size: 接口返回的文件大小，为0时不校验
+            expected_md5: 接口返回的MD5，为空时不校验
+            content_length: 响应头中的Content-Length，为0时不校验
+        """
+        self.expected_size = expected_size or 0
+        self.expected_md5 = (expected_md5 or "").lower()
+        self.content_length = content_length or 0
+        self.received = 0
+        self._md5 = hashlib.md5()
+        self._content_md5 = None
+
+    def update(self, data) -> None:
+        """累计一个数据分块"""
+        self._md5.update(data)
+        self.received += len(data)
+
+    def update_written(self, data) -> None:
+        """累计一个写入文件的数据分块（只在改写标签时调用）"""
+        if self._content_md5 is None:
+            self._content_md5 = hashlib.md5()
+        self._content_md5.update(data)
+
+    def hexdigest(self) -> str:
+        """获取已接收数据的MD5"""
+        return self._md5.hexdigest()
+
+    def content_hexdigest(self) -> str:
+        """获取写入文件的数据的MD5（写入后文件又被修改时不再有效）"""
+        return (self._content_md5 or self._md5).hexdigest()
+
+    def verify(self) -> Optional[str]:
+        """校验已接收的数据
+
+        Returns:
+            校验失败的原因，校验通过时返回None
+        """
+        if self.content_length and self.received != self.content_length:
+            return f"接收 {self.received} 字节，与Content-Length {self.content_length} 不一致"
+        if self.expected_size and self.received != self.expected_size:
+            return f"接收 {self.received} 字节，与接口返回大小 {self.expected_size} 不一致"
+        if self.expected_md5 and self.hexdigest() != self.expected_md5:
+            return f"MD5 {self.hexdigest()} 与接口返回值 {self.expected_md5} 不一致"
+        return None
+
+
+class AdaptiveChunkSizer:
+    """自适应分块大小调节器
+
+    每次读取后根据读取量和耗时调整下一次的分块大小：
+    读满且耗时明显低于目标时翻倍，耗时明显超过目标时减半。
+    """
+
+    def __init__(self, min_size: int = MIN_CHUNK_SIZE, max_size: int = MAX_CHUNK_SIZE,
+                 target_seconds: float = TARGET_READ_SECONDS):
+        """
+        初始化分块大小调节器
+
+        Args:
+            min_size: 最小分块大小（字节）
+            max_size: 最大分块大小（字节），同时决定缓冲区大小
+            target_seconds: 单次读取的目标耗时（秒）
+        """
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size)
+        self.target_seconds = target_seconds
+        self.size = min_size
+
+    def update(self, nbytes: int, elapsed: float) -> int:
+        """根据本次读取结果调整分块大小
+
+        Args:
+            nbytes: 本次读取的字节数
+            elapsed: 本次读取耗时（秒）
+
+        Returns:
+            下一次读取使用的分块大小
+        """
+        if nbytes >= self.size and elapsed < self.target_seconds / 2:
+            self.size = min(self.size * 2, self.max_size)
+        elif elapsed > self.target_seconds * 2:
+            self.size = max(self.size // 2, self.min_size)
+        return self.size
+
+    def cap(self, limit: Optional[int]) -> int:
+        """限速时把分块大小限制在限速回调给出的上限内（不低于THROTTLED_MIN_CHUNK_SIZE）
+
+        Args:
+            limit: 单次读取的上限（字节），为0或None时不限制
+
+        Returns:
+            下一次读取使用的分块大小
+        """
+        if limit:
+            self.size = min(self.size, max(limit, THROTTLED_MIN_CHUNK_SIZE))
+        return self.size
+
+
+def preallocate_fd(fd: int, size: int) -> bool:
+    """根据预期大小预分配文件空间
+
+    Args:
+        fd: 文件描述符
+        size: 预期文件大小（字节）
+
+    Returns:
+        是否预分配成功
+    """
+    if size <= 0:
+        return False
+
+    try:
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+        return True
+    except OSError:
+        # 文件系统不支持预分配时直接按需增长
+        return False
+
+
+def write_all(f, data) -> int:
+    """把数据完整写入无缓冲文件（buffering=0时一次write可能只写入一部分）
+
+    Args:
+        f: 以buffering=0打开的文件对象
+        data: 要写入的数据
+
+    Returns:
+        写入的字节数
+    """
+    view = memoryview(data)
+    total = len(view)
+    while view:
+        nbytes = f.write(view)
+        if not nbytes:
+            raise OSError(f"写入文件失败: 剩余 {len(view)} 字节未能写入")
+        view = view[nbytes:]
+    return total
+
+
+async def write_all_async(f, data) -> int:
+    """把数据完整写入以buffering=0打开的aiofiles文件对象，同write_all"""
+    view = memoryview(data)
+    total = len(view)
+    while view:
+        nbytes = await f.write(view)
+        if not nbytes:
+            raise OSError(f"写入文件失败: 剩余 {len(view)} 字节未能写入")
+        view = view[nbytes:]
+    return total
+
+
+def get_content_length(headers) -> int:
+    """从响应头中解析Content-Length
+
+    Args:
+        headers: HTTP响应头
+
+    Returns:
+        内容长度，未知时返回0
+    """
+    try:
+        return int(headers.get('Content-Length') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def stream_to_file(raw, file_path: Union[str, Path], expected_size: int = 0,
+                   should_cancel: Optional[Callable[[], bool]] = None,
+                   sizer: Optional[AdaptiveChunkSizer] = None, rewriter=None,
+                   checker: Optional[IntegrityChecker] = None,
+                   throttle: Optional[Callable[[int], Optional[int]]] = None) -> int:
+    """将同步数据流写入文件
+
+    Args:
+        raw: 支持readinto的原始数据流（如requests响应的raw属性）
+        file_path: 目标文件路径
+        expected_size: 预期大小（通常来自Content-Length），用于预分配
+        should_cancel: 取消检查函数，每个分块调用一次
+        sizer: 分块大小调节器，为None时使用默认配置
+        rewriter: 标签改写器（见stream_tagger），为None时原样写入
+        checker: 完整性校验器，累计上游数据的长度和MD5
+        throttle: 限速回调，参数为本次读取的字节数，需要限速时阻塞等待，
+            返回下一次读取的上限（为0或None时不限制），限速时分块不超过该上限
+
+    Returns:
+        写入文件的字节数
+
+    Raises:
+        FetchCancelled: should_cancel返回True时抛出
+    """
+    sizer = sizer or AdaptiveChunkSizer()
+    buffer = bytearray(sizer.max_size)
+    view = memoryview(buffer)
+    written = 0
+
+    # 关闭Python层缓冲，大分块直接写入文件描述符
+    with open(file_path, 'wb', buffering=0) as f:
+        preallocated = preallocate_fd(f.fileno(), expected_size)
+
+        while True:
+            if should_cancel is not None and should_cancel():
+                raise FetchCancelled()
+
+            started = time.perf_counter()
+            nbytes = raw.readinto(view[:sizer.size])
+            if not nbytes:
+                break
+
+            if checker is not None:
+                checker.update(view[:nbytes])
+            if rewriter is None or rewriter.done:
+                parts = [view[:nbytes]]
+            else:
+                parts = rewriter.feed(view[:nbytes])
+            for part in parts:
+                written += write_all(f, part)
+                if checker is not None and rewriter is not None:
+                    checker.update_written(part)
+            sizer.update(nbytes, time.perf_counter() - started)
+            # 限速等待不计入读取耗时，避免影响分块大小的调整
+            if throttle is not None:
+                sizer.cap(throttle(nbytes))
+
+        if rewriter is not None:
+            for part in rewriter.finish():
+                written += write_all(f, part)
+                if checker is not None:
+                    checker.update_written(part)
+
+        # 实际长度与预分配长度不一致时截断多余空间
+        if preallocated and written != expected_size:
+            f.truncate(written)
+
+    return written
+
+
+async def stream_to_file_async(content, file_path: Union[str, Path], expected_size: int = 0,
+                               should_cancel: Optional[Callable[[], bool]] = None,
+                               sizer: Optional[AdaptiveChunkSizer] = None, rewriter=None,
+                               checker: Optional[IntegrityChecker] = None,
+                               throttle: Optional[Callable[[int], Awaitable[Optional[int]]]] = None) -> int:
+    """将异步数据流写入文件
+
+    aiohttp的StreamReader不支持readinto，这里把多次读取的数据合并到
+    预分配缓冲区后再一次性写入，减少每个分块一次的线程池写入往返。
+
+    Args:
+        content: aiohttp响应的content（StreamReader）
+        file_path: 目标文件路径
+        expected_size: 预期大小（通常来自Content-Length），用于预分配
+        should_cancel: 取消检查函数，每个分块调用一次
+        sizer: 分块大小调节器，为None时使用默认配置
+        rewriter: 标签改写器（见stream_tagger），为None时原样写入
+        checker: 完整性校验器，累计上游数据的长度和MD5
+        throttle: 异步限速回调，参数为本次读取的字节数，需要限速时等待，返回值同stream_to_file
+
+    Returns:
+        写入文件的字节数
+
+    Raises:
+        FetchCancelled: should_cancel返回True时抛出
+    """
+    sizer = sizer or AdaptiveChunkSizer()
+    buffer = bytearray(sizer.max_size)
+    view = memoryview(buffer)
+    written = 0
+    eof = False
+
+    async with aiofiles.open(file_path, 'wb', buffering=0) as f:
+        preallocated = preallocate_fd(f.fileno(), expected_size)
+
+        while not eof:
+            if should_cancel is not None and should_cancel():
+                raise FetchCancelled()
+
+            # 填充缓冲区至当前分块大小
+            started = time.perf_counter()
+            filled = 0
+            target = sizer.size
+            while filled < target:
+                data = await content.read(target - filled)
+                if not data:
+                    eof = True
+                    break
+                view[filled:filled + len(data)] = data
+                filled += len(data)
+
+            if filled:
+                if checker is not None:
+                    checker.update(view[:filled])
+                if rewriter is None or rewriter.done:
+                    parts = [view[:filled]]
+                else:
+                    parts = rewriter.feed(view[:filled])
+                for part in parts:
+                    written += await write_all_async(f, part)
+                    if checker is not None and rewriter is not None:
+                        checker.update_written(part)
+                sizer.update(filled, time.perf_counter() - started)
+                if throttle is not None:
+                    sizer.cap(await throttle(filled))
+
+        if rewriter is not None:
+            for part in rewriter.finish():
+                written += await write_all_async(f, part)
+                if checker is not None:
+                    checker.update_written(part)
+
+        if preallocated and written != expected_size:
+            await f.truncate(written)
+
+    return written
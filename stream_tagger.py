@@ -0,0 +1,296 @@
+"""边下载边写标签模块
+
+在音频数据写入磁盘的同时改写文件头部的元数据，使每个文件只写一次：
+- MP3：丢弃上游的ID3v2标签，在数据流开头写入新的ID3v2标签（含预留填充）
+- FLAC：保留STREAMINFO等音频相关元数据块，合并VORBIS_COMMENT，替换封面并追加填充块
+- 其他格式（如M4A）或解析失败时原样写入，由调用方回退到下载完成后再写标签
+"""
+
+import struct
+from abc import ABC, abstractmethod
+from io import BytesIO
+from typing import Any, List, Optional
+
+from mutagen import MutagenError
+from mutagen.flac import Picture, VCFLACDict
+from mutagen.id3 import ID3, TIT2, TPE1, TALB, TRCK, TXXX, APIC
+
+from cover_cache import guess_image_mime
+
+
+# 标签后预留的填充大小，后续修改标签时可原地写入而无需重写整个文件
+TAG_PADDING = 8192
+
+# 头部解析最多缓存的数据量，超出时放弃改写
+MAX_HEADER_BYTES = 32 * 1024 * 1024
+
+# FLAC元数据块类型
+FLAC_BLOCK_PADDING = 1
+FLAC_BLOCK_VORBIS_COMMENT = 4
+FLAC_BLOCK_PICTURE = 6
+
+# FLAC图片块的图片类型：封面（正面）
+FLAC_PICTURE_FRONT_COVER = 3
+
+# FLAC元数据块长度字段为24位
+FLAC_MAX_BLOCK_SIZE = (1 << 24) - 1
+
+# 自定义标签：歌曲ID和音质，数据库丢失或挂载已有曲库时据此重建下载记录（见library_import）
+# MP3写入TXXX帧，FLAC写入Vorbis注释，M4A写入该命名空间下的自由格式标签
+SONG_ID_TAG = 'NETEASE_SONG_ID'
+QUALITY_TAG = 'NETEASE_QUALITY'
+MP4_TAG_NAMESPACE = 'com.netease.music'
+
+
+class StreamTagRewriter(ABC):
+    """数据流标签改写器基类
+
+    写入循环把读到的每个分块交给feed()，写入其返回的数据。
+    头部解析完成前数据暂存在内部缓冲区中，解析完成后直接透传。
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.done = False
+        self.applied = False
+
+    def feed(self, data) -> List[Any]:
+        """处理一个数据分块
+
+        Args:
+            data: 从上游读取的数据（bytes或memoryview）
+
+        Returns:
+            需要按顺序写入文件的数据列表
+        """
+        if self.done:
+            return [data]
+
+        self._buffer += data
+        try:
+            result = self._parse(self._buffer)
+        except (ValueError, MutagenError):
+            # 上游元数据损坏时原样写入，由调用方在下载完成后写标签
+            return self._give_up()
+
+        if result is None:
+            if len(self._buffer) > MAX_HEADER_BYTES:
+                return self._give_up()
+            return []
+
+        parts, consumed = result
+        self.done = True
+        self.applied = True
+        buffer, self._buffer = self._buffer, bytearray()
+        return parts + [memoryview(buffer)[consumed:]]
+
+    def finish(self) -> List[Any]:
+        """数据流结束时调用，返回尚未写出的数据"""
+        if self.done:
+            return []
+        return self._give_up()
+
+    def _give_up(self) -> List[Any]:
+        """放弃改写，原样写出已缓存的数据"""
+        self.done = True
+        self.applied = False
+        buffer, self._buffer = self._buffer, bytearray()
+        return [buffer] if buffer else []
+
+    @abstractmethod
+    def _parse(self, buffer: bytearray):
+        """解析头部
+
+        Args:
+            buffer: 已缓存的数据
+
+        Returns:
+            (需要写入的新头部数据列表, 上游头部占用的字节数)，数据不足时返回None
+
+        Raises:
+            ValueError: 数据格式不符合预期时抛出
+            MutagenError: 上游元数据无法解析时抛出
+        """
+
+
+class ID3StreamRewriter(StreamTagRewriter):
+    """MP3数据流标签改写器"""
+
+    def __init__(self, music_info, cover_data: Optional[bytes] = None, padding: int = TAG_PADDING):
+        """
+        初始化MP3标签改写器
+
+        Args:
+            music_info: 音乐信息
+            cover_data: 封面图片数据
+            padding: 标签后预留的填充大小
+        """
+        super().__init__()
+        self.music_info = music_info
+        self.cover_data = cover_data
+        self.padding = padding
+
+    def _parse(self, buffer: bytearray):
+        if len(buffer) < 10:
+            return None
+
+        consumed = 0
+        if buffer[:3] == b'ID3':
+            # 跳过上游的ID3v2标签：10字节头部 + syncsafe长度 + 可选的10字节尾部
+            size = 0
+            for byte in buffer[6:10]:
+                if byte & 0x80:
+                    raise ValueError('无效的ID3标签长度')
+                size = (size << 7) | byte
+            consumed = 10 + size + (10 if buffer[5] & 0x10 else 0)
+            if len(buffer) < consumed:
+                return None
+
+        return [self._build_tag()], consumed
+
+    def _build_tag(self) -> bytes:
+        """生成ID3v2标签数据"""
+        tags = ID3()
+        tags.add(TIT2(encoding=3, text=self.music_info.name))
+        tags.add(TPE1(encoding=3, text=self.music_info.artists))
+        tags.add(TALB(encoding=3, text=self.music_info.album))
+
+        if self.music_info.track_number > 0:
+            tags.add(TRCK(encoding=3, text=str(self.music_info.track_number)))
+        tags.add(TXXX(encoding=3, desc=SONG_ID_TAG, text=str(self.music_info.id)))
+        tags.add(TXXX(encoding=3, desc=QUALITY_TAG, text=self.music_info.quality))
+
+        if self.cover_data:
+            tags.add(APIC(
+                encoding=3,
+                mime=guess_image_mime(self.cover_data),
+                type=3,
+                desc='Cover',
+                data=self.cover_data
+            ))
+
+        output = BytesIO()
+        tags.save(output, v1=0, padding=lambda info: self.padding)
+        return output.getvalue()
+
+
+class FLACStreamRewriter(StreamTagRewriter):
+    """FLAC数据流标签改写器"""
+
+    def __init__(self, music_info, cover_data: Optional[bytes] = None, padding: int = TAG_PADDING):
+        """
+        初始化FLAC标签改写器
+
+        Args:
+            music_info: 音乐信息
+            cover_data: 封面图片数据
+            padding: 元数据后预留的填充大小
+        """
+        super().__init__()
+        self.music_info = music_info
+        self.cover_data = cover_data
+        self.padding = padding
+
+    def _parse(self, buffer: bytearray):
+        if len(buffer) < 4:
+            return None
+        if buffer[:4] != b'fLaC':
+            raise ValueError('不是FLAC数据流')
+
+        # 逐个读取元数据块，直到最后一个块
+        blocks = []
+        offset = 4
+        while True:
+            if len(buffer) < offset + 4:
+                return None
+            header = buffer[offset]
+            length = int.from_bytes(buffer[offset + 1:offset + 4], 'big')
+            end = offset + 4 + length
+            if len(buffer) < end:
+                return None
+            blocks.append((header & 0x7F, buffer[offset + 4:end]))
+            offset = end
+            if header & 0x80:
+                break
+
+        if not blocks or blocks[0][0] != 0:
+            raise ValueError('FLAC数据流缺少STREAMINFO')
+
+        return [self._build_metadata(blocks)], offset
+
+    def _build_cover(self) -> Optional[bytes]:
+        """生成封面图片块的数据，没有封面或封面超出元数据块长度上限时返回None"""
+        if not self.cover_data:
+            return None
+        picture = Picture()
+        picture.type = FLAC_PICTURE_FRONT_COVER
+        picture.mime = guess_image_mime(self.cover_data)
+        picture.desc = 'Cover'
+        picture.data = self.cover_data
+        picture_data = picture.write()
+        if len(picture_data) > FLAC_MAX_BLOCK_SIZE:
+            return None
+        return picture_data
+
+    def _build_metadata(self, blocks: list) -> bytes:
+        """生成新的FLAC头部（fLaC标记 + 全部元数据块）"""
+        cover = self._build_cover()
+        comment = VCFLACDict()
+        kept = []
+        for block_type, data in blocks:
+            if block_type == FLAC_BLOCK_VORBIS_COMMENT:
+                # 保留上游已有的注释字段（如ReplayGain），与mutagen重写时的行为一致
+                comment = VCFLACDict(bytes(data), framing=False)
+            elif (block_type == FLAC_BLOCK_PICTURE and cover is not None
+                  and int.from_bytes(data[:4], 'big') == FLAC_PICTURE_FRONT_COVER):
+                # 写入新封面时去掉上游的封面，避免文件中有两张封面
+                continue
+            elif block_type != FLAC_BLOCK_PADDING:
+                kept.append((block_type, bytes(data)))
+
+        comment['TITLE'] = self.music_info.name
+        comment['ARTIST'] = self.music_info.artists
+        comment['ALBUM'] = self.music_info.album
+        if self.music_info.track_number > 0:
+            comment['TRACKNUMBER'] = str(self.music_info.track_number)
+        comment[SONG_ID_TAG] = str(self.music_info.id)
+        comment[QUALITY_TAG] = self.music_info.quality
+        kept.append((FLAC_BLOCK_VORBIS_COMMENT, comment.write(framing=False)))
+
+        if cover is not None:
+            kept.append((FLAC_BLOCK_PICTURE, cover))
+
+        kept.append((FLAC_BLOCK_PADDING, b'\x00' * self.padding))
+
+        output = bytearray(b'fLaC')
+        for index, (block_type, data) in enumerate(kept):
+            is_last = index == len(kept) - 1
+            output += struct.pack('>I', len(data))
+            output[-4] = block_type | (0x80 if is_last else 0)
+            output += data
+        return bytes(output)
+
+
+def supports_stream_tagging(file_ext: str) -> bool:
+    """判断该格式是否支持边下载边写标签"""
+    return file_ext.lower() in ('.mp3', '.flac')
+
+
+def create_tag_rewriter(file_ext: str, music_info,
+                        cover_data: Optional[bytes] = None) -> Optional[StreamTagRewriter]:
+    """根据文件扩展名创建标签改写器
+
+    Args:
+        file_ext: 文件扩展名（如 .mp3）
+        music_info: 音乐信息
+        cover_data: 封面图片数据
+
+    Returns:
+        标签改写器，不支持边下载边写标签的格式返回None
+    """
+    file_ext = file_ext.lower()
+    if file_ext == '.mp3':
+        return ID3StreamRewriter(music_info, cover_data)
+    if file_ext == '.flac':
+        return FLACStreamRewriter(music_info, cover_data)
+    return None
@@ -6,6 +6,7 @@
 import asyncio
 import uuid
 import time
+from collections import deque
 from typing import Dict, List, Optional, Any, Callable
 from enum import Enum
 from dataclasses import dataclass, field
@@ -13,6 +14,10 @@ import threading
 from concurrent.futures import ThreadPoolExecutor
 import logging
 
+from cancellation import CancellationToken, cancellation_stats
+from inflight import inflight_registry
+from download_db import flush_all as flush_download_records
+
 
 class TaskStatus(Enum):
     """任务状态枚举"""
@@ -40,15 +45,81 @@ class TaskInfo:
     metadata: Dict[str, Any] = field(default_factory=dict)
 
 
+class IndexedTaskQueue(asyncio.Queue):
+    """可按任务ID移除的先进先出任务队列
+
+    队列项为 (task_id, task_func, task_type, metadata)。移除任务时只把队列项标记为已删除并从索引中去掉（O(1)），
+    取出时跳过已删除的项；已删除的项过多时压缩一次队列。qsize()只统计未删除的任务，
+    被移除的任务视为已处理（调用task_done），join()不会等待它们。
+    """
+
+    # 已删除的项超过该数量且多于有效项时压缩队列
+    COMPACT_THRESHOLD = 64
+
+    def _init(self, maxsize):
+        self._queue = deque()
+        self._index: Dict[str, list] = {}
+        self._tombstones = 0
+
+    def _put(self, item):
+        entry = [item[0], item]
+        self._queue.append(entry)
+        self._index[item[0]] = entry
+
+    def _get(self):
+        while True:
+            task_id, item = self._queue.popleft()
+            if item is not None:
+                del self._index[task_id]
+                return item
+            self._tombstones -= 1
+
+    def qsize(self) -> int:
+        return len(self._index)
+
+    def empty(self) -> bool:
+        return not self._index
+
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self._index
+
+    def remove(self, task_id: str) -> bool:
+        """移除等待中的任务
+
+        Args:
+            task_id: 任务ID
+
+        Returns:
+            任务是否在队列中
+        """
+        entry = self._index.pop(task_id, None)
+        if entry is None:
+            return False
+        entry[1] = None
+        self._tombstones += 1
+        self.task_done()
+
+        if self._tombstones > self.COMPACT_THRESHOLD and self._tombstones > len(self._index):
+            self._queue = deque(entry for entry in self._queue if entry[1] is not None)
+            self._tombstones = 0
+        return True
+
+    @property
+    def tombstones(self) -> int:
+        """队列中尚未清除的已删除项数"""
+        return self._tombstones
+
+
 class TaskManager:
     """异步任务管理器"""
     
     def __init__(self, max_workers: int = 5):
         self.max_workers = max_workers
         self.tasks: Dict[str, TaskInfo] = {}
-        self.task_queue = asyncio.Queue()
+        self.task_queue = IndexedTaskQueue()
         self.worker_tasks: List[asyncio.Task] = []
         self.running_tasks: Dict[str, asyncio.Task] = {}  # 跟踪正在运行的任务
+        self.cancel_tokens: Dict[str, CancellationToken] = {}  # 每个任务的取消令牌
         self.is_running = False
         self.logger = self._setup_logger()
         
@@ -58,6 +129,9 @@ class TaskManager:
         # WebSocket进度更新回调函数
         self.progress_callback = None
         
+        # 停止时执行的清理回调（如关闭长连接会话）
+        self.shutdown_callbacks: List[Callable] = []
+
     def _setup_logger(self) -> logging.Logger:
         """设置日志记录器"""
         logger = logging.getLogger('task_manager')
@@ -99,8 +173,31 @@ class TaskManager:
             await asyncio.gather(*self.worker_tasks, return_exceptions=True)
             
         self.worker_tasks.clear()
+
+        # 执行清理回调，单个回调失败不影响其他回调
+        for callback in self.shutdown_callbacks:
+            try:
+                result = callback()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                self.logger.warning(f"执行停止回调失败: {e}")
+        self.shutdown_callbacks.clear()
+
+        # 写入尚未写入的下载记录
+        flush_download_records()
+
         self.logger.info("任务管理器已停止")
     
+    def register_shutdown_callback(self, callback: Callable) -> None:
+        """注册任务管理器停止时执行的清理回调
+
+        Args:
+            callback: 回调函数，可以是普通函数或协程函数
+        """
+        if callback not in self.shutdown_callbacks:
+            self.shutdown_callbacks.append(callback)
+
     async def _worker(self, worker_name: str):
         """工作线程"""
         self.logger.info(f"工作线程 {worker_name} 已启动")
@@ -134,8 +231,8 @@ class TaskManager:
                 try:
                     result = await task
                     
-                    # 任务完成
-                    if task_info:
+                    # 任务完成（任务函数响应取消令牌后正常返回时保持已取消状态）
+                    if task_info and task_info.status != TaskStatus.CANCELLED:
                         task_info.status = TaskStatus.COMPLETED
                         task_info.completed_at = time.time()
                         # 只有在任务真正完成时才设置进度为100%
@@ -216,6 +313,7 @@ class TaskManager:
         
         # 保存任务信息
         self.tasks[task_id] = task_info
+        self.cancel_tokens[task_id] = CancellationToken(task_id)
         
         # 将任务加入队列（使用同步方式）
         self._add_to_queue_sync(task_id, task_func, task_type, metadata)
@@ -251,19 +349,24 @@ class TaskManager:
         # 执行任务，添加task_id参数
         task_metadata = metadata.copy()
         task_metadata['task_id'] = task_id
+        task_metadata['cancel_token'] = self.get_cancel_token(task_id)
         
-        if asyncio.iscoroutinefunction(task_func):
-            # 异步函数
-            result = await task_func(**task_metadata)
-        else:
-            # 同步函数，在线程池中执行
-            import functools
-            # 使用functools.partial包装函数调用
-            func_call = functools.partial(task_func, **task_metadata)
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                self.thread_pool, func_call
-            )
+        loop = asyncio.get_event_loop()
+        try:
+            if asyncio.iscoroutinefunction(task_func):
+                # 异步函数
+                result = await task_func(**task_metadata)
+            else:
+                # 同步函数，在线程池中执行
+                import functools
+                # 使用functools.partial包装函数调用
+                func_call = functools.partial(task_func, **task_metadata)
+                result = await loop.run_in_executor(
+                    self.thread_pool, func_call
+                )
+        finally:
+            # 任务结束时写入延迟写入队列中的下载记录
+            await loop.run_in_executor(self.thread_pool, flush_download_records)
         
         return result
     
@@ -275,6 +378,34 @@ class TaskManager:
         """获取所有任务信息"""
         return list(self.tasks.values())
     
+    def get_cancel_token(self, task_id: str) -> CancellationToken:
+        """获取任务的取消令牌
+
+        Args:
+            task_id: 任务ID
+
+        Returns:
+            取消令牌，任务不存在时返回一个独立的未取消令牌
+        """
+        token = self.cancel_tokens.get(task_id)
+        if token is None:
+            token = CancellationToken(task_id)
+            task_info = self.tasks.get(task_id)
+            if task_info and task_info.status == TaskStatus.CANCELLED:
+                token.cancel()
+        return token
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """获取任务管理器运行指标"""
+        return {
+            'total_tasks': len(self.tasks),
+            'running_tasks': len(self.running_tasks),
+            'queue_size': self.task_queue.qsize(),
+            'queue_tombstones': self.task_queue.tombstones,
+            'cancel_latency': cancellation_stats.snapshot(),
+            'inflight_downloads': inflight_registry.get_statistics()
+        }
+
     def clear_cancelled_tasks(self) -> Dict[str, Any]:
         """清理已取消的任务
         
@@ -295,6 +426,7 @@ class TaskManager:
             for task_info in cancelled_tasks:
                 if task_info.task_id in self.tasks:
                     del self.tasks[task_info.task_id]
+                self.cancel_tokens.pop(task_info.task_id, None)
             
             # 记录清理后的任务数量
             total_after = len(self.tasks)
@@ -392,6 +524,11 @@ class TaskManager:
         """
         task_info = self.tasks.get(task_id)
         if task_info and task_info.status in [TaskStatus.PENDING, TaskStatus.RUNNING]:
+            # 通知取消令牌，唤醒线程池中正在下载的代码
+            token = self.cancel_tokens.get(task_id)
+            if token:
+                token.cancel()
+
             # 如果任务正在运行，取消对应的asyncio任务
             if task_id in self.running_tasks:
                 running_task = self.running_tasks[task_id]
@@ -413,44 +550,14 @@ class TaskManager:
         return False
     
     def _remove_from_queue(self, task_id: str):
-        """从队列中移除指定任务
+        """从队列中移除指定任务（按任务ID索引，不需要重建队列）
         
         Args:
             task_id: 要移除的任务ID
         """
-        # 由于asyncio.Queue不支持直接移除特定元素，我们需要重新构建队列
-        # 创建一个临时队列，只保留未取消的任务
-        temp_queue = asyncio.Queue()
-        removed = False
-        
-        # 将队列中所有任务转移到临时队列，跳过要移除的任务
-        while not self.task_queue.empty():
-            try:
-                task_data = self.task_queue.get_nowait()
-                current_task_id, task_func, task_type, metadata = task_data
-                
-                if current_task_id == task_id:
-                    # 找到要移除的任务，跳过它
-                    self.logger.info(f"从队列中移除了任务 {task_id}")
-                    removed = True
-                    self.task_queue.task_done()
-                else:
-                    # 保留其他任务
-                    temp_queue.put_nowait(task_data)
-                    self.task_queue.task_done()
-            except asyncio.QueueEmpty:
-                break
-        
-        # 将临时队列中的任务移回原队列
-        while not temp_queue.empty():
-            try:
-                task_data = temp_queue.get_nowait()
-                self.task_queue.put_nowait(task_data)
-                temp_queue.task_done()
-            except asyncio.QueueEmpty:
-                break
-        
-        if not removed:
+        if self.task_queue.remove(task_id):
+            self.logger.info(f"从队列中移除了任务 {task_id}")
+        else:
             self.logger.info(f"任务 {task_id} 不在队列中或已被移除")
     
     def cleanup_completed_tasks(self, max_age_seconds: int = 3600):
@@ -468,6 +575,7 @@ class TaskManager:
         
         for task_id in tasks_to_remove:
             del self.tasks[task_id]
+            self.cancel_tokens.pop(task_id, None)
         
         if tasks_to_remove:
             self.logger.info(f"清理了 {len(tasks_to_remove)} 个已完成的任务")
@@ -0,0 +1,110 @@
+"""
+异步下载会话测试
+验证异步下载在同一事件循环中复用一个长连接会话（批量下载只建立一次连接），
+会话按配置创建、在新的事件循环中重新创建，以及close()释放会话
+"""
+
+import asyncio
+import hashlib
+
+import pytest
+from aiohttp import web
+
+import music_downloader
+from download_db import DownloadDatabase
+from music_downloader import MusicDownloader, MusicInfo
+
+
+DATA = b'audio-data' * 1000
+
+
+@pytest.fixture
+def downloader(tmp_path, monkeypatch):
+    monkeypatch.setattr(music_downloader, 'DownloadDatabase',
+                        lambda: DownloadDatabase(str(tmp_path / 'downloads.db')))
+    monkeypatch.setattr(music_downloader, 'get_library_store', lambda: None)
+    instance = MusicDownloader(download_dir=str(tmp_path / 'music'), create_artist_dir=False)
+    instance.stream_tagging = False
+    instance._write_music_tags = lambda *args: None
+    yield instance
+    instance.db.flush()
+
+
+async def _serve(handler):
+    """在本机随机端口启动HTTP服务，返回 (runner, 基础URL)"""
+    app = web.Application()
+    app.router.add_get('/{name}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f'http://127.0.0.1:{port}'
+
+
+def test_session_reused_within_loop_and_recreated_for_new_loop(downloader):
+    """同一事件循环中返回同一会话，按配置限制连接数；新的事件循环中重新创建"""
+    downloader.async_session_config = {'limit': 5, 'limit_per_host': 2}
+
+    async def get_twice():
+        first = downloader._get_async_session()
+        assert downloader._get_async_session() is first
+        assert (first.connector.limit, first.connector.limit_per_host) == (5, 2)
+        return first
+
+    loops = [asyncio.new_event_loop(), asyncio.new_event_loop()]
+    try:
+        first = loops[0].run_until_complete(get_twice())
+        second = loops[1].run_until_complete(get_twice())
+
+        assert second is not first
+        loops[0].run_until_complete(first.close())
+        loops[1].run_until_complete(downloader.close())
+        assert downloader._async_session is None
+    finally:
+        for loop in loops:
+            loop.close()
+
+
+def test_close_closes_session(downloader):
+    async def run():
+        session = downloader._get_async_session()
+        await downloader.close()
+        assert session.closed
+        # 关闭后再次下载时重新创建
+        assert downloader._get_async_session() is not session
+        await downloader.close()
+
+    asyncio.run(run())
+
+
+def test_batch_download_uses_one_connection(downloader):
+    """批量下载的所有歌曲通过同一个长连接下载，不为每首歌重新建立连接"""
+    downloader.max_concurrent = 1
+    peers = []
+
+    async def handler(request):
+        peers.append(request.transport.get_extra_info('peername'))
+        return web.Response(body=DATA)
+
+    async def run():
+        runner, base_url = await _serve(handler)
+        downloader.get_music_info = lambda music_id, quality: MusicInfo(
+            id=music_id, name=f'歌曲{music_id}', artists='歌手', album='', pic_url='', duration=0,
+            track_number=0, download_url=f'{base_url}/{music_id}.mp3', file_type='mp3', file_size=len(DATA),
+            quality=quality, md5=hashlib.md5(DATA).hexdigest()
+        )
+        try:
+            return await downloader.download_batch_async([1, 2, 3], 'exhigh')
+        finally:
+            await downloader.close()
+            await runner.cleanup()
+
+    results = asyncio.run(run())
+
+    assert all(result.success for result in results), [result.error_message for result in results]
+    assert len(peers) == 3
+    assert len(set(peers)) == 1
+    assert sorted(path.name for path in downloader.download_dir.iterdir()) == [
+        '歌手 - 歌曲1.mp3', '歌手 - 歌曲2.mp3', '歌手 - 歌曲3.mp3'
+    ]
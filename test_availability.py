@@ -0,0 +1,128 @@
+"""
+歌曲可用性预检测试
+验证按音质降级顺序批量预检、接口自动降级时直接采用较低音质、不可用结果写入负缓存后不再请求，
+以及接口请求失败时不给出结论
+"""
+
+import pytest
+
+from availability import AvailabilityProbe, quality_ladder_from, unusable_reason
+from download_db import DownloadDatabase
+from music_api import APIException
+
+
+LADDER = ['hires', 'lossless', 'exhigh']
+
+
+class _API:
+    """按音质返回预设的链接信息，记录每次请求"""
+
+    def __init__(self, levels: dict, fail_levels=()):
+        self.levels = levels
+        self.fail_levels = set(fail_levels)
+        self.requests = []
+
+    def get_song_urls(self, ids, level, cookies):
+        self.requests.append((level, list(ids)))
+        if level in self.fail_levels:
+            raise APIException('请求失败')
+        available = self.levels.get(level, {})
+        return {'data': [
+            dict({'id': song_id, 'url': None}, **available.get(song_id, {})) for song_id in ids
+        ]}
+
+
+def _item(level: str, **extra) -> dict:
+    return dict({'url': f'http://cdn.example/{level}.flac', 'level': level, 'size': 100, 'md5': 'abc'}, **extra)
+
+
+LEVELS = {
+    'hires': {1: _item('hires'), 4: _item('hires', freeTrialInfo={'start': 0})},
+    'lossless': {1: _item('lossless'), 2: _item('lossless')},
+    'exhigh': {1: _item('exhigh'), 2: _item('exhigh')},
+}
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = DownloadDatabase(str(tmp_path / 'downloads.db'))
+    yield database
+    database.flush()
+
+
+def test_ladder_and_reasons():
+    assert quality_ladder_from('lossless', LADDER) == ['lossless', 'exhigh']
+    assert quality_ladder_from('dolby', LADDER) == ['dolby']
+    assert unusable_reason(None) == '接口未返回该歌曲'
+    assert unusable_reason({'url': None}) == '无可用的下载链接'
+    assert unusable_reason(_item('hires', freeTrialInfo={})) is None
+    assert unusable_reason(_item('hires', freeTrialInfo={'start': 0})) == '仅可试听片段'
+
+
+def test_probe_picks_highest_available_quality(db):
+    """每档音质一次批量请求，为每首歌选出可用的最高音质"""
+    api = _API(LEVELS)
+    probe = AvailabilityProbe(api, db, ladder=LADDER)
+
+    results = probe.probe([1, 2, 3, 4, 1], 'hires', {})
+
+    assert {song_id: result.quality for song_id, result in results.items()} == {
+        1: 'hires', 2: 'lossless', 3: None, 4: None
+    }
+    assert results[1].song_data['url'] == 'http://cdn.example/hires.flac'
+    assert results[3].reason == '无可用的下载链接'
+    assert api.requests == [('hires', [1, 2, 3, 4]), ('lossless', [2, 3, 4]), ('exhigh', [3, 4])]
+    assert probe.get_statistics()['downgraded'] == 1
+
+
+def test_negative_cache_skips_requests(db):
+    """不可用的 (歌曲, 音质) 在有效期内不再请求接口"""
+    AvailabilityProbe(_API(LEVELS), db, ladder=LADDER).probe([1, 2, 3], 'hires', {})
+    api = _API(LEVELS)
+    probe = AvailabilityProbe(api, db, ladder=LADDER)
+
+    results = probe.probe([1, 2, 3], 'hires', {})
+
+    assert {song_id: result.quality for song_id, result in results.items()} == {1: 'hires', 2: 'lossless', 3: None}
+    assert api.requests == [('hires', [1]), ('lossless', [2])]
+    assert probe.get_statistics()['negative_hits'] == 4
+
+
+def test_expired_negative_cache_is_requested_again(db):
+    AvailabilityProbe(_API(LEVELS), db, ladder=LADDER, negative_ttl=-1).probe([3], 'exhigh', {})
+    api = _API(LEVELS)
+
+    AvailabilityProbe(api, db, ladder=LADDER).probe([3], 'exhigh', {})
+
+    assert api.requests == [('exhigh', [3])]
+
+
+def test_auto_downgrade_is_adopted(db):
+    """接口把hires自动降级为lossless时直接采用，不再单独请求lossless，hires写入负缓存"""
+    api = _API({'hires': {5: _item('lossless')}})
+    probe = AvailabilityProbe(api, db, ladder=LADDER)
+
+    results = probe.probe([5], 'hires', {})
+
+    assert results[5].quality == 'lossless'
+    assert api.requests == [('hires', [5])]
+    assert db.get_unavailable([5], 'hires') == {5: '无hires音质'}
+
+
+def test_auto_downgrade_below_ladder_is_rejected(db):
+    """降级后的音质低于允许范围时按不可用处理"""
+    api = _API({'lossless': {5: _item('standard')}})
+
+    results = AvailabilityProbe(api, db, ladder=LADDER).probe([5], 'lossless', {})
+
+    assert results[5].quality is None
+
+
+def test_request_failure_gives_no_conclusion(db):
+    """接口请求失败的歌曲不在结果中，也不写入负缓存"""
+    api = _API(LEVELS, fail_levels=['hires'])
+
+    results = AvailabilityProbe(api, db, ladder=LADDER).probe([1, 2], 'hires', {})
+
+    assert results == {}
+    assert db.get_unavailable([1, 2], 'hires') == {}
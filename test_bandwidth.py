@@ -0,0 +1,121 @@
+"""
+下载带宽调度测试
+验证全局带宽按权重注水分配（受自身上限限制的任务用不完的份额分给其他任务）、
+单任务上限、令牌桶的等待时间，以及等待期间响应取消
+"""
+
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import bandwidth
+from bandwidth import ACTIVE_WINDOW, BandwidthScheduler
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    instance = _Clock()
+    monkeypatch.setattr(bandwidth, 'time', SimpleNamespace(monotonic=instance, sleep=time.sleep))
+    return instance
+
+
+def _rates(scheduler: BandwidthScheduler, *task_ids) -> dict:
+    """所有任务各读取一次（都处于活跃状态）后，再次读取时各自的速率"""
+    for task_id in task_ids:
+        scheduler.reserve(0, task_id)
+    for task_id in task_ids:
+        scheduler.reserve(0, task_id)
+    return {task_id: scheduler.get_statistics()['tasks'][task_id]['rate'] for task_id in task_ids}
+
+
+def test_global_limit_shared_by_weight(clock):
+    scheduler = BandwidthScheduler(global_limit=1000)
+    assert _rates(scheduler, 'a', 'b') == {'a': 500, 'b': 500}
+
+    scheduler.set_task_limit('a', weight=3)
+    assert _rates(scheduler, 'a', 'b') == {'a': 750, 'b': 250}
+
+
+def test_capped_task_share_goes_to_others(clock):
+    """自身上限低于应得份额的任务只分配上限，剩余带宽由其他任务分享"""
+    scheduler = BandwidthScheduler(global_limit=1000)
+    scheduler.set_task_limit('a', limit=100)
+
+    assert _rates(scheduler, 'a', 'b', 'c') == {'a': 100, 'b': 450, 'c': 450}
+
+
+def test_water_filling_cascades(clock):
+    """去掉受限任务后重新分配，新的份额又超过其他任务的上限时继续分配"""
+    scheduler = BandwidthScheduler(global_limit=900)
+    scheduler.set_task_limit('a', limit=100)
+    # 第一轮每个任务300，a受限；第二轮b、c各400，b受限；最后c得到450
+    scheduler.set_task_limit('b', limit=350)
+
+    assert _rates(scheduler, 'a', 'b', 'c') == {'a': 100, 'b': 350, 'c': 450}
+
+
+def test_all_tasks_capped_below_global(clock):
+    scheduler = BandwidthScheduler(global_limit=1000, task_limit=200)
+
+    assert _rates(scheduler, 'a', 'b') == {'a': 200, 'b': 200}
+
+
+def test_inactive_task_releases_share(clock):
+    """超过ACTIVE_WINDOW没有读取的任务不再参与分配"""
+    scheduler = BandwidthScheduler(global_limit=1000)
+    _rates(scheduler, 'a', 'b')
+
+    clock.now += ACTIVE_WINDOW + 1
+    scheduler.reserve(0, 'a')
+
+    assert scheduler.get_statistics()['tasks']['a']['rate'] == 1000
+
+
+def test_no_limit_never_waits(clock):
+    scheduler = BandwidthScheduler()
+
+    assert scheduler.reserve(10 ** 9, 'a') == 0
+    assert scheduler.burst_bytes('a') == 0
+
+
+def test_reserve_returns_delay_and_refills(clock):
+    """令牌不足时返回按速率需要等待的时间，令牌随时间补充但不超过突发容量"""
+    scheduler = BandwidthScheduler(task_limit=1000, burst_seconds=0.5)
+
+    assert scheduler.reserve(500, 'a') == pytest.approx(0.5)
+    clock.now += 0.5
+    assert scheduler.reserve(0, 'a') == 0
+    clock.now += 10
+    # 最多积累0.5秒的令牌
+    assert scheduler.reserve(1000, 'a') == pytest.approx(0.5)
+    assert scheduler.burst_bytes('a') == 500
+
+
+def test_runtime_limit_change(clock):
+    """运行时调整上限，下一次读取起生效；负数恢复默认上限"""
+    scheduler = BandwidthScheduler(task_limit=1000)
+    scheduler.set_task_limit('a', limit=0)
+    assert scheduler.reserve(10 ** 6, 'a') == 0
+
+    scheduler.set_task_limit('a', limit=-1)
+    scheduler.reserve(0, 'a')
+    assert scheduler.get_statistics()['tasks']['a']['rate'] == 1000
+
+
+def test_throttle_stops_waiting_when_cancelled():
+    """限速等待期间取消时提前结束"""
+    scheduler = BandwidthScheduler(task_limit=1000)
+
+    started = time.monotonic()
+    scheduler.throttle(10000, 'a', should_cancel=lambda: time.monotonic() - started > 0.05)
+
+    assert time.monotonic() - started < 1
@@ -0,0 +1,114 @@
+"""
+任务取消令牌测试
+验证取消信号唤醒同步和异步等待者、执行中断回调、统计取消延迟，以及写入循环在下一分块响应取消
+"""
+
+import asyncio
+import threading
+from io import BytesIO
+
+import pytest
+
+from cancellation import CancellationStats, CancellationToken, TaskCancelledException
+from stream_fetcher import FetchCancelled, stream_to_file
+
+
+def test_cancel_runs_callbacks_once():
+    """取消时执行已注册的回调，重复取消不再执行；注销的回调不执行"""
+    token = CancellationToken('task')
+    calls = []
+    token.register(lambda: calls.append('a'))
+    unregister = token.register(lambda: calls.append('b'))
+    unregister()
+
+    token.cancel()
+    token.cancel()
+
+    assert calls == ['a']
+    assert token.is_cancelled()
+
+
+def test_register_after_cancel_runs_immediately():
+    token = CancellationToken()
+    token.cancel()
+    calls = []
+
+    token.register(lambda: calls.append(1))
+
+    assert calls == [1]
+
+
+def test_failing_callback_does_not_stop_cancel():
+    token = CancellationToken()
+    calls = []
+    token.register(lambda: 1 / 0)
+    token.register(lambda: calls.append(1))
+
+    token.cancel()
+
+    assert calls == [1]
+
+
+def test_wait_wakes_up_thread():
+    token = CancellationToken()
+    assert not token.wait(0.01)
+
+    threading.Timer(0.05, token.cancel).start()
+
+    assert token.wait(5)
+
+
+def test_wait_async_wakes_up_from_other_thread():
+    """其他线程取消时唤醒事件循环中的等待者"""
+    token = CancellationToken()
+
+    async def waiter():
+        threading.Timer(0.05, token.cancel).start()
+        await asyncio.wait_for(token.wait_async(), 5)
+
+    asyncio.run(waiter())
+    assert token.is_cancelled()
+
+
+def test_raise_if_cancelled_records_latency_once(monkeypatch):
+    """首次响应取消时记录一次延迟"""
+    stats = CancellationStats()
+    monkeypatch.setattr('cancellation.cancellation_stats', stats)
+    token = CancellationToken()
+    token.raise_if_cancelled()
+    assert token.mark_observed() is None
+
+    token.cancel()
+    for _ in range(2):
+        with pytest.raises(TaskCancelledException):
+            token.raise_if_cancelled()
+
+    assert stats.snapshot()['count'] == 1
+
+
+def test_stats_snapshot():
+    stats = CancellationStats()
+    assert stats.snapshot() == {'count': 0, 'avg_ms': 0.0, 'p95_ms': 0.0, 'max_ms': 0.0}
+
+    stats.record(0.01)
+    stats.record(0.03)
+
+    snapshot = stats.snapshot()
+    assert (snapshot['count'], snapshot['avg_ms'], snapshot['max_ms']) == (2, 20.0, 30.0)
+
+
+def test_write_loop_stops_at_next_chunk(tmp_path):
+    """写入循环每个分块检查一次令牌，取消后在下一分块停止"""
+    token = CancellationToken()
+    raw = BytesIO(b'x' * (1024 * 1024))
+    original = raw.readinto
+
+    def readinto(view):
+        token.cancel()
+        return original(view)
+
+    raw.readinto = readinto
+
+    with pytest.raises(FetchCancelled):
+        stream_to_file(raw, tmp_path / 'song.mp3', should_cancel=token.is_cancelled)
+    assert raw.tell() < len(raw.getvalue())
@@ -0,0 +1,135 @@
+"""
+专辑封面缓存测试
+验证同一封面只下载一次（不同CDN节点视为同一封面）、并发请求合并、内存LRU淘汰和磁盘缓存
+"""
+
+import threading
+import time
+
+import pytest
+import requests
+
+import cover_cache
+from cover_cache import CoverArtCache, guess_image_mime
+
+
+URL = 'http://p1.music.126.net/token==/109951163.jpg'
+
+
+class _Response:
+    def __init__(self, content: bytes):
+        self.content = content
+
+    def raise_for_status(self) -> None:
+        pass
+
+
+class _Pool:
+    """按URL路径返回封面数据，可设置延迟和失败"""
+
+    def __init__(self, delay: float = 0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.urls = []
+
+    def get(self, url, timeout=None):
+        self.urls.append(url)
+        time.sleep(self.delay)
+        if self.fail:
+            raise requests.ConnectionError('offline')
+        return _Response(b'cover:' + url.rsplit('/', 1)[-1].encode() * 10)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    instance = _Pool()
+    monkeypatch.setattr(cover_cache, 'get_http_pool', lambda name: instance)
+    return instance
+
+
+def test_same_cover_fetched_once(tmp_path, pool):
+    """同一专辑的封面只下载一次，不同CDN节点和查询参数视为同一封面"""
+    cache = CoverArtCache(str(tmp_path))
+
+    first = cache.get(URL)
+    second = cache.get(URL.replace('p1.', 'p3.').replace('http:', 'https:') + '?param=500y500')
+
+    assert first == second
+    assert len(pool.urls) == 1
+    assert cache.get_statistics()['memory_hits'] == 1
+
+
+def test_concurrent_requests_coalesce(tmp_path, pool):
+    """并发请求同一封面时只有一个请求下载，其余等待结果"""
+    pool.delay = 0.2
+    cache = CoverArtCache(str(tmp_path))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(URL))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(pool.urls) == 1
+    assert len(set(results)) == 1 and results[0] is not None
+    assert cache.get_statistics()['coalesced'] == 4
+
+
+def test_disk_cache_survives_restart(tmp_path, pool):
+    """磁盘缓存在新实例中命中，不再下载"""
+    CoverArtCache(str(tmp_path)).get(URL)
+    cache = CoverArtCache(str(tmp_path))
+
+    assert cache.get(URL) is not None
+    assert len(pool.urls) == 1
+    assert cache.get_statistics()['disk_hits'] == 1
+
+
+def test_memory_lru_eviction(tmp_path, pool):
+    """内存缓存超过上限时淘汰最久未使用的封面"""
+    size = len(pool.get('/a.jpg').content)
+    pool.urls.clear()
+    cache = CoverArtCache(str(tmp_path), max_memory_bytes=size * 2, max_disk_bytes=0)
+
+    cache.get('http://p1.music.126.net/x/a.jpg')
+    cache.get('http://p1.music.126.net/x/b.jpg')
+    cache.get('http://p1.music.126.net/x/a.jpg')
+    cache.get('http://p1.music.126.net/x/c.jpg')
+    cache.get('http://p1.music.126.net/x/a.jpg')
+    cache.get('http://p1.music.126.net/x/b.jpg')
+
+    # a一直被使用，b被淘汰后重新下载
+    assert [url.rsplit('/', 1)[-1] for url in pool.urls] == ['a.jpg', 'b.jpg', 'c.jpg', 'b.jpg']
+    assert cache.get_statistics()['memory_bytes'] <= size * 2
+
+
+def test_failed_fetch_is_not_cached(tmp_path, pool):
+    pool.fail = True
+    cache = CoverArtCache(str(tmp_path))
+
+    assert cache.get(URL) is None
+    pool.fail = False
+    assert cache.get(URL) is not None
+    assert len(pool.urls) == 2
+    assert cache.get_statistics()['failures'] == 1
+
+
+def test_disk_eviction(tmp_path, pool):
+    """磁盘缓存超过上限时淘汰到上限的80%以下"""
+    size = len(pool.get('/a.jpg').content)
+    cache = CoverArtCache(str(tmp_path), max_disk_bytes=size * 3)
+
+    for name in 'abcd':
+        cache.get(f'http://p1.music.126.net/x/{name}.jpg')
+
+    assert cache.get_statistics()['disk_bytes'] <= size * 3 * 0.8
+    assert sum(path.stat().st_size for path in tmp_path.glob('*/*')) <= size * 3 * 0.8
+
+
+def test_empty_url():
+    assert CoverArtCache(max_disk_bytes=0).get('') is None
+
+
+def test_guess_image_mime():
+    assert guess_image_mime(b'\x89PNG\r\n') == 'image/png'
+    assert guess_image_mime(b'\xff\xd8\xff') == 'image/jpeg'
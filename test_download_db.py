@@ -0,0 +1,531 @@
+"""
+下载数据库测试
+验证批量下载规划（跳过、升级、下载及负缓存）、批量查询、延迟批量写入、统计计数、歌手索引、连接池、曲库监视器的文件变化同步和歌曲ID索引快照
+"""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from download_db import DownloadDatabase, _ConnectionPool, quality_rank
+from music_downloader import QualityLevel
+
+
+def _add(db: DownloadDatabase, song_id: int, file_path, quality: str = 'exhigh', status: str = 'success',
+         file_size: int = 4) -> None:
+    db.add_song({
+        'song_id': song_id,
+        'song_name': f'歌曲{song_id}',
+        'artists': '歌手',
+        'album': '专辑',
+        'file_path': str(file_path),
+        'file_size': file_size,
+        'quality': quality,
+        'status': status
+    })
+
+
+def _write(path: Path, data: bytes = b'data') -> Path:
+    path.write_bytes(data)
+    return path
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = DownloadDatabase(str(tmp_path / 'downloads.db'))
+    yield database
+    database.flush()
+
+
+def test_plan_downloads_skip_upgrade_download(db, tmp_path):
+    """按请求音质分为跳过、升级和下载三类，下载保持输入顺序并去重"""
+    _add(db, 1, _write(tmp_path / '1.flac'), quality='lossless')
+    _add(db, 2, _write(tmp_path / '2.mp3'), quality='standard')
+    _add(db, 4, tmp_path / '4.mp3')
+    _add(db, 5, _write(tmp_path / '5.mp3'), status='failed')
+
+    plan = db.plan_downloads([5, 1, 3, 2, 4, 3], 'exhigh')
+
+    assert list(plan.skip) == [1]
+    assert list(plan.upgrade) == [2]
+    assert plan.upgrade[2].quality == 'standard'
+    # 3没有记录，4的文件不存在，5的记录失败
+    assert plan.download == [5, 3, 4]
+
+
+def test_plan_downloads_same_quality_is_skipped(db, tmp_path):
+    """已有文件的音质与请求音质相同时跳过"""
+    _add(db, 1, _write(tmp_path / '1.mp3'), quality='exhigh')
+
+    plan = db.plan_downloads([1], 'exhigh')
+
+    assert list(plan.skip) == [1]
+    assert not plan.upgrade and not plan.download
+
+
+def test_plan_downloads_negative_cache_turns_upgrade_into_skip(db, tmp_path):
+    """请求音质已确认不可用时，较低音质的文件直接跳过"""
+    _add(db, 1, _write(tmp_path / '1.mp3'), quality='exhigh')
+    _add(db, 2, _write(tmp_path / '2.mp3'), quality='exhigh')
+    db.mark_unavailable(1, 'lossless', 'no lossless')
+
+    plan = db.plan_downloads([1, 2], 'lossless')
+
+    assert list(plan.skip) == [1]
+    assert list(plan.upgrade) == [2]
+
+
+def test_plan_downloads_negative_cache_other_quality_or_expired(db, tmp_path):
+    """其他音质的负缓存和已过期的负缓存不影响升级"""
+    _add(db, 1, _write(tmp_path / '1.mp3'), quality='exhigh')
+    _add(db, 2, _write(tmp_path / '2.mp3'), quality='exhigh')
+    db.mark_unavailable(1, 'hires', 'no hires')
+    db.mark_unavailable(2, 'lossless', 'expired', ttl=-1)
+
+    plan = db.plan_downloads([1, 2], 'lossless')
+
+    assert list(plan.upgrade) == [1, 2]
+    assert not plan.skip
+
+
+def test_plan_downloads_negative_cache_does_not_hide_missing_files(db, tmp_path):
+    """文件不存在的歌曲即使请求音质在负缓存中也需要下载"""
+    _add(db, 1, tmp_path / '1.mp3', quality='exhigh')
+    db.mark_unavailable(1, 'lossless', 'no lossless')
+
+    plan = db.plan_downloads([1], 'lossless')
+
+    assert plan.download == [1]
+    assert not plan.skip
+
+
+@pytest.mark.parametrize('write_behind', [True, False])
+def test_failed_upgrade_keeps_existing_file(tmp_path, write_behind):
+    """升级下载失败写入的失败记录不覆盖原有的成功记录，低音质文件仍然跳过"""
+    db = DownloadDatabase(str(tmp_path / 'downloads.db'), write_behind=write_behind)
+    path = _write(tmp_path / '1.mp3')
+    _add(db, 1, path, quality='exhigh')
+    db.flush()
+    assert list(db.plan_downloads([1], 'lossless').upgrade) == [1]
+
+    _add(db, 1, '', quality='lossless', status='failed', file_size=0)
+    db.flush()
+
+    assert db.is_downloaded(1)
+    song = db.get_song_info(1)
+    assert (song.status, song.quality, song.file_path) == ('success', 'exhigh', str(path))
+    assert list(db.plan_downloads([1], 'exhigh').skip) == [1]
+    assert list(db.plan_downloads([1], 'lossless').upgrade) == [1]
+
+
+def test_failed_record_collapsed_with_pending_success(db, tmp_path):
+    """延迟写入队列中同一歌曲的成功记录不被随后的失败记录合并掉"""
+    path = _write(tmp_path / '1.mp3')
+    _add(db, 1, path)
+    _add(db, 1, '', status='failed', file_size=0)
+    db.flush()
+
+    assert db.is_downloaded(1)
+    assert db.get_song_info(1).file_path == str(path)
+
+
+def test_failed_record_replaces_non_success_record(db, tmp_path):
+    """没有成功记录时失败记录照常写入"""
+    _add(db, 1, tmp_path / '1.mp3', status='missing')
+    _add(db, 2, '', status='failed', file_size=0)
+    db.flush()
+    _add(db, 1, '', status='failed', file_size=0)
+    db.flush()
+
+    assert db.get_song_info(1).status == 'failed'
+    assert db.get_song_info(2).status == 'failed'
+    assert not db.is_downloaded(1)
+
+
+def test_write_behind_batches_and_collapses(db, tmp_path):
+    """记录（连同存放位置）先进入队列，同一首歌只写入最后一条；查询队列中的歌曲前先写入"""
+    _add(db, 1, tmp_path / '1.mp3', quality='standard')
+    _add(db, 1, tmp_path / '1.mp3', quality='exhigh')
+    _add(db, 2, tmp_path / '2.mp3')
+    statistics = db._pool.recorder.get_statistics()
+    assert (statistics['pending'], statistics['collapsed'], statistics['flushes']) == (4, 1, 0)
+
+    assert db.get_song_info(1).quality == 'exhigh'
+
+    statistics = db._pool.recorder.get_statistics()
+    assert (statistics['pending'], statistics['flushes'], statistics['rows_written']) == (0, 1, 4)
+
+
+def test_flush_drops_invalid_record_group(db, tmp_path, caplog):
+    """批量写入时某条记录的歌手索引违反约束，整组回滚（下载记录也不写入），其他记录照常写入"""
+    conn = db._connect()
+    conn.execute('''
+        CREATE TRIGGER reject_song_2 BEFORE INSERT ON song_artists WHEN NEW.song_id = 2
+        BEGIN
+            SELECT RAISE(ABORT, 'rejected');
+        END
+    ''')
+    conn.commit()
+    for song_id in (1, 2, 3):
+        _add(db, song_id, tmp_path / f'{song_id}.mp3')
+
+    with caplog.at_level('WARNING', logger='download_db'):
+        # 歌曲2的下载记录被丢弃，存放位置单独成组照常写入
+        assert db.flush() == 5
+
+    assert '丢弃无效的下载记录 2' in caplog.text
+    assert [row[0] for row in conn.execute('SELECT song_id FROM downloaded_songs ORDER BY song_id')] == [1, 3]
+    assert [row[0] for row in conn.execute('SELECT song_id FROM song_grams ORDER BY song_id')] == [1, 3]
+    assert not db.is_downloaded(2)
+    assert db.is_downloaded(1) and db.is_downloaded(3)
+    assert not conn.in_transaction
+
+
+def test_plan_downloads_include_locations(db, tmp_path):
+    """跳过的歌曲可同时取出所有存放位置"""
+    _add(db, 1, _write(tmp_path / '1.mp3'))
+
+    plan = db.plan_downloads([1], 'exhigh', include_locations=True)
+
+    assert [location['file_path'] for location in plan.locations[1]] == [str(tmp_path / '1.mp3')]
+
+
+# 音质从低到高
+QUALITY_ORDER = ['standard', 'exhigh', 'lossless', 'hires', 'jyeffect', 'sky', 'dolby', 'jymaster']
+
+
+def test_every_quality_level_is_ranked():
+    """每个音质等级都有确定的等级，顺序从低到高"""
+    assert sorted(level.value for level in QualityLevel) == sorted(QUALITY_ORDER)
+    assert all(quality_rank(level.value) >= 0 for level in QualityLevel)
+    ranks = [quality_rank(quality) for quality in QUALITY_ORDER]
+    assert ranks == sorted(ranks) and len(set(ranks)) == len(ranks)
+
+
+@pytest.mark.parametrize('existing', QUALITY_ORDER)
+def test_plan_downloads_compares_every_quality_level(db, tmp_path, existing):
+    """已有文件的音质不低于请求音质时跳过，否则升级"""
+    _add(db, 1, _write(tmp_path / '1.mp3'), quality=existing)
+
+    for requested in QUALITY_ORDER:
+        plan = db.plan_downloads([1], requested)
+        if QUALITY_ORDER.index(existing) >= QUALITY_ORDER.index(requested):
+            assert list(plan.skip) == [1], (existing, requested)
+        else:
+            assert list(plan.upgrade) == [1], (existing, requested)
+
+
+def test_apply_file_changes_missing_and_restored(db, tmp_path):
+    """删除的文件标记为missing并删除存放位置，重新出现时恢复"""
+    path = str(tmp_path / '1.mp3')
+    _add(db, 1, path)
+    db.flush()
+
+    assert db.apply_file_changes({}, [path]) == {'missing': 1, 'restored': 0, 'resized': 0}
+    assert db.get_song_info(1).status == 'missing'
+    assert db.get_song_locations(1) == []
+    assert not db.is_downloaded(1)
+
+    assert db.apply_file_changes({path: 6}, []) == {'missing': 0, 'restored': 1, 'resized': 0}
+    song = db.get_song_info(1)
+    assert song.status == 'success'
+    assert song.file_size == 6
+    assert [location['file_path'] for location in db.get_song_locations(1)] == [path]
+    assert db.is_downloaded(1)
+
+
+def test_apply_file_changes_resized(db, tmp_path):
+    """大小变化的文件只更新记录中的大小"""
+    path = str(tmp_path / '1.mp3')
+    _add(db, 1, path, file_size=4)
+
+    assert db.apply_file_changes({path: 4}, []) == {'missing': 0, 'restored': 0, 'resized': 0}
+    assert db.apply_file_changes({path: 10}, []) == {'missing': 0, 'restored': 0, 'resized': 1}
+    song = db.get_song_info(1)
+    assert song.status == 'success'
+    assert song.file_size == 10
+
+
+def test_apply_file_changes_ignores_unknown_and_failed(db, tmp_path):
+    """没有记录的路径和非成功的记录不受影响"""
+    path = str(tmp_path / '1.mp3')
+    _add(db, 1, path, status='failed')
+
+    result = db.apply_file_changes({str(tmp_path / 'other.mp3'): 1}, [path])
+
+    assert result == {'missing': 0, 'restored': 0, 'resized': 0}
+    assert db.get_song_info(1).status == 'failed'
+
+
+def test_index_snapshot_reused_when_generation_matches(db, tmp_path):
+    """保存的快照在数据库未变化时被直接映射"""
+    for song_id in (3, 1, 2):
+        _add(db, song_id, tmp_path / f'{song_id}.mp3')
+    _add(db, 4, tmp_path / '4.mp3', status='failed')
+    db.flush()
+    assert db.is_downloaded(1)
+    db._pool.index.save()
+    assert db._pool.index.snapshot_path.exists()
+
+    # 新的连接池相当于重启后的进程
+    index = _ConnectionPool(db.db_path).index
+    assert index.contains(2)
+    assert not index.contains(4)
+    assert not index.contains(5)
+    assert index.get_statistics()['source'] == 'snapshot'
+    assert index.get_statistics()['base_size'] == 3
+
+
+def test_index_snapshot_ignored_after_external_write(db, tmp_path):
+    """其他连接修改下载记录后代数变化，快照不再使用"""
+    _add(db, 1, tmp_path / '1.mp3')
+    db.flush()
+    assert db.is_downloaded(1)
+    db._pool.index.save()
+
+    conn = sqlite3.connect(str(db.db_path))
+    conn.execute("UPDATE downloaded_songs SET status = 'failed' WHERE song_id = 1")
+    conn.commit()
+    conn.close()
+
+    index = _ConnectionPool(db.db_path).index
+    assert not index.contains(1)
+    assert index.get_statistics()['source'] == 'table'
+
+
+def test_index_snapshot_ignored_when_corrupt(db, tmp_path):
+    """快照文件损坏时从数据库重建"""
+    _add(db, 1, tmp_path / '1.mp3')
+    db.flush()
+    assert db.is_downloaded(1)
+    db._pool.index.save()
+    db._pool.index.snapshot_path.write_bytes(b'corrupt')
+
+    index = _ConnectionPool(db.db_path).index
+    assert index.contains(1)
+    assert index.get_statistics()['source'] == 'table'
+
+
+def test_index_tracks_status_changes(db, tmp_path):
+    """写入成功记录后索引立即可见，改为其他状态后移除"""
+    assert not db.is_downloaded(1)
+    _add(db, 1, tmp_path / '1.mp3')
+    db.flush()
+    assert db.is_downloaded(1)
+
+    db.update_song_status(1, 'failed')
+    assert not db.is_downloaded(1)
+
+
+def test_instances_share_pool_and_reuse_connection(db, tmp_path):
+    """同一数据库文件的实例共用连接池，同一线程反复查询复用一个WAL连接"""
+    other = DownloadDatabase(str(tmp_path / 'downloads.db'))
+    opened = db._pool.connections_opened
+
+    for song_id in range(20):
+        db.get_song_info(song_id)
+        other.is_downloaded(song_id)
+
+    assert other._pool is db._pool
+    assert db._connect() is other._connect()
+    assert db._pool.connections_opened == opened
+    assert db._connect().execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+
+def test_connection_per_thread(db):
+    """每个线程使用自己的连接"""
+    connections = []
+    thread = threading.Thread(target=lambda: connections.append(db._connect()))
+    thread.start()
+    thread.join()
+
+    assert connections[0] is not db._connect()
+
+
+def test_connection_recreated_after_fork(db):
+    """进程fork后不使用父进程的连接"""
+    conn = db._connect()
+    db._pool._local.pid = -1
+
+    assert db._connect() is not conn
+
+
+def test_reads_not_blocked_by_open_write(db, tmp_path):
+    """其他连接的写事务未提交时，读取不被阻塞，读到已提交的数据"""
+    _add(db, 1, tmp_path / '1.mp3')
+    db.flush()
+    writer = sqlite3.connect(str(tmp_path / 'downloads.db'))
+    writer.execute("UPDATE downloaded_songs SET quality = 'lossless' WHERE song_id = 1")
+
+    started = time.monotonic()
+    assert db.get_song_info(1).quality == 'exhigh'
+    assert time.monotonic() - started < 1
+
+    writer.rollback()
+    writer.close()
+
+
+def test_bulk_lookups_query_in_batches(db, tmp_path):
+    """批量查询按500个ID一组，查询数与歌曲数无关；重复ID只查一次"""
+    for song_id in range(1, 701, 2):
+        _add(db, song_id, tmp_path / f'{song_id}.mp3')
+    db.flush()
+    statements = []
+    conn = db._connect()
+    conn.set_trace_callback(statements.append)
+    try:
+        songs = db.get_songs_bulk(list(range(1, 1001)) + [1, 3])
+        locations = db.get_locations_bulk(list(range(1, 1001)))
+    finally:
+        conn.set_trace_callback(None)
+
+    assert sorted(songs) == list(range(1, 701, 2))
+    assert songs[3].file_path == str(tmp_path / '3.mp3')
+    assert sorted(locations) == list(range(1, 701, 2))
+    assert sum(1 for sql in statements if sql.lstrip().upper().startswith('SELECT')) == 4
+
+
+def test_locations_bulk_lists_store_copy_first(db, tmp_path):
+    _add(db, 1, tmp_path / 'a' / '1.mp3')
+    db.add_song_location(1, 'exhigh', str(tmp_path / '.store' / '1.mp3'), 'store')
+
+    locations = db.get_locations_bulk([1, 2])
+
+    assert [location['link_type'] for location in locations[1]] == ['store', 'download']
+
+
+def _scanned_statistics(db: DownloadDatabase) -> tuple:
+    """扫描下载记录得到的统计值，与维护的计数比较"""
+    conn = db._connect()
+    by_status = dict(conn.execute('SELECT status, COUNT(*) FROM downloaded_songs GROUP BY status'))
+    total_size = conn.execute(
+        "SELECT COALESCE(SUM(file_size), 0) FROM downloaded_songs WHERE status = 'success'"
+    ).fetchone()[0]
+    artists = conn.execute('SELECT COUNT(DISTINCT artists) FROM downloaded_songs').fetchone()[0]
+    return sum(by_status.values()), by_status.get('success', 0), by_status.get('failed', 0), total_size, artists
+
+
+def _maintained_statistics(db: DownloadDatabase) -> tuple:
+    statistics = db.get_statistics()
+    return (statistics['total_songs'], statistics['success_songs'], statistics['failed_songs'],
+            statistics['total_size'], statistics['artist_count'])
+
+
+def test_statistics_counters_follow_changes(db, tmp_path):
+    """新增、覆盖、状态变化、换歌手和删除后，维护的计数与全表扫描一致"""
+    for song_id in range(1, 7):
+        _add(db, song_id, tmp_path / f'{song_id}.mp3', file_size=song_id * 10)
+    db.add_song({'song_id': 7, 'song_name': '歌曲7', 'artists': '其他歌手', 'album': '',
+                 'file_path': str(tmp_path / '7.mp3'), 'file_size': 70, 'quality': 'exhigh', 'status': 'success'})
+    _add(db, 8, '', status='failed', file_size=0)
+    db.flush()
+    assert _maintained_statistics(db) == _scanned_statistics(db) == (8, 7, 1, 280, 2)
+
+    _add(db, 1, tmp_path / '1.flac', quality='lossless', file_size=100)
+    db.update_song_status(2, 'missing')
+    db.add_song({'song_id': 7, 'song_name': '歌曲7', 'artists': '歌手', 'album': '',
+                 'file_path': str(tmp_path / '7.mp3'), 'file_size': 70, 'quality': 'exhigh', 'status': 'success'})
+    assert db.delete_by_file_paths('downloaded_songs', [str(tmp_path / '3.mp3')]) == 1
+
+    assert _maintained_statistics(db) == _scanned_statistics(db) == (7, 5, 1, 100 + 40 + 50 + 60 + 70, 1)
+
+
+def test_statistics_recompute_and_migration(tmp_path):
+    """统计表被外部修改后可重新计算；没有统计表的旧数据库打开时从记录计算"""
+    path = str(tmp_path / 'downloads.db')
+    db = DownloadDatabase(path)
+    for song_id in range(1, 4):
+        _add(db, song_id, tmp_path / f'{song_id}.mp3')
+    db.flush()
+    expected = _scanned_statistics(db)
+
+    conn = db._connect()
+    conn.execute("UPDATE song_stats SET song_count = 100")
+    conn.commit()
+    assert _maintained_statistics(db) != expected
+    db.get_statistics(recompute=True)
+    assert _maintained_statistics(db) == expected
+
+    conn.executescript('''
+        DROP TABLE song_stats;
+        DROP TABLE artist_stats;
+        DROP TRIGGER songs_stats_insert;
+        DROP TRIGGER songs_stats_delete;
+        DROP TRIGGER songs_stats_update;
+    ''')
+    assert _maintained_statistics(DownloadDatabase(path)) == expected
+
+
+def test_statistics_do_not_scan_records(db, tmp_path):
+    """读取统计信息只读统计表，不扫描下载记录"""
+    _add(db, 1, tmp_path / '1.mp3')
+    db.flush()
+    statements = []
+    conn = db._connect()
+    conn.set_trace_callback(statements.append)
+    try:
+        db.get_statistics()
+    finally:
+        conn.set_trace_callback(None)
+
+    assert statements and not any('downloaded_songs' in sql for sql in statements)
+
+
+def _add_artist_song(db: DownloadDatabase, song_id: int, artists: str) -> None:
+    db.add_song({'song_id': song_id, 'song_name': f'歌曲{song_id}', 'artists': artists, 'album': '',
+                 'file_path': f'/music/{song_id}.mp3', 'file_size': 4, 'quality': 'exhigh', 'status': 'success'})
+
+
+def _artist_ids(db: DownloadDatabase, artist: str, prefix: bool = False) -> list:
+    return sorted(song.song_id for song in db.get_songs_by_artist(artist, prefix=prefix))
+
+
+def test_artist_index_exact_and_prefix(db):
+    """合唱歌曲中的每位歌手都可匹配；精确匹配忽略大小写、全半角和多余空白，不匹配子串"""
+    _add_artist_song(db, 1, '周杰伦')
+    _add_artist_song(db, 2, '周杰伦/费玉清')
+    _add_artist_song(db, 3, 'Taylor  Swift')
+    _add_artist_song(db, 4, '周杰')
+
+    assert _artist_ids(db, '周杰伦') == [1, 2]
+    assert _artist_ids(db, '费玉清') == [2]
+    assert _artist_ids(db, 'ｔａｙｌｏｒ swift') == [3]
+    assert _artist_ids(db, '周杰') == [4]
+    assert _artist_ids(db, '周杰', prefix=True) == [1, 2, 4]
+    assert _artist_ids(db, '杰伦') == []
+    assert _artist_ids(db, '  ') == []
+
+
+def test_artist_index_follows_changes(db):
+    """歌手变化时更新索引，记录删除时删除索引"""
+    _add_artist_song(db, 1, '周杰伦/费玉清')
+    _add_artist_song(db, 1, '周杰伦')
+    db.flush()
+
+    assert _artist_ids(db, '费玉清') == []
+    db.delete_by_file_paths('downloaded_songs', ['/music/1.mp3'])
+    assert _artist_ids(db, '周杰伦') == []
+    assert db._connect().execute('SELECT COUNT(*) FROM song_artists').fetchone()[0] == 0
+
+
+def test_artist_lookup_uses_index(db):
+    conn = db._connect()
+    plan = ' '.join(str(row[-1]) for row in conn.execute(
+        'EXPLAIN QUERY PLAN SELECT song_id FROM song_artists a WHERE a.name_key = ?', ('周杰伦',)
+    ))
+
+    assert 'idx_song_artists_name' in plan
+
+
+def test_artist_index_built_for_existing_database(tmp_path):
+    """没有歌手索引的旧数据库打开时为已有记录建立索引"""
+    path = str(tmp_path / 'downloads.db')
+    db = DownloadDatabase(path)
+    _add_artist_song(db, 1, '周杰伦/费玉清')
+    db.flush()
+    db._connect().executescript('DROP TRIGGER song_artists_delete; DROP TABLE song_artists;')
+
+    assert _artist_ids(DownloadDatabase(path), '费玉清') == [1]
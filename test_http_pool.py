@@ -0,0 +1,136 @@
+"""
+HTTP连接池测试
+验证按主机限制并发（不同主机互不影响）、等待名额的超时和取消，
+以及流式响应关闭或未关闭被回收时归还名额
+"""
+
+import gc
+import threading
+import time
+from io import BytesIO
+
+import pytest
+import requests
+
+import http_pool
+from http_pool import HostLimitedPool, PoolWaitCancelled, PoolWaitTimeout
+
+
+class _Session:
+    """代替requests.Session：记录各主机的并发数，可阻塞到release被设置"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = {}
+        self.max_active = {}
+        self.release = threading.Event()
+        self.release.set()
+        self.error = None
+
+    def request(self, method, url, **kwargs):
+        host = url.split('/')[2]
+        with self.lock:
+            self.active[host] = self.active.get(host, 0) + 1
+            self.max_active[host] = max(self.max_active.get(host, 0), self.active[host])
+        try:
+            self.release.wait(5)
+            if self.error is not None:
+                raise self.error
+            response = requests.Response()
+            response.raw = BytesIO(b'')
+            return response
+        finally:
+            with self.lock:
+                self.active[host] -= 1
+
+
+def _pool(per_host_limit: int = 2, acquire_timeout: float = 5) -> HostLimitedPool:
+    pool = HostLimitedPool('test', per_host_limit=per_host_limit, acquire_timeout=acquire_timeout)
+    pool.session = _Session()
+    return pool
+
+
+def test_per_host_limit():
+    """同一主机的并发请求不超过上限，其他主机不受影响"""
+    pool = _pool()
+    pool.session.release.clear()
+    threads = [threading.Thread(target=pool.get, args=(f'http://{host}/song',))
+               for host in ['a.example'] * 5 + ['b.example'] * 2]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    assert pool.session.active == {'a.example': 2, 'b.example': 2}
+    pool.session.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert pool.session.max_active == {'a.example': 2, 'b.example': 2}
+    statistics = pool.get_statistics()
+    assert (statistics['requests'], statistics['in_flight']) == (7, 0)
+    assert statistics['hosts'] == {'a.example': 5, 'b.example': 2}
+
+
+def test_stream_holds_slot_until_closed():
+    """流式响应在关闭前一直占用名额，重复关闭只归还一次"""
+    pool = _pool(per_host_limit=1, acquire_timeout=0.1)
+
+    response = pool.get('http://a.example/1', stream=True)
+    with pytest.raises(PoolWaitTimeout):
+        pool.get('http://a.example/2')
+    response.close()
+    response.close()
+
+    pool.get('http://a.example/3')
+    statistics = pool.get_statistics()
+    assert (statistics['wait_timeouts'], statistics['in_flight']) == (1, 0)
+
+
+def test_leaked_stream_released_on_collect():
+    """未关闭的流式响应被回收时归还名额"""
+    pool = _pool(per_host_limit=1, acquire_timeout=0.1)
+
+    pool.get('http://a.example/1', stream=True)
+    gc.collect()
+
+    pool.get('http://a.example/2')
+    assert pool.get_statistics()['leaked'] == 1
+
+
+def test_wait_is_cancellable(monkeypatch):
+    """等待名额期间定期检查取消"""
+    monkeypatch.setattr(http_pool, 'ACQUIRE_POLL_SECONDS', 0.01)
+    pool = _pool(per_host_limit=1)
+    response = pool.get('http://a.example/1', stream=True)
+    cancelled = threading.Event()
+    threading.Timer(0.05, cancelled.set).start()
+
+    started = time.monotonic()
+    with pytest.raises(PoolWaitCancelled):
+        pool.get('http://a.example/2', should_cancel=cancelled.is_set)
+
+    assert time.monotonic() - started < 1
+    response.close()
+
+
+def test_failed_request_releases_slot():
+    pool = _pool(per_host_limit=1, acquire_timeout=0.1)
+    pool.session.error = requests.ConnectionError('refused')
+
+    with pytest.raises(requests.ConnectionError):
+        pool.get('http://a.example/1', stream=True)
+
+    pool.session.error = None
+    pool.get('http://a.example/2')
+    assert pool.get_statistics()['errors'] == 1
+
+
+def test_default_timeout():
+    """未指定timeout时使用连接池的超时配置"""
+    pool = _pool()
+    seen = []
+    pool.session.request = lambda method, url, **kwargs: seen.append(kwargs['timeout']) or requests.Response()
+
+    pool.get('http://a.example/1')
+    pool.get('http://a.example/1', timeout=1)
+
+    assert seen == [pool.timeout, 1]
@@ -0,0 +1,165 @@
+"""
+下载去重测试
+验证同一首歌（相同音质）的并发下载只由第一个请求者下载，其余请求复用其结果；
+负责者失败时等待者自行下载，等待超时时等待者使用独立的临时文件下载
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import music_downloader
+from download_db import DownloadDatabase
+from inflight import InflightRegistry
+from music_downloader import DownloadResult, MusicDownloader, MusicInfo
+
+
+DATA = b'audio' * 100
+
+
+def test_claim_and_complete():
+    """第一个请求者负责下载，其余请求者拿到同一个Future；完成后重新登记成为新的负责者"""
+    registry = InflightRegistry()
+
+    leader, future = registry.claim((1, 'exhigh'))
+    waiter, same = registry.claim((1, 'exhigh'))
+    other, _ = registry.claim((1, 'lossless'))
+
+    assert (leader, waiter, other) == (True, False, True)
+    assert same is future
+    registry.complete((1, 'exhigh'), future, 'result')
+    assert future.result() == 'result'
+    assert registry.claim((1, 'exhigh'))[0]
+    statistics = registry.get_statistics()
+    assert (statistics['leaders'], statistics['coalesced'], statistics['inflight']) == (3, 1, 2)
+
+
+def _wait_until(predicate) -> None:
+    """等待另一线程到达指定状态"""
+    deadline = time.monotonic() + 5
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    instance = InflightRegistry()
+    monkeypatch.setattr(music_downloader, 'inflight_registry', instance)
+    return instance
+
+
+@pytest.fixture
+def make_downloader(tmp_path, monkeypatch):
+    monkeypatch.setattr(music_downloader, 'DownloadDatabase',
+                        lambda: DownloadDatabase(str(tmp_path / 'downloads.db')))
+    monkeypatch.setattr(music_downloader, 'get_library_store', lambda: None)
+    downloaders = []
+
+    def make(name: str, fetch) -> MusicDownloader:
+        downloader = MusicDownloader(download_dir=str(tmp_path / name), create_artist_dir=False)
+        downloader._fetch_music_file = fetch(downloader)
+        downloaders.append(downloader)
+        return downloader
+
+    yield make
+    for downloader in downloaders:
+        downloader.db.flush()
+
+
+def _writing_fetch(started: threading.Event = None, release: threading.Event = None, calls: list = None):
+    """模拟下载：可在开始后阻塞，结束时写入文件"""
+    def factory(downloader: MusicDownloader):
+        def fetch(music_id, quality, cancel_token, plan=None, independent=False):
+            if calls is not None:
+                calls.append((downloader.download_dir.name, independent))
+            if started is not None:
+                started.set()
+            if release is not None:
+                release.wait(5)
+            info = MusicInfo(id=music_id, name='歌曲', artists='歌手', album='', pic_url='', duration=0,
+                             track_number=0, download_url='', file_type='flac', file_size=len(DATA),
+                             quality=quality)
+            path = downloader.download_dir / '歌手 - 歌曲.flac'
+            path.write_bytes(DATA)
+            return DownloadResult(success=True, file_path=str(path), file_size=len(DATA), music_info=info)
+        return fetch
+    return factory
+
+
+def _failing_fetch(calls: list, release: threading.Event = None):
+    def factory(downloader: MusicDownloader):
+        def fetch(music_id, quality, cancel_token, plan=None, independent=False):
+            calls.append(downloader.download_dir.name)
+            if release is not None:
+                release.wait(5)
+            return DownloadResult(success=False, error_message='下载失败')
+        return fetch
+    return factory
+
+
+def test_concurrent_download_is_shared(registry, make_downloader):
+    """并发下载同一首歌时只下载一次，等待者把结果链接到自己的目录"""
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    leader = make_downloader('playlist', _writing_fetch(started, release, calls))
+    waiter = make_downloader('artist', _writing_fetch(calls=calls))
+
+    with ThreadPoolExecutor(2) as executor:
+        first = executor.submit(leader.download_music_file, 1, 'lossless')
+        assert started.wait(5)
+        second = executor.submit(waiter.download_music_file, 1, 'lossless')
+        _wait_until(lambda: registry.get_statistics()['coalesced'])
+        release.set()
+        results = [first.result(), second.result()]
+
+    assert all(result.success for result in results)
+    assert calls == [('playlist', False)]
+    assert results[1].file_path == str(waiter.download_dir / '歌手 - 歌曲.flac')
+    with open(results[1].file_path, 'rb') as f:
+        assert f.read() == DATA
+    assert registry.get_statistics()['bytes_saved'] == len(DATA)
+
+
+def test_waiter_downloads_itself_after_leader_fails(registry, make_downloader):
+    """负责者下载失败时等待者重新登记并自行下载"""
+    release = threading.Event()
+    failed = []
+    calls = []
+    leader = make_downloader('playlist', _failing_fetch(failed, release))
+    waiter = make_downloader('artist', _writing_fetch(calls=calls))
+
+    with ThreadPoolExecutor(2) as executor:
+        first = executor.submit(leader.download_music_file, 1, 'lossless')
+        _wait_until(lambda: registry.get_statistics()['leaders'])
+        second = executor.submit(waiter.download_music_file, 1, 'lossless')
+        _wait_until(lambda: registry.get_statistics()['coalesced'])
+        release.set()
+
+        assert not first.result().success
+        assert second.result().success
+
+    assert failed == ['playlist']
+    assert calls == [('artist', False)]
+    assert registry.get_statistics()['fallbacks'] == 1
+
+
+def test_waiter_stops_waiting_after_timeout(registry, make_downloader):
+    """负责者长时间未结束时等待者不再等待，以独立临时文件自行下载"""
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    leader = make_downloader('playlist', _writing_fetch(started, release, calls))
+    waiter = make_downloader('artist', _writing_fetch(calls=calls))
+    waiter.inflight_wait_timeout = 0.05
+
+    with ThreadPoolExecutor(2) as executor:
+        first = executor.submit(leader.download_music_file, 1, 'lossless')
+        assert started.wait(5)
+        assert waiter.download_music_file(1, 'lossless').success
+        release.set()
+        assert first.result().success
+
+    assert calls == [('playlist', False), ('artist', True)]
+    assert registry.get_statistics()['timeouts'] == 1
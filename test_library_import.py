@@ -0,0 +1,171 @@
+"""
+曲库导入测试
+验证从MP3/FLAC标签读取歌曲ID和音质、没有音质标签时按格式和码率推断、跳过以"."开头的目录，
+已有记录的歌曲只登记存放位置，以及多进程读取、进度回调和取消
+"""
+
+import os
+import struct
+
+import pytest
+from mutagen.flac import FLAC
+from mutagen.id3 import ID3, TIT2, TPE1, TXXX
+
+from cancellation import CancellationToken
+from download_db import DownloadDatabase
+from library_import import LibraryImporter, infer_quality, iter_audio_files, read_song_file
+from stream_tagger import QUALITY_TAG, SONG_ID_TAG
+
+
+def _mp3(path, kbps: int = 320, **tags) -> str:
+    """写入一段固定码率的MPEG1 Layer3帧（44.1kHz），tags为要写入的ID3帧"""
+    bitrate_index = {128: 9, 320: 14}[kbps]
+    frame = bytes([0xFF, 0xFB, bitrate_index << 4, 0x64])
+    frame += b'\x00' * (144 * kbps * 1000 // 44100 - len(frame))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(frame * 20)
+    if tags:
+        id3 = ID3()
+        for frame_tag in tags.values():
+            id3.add(frame_tag)
+        id3.save(str(path))
+    return str(path)
+
+
+def _flac(path, sample_rate: int = 44100, bits: int = 16, **tags) -> str:
+    """只有STREAMINFO和注释块的FLAC文件"""
+    packed = (sample_rate << 44) | (1 << 41) | ((bits - 1) << 36)
+    streaminfo = struct.pack('>HH', 4096, 4096) + b'\x00' * 6 + packed.to_bytes(8, 'big') + b'\x00' * 16
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'fLaC' + bytes([0x80]) + len(streaminfo).to_bytes(3, 'big') + streaminfo)
+    if tags:
+        flac = FLAC(str(path))
+        flac.add_tags()
+        for key, value in tags.items():
+            flac[key] = value
+        flac.save()
+    return str(path)
+
+
+def _tagged_mp3(path, song_id: int, quality: str = '', kbps: int = 320) -> str:
+    tags = {'id': TXXX(encoding=3, desc=SONG_ID_TAG, text=[str(song_id)]),
+            'name': TIT2(encoding=3, text=[f'歌曲{song_id}']),
+            'artist': TPE1(encoding=3, text=['歌手'])}
+    if quality:
+        tags['quality'] = TXXX(encoding=3, desc=QUALITY_TAG, text=[quality])
+    return _mp3(path, kbps, **tags)
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = DownloadDatabase(str(tmp_path / 'downloads.db'))
+    yield database
+    database.flush()
+
+
+@pytest.fixture
+def library(tmp_path):
+    """两个带标签的MP3、一个带标签的FLAC和一个没有标签的MP3"""
+    root = tmp_path / 'music'
+    _tagged_mp3(root / 'a' / '1.mp3', 1, 'exhigh')
+    _tagged_mp3(root / 'a' / '2.mp3', 2)
+    _flac(root / 'b' / '3.flac', TITLE='歌曲3', ARTIST=['歌手', '乐队'], **{SONG_ID_TAG: '3', QUALITY_TAG: 'lossless'})
+    _mp3(root / 'b' / 'untagged.mp3')
+    return root
+
+
+def test_read_song_file(library):
+    """歌曲信息来自标签，没有歌曲ID标签的文件返回None"""
+    song = read_song_file(str(library / 'b' / '3.flac'))
+
+    assert (song['song_id'], song['song_name'], song['quality']) == (3, '歌曲3', 'lossless')
+    assert song['artists'] == '歌手/乐队'
+    assert song['file_size'] == os.path.getsize(library / 'b' / '3.flac')
+    assert read_song_file(str(library / 'b' / 'untagged.mp3')) is None
+
+
+def test_name_falls_back_to_file_name(tmp_path):
+    path = _flac(tmp_path / '歌手 - 无标题.flac', **{SONG_ID_TAG: '7'})
+
+    assert read_song_file(path)['song_name'] == '歌手 - 无标题'
+
+
+@pytest.mark.parametrize('make, expected', [
+    (lambda path: _flac(path / 'x.flac'), 'lossless'),
+    (lambda path: _flac(path / 'x.flac', bits=24), 'hires'),
+    (lambda path: _flac(path / 'x.flac', sample_rate=96000), 'hires'),
+    (lambda path: _mp3(path / 'x.mp3', 320), 'exhigh'),
+    (lambda path: _mp3(path / 'x.mp3', 128), 'standard'),
+])
+def test_infer_quality(tmp_path, make, expected):
+    assert infer_quality(make(tmp_path)) == expected
+
+
+def test_iter_audio_files_skips_dot_dirs(library):
+    """跳过曲库.store、封面缓存.cache等目录和非音频文件，按名称顺序遍历"""
+    _tagged_mp3(library / '.store' / '9.mp3', 9)
+    _tagged_mp3(library / '.cache' / '8.mp3', 8)
+    (library / 'a' / 'cover.jpg').write_bytes(b'jpg')
+
+    paths = [os.path.relpath(path, library) for path in iter_audio_files(str(library))]
+
+    assert paths == [os.path.join('a', '1.mp3'), os.path.join('a', '2.mp3'),
+                     os.path.join('b', '3.flac'), os.path.join('b', 'untagged.mp3')]
+
+
+def test_run_imports_tagged_files(db, library):
+    progress = []
+
+    result = LibraryImporter(db, workers=1, batch_size=2).run(
+        str(library), progress_callback=lambda done, total: progress.append((done, total))
+    )
+
+    assert result == {'files': 4, 'imported': 3, 'located': 0, 'untagged': 1, 'errors': 0,
+                      'processed': 4, 'cancelled': False}
+    assert progress == [(2, 4), (4, 4)]
+    assert db.get_song_info(2).quality == 'exhigh'
+    assert db.get_song_info(3).file_path == str(library / 'b' / '3.flac')
+
+
+def test_existing_records_are_only_located(db, library, tmp_path):
+    """已有成功记录（文件存在）的歌曲不覆盖记录，只登记新的存放位置"""
+    original = _tagged_mp3(tmp_path / 'old' / '1.mp3', 1, 'standard')
+    db.add_song({'song_id': 1, 'song_name': '原记录', 'artists': '歌手', 'file_path': original,
+                 'file_size': 1, 'quality': 'standard', 'status': 'success'})
+
+    result = LibraryImporter(db, workers=1).run(str(library))
+
+    assert (result['imported'], result['located']) == (2, 1)
+    assert db.get_song_info(1).song_name == '原记录'
+    assert str(library / 'a' / '1.mp3') in [location['file_path'] for location in db.get_song_locations(1)]
+
+
+def test_run_again_only_locates(db, library):
+    LibraryImporter(db, workers=1).run(str(library))
+
+    result = LibraryImporter(db, workers=1).run(str(library))
+
+    assert (result['imported'], result['located']) == (0, 3)
+
+
+def test_run_with_worker_processes(db, library):
+    """多个批次时在子进程中读取标签，结果与单进程相同"""
+    result = LibraryImporter(db, workers=2, batch_size=1).run(str(library))
+
+    assert (result['imported'], result['untagged'], result['processed']) == (3, 1, 4)
+    assert db.get_song_info(3).artists == '歌手/乐队'
+
+
+def test_cancelled_run_stops_before_next_batch(db, library):
+    """取消后不再处理剩余批次，已写入的记录保留"""
+    token = CancellationToken()
+
+    def progress(done, total):
+        token.cancel()
+
+    result = LibraryImporter(db, workers=1, batch_size=2).run(str(library), token, progress)
+
+    assert result['cancelled']
+    assert (result['processed'], result['imported']) == (2, 2)
+    assert db.get_song_info(1) is not None
+    assert db.get_song_info(3) is None
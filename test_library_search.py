@@ -0,0 +1,142 @@
+"""
+曲库搜索测试
+验证三元组索引和短词索引的匹配（1到2个字符的词不退化为全表LIKE）、混合搜索词、游标分页，
+以及短词索引随下载记录更新、删除和旧数据库迁移
+"""
+
+import sqlite3
+
+import pytest
+
+from download_db import DownloadDatabase, search_grams, _fts_phrases
+
+
+SONGS = [
+    (1, '晴天', '周杰伦', '叶惠美'),
+    (2, '稻香', '周杰伦', '魔杰座'),
+    (3, 'Love Story', 'Taylor Swift', 'Fearless'),
+    (4, 'C-3PO', 'Droid', 'Star Wars'),
+    (5, '夜曲', '周杰伦', '十一月的萧邦'),
+]
+
+
+def _add(db: DownloadDatabase, song_id: int, name: str, artists: str, album: str = '') -> None:
+    db.add_song({
+        'song_id': song_id,
+        'song_name': name,
+        'artists': artists,
+        'album': album,
+        'file_path': f'/music/{song_id}.flac',
+        'file_size': 4,
+        'quality': 'lossless',
+        'status': 'success'
+    })
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = DownloadDatabase(str(tmp_path / 'downloads.db'))
+    for song in SONGS:
+        _add(database, *song)
+    database.flush()
+    yield database
+    database.flush()
+
+
+def _ids(db: DownloadDatabase, query: str, **kwargs):
+    return sorted(song['song_id'] for song in db.search_library(query, **kwargs)['songs'])
+
+
+def test_search_grams():
+    """只拆出字母数字组成的1到2个字符片段，不跨越空白和标点"""
+    assert search_grams('晴天', 'C-3PO') == ' '.join(sorted({'晴', '天', '晴天', 'C', '3', 'P', 'O', '3P', 'PO'}))
+    assert search_grams('', None) == ''
+
+
+def test_fts_phrases_split_terms_by_index():
+    """长词用三元组索引，短词用短词索引，含标点的短词另外用LIKE确认"""
+    assert _fts_phrases('周杰伦 晴 c-') == (['"周杰伦"'], ['"晴"', '"c"'], ['c-'])
+    assert _fts_phrases('周杰伦 晴', fts_enabled=False) == ([], [], ['周杰伦', '晴'])
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('晴', [1]),
+    ('杰伦', [1, 2, 5]),
+    ('lo', [3]),
+    ('LO', [3]),
+    ('3p', [4]),
+    ('周杰伦 夜', [5]),
+    ('周杰伦 曲', [5]),
+    ('taylor st', [3]),
+    ('c-', [4]),
+    ('天稻', []),
+])
+def test_short_terms_use_gram_index(db, query, expected):
+    """1到2个字符的词通过短词索引匹配，可与长词组合；片段不跨越字段"""
+    result = db.search_library(query)
+
+    assert sorted(song['song_id'] for song in result['songs']) == expected
+    if expected:
+        assert result['order'] == 'rank'
+
+
+def test_short_term_query_plan_uses_index(db):
+    """只有短词时查询由短词索引驱动，不扫描下载记录表"""
+    conn = db._connect()
+    plan = ' '.join(str(row[-1]) for row in conn.execute(
+        'EXPLAIN QUERY PLAN SELECT rowid FROM song_gram_fts WHERE song_gram_fts MATCH ?', ('"杰伦"',)
+    ))
+
+    assert 'VIRTUAL TABLE INDEX' in plan
+    assert db.search_library('杰伦')['order'] != 'time'
+
+
+def test_short_term_pagination_by_id(db, monkeypatch):
+    """短词匹配过多时按歌曲ID倒序分页，翻页不重复不遗漏"""
+    monkeypatch.setattr('download_db.FTS_RANK_LIMIT', 1)
+    seen = []
+    cursor = None
+    while True:
+        result = db.search_library('周', limit=2, cursor=cursor)
+        assert result['order'] == 'id'
+        seen.extend(song['song_id'] for song in result['songs'])
+        cursor = result['next_cursor']
+        if cursor is None:
+            break
+
+    assert seen == [5, 2, 1]
+
+
+def test_grams_follow_rename_and_delete(db):
+    """改名后短词索引随之更新，记录删除后短词索引同时删除"""
+    _add(db, 1, '七里香', '周杰伦', '七里香')
+    db.flush()
+
+    assert _ids(db, '晴') == []
+    assert _ids(db, '里') == [1]
+
+    assert db.delete_by_file_paths('downloaded_songs', ['/music/1.flac']) == 1
+    assert _ids(db, '里') == []
+    conn = db._connect()
+    assert conn.execute('SELECT COUNT(*) FROM song_grams WHERE song_id = 1').fetchone()[0] == 0
+
+
+def test_existing_database_is_indexed(tmp_path):
+    """没有短词索引的旧数据库打开时为已有记录建立索引"""
+    path = str(tmp_path / 'downloads.db')
+    db = DownloadDatabase(path)
+    for song in SONGS:
+        _add(db, *song)
+    db.flush()
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        DROP TABLE song_gram_fts;
+        DROP TRIGGER song_grams_delete;
+        DROP TABLE song_grams;
+    ''')
+    conn.close()
+
+    reopened = DownloadDatabase(path)
+
+    assert _ids(reopened, '杰伦') == [1, 2, 5]
+    assert _ids(reopened, 'sw') == [3]
@@ -0,0 +1,114 @@
+"""
+曲库内容存储测试
+验证新下载的文件以硬链接登记到曲库，放入其他目录时复用同一文件而不是重新下载，
+链接方式按优先顺序回退，以及原下载位置被删除后仍可从曲库放置
+"""
+
+import os
+
+import pytest
+
+import library_store
+from download_db import DownloadDatabase
+from library_store import LibraryStore, place_file
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = DownloadDatabase(str(tmp_path / 'downloads.db'))
+    yield database
+    database.flush()
+
+
+@pytest.fixture
+def store(tmp_path, db):
+    return LibraryStore(str(tmp_path / '.store'), db=db)
+
+
+def _download(tmp_path, store: LibraryStore, song_id: int = 1, quality: str = 'lossless'):
+    """模拟下载完成：写入文件和下载记录，并登记到曲库"""
+    path = tmp_path / 'playlist' / f'{song_id}.flac'
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(b'audio' * 100)
+    path.with_suffix('.lrc').write_text('[00:00.00]歌词', encoding='utf-8')
+    store.db.add_song({
+        'song_id': song_id,
+        'song_name': '歌曲',
+        'artists': '歌手',
+        'album': '',
+        'file_path': str(path),
+        'file_size': path.stat().st_size,
+        'quality': quality,
+        'status': 'success'
+    })
+    assert store.adopt(path, song_id, quality)
+    return path
+
+
+def test_adopt_hardlinks_into_store(tmp_path, store, db):
+    """下载的文件以硬链接登记到曲库，不占用额外空间；重复登记不出错"""
+    path = _download(tmp_path, store)
+
+    locations = {location['link_type']: location['file_path'] for location in db.get_song_locations(1, 'lossless')}
+    assert locations['download'] == str(path)
+    assert os.path.samefile(locations['store'], path)
+    assert store.adopt(path, 1, 'lossless')
+
+
+def test_place_song_links_existing_file(tmp_path, store, db):
+    """放入其他目录时硬链接已有文件，连同歌词，并记录节省的流量"""
+    path = _download(tmp_path, store)
+
+    target = store.place_song(1, 'lossless', tmp_path / 'artist' / '歌手 - 歌曲')
+
+    assert target == tmp_path / 'artist' / '歌手 - 歌曲.flac'
+    assert os.path.samefile(target, path)
+    assert target.with_suffix('.lrc').read_text(encoding='utf-8') == '[00:00.00]歌词'
+    statistics = store.get_statistics()
+    assert statistics['placements']['hardlink'] == 1
+    assert statistics['network_bytes_saved'] == path.stat().st_size
+    assert str(target) in [location['file_path'] for location in db.get_song_locations(1, 'lossless')]
+
+
+def test_place_song_survives_original_deletion(tmp_path, store):
+    """原下载位置被删除后仍可从曲库副本放置"""
+    path = _download(tmp_path, store)
+    path.unlink()
+
+    target = store.place_song(1, 'lossless', tmp_path / 'artist' / '歌曲')
+
+    assert target is not None and target.read_bytes() == b'audio' * 100
+
+
+def test_place_song_unknown_or_other_quality(tmp_path, store):
+    """曲库中没有该歌曲或只有其他音质时不放置"""
+    _download(tmp_path, store, quality='exhigh')
+
+    assert store.place_song(2, 'exhigh', tmp_path / 'a' / '2') is None
+    assert store.place_song(1, 'lossless', tmp_path / 'a' / '1') is None
+
+
+def test_place_song_existing_target(tmp_path, store):
+    """目标已是同一文件时直接登记，是其他文件时不覆盖"""
+    path = _download(tmp_path, store)
+    other = tmp_path / 'other.flac'
+    other.write_bytes(b'other')
+
+    assert store.place_song(1, 'lossless', path.with_suffix('')) == path
+    assert store.place_song(1, 'lossless', other.with_suffix('')) is None
+    assert other.read_bytes() == b'other'
+
+
+def test_place_file_falls_back(tmp_path, monkeypatch):
+    """优先的链接方式失败时依次尝试下一种"""
+    source = tmp_path / 'source.flac'
+    source.write_bytes(b'audio')
+
+    def fail(source, target):
+        raise OSError('cross-device link')
+
+    monkeypatch.setitem(library_store.LINKERS, 'hardlink', fail)
+
+    assert place_file(source, tmp_path / 'a' / 'copy.flac', ['hardlink', 'copy']) == 'copy'
+    assert (tmp_path / 'a' / 'copy.flac').read_bytes() == b'audio'
+    assert place_file(source, tmp_path / 'a' / 'none.flac', ['hardlink']) is None
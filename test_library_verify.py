@@ -0,0 +1,155 @@
+"""
+曲库校验测试
+验证下载时记录的写入数据MD5作为校验基准（没有记录时首次校验的结果作为基准）、未变化的文件不重复读取、
+损坏的文件连同硬链接改名保留并标记记录，以及取消后从中断的位置继续
+"""
+
+import hashlib
+import os
+
+import pytest
+
+from cancellation import CancellationToken
+from download_db import DownloadDatabase
+from library_verify import CORRUPT_SUFFIX, LibraryVerifier, hash_file
+from stream_fetcher import IntegrityChecker
+
+
+DATA = b'audio-data' * 10000
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = DownloadDatabase(str(tmp_path / 'downloads.db'))
+    yield database
+    database.flush()
+
+
+def _song(db, tmp_path, song_id: int, content_md5: str = '', data: bytes = DATA) -> str:
+    file_path = str(tmp_path / f'{song_id}.mp3')
+    with open(file_path, 'wb') as f:
+        f.write(data)
+    db.add_song({'song_id': song_id, 'song_name': f'歌曲{song_id}', 'artists': '歌手', 'file_path': file_path,
+                 'file_size': len(data), 'quality': 'exhigh', 'status': 'success', 'content_md5': content_md5})
+    return file_path
+
+
+def _verifier(db, **kwargs) -> LibraryVerifier:
+    kwargs.setdefault('read_limit', 0)
+    return LibraryVerifier(db, workers=kwargs.pop('workers', 2), **kwargs)
+
+
+def _content_md5(db, song_id: int) -> str:
+    db.flush()
+    return db._connect().execute(
+        'SELECT content_md5 FROM downloaded_songs WHERE song_id = ?', (song_id,)
+    ).fetchone()[0]
+
+
+def test_hash_file(tmp_path, monkeypatch):
+    """分块读取计算MD5，每块调用一次限速回调"""
+    monkeypatch.setattr('library_verify.HASH_BLOCK_SIZE', 4096)
+    file_path = tmp_path / 'x.mp3'
+    file_path.write_bytes(DATA)
+    reads = []
+
+    assert hash_file(str(file_path), reads.append) == hashlib.md5(DATA).hexdigest()
+    assert sum(reads) == len(DATA) and max(reads) == 4096
+    assert hash_file(str(file_path), should_cancel=lambda: True) is None
+
+
+def test_content_hash_of_written_data():
+    """没有改写标签时写入的数据就是上游数据；改写标签时使用实际写入的数据"""
+    checker = IntegrityChecker()
+    checker.update(DATA)
+    assert checker.content_hexdigest() == hashlib.md5(DATA).hexdigest()
+
+    checker.update_written(b'ID3' + DATA)
+    assert checker.content_hexdigest() == hashlib.md5(b'ID3' + DATA).hexdigest()
+    assert checker.hexdigest() == hashlib.md5(DATA).hexdigest()
+
+
+def test_verify_against_recorded_md5(db, tmp_path):
+    """与下载时记录的MD5一致的文件通过校验；没有记录的文件以本次结果为基准"""
+    _song(db, tmp_path, 1, hashlib.md5(DATA).hexdigest())
+    _song(db, tmp_path, 2)
+    _song(db, tmp_path, 3, hashlib.md5(DATA).hexdigest())
+    os.remove(tmp_path / '3.mp3')
+
+    result = _verifier(db).run()
+
+    assert (result['ok'], result['baseline'], result['missing'], result['corrupt']) == (1, 1, 1, 0)
+    assert (result['processed'], result['total'], result['cancelled']) == (3, 3, False)
+    assert _content_md5(db, 2) == hashlib.md5(DATA).hexdigest()
+
+
+def test_unchanged_files_are_not_read_again(db, tmp_path, monkeypatch):
+    """大小和修改时间未变化且未超过重新校验间隔的文件不再读取"""
+    _song(db, tmp_path, 1, hashlib.md5(DATA).hexdigest())
+    _verifier(db).run()
+    hashed = []
+    monkeypatch.setattr('library_verify.hash_file', lambda file_path, *args: hashed.append(file_path))
+
+    assert _verifier(db).run()['unchanged'] == 1
+    assert hashed == []
+
+    with open(tmp_path / '1.mp3', 'ab') as f:
+        f.write(b'x')
+    _verifier(db).run()
+    assert hashed == [str(tmp_path / '1.mp3')]
+
+
+def test_reverify_after_interval(db, tmp_path):
+    _song(db, tmp_path, 1, hashlib.md5(DATA).hexdigest())
+    _verifier(db).run()
+
+    assert _verifier(db, reverify_interval=-1).run()['ok'] == 1
+
+
+def test_corrupt_file_and_hardlinks_are_quarantined(db, tmp_path):
+    """损坏的文件和硬链接改名为.corrupt，记录标记为corrupt并返回待重新下载的歌曲"""
+    file_path = _song(db, tmp_path, 1, hashlib.md5(DATA).hexdigest())
+    link_path = str(tmp_path / 'playlist' / '1.mp3')
+    os.makedirs(os.path.dirname(link_path))
+    os.link(file_path, link_path)
+    db.add_song_location(1, 'exhigh', link_path, 'hardlink')
+    with open(file_path, 'r+b') as f:
+        f.seek(100)
+        f.write(b'\xff')
+
+    result = _verifier(db).run()
+
+    assert result['corrupted'] == [(1, 'exhigh')]
+    assert os.path.exists(file_path + CORRUPT_SUFFIX) and os.path.exists(link_path + CORRUPT_SUFFIX)
+    assert not os.path.exists(file_path) and not os.path.exists(link_path)
+    assert db.get_song_info(1).status == 'corrupt'
+    assert db.get_song_locations(1) == []
+
+
+def test_cancelled_run_resumes(db, tmp_path):
+    """取消后保存已完成批次的位置，下次从该位置继续；全部完成后从头开始"""
+    for song_id in range(1, 6):
+        _song(db, tmp_path, song_id)
+    token = CancellationToken()
+    progress = []
+
+    def cancel_after_two(done, total):
+        progress.append(done)
+        if done == 2:
+            token.cancel()
+
+    first = _verifier(db, chunk_size=1).run(token, cancel_after_two)
+    second = _verifier(db, chunk_size=1).run(progress_callback=lambda done, total: progress.append(done))
+
+    assert (first['cancelled'], first['baseline']) == (True, 2)
+    assert (second['cancelled'], second['baseline'], second['processed']) == (False, 3, 5)
+    assert progress == [1, 2, 3, 4, 5]
+    assert db.get_scan_position('verify') == ''
+
+
+def test_rewritten_record_keeps_content_md5(db, tmp_path):
+    """再次写入记录时没有提供content_md5的，保留下载时记录的基准"""
+    _song(db, tmp_path, 1, 'abc')
+    _song(db, tmp_path, 1)
+
+    assert _content_md5(db, 1) == 'abc'
@@ -0,0 +1,202 @@
+"""
+单曲下载测试
+验证下载时的完整性校验和重试：校验失败或读取中断时重新下载，出错时不残留临时文件
+"""
+
+import asyncio
+import hashlib
+from io import BytesIO
+
+import aiohttp
+import pytest
+from requests.exceptions import ChunkedEncodingError
+from urllib3.exceptions import ProtocolError
+
+import music_downloader
+from download_db import DownloadDatabase
+from music_downloader import MusicDownloader, MusicInfo
+
+
+DATA = b'audio-data' * 1000
+
+
+class _Raw:
+    """模拟requests响应的raw：读完数据后可抛出指定异常（连接中断）"""
+
+    def __init__(self, data: bytes, error: Exception = None):
+        self.data = BytesIO(data)
+        self.error = error
+        self.decode_content = False
+
+    def readinto(self, buffer) -> int:
+        nbytes = self.data.readinto(buffer)
+        if not nbytes and self.error is not None:
+            raise self.error
+        return nbytes
+
+
+class _Response:
+    def __init__(self, data: bytes, error: Exception = None, content_length: int = None):
+        self.headers = {'Content-Length': str(len(data) if content_length is None else content_length)}
+        self.raw = _Raw(data, error)
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class _Pool:
+    """按顺序返回预设的响应"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = 0
+
+    def get(self, url, stream=False, should_cancel=None):
+        self.requests += 1
+        return self.responses.pop(0)
+
+
+class _AsyncContent:
+    def __init__(self, data: bytes, error: Exception = None):
+        self.data = BytesIO(data)
+        self.error = error
+
+    async def read(self, n: int) -> bytes:
+        data = self.data.read(n)
+        if not data and self.error is not None:
+            raise self.error
+        return data
+
+
+class _AsyncResponse:
+    def __init__(self, data: bytes, error: Exception = None):
+        self.headers = {'Content-Length': str(len(data))}
+        self.content = _AsyncContent(data, error)
+
+    def raise_for_status(self) -> None:
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class _AsyncSession(_Pool):
+    def get(self, url):
+        self.requests += 1
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def downloader(tmp_path, monkeypatch):
+    monkeypatch.setattr(music_downloader, 'DownloadDatabase',
+                        lambda: DownloadDatabase(str(tmp_path / 'downloads.db')))
+    monkeypatch.setattr(music_downloader, 'get_library_store', lambda: None)
+    instance = MusicDownloader(download_dir=str(tmp_path / 'music'), create_artist_dir=False)
+    instance.verify_retries = 2
+    instance.stream_tagging = False
+    instance._write_music_tags = lambda *args: None
+    instance.get_music_info = lambda music_id, quality: MusicInfo(
+        id=music_id, name='歌曲', artists='歌手', album='专辑', pic_url='', duration=0, track_number=0,
+        download_url='http://cdn.example/1.mp3', file_type='mp3', file_size=len(DATA), quality=quality,
+        md5=hashlib.md5(DATA).hexdigest()
+    )
+    yield instance
+    instance.db.flush()
+
+
+def _use_pool(monkeypatch, responses) -> _Pool:
+    pool = _Pool(responses)
+    monkeypatch.setattr(music_downloader, 'get_http_pool', lambda name: pool)
+    return pool
+
+
+def _leftovers(downloader: MusicDownloader):
+    return sorted(path.name for path in downloader.download_dir.iterdir())
+
+
+def test_checksum_mismatch_is_retried(downloader, monkeypatch):
+    """MD5不一致时删除临时文件重新下载，成功后记录校验通过的MD5"""
+    corrupted = b'x' + DATA[1:]
+    pool = _use_pool(monkeypatch, [_Response(corrupted), _Response(DATA)])
+
+    result = downloader._fetch_music_file(1, 'exhigh', None)
+
+    assert result.success, result.error_message
+    assert pool.requests == 2
+    assert _leftovers(downloader) == ['歌手 - 歌曲.mp3']
+    song = downloader.db.get_song_info(1)
+    assert song.file_md5 == hashlib.md5(DATA).hexdigest()
+
+
+@pytest.mark.parametrize('error', [
+    ProtocolError('Connection broken: IncompleteRead'),
+    ChunkedEncodingError('Connection broken'),
+])
+def test_truncated_read_is_retried(downloader, monkeypatch, error):
+    """读取中断抛出的异常与校验失败一样重新下载"""
+    half = DATA[:len(DATA) // 2]
+    pool = _use_pool(monkeypatch, [_Response(half, error, len(DATA)), _Response(DATA)])
+
+    result = downloader._fetch_music_file(1, 'exhigh', None)
+
+    assert result.success, result.error_message
+    assert pool.requests == 2
+    with open(result.file_path, 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_gives_up_after_retries(downloader, monkeypatch):
+    """每次都读取中断时重试verify_retries次后失败，不残留临时文件"""
+    pool = _use_pool(monkeypatch, [_Response(DATA[:10], ProtocolError('broken'), len(DATA)) for _ in range(3)])
+
+    result = downloader._fetch_music_file(1, 'exhigh', None)
+
+    assert not result.success
+    assert '读取中断' in result.error_message
+    assert pool.requests == 3
+    assert _leftovers(downloader) == []
+    assert downloader.db.get_song_info(1) is None
+
+
+def test_unexpected_error_removes_partial_file(downloader, monkeypatch):
+    """其他异常直接失败，同样删除临时文件"""
+    _use_pool(monkeypatch, [_Response(DATA[:10], OSError('disk error'), len(DATA))])
+
+    result = downloader._fetch_music_file(1, 'exhigh', None)
+
+    assert not result.success
+    assert 'disk error' in result.error_message
+    assert _leftovers(downloader) == []
+
+
+def test_async_truncated_read_is_retried(downloader):
+    """异步下载中响应内容不完整时重新下载"""
+    session = _AsyncSession([
+        _AsyncResponse(DATA[:10], aiohttp.ClientPayloadError('Response payload is not completed')),
+        _AsyncResponse(DATA)
+    ])
+    downloader._get_async_session = lambda: session
+
+    result = asyncio.run(downloader._fetch_music_file_async(1, 'exhigh', None))
+
+    assert result.success, result.error_message
+    assert session.requests == 2
+    assert _leftovers(downloader) == ['歌手 - 歌曲.mp3']
+
+
+def test_async_gives_up_and_removes_partial_file(downloader):
+    """异步下载每次都读取中断时失败，不残留临时文件"""
+    downloader.verify_retries = 0
+    session = _AsyncSession([_AsyncResponse(DATA[:10], aiohttp.ClientPayloadError('broken'))])
+    downloader._get_async_session = lambda: session
+
+    result = asyncio.run(downloader._fetch_music_file_async(1, 'exhigh', None))
+
+    assert not result.success
+    assert _leftovers(downloader) == []
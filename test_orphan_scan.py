@@ -0,0 +1,117 @@
+"""
+孤立记录扫描测试
+验证按目录列出文件删除孤立记录、扫描期间新下载的文件不被误删、取消后从保存的位置继续
+"""
+
+import os
+from pathlib import Path
+
+import pytest
+
+from cancellation import CancellationToken
+from download_db import DownloadDatabase
+from orphan_scan import OrphanScanner, SCAN_STATE_PREFIX
+
+
+def _add(db: DownloadDatabase, song_id: int, file_path: Path, create: bool = True) -> str:
+    if create:
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(b'data')
+    db.add_song({
+        'song_id': song_id,
+        'song_name': f'歌曲{song_id}',
+        'artists': '歌手',
+        'album': '',
+        'file_path': str(file_path),
+        'file_size': 4,
+        'quality': 'exhigh',
+        'status': 'success'
+    })
+    return str(file_path)
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = DownloadDatabase(str(tmp_path / 'downloads.db'))
+    yield database
+    database.flush()
+
+
+def test_deletes_records_of_missing_files(db, tmp_path):
+    """文件不存在的下载记录和存放位置被删除，存在的保留"""
+    kept = _add(db, 1, tmp_path / 'a' / '1.mp3')
+    _add(db, 2, tmp_path / 'a' / '2.mp3', create=False)
+    _add(db, 3, tmp_path / 'gone' / '3.mp3', create=False)
+
+    result = OrphanScanner(db, workers=2, chunk_size=2).run(resume=False)
+
+    assert result['deleted_songs'] == 2
+    assert result['deleted_locations'] == 2
+    assert result['processed'] == result['total'] == 6
+    assert not result['cancelled']
+    assert db.get_song_info(1).file_path == kept
+    assert db.get_song_info(2) is None
+    assert db.get_song_info(3) is None
+    assert [location['file_path'] for location in db.get_song_locations(1)] == [kept]
+
+
+def test_broken_symlink_is_missing(db, tmp_path):
+    """指向不存在目标的符号链接视为文件不存在"""
+    link = tmp_path / 'a' / '1.mp3'
+    link.parent.mkdir()
+    os.symlink(tmp_path / 'nowhere.mp3', link)
+    _add(db, 1, link, create=False)
+
+    result = OrphanScanner(db, workers=1).run(resume=False)
+
+    assert result['deleted_songs'] == 1
+    assert db.get_song_info(1) is None
+
+
+def test_file_added_to_cached_directory_during_scan(db, tmp_path):
+    """扫描期间下载到已列出目录的文件，其记录不会因目录列表过期而被删除"""
+    directory = tmp_path / 'a'
+    _add(db, 1, directory / '1.mp3')
+    _add(db, 2, directory / '2.mp3')
+    added = []
+
+    def progress(processed: int, total: int) -> None:
+        assert processed <= total
+        if not added:
+            added.append(_add(db, 3, directory / '3.mp3'))
+
+    result = OrphanScanner(db, workers=1, chunk_size=1).run(progress_callback=progress, resume=False)
+
+    assert result['deleted_songs'] == 0
+    assert result['deleted_locations'] == 0
+    assert result['processed'] <= result['total']
+    assert db.get_song_info(3) is not None
+    assert os.path.exists(added[0])
+
+
+def test_cancel_and_resume(db, tmp_path):
+    """取消后保存扫描位置，下次从该位置继续"""
+    for song_id in range(1, 7):
+        _add(db, song_id, tmp_path / f'd{song_id}' / f'{song_id}.mp3', create=song_id % 2 == 0)
+
+    token = CancellationToken('scan')
+    progress = []
+
+    def cancel_after_first_chunk(processed: int, total: int) -> None:
+        progress.append(processed)
+        token.cancel()
+
+    first = OrphanScanner(db, workers=1, chunk_size=2).run(cancel_token=token,
+                                                           progress_callback=cancel_after_first_chunk)
+    assert first['cancelled']
+    assert first['deleted_songs'] == 1
+    assert db.get_scan_position(SCAN_STATE_PREFIX + 'downloaded_songs')
+
+    second = OrphanScanner(db, workers=1, chunk_size=2).run()
+    assert not second['cancelled']
+    assert second['processed'] == second['total']
+    assert first['deleted_songs'] + second['deleted_songs'] == 3
+    assert [song_id for song_id in range(1, 7) if db.get_song_info(song_id)] == [2, 4, 6]
+
+    # 扫描完成后位置清空，下次从头开始
+    assert not db.get_scan_position(SCAN_STATE_PREFIX + 'downloaded_songs')
@@ -0,0 +1,177 @@
+"""
+歌单批量下载测试
+验证批量下载循环不会用请求的音质覆盖已有文件的实际音质，升级失败时保留原有的成功记录，
+以及跳过检查使用整批的下载规划，不逐首查询数据库
+"""
+
+import logging
+from pathlib import Path
+
+import pytest
+
+import playlist_downloader
+from download_db import DownloadDatabase
+from music_downloader import DownloadResult
+from playlist_downloader import PlaylistDownloadConfig, PlaylistDownloader
+
+
+class _FakeDownloader:
+    """代替MusicDownloader：放置和下载时按实际音质写入记录，与真实下载器一致"""
+
+    def __init__(self, db: DownloadDatabase, directory: Path, fail: bool = False):
+        self.db = db
+        self.directory = directory
+        self.fail = fail
+        self.downloads = []
+
+    def probe_availability(self, music_ids, quality):
+        return {}
+
+    def _record(self, music_id: int, quality: str, name: str) -> DownloadResult:
+        file_path = self.directory / f'{name}.{quality}'
+        file_path.write_bytes(b'data')
+        self.db.add_song({
+            'song_id': music_id,
+            'song_name': name,
+            'artists': '歌手',
+            'album': '',
+            'file_path': str(file_path),
+            'file_size': 4,
+            'quality': quality,
+            'status': 'success'
+        })
+        return DownloadResult(success=True, file_path=str(file_path), file_size=4)
+
+    def place_from_library(self, music_id, quality, name, artists, album=''):
+        return self._record(music_id, quality, name)
+
+    def download_music_file(self, music_id, quality='standard', cancel_token=None, plan=None):
+        self.downloads.append((music_id, quality))
+        if self.fail:
+            return DownloadResult(success=False, error_message='下载失败')
+        return self._record(music_id, quality, f'歌曲{music_id}')
+
+
+def _downloader(tmp_path, db: DownloadDatabase, quality: str, fail: bool = False) -> PlaylistDownloader:
+    """不请求接口构造歌单下载器"""
+    directory = tmp_path / 'playlist'
+    directory.mkdir(exist_ok=True)
+    downloader = PlaylistDownloader.__new__(PlaylistDownloader)
+    downloader.config = PlaylistDownloadConfig(playlist_id='1', quality=quality, download_dir=str(tmp_path),
+                                               include_lyric=False, schedule_policy='list')
+    downloader.logger = logging.getLogger('test_playlist_downloader')
+    downloader.playlist_name = '歌单'
+    downloader.db = db
+    downloader.download_path = directory
+    downloader.downloader = _FakeDownloader(db, directory, fail)
+    downloader.get_playlist_songs = lambda: [{'id': 1, 'name': '歌曲1', 'artists': '歌手', 'album': ''}]
+    return downloader
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # 下载结果JSON保存在模块所在目录，测试时改到临时目录
+    monkeypatch.setattr(playlist_downloader, '__file__', str(tmp_path / 'playlist_downloader.py'))
+    database = DownloadDatabase(str(tmp_path / 'downloads.db'))
+    yield database
+    database.flush()
+
+
+def _add_existing(db: DownloadDatabase, tmp_path, quality: str) -> Path:
+    """在歌单目录之外登记一个已下载的文件"""
+    path = tmp_path / 'other' / '1.flac'
+    path.parent.mkdir()
+    path.write_bytes(b'data')
+    db.add_song({
+        'song_id': 1,
+        'song_name': '歌曲1',
+        'artists': '歌手',
+        'album': '',
+        'file_path': str(path),
+        'file_size': 4,
+        'quality': quality,
+        'status': 'success'
+    })
+    db.flush()
+    return path
+
+
+def test_placed_file_keeps_its_quality(db, tmp_path):
+    """低音质任务放置已有的无损文件后，记录仍为无损，之后的无损任务直接跳过"""
+    _add_existing(db, tmp_path, 'lossless')
+
+    result = _downloader(tmp_path, db, 'standard').download_playlist_songs()
+    db.flush()
+
+    assert result['success_count'] == 1
+    assert db.get_song_info(1).quality == 'lossless'
+    assert list(db.plan_downloads([1], 'lossless').skip) == [1]
+
+
+def test_downloaded_file_records_actual_quality(db, tmp_path):
+    """新下载的歌曲只由下载器按实际音质记录一次"""
+    result = _downloader(tmp_path, db, 'exhigh').download_playlist_songs()
+    db.flush()
+
+    assert result['success_count'] == 1
+    song = db.get_song_info(1)
+    assert (song.status, song.quality) == ('success', 'exhigh')
+
+
+def test_failed_upgrade_keeps_existing_record(db, tmp_path):
+    """升级下载失败后原有的低音质文件仍被视为已下载"""
+    path = _add_existing(db, tmp_path, 'exhigh')
+    downloader = _downloader(tmp_path, db, 'lossless', fail=True)
+
+    result = downloader.download_playlist_songs()
+    db.flush()
+
+    assert downloader.downloader.downloads == [(1, 'lossless')]
+    assert result['failed_count'] == 1
+    assert db.is_downloaded(1)
+    song = db.get_song_info(1)
+    assert (song.status, song.quality, song.file_path) == ('success', 'exhigh', str(path))
+    assert list(db.plan_downloads([1], 'exhigh').skip) == [1]
+
+
+def _run_with_existing_files(db: DownloadDatabase, tmp_path, name: str, count: int) -> int:
+    """歌单中的歌曲都已在歌单目录下，返回批量下载期间执行的查询数"""
+    (tmp_path / name).mkdir()
+    downloader = _downloader(tmp_path / name, db, 'exhigh')
+    songs = []
+    for song_id in range(1, count + 1):
+        path = downloader.download_path / f'{song_id}.mp3'
+        path.write_bytes(b'data')
+        db.add_song({
+            'song_id': song_id,
+            'song_name': f'歌曲{song_id}',
+            'artists': '歌手',
+            'album': '',
+            'file_path': str(path),
+            'file_size': 4,
+            'quality': 'exhigh',
+            'status': 'success'
+        })
+        songs.append({'id': song_id, 'name': f'歌曲{song_id}', 'artists': '歌手', 'album': ''})
+    db.flush()
+    downloader.get_playlist_songs = lambda: songs
+
+    statements = []
+    conn = db._connect()
+    conn.set_trace_callback(statements.append)
+    try:
+        result = downloader.download_playlist_songs()
+    finally:
+        conn.set_trace_callback(None)
+
+    assert result['skipped_count'] == count
+    assert not downloader.downloader.downloads
+    return sum(1 for sql in statements if sql.lstrip().upper().startswith('SELECT'))
+
+
+def test_skip_checks_do_not_query_per_song(db, tmp_path):
+    """跳过检查使用整批的下载规划，查询数不随歌曲数增长"""
+    # 第一次运行时加载歌曲ID索引，不计入比较
+    _run_with_existing_files(db, tmp_path, 'warm', 1)
+
+    assert _run_with_existing_files(db, tmp_path, 'large', 300) == _run_with_existing_files(db, tmp_path, 'small', 10)
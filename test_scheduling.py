@@ -0,0 +1,82 @@
+"""
+批量下载调度策略测试
+验证按文件大小排列歌曲（大小相同时保持原顺序、大小未知的排在最后）、分批解析大小，
+以及list策略不发起请求
+"""
+
+import pytest
+
+from music_api import APIException
+from scheduling import order_songs, resolve_song_sizes, schedule_songs
+
+
+SONGS = [{'id': song_id} for song_id in (1, 2, 3, 4, 5)]
+SIZES = {1: 300, 2: 100, 3: 300, 5: 200}
+
+
+class _API:
+    """按批返回预设的URL解析结果，可让指定批次失败"""
+
+    def __init__(self, sizes: dict, fail_batches=()):
+        self.sizes = sizes
+        self.fail_batches = set(fail_batches)
+        self.batches = []
+
+    def get_song_urls(self, ids, quality, cookies):
+        self.batches.append(list(ids))
+        if len(self.batches) - 1 in self.fail_batches:
+            raise APIException('请求失败')
+        return {'data': [
+            {'id': song_id, 'url': 'http://cdn.example/x.mp3' if song_id in self.sizes else None,
+             'size': self.sizes.get(song_id, 0)}
+            for song_id in ids
+        ]}
+
+
+def _ids(songs):
+    return [song['id'] for song in songs]
+
+
+@pytest.mark.parametrize('policy, expected', [
+    ('list', [1, 2, 3, 4, 5]),
+    ('smallest_first', [2, 5, 1, 3, 4]),
+    ('largest_first', [1, 3, 5, 2, 4]),
+    ('unknown', [1, 2, 3, 4, 5]),
+])
+def test_order_songs(policy, expected):
+    """排序稳定，大小未知的歌曲保持原顺序排在最后"""
+    assert _ids(order_songs(SONGS, policy, SIZES)) == expected
+
+
+def test_order_songs_custom_key():
+    songs = [{'song_id': 1}, {'song_id': 2}]
+
+    ordered = order_songs(songs, 'smallest_first', {1: 2, 2: 1}, key=lambda song: song['song_id'])
+
+    assert ordered == [{'song_id': 2}, {'song_id': 1}]
+
+
+def test_resolve_sizes_in_batches():
+    """分批解析，某一批失败时这一批按大小未知处理；没有链接的歌曲不计入"""
+    api = _API(SIZES, fail_batches=[1])
+
+    sizes = resolve_song_sizes(api, [1, 2, 3, 4, 5], 'lossless', {}, batch_size=2)
+
+    assert api.batches == [[1, 2], [3, 4], [5]]
+    assert sizes == {1: 300, 2: 100, 5: 200}
+
+
+def test_schedule_songs():
+    api = _API(SIZES)
+
+    assert _ids(schedule_songs(api, SONGS, 'smallest_first', 'lossless', {})) == [2, 5, 1, 3, 4]
+    assert api.batches == [[1, 2, 3, 4, 5]]
+
+
+@pytest.mark.parametrize('policy, songs', [('list', SONGS), ('smallest_first', SONGS[:1])])
+def test_schedule_songs_without_requests(policy, songs):
+    """list策略或只有一首歌时不解析大小"""
+    api = _API(SIZES)
+
+    assert schedule_songs(api, songs, policy, 'lossless', {}) == songs
+    assert api.batches == []
@@ -0,0 +1,138 @@
+"""
+下载数据流写入测试
+验证无缓冲写入处理部分写入、分块大小自适应调整、复用缓冲区写入文件以及预分配后截断
+"""
+
+import asyncio
+from io import BytesIO
+
+import pytest
+
+from stream_fetcher import (
+    AdaptiveChunkSizer, MAX_CHUNK_SIZE, MIN_CHUNK_SIZE, THROTTLED_MIN_CHUNK_SIZE,
+    stream_to_file, stream_to_file_async, write_all, write_all_async
+)
+
+
+DATA = bytes(range(256)) * 4096
+
+
+class _ShortWriter:
+    """每次write最多写入limit字节，模拟无缓冲文件的部分写入"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.data = bytearray()
+        self.calls = 0
+
+    def write(self, data) -> int:
+        self.calls += 1
+        part = bytes(data[:self.limit])
+        self.data += part
+        return len(part)
+
+
+class _AsyncShortWriter(_ShortWriter):
+    async def write(self, data) -> int:
+        return super().write(data)
+
+
+class _Raw:
+    """记录每次readinto使用的缓冲区"""
+
+    def __init__(self, data: bytes):
+        self.data = BytesIO(data)
+        self.buffers = set()
+
+    def readinto(self, view) -> int:
+        self.buffers.add(id(view.obj))
+        return self.data.readinto(view)
+
+
+class _Content:
+    def __init__(self, data: bytes, max_read: int = 10000):
+        self.data = BytesIO(data)
+        self.max_read = max_read
+
+    async def read(self, n: int) -> bytes:
+        return self.data.read(min(n, self.max_read))
+
+
+def test_write_all_retries_short_writes():
+    """一次write只写入一部分时继续写入剩余数据"""
+    writer = _ShortWriter(1000)
+
+    assert write_all(writer, DATA[:2500]) == 2500
+    assert bytes(writer.data) == DATA[:2500]
+    assert writer.calls == 3
+
+
+def test_write_all_raises_when_nothing_written():
+    with pytest.raises(OSError):
+        write_all(_ShortWriter(0), b'data')
+
+
+def test_write_all_async_retries_short_writes():
+    writer = _AsyncShortWriter(1000)
+
+    assert asyncio.run(write_all_async(writer, DATA[:2500])) == 2500
+    assert bytes(writer.data) == DATA[:2500]
+
+
+def test_sizer_grows_and_shrinks_within_bounds():
+    """读满且很快时翻倍，读取很慢时减半，不超出上下限"""
+    sizer = AdaptiveChunkSizer()
+
+    for _ in range(20):
+        sizer.update(sizer.size, 0.001)
+    assert sizer.size == MAX_CHUNK_SIZE
+
+    sizer.update(sizer.size, 1.0)
+    assert sizer.size == MAX_CHUNK_SIZE // 2
+    for _ in range(20):
+        sizer.update(1, 1.0)
+    assert sizer.size == MIN_CHUNK_SIZE
+
+
+def test_sizer_keeps_size_for_partial_or_normal_reads():
+    """没有读满或耗时接近目标时保持不变"""
+    sizer = AdaptiveChunkSizer()
+
+    assert sizer.update(sizer.size - 1, 0.001) == MIN_CHUNK_SIZE
+    assert sizer.update(sizer.size, sizer.target_seconds) == MIN_CHUNK_SIZE
+
+
+def test_sizer_cap():
+    """限速时分块不超过上限，但不低于THROTTLED_MIN_CHUNK_SIZE；上限为空时不变"""
+    sizer = AdaptiveChunkSizer()
+
+    assert sizer.cap(None) == MIN_CHUNK_SIZE
+    assert sizer.cap(1) == THROTTLED_MIN_CHUNK_SIZE
+
+
+def test_stream_to_file_reuses_buffer(tmp_path):
+    """所有读取都写入同一个预分配缓冲区，文件内容完整"""
+    raw = _Raw(DATA)
+    path = tmp_path / 'song.mp3'
+
+    assert stream_to_file(raw, path, expected_size=len(DATA)) == len(DATA)
+    assert path.read_bytes() == DATA
+    assert len(raw.buffers) == 1
+
+
+def test_stream_to_file_truncates_preallocated_space(tmp_path):
+    """实际长度小于预分配长度时截断多余空间"""
+    path = tmp_path / 'song.mp3'
+
+    assert stream_to_file(_Raw(DATA[:1000]), path, expected_size=len(DATA)) == 1000
+    assert path.read_bytes() == DATA[:1000]
+
+
+def test_stream_to_file_async_combines_reads(tmp_path):
+    """异步读取的小分块合并到缓冲区后写入，文件内容完整"""
+    path = tmp_path / 'song.mp3'
+
+    written = asyncio.run(stream_to_file_async(_Content(DATA), path, expected_size=len(DATA) + 100))
+
+    assert written == len(DATA)
+    assert path.read_bytes() == DATA
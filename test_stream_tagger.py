@@ -0,0 +1,176 @@
+"""
+边下载边写标签测试
+验证MP3和FLAC数据流改写器替换头部元数据、保留音频数据，以及无法解析时原样写入
+"""
+
+import struct
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+from mutagen.flac import FLAC, Picture, VCFLACDict
+from mutagen.id3 import ID3, TIT2
+
+from stream_tagger import (
+    FLACStreamRewriter, ID3StreamRewriter, StreamTagRewriter, QUALITY_TAG, SONG_ID_TAG, create_tag_rewriter
+)
+
+
+AUDIO = bytes(range(256)) * 64
+COVER = b'\x89PNG\r\n\x1a\n' + b'new-cover' * 10
+OLD_COVER = b'\x89PNG\r\n\x1a\n' + b'old-cover' * 10
+
+MUSIC_INFO = SimpleNamespace(id=42, name='歌曲', artists='歌手', album='专辑', track_number=3, quality='lossless')
+
+
+def _rewrite(rewriter: StreamTagRewriter, data: bytes, chunk_size: int = 1000) -> bytes:
+    """按分块把数据交给改写器，返回写出的全部数据"""
+    output = bytearray()
+    for start in range(0, len(data), chunk_size):
+        for part in rewriter.feed(memoryview(data)[start:start + chunk_size]):
+            output += part
+    for part in rewriter.finish():
+        output += part
+    return bytes(output)
+
+
+def _id3_tag(title: str) -> bytes:
+    tags = ID3()
+    tags.add(TIT2(encoding=3, text=title))
+    output = BytesIO()
+    tags.save(output, v1=0, padding=lambda info: 100)
+    return output.getvalue()
+
+
+def _flac_block(block_type: int, data: bytes, last: bool = False) -> bytes:
+    return bytes([block_type | (0x80 if last else 0)]) + len(data).to_bytes(3, 'big') + data
+
+
+def _streaminfo() -> bytes:
+    # 44.1kHz、双声道、16位，总采样数为0（未知）
+    packed = (44100 << 44) | (1 << 41) | (15 << 36)
+    return struct.pack('>HH', 4096, 4096) + b'\x00' * 6 + packed.to_bytes(8, 'big') + b'\x00' * 16
+
+
+def _picture(data: bytes, picture_type: int = 3) -> bytes:
+    picture = Picture()
+    picture.type = picture_type
+    picture.mime = 'image/png'
+    picture.data = data
+    return picture.write()
+
+
+def _flac(comment: bytes = None, pictures=()) -> bytes:
+    if comment is None:
+        vorbis = VCFLACDict()
+        vorbis['REPLAYGAIN_TRACK_GAIN'] = '-6.5 dB'
+        vorbis['TITLE'] = '上游标题'
+        comment = vorbis.write(framing=False)
+    blocks = [(0, _streaminfo()), (4, comment)] + [(6, picture) for picture in pictures] + [(1, b'\x00' * 64)]
+    header = b'fLaC' + b''.join(
+        _flac_block(block_type, data, index == len(blocks) - 1) for index, (block_type, data) in enumerate(blocks)
+    )
+    return header + AUDIO
+
+
+def test_base_class_is_abstract():
+    """基类未实现头部解析，不能直接实例化"""
+    with pytest.raises(TypeError):
+        StreamTagRewriter()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_id3_replaces_upstream_tag(tmp_path, chunk_size):
+    """上游的ID3v2标签被替换，音频数据原样保留"""
+    rewriter = ID3StreamRewriter(MUSIC_INFO, COVER, padding=256)
+
+    output = _rewrite(rewriter, _id3_tag('上游标题') + AUDIO, chunk_size)
+
+    assert rewriter.applied
+    assert output.endswith(AUDIO)
+    path = tmp_path / '1.mp3'
+    path.write_bytes(output)
+    tags = ID3(str(path))
+    assert str(tags['TIT2']) == '歌曲'
+    assert str(tags['TPE1']) == '歌手'
+    assert str(tags['TXXX:' + SONG_ID_TAG]) == '42'
+    assert str(tags['TXXX:' + QUALITY_TAG]) == 'lossless'
+    assert [frame.data for frame in tags.getall('APIC')] == [COVER]
+    # 新标签之后紧接音频数据
+    assert len(output) == tags.size + len(AUDIO)
+
+
+def test_id3_without_upstream_tag():
+    """上游没有ID3v2标签时在开头插入新标签"""
+    rewriter = ID3StreamRewriter(MUSIC_INFO)
+
+    output = _rewrite(rewriter, AUDIO)
+
+    assert rewriter.applied
+    assert output[:3] == b'ID3'
+    assert output.endswith(AUDIO)
+
+
+def test_id3_invalid_length_gives_up():
+    """ID3长度字段无效时放弃改写，原样写出"""
+    data = b'ID3\x04\x00\x00\x80\x00\x00\x00' + AUDIO
+    rewriter = ID3StreamRewriter(MUSIC_INFO)
+
+    assert _rewrite(rewriter, data) == data
+    assert not rewriter.applied
+
+
+@pytest.mark.parametrize('chunk_size', [1, 100, 65536])
+def test_flac_merges_comment_and_replaces_cover(tmp_path, chunk_size):
+    """保留上游的注释字段和STREAMINFO，覆盖歌曲信息，上游封面被新封面替换"""
+    rewriter = FLACStreamRewriter(MUSIC_INFO, COVER)
+
+    output = _rewrite(rewriter, _flac(pictures=[_picture(OLD_COVER)]), chunk_size)
+
+    assert rewriter.applied
+    assert output.endswith(AUDIO)
+    path = tmp_path / '1.flac'
+    path.write_bytes(output)
+    audio = FLAC(str(path))
+    assert audio.info.sample_rate == 44100
+    assert audio['TITLE'] == ['歌曲']
+    assert audio['REPLAYGAIN_TRACK_GAIN'] == ['-6.5 dB']
+    assert audio[SONG_ID_TAG] == ['42']
+    assert audio['TRACKNUMBER'] == ['3']
+    assert [picture.data for picture in audio.pictures] == [COVER]
+
+
+def test_flac_keeps_other_pictures_and_cover_without_new_one(tmp_path):
+    """非封面类型的图片总是保留；没有新封面时保留上游封面"""
+    pictures = [_picture(OLD_COVER), _picture(b'back', picture_type=4)]
+
+    with_cover = _rewrite(FLACStreamRewriter(MUSIC_INFO, COVER), _flac(pictures=pictures))
+    without_cover = _rewrite(FLACStreamRewriter(MUSIC_INFO), _flac(pictures=pictures))
+
+    path = tmp_path / '1.flac'
+    path.write_bytes(with_cover)
+    assert sorted((p.type, p.data) for p in FLAC(str(path)).pictures) == [(3, COVER), (4, b'back')]
+    path.write_bytes(without_cover)
+    assert sorted((p.type, p.data) for p in FLAC(str(path)).pictures) == [(3, OLD_COVER), (4, b'back')]
+
+
+def test_flac_malformed_comment_gives_up():
+    """上游注释块损坏时放弃改写，原样写出，由下载后写标签处理"""
+    data = _flac(comment=b'\xff\xff\xff\x7fbroken')
+    rewriter = FLACStreamRewriter(MUSIC_INFO, COVER)
+
+    assert _rewrite(rewriter, data) == data
+    assert not rewriter.applied
+
+
+def test_flac_not_flac_gives_up():
+    """不是FLAC数据流时原样写出"""
+    rewriter = create_tag_rewriter('.FLAC', MUSIC_INFO)
+
+    assert isinstance(rewriter, FLACStreamRewriter)
+    assert _rewrite(rewriter, AUDIO) == AUDIO
+    assert not rewriter.applied
+
+
+def test_unsupported_format_has_no_rewriter():
+    assert create_tag_rewriter('.m4a', MUSIC_INFO) is None
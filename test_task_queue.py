@@ -0,0 +1,125 @@
+"""
+任务队列测试
+验证IndexedTaskQueue按任务ID移除、已删除项计数、队列压缩以及qsize和join的计数
+"""
+
+import asyncio
+
+from task_manager import IndexedTaskQueue
+
+
+def _item(task_id: str) -> tuple:
+    """构造队列项 (task_id, task_func, task_type, metadata)"""
+    return (task_id, None, 'test', {})
+
+
+def _fill(queue: IndexedTaskQueue, count: int) -> None:
+    for i in range(count):
+        queue.put_nowait(_item(f'task-{i}'))
+
+
+def test_remove_skips_removed_items():
+    """移除的任务不再被取出，其余任务保持先进先出"""
+    async def run():
+        queue = IndexedTaskQueue()
+        _fill(queue, 5)
+
+        assert queue.remove('task-1')
+        assert queue.remove('task-3')
+        assert not queue.remove('task-3')
+        assert not queue.remove('missing')
+        assert 'task-1' not in queue
+        assert 'task-2' in queue
+
+        return [queue.get_nowait()[0] for _ in range(queue.qsize())]
+
+    assert asyncio.run(run()) == ['task-0', 'task-2', 'task-4']
+
+
+def test_qsize_and_empty_count_only_live_items():
+    """qsize和empty只统计未删除的任务"""
+    async def run():
+        queue = IndexedTaskQueue()
+        _fill(queue, 3)
+        queue.remove('task-0')
+        assert queue.qsize() == 2
+        assert queue.tombstones == 1
+
+        queue.remove('task-1')
+        queue.remove('task-2')
+        assert queue.qsize() == 0
+        assert queue.empty()
+
+    asyncio.run(run())
+
+
+def test_get_clears_tombstones():
+    """取出时跳过的已删除项从计数中扣除"""
+    async def run():
+        queue = IndexedTaskQueue()
+        _fill(queue, 3)
+        queue.remove('task-0')
+        queue.remove('task-1')
+        assert queue.tombstones == 2
+
+        assert queue.get_nowait()[0] == 'task-2'
+        assert queue.tombstones == 0
+
+    asyncio.run(run())
+
+
+def test_compaction_when_tombstones_dominate():
+    """已删除项超过阈值且多于有效项时压缩队列"""
+    async def run():
+        queue = IndexedTaskQueue()
+        count = IndexedTaskQueue.COMPACT_THRESHOLD * 2 + 10
+        _fill(queue, count)
+
+        # 删除项未多于有效项时不压缩
+        for i in range(IndexedTaskQueue.COMPACT_THRESHOLD + 1):
+            queue.remove(f'task-{i}')
+        assert queue.tombstones == IndexedTaskQueue.COMPACT_THRESHOLD + 1
+        assert len(queue._queue) == count
+
+        # 继续删除直到删除项多于有效项
+        i = IndexedTaskQueue.COMPACT_THRESHOLD + 1
+        while queue.tombstones:
+            queue.remove(f'task-{i}')
+            i += 1
+        assert queue.tombstones == 0
+        assert len(queue._queue) == queue.qsize() == count - i
+
+        assert [queue.get_nowait()[0] for _ in range(queue.qsize())] == [f'task-{j}' for j in range(i, count)]
+
+    asyncio.run(run())
+
+
+def test_join_does_not_wait_for_removed_tasks():
+    """移除的任务视为已处理，join只等待被取出的任务"""
+    async def run():
+        queue = IndexedTaskQueue()
+        _fill(queue, 4)
+        queue.remove('task-1')
+        queue.remove('task-2')
+
+        while not queue.empty():
+            await queue.get()
+            queue.task_done()
+
+        await asyncio.wait_for(queue.join(), timeout=1)
+
+    asyncio.run(run())
+
+
+def test_put_after_remove_reuses_task_id():
+    """移除后以相同任务ID重新加入时排在队尾"""
+    async def run():
+        queue = IndexedTaskQueue()
+        _fill(queue, 3)
+        queue.remove('task-0')
+        queue.put_nowait(_item('task-0'))
+
+        assert queue.qsize() == 3
+        return [queue.get_nowait()[0] for _ in range(queue.qsize())]
+
+    assert asyncio.run(run()) == ['task-1', 'task-2', 'task-0']